@@ -277,6 +277,11 @@ class FilterCollection(object):
     def include_redundant_members(self):
         return self._room_state_filter.include_redundant_members()
 
+    def includes_room(self, room_id):
+        """Whether events in the given room can pass this filter at all.
+        """
+        return self._room_filter.check_fields(room_id, None, None, False)
+
     def filter_presence(self, events):
         return self._presence_filter.filter(events)
 
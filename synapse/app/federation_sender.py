@@ -60,21 +60,40 @@ class FederationSenderSlaveStore(
         # always have a known value for the federation position in memory so
         # that we don't have to bounce via a deferred once when we start the
         # replication streams.
-        self.federation_out_pos_startup = self._get_federation_out_pos(db_conn)
+        self.federation_out_pos_startup = self._get_federation_out_pos(
+            db_conn, get_federation_position_type(hs.config),
+        )
 
-    def _get_federation_out_pos(self, db_conn):
+    def _get_federation_out_pos(self, db_conn, typ):
         sql = (
-            "SELECT stream_id FROM federation_stream_position"
-            " WHERE type = ?"
+            "SELECT type, stream_id FROM federation_stream_position"
+            " WHERE type IN (?, ?)"
         )
         sql = self.database_engine.convert_param_style(sql)
 
         txn = db_conn.cursor()
-        txn.execute(sql, ("federation",))
-        rows = txn.fetchall()
+        txn.execute(sql, (typ, "federation"))
+        positions = dict(txn.fetchall())
         txn.close()
 
-        return rows[0][0] if rows else -1
+        # A new federation sender shard carries on from wherever the unsharded
+        # federation sender got to.
+        return positions.get(typ, positions.get("federation", -1))
+
+
+def get_federation_position_type(config):
+    """Get the type of the federation_stream_position row which tracks how
+    far this federation sender has got through the federation stream.
+
+    Args:
+        config (HomeServerConfig)
+
+    Returns:
+        str
+    """
+    if config.federation_sender_instances > 1:
+        return "federation_%d" % (config.federation_sender_instance,)
+    return "federation"
 
 
 class FederationSenderServer(HomeServer):
@@ -215,6 +234,7 @@ class FederationSenderHandler(object):
         self.federation_sender = hs.get_federation_sender()
         self.replication_client = replication_client
 
+        self._federation_position_type = get_federation_position_type(hs.config)
         self.federation_position = self.store.federation_out_pos_startup
         self._fed_position_linearizer = Linearizer(name="_fed_position_linearizer")
 
@@ -253,7 +273,7 @@ class FederationSenderHandler(object):
             with (yield self._fed_position_linearizer.queue(None)):
                 if self._last_ack < self.federation_position:
                     yield self.store.update_federation_out_pos(
-                        "federation", self.federation_position
+                        self._federation_position_type, self.federation_position
                     )
 
                     # We ACK this token over replication so that the master can drop
@@ -54,7 +54,9 @@ from synapse.rest.client.v1.room import RoomInitialSyncRestServlet
 from synapse.rest.client.v2_alpha import sync
 from synapse.server import HomeServer
 from synapse.storage.engines import create_engine
+from synapse.storage.lazy_loaded_members import LazyLoadedMembersWorkerStore
 from synapse.storage.presence import UserPresenceState
+from synapse.storage.sync_snapshots import SyncSnapshotWorkerStore
 from synapse.util.httpresourcetree import create_resource_tree
 from synapse.util.logcontext import LoggingContext, run_in_background
 from synapse.util.manhole import manhole
@@ -78,6 +80,8 @@ class SynchrotronSlavedStore(
     SlavedEventStore,
     SlavedClientIpStore,
     RoomStore,
+    SyncSnapshotWorkerStore,
+    LazyLoadedMembersWorkerStore,
     BaseSlavedStore,
 ):
     pass
@@ -64,6 +64,20 @@ class ServerConfig(Config):
 
         self.filter_timeline_limit = config.get("filter_timeline_limit", -1)
 
+        # The number of rooms to generate the /sync response for at once
+        self.sync_room_concurrency = config.get("sync_room_concurrency", 10)
+
+        # If set, syncs which take longer than this are logged along with a
+        # breakdown of where the time went.
+        self.slow_sync_log_threshold_ms = config.get("slow_sync_log_threshold_ms")
+
+        # Whether to keep a snapshot of each device's initial /sync response,
+        # so that later initial syncs can be served by bringing the snapshot
+        # up to date with an incremental sync.
+        self.enable_initial_sync_snapshots = config.get(
+            "enable_initial_sync_snapshots", False,
+        )
+
         # Whether we should block invites sent to users on this server
         # (other than those sent by local server admins)
         self.block_non_admin_invites = config.get(
@@ -106,6 +120,56 @@ class ServerConfig(Config):
             for domain in federation_domain_whitelist:
                 self.federation_domain_whitelist[domain] = True
 
+        # The number of idle connections to keep open to each remote server
+        # for federation requests, and how long to keep them open for.
+        self.federation_client_max_idle_connections_per_host = config.get(
+            "federation_client_max_idle_connections_per_host", 5,
+        )
+        self.federation_client_idle_timeout = self.parse_duration(
+            config.get("federation_client_idle_timeout", "2m"),
+        ) / 1000
+
+        # The most concurrent federation requests to send to a remote server,
+        # how long those requests can take before we send fewer of them at
+        # once, and how many requests in a row can fail before we stop sending
+        # requests to the server for a while.
+        self.federation_client_max_concurrency_per_host = config.get(
+            "federation_client_max_concurrency_per_host", 50,
+        )
+        self.federation_client_latency_target_ms = config.get(
+            "federation_client_latency_target_ms", 10000,
+        )
+        self.federation_client_failure_threshold = config.get(
+            "federation_client_failure_threshold", 5,
+        )
+
+        # Whether to respond to incoming federation transactions once their
+        # PDUs have been queued in the database, rather than once they have
+        # been processed.
+        self.federation_async_transactions = config.get(
+            "federation_async_transactions", False,
+        )
+        # The most PDUs which may be waiting in the queue before we go back to
+        # processing transactions before responding to them.
+        self.federation_incoming_pdu_queue_limit = config.get(
+            "federation_incoming_pdu_queue_limit", 1000,
+        )
+        # The number of rooms to process queued PDUs for at once
+        self.federation_incoming_pdu_concurrency = config.get(
+            "federation_incoming_pdu_concurrency", 10,
+        )
+
+        # How long to wait after an EDU is queued for a remote server before
+        # sending it, so that other EDUs can be sent in the same transaction.
+        self.federation_edu_coalescing_window_ms = config.get(
+            "federation_edu_coalescing_window_ms", 0,
+        )
+        # Whether to gzip outgoing transactions to servers which say they
+        # accept gzipped requests
+        self.federation_compress_transactions = config.get(
+            "federation_compress_transactions", False,
+        )
+
         if self.public_baseurl is not None:
             if self.public_baseurl[-1] != '/':
                 self.public_baseurl += '/'
@@ -268,6 +332,26 @@ class ServerConfig(Config):
         # and sync operations. The default value is -1, means no upper limit.
         # filter_timeline_limit: 5000
 
+        # The number of rooms to generate the /sync response for concurrently.
+        # Requests for the state of each room are batched together, so
+        # increasing this makes for fewer, larger, database queries. The
+        # default is 10.
+        # sync_room_concurrency: 10
+
+        # If set, any /sync request which takes longer than this many
+        # milliseconds to calculate is logged, along with the time taken by
+        # each phase of the calculation and the number of rooms, events etc
+        # it returned. Disabled by default.
+        # slow_sync_log_threshold_ms: 5000
+
+        # Whether to store a snapshot of each device's initial /sync response
+        # in the database, so that subsequent initial syncs by that device
+        # can be generated by applying an incremental sync to the snapshot,
+        # rather than by recalculating every room from scratch. This can
+        # make a big difference for users in a lot of rooms. The default is
+        # False.
+        # enable_initial_sync_snapshots: True
+
         # Whether room invites to users on this server should be blocked
         # (except those sent by local server admins). The default is False.
         # block_non_admin_invites: True
@@ -283,6 +367,62 @@ class ServerConfig(Config):
         #  - nyc.example.com
         #  - syd.example.com
 
+        # The maximum number of idle connections to keep open to each remote
+        # server for sending federation requests over, and how long to keep
+        # them open for while they are idle. Reusing connections saves
+        # connecting and doing a TLS handshake for each request.
+        # federation_client_max_idle_connections_per_host: 5
+        # federation_client_idle_timeout: 2m
+
+        # The number of concurrent federation requests we send to each remote
+        # server is adjusted based on how quickly the server responds: it
+        # grows while requests take less than federation_client_latency_target_ms
+        # milliseconds, up to federation_client_max_concurrency_per_host, and
+        # halves when they take longer or fail.
+        #
+        # Once federation_client_failure_threshold requests to a server have
+        # failed in a row, requests to it fail straight away for a while
+        # (starting at 10 seconds, and backing off to 5 minutes), after which
+        # a single request is let through to see if it has recovered. Set to 0
+        # to keep sending requests to failing servers.
+        #
+        # federation_client_max_concurrency_per_host: 50
+        # federation_client_latency_target_ms: 10000
+        # federation_client_failure_threshold: 5
+
+        # Whether to respond to incoming federation transactions as soon as
+        # their events have been queued in the database, and process the
+        # events afterwards, rather than making the sending server wait while
+        # they are processed. Events for different rooms are processed in
+        # parallel, up to federation_incoming_pdu_concurrency rooms at once.
+        #
+        # If more than federation_incoming_pdu_queue_limit events are waiting
+        # to be processed, new transactions are processed before responding
+        # again, which slows down the servers sending them.
+        #
+        # Each process only processes the queued events it received itself
+        # (including after a restart), so when federation requests are handled
+        # by several workers, each should be given a distinct worker_name.
+        #
+        # federation_async_transactions: false
+        # federation_incoming_pdu_queue_limit: 1000
+        # federation_incoming_pdu_concurrency: 10
+
+        # How long to wait, in milliseconds, after queuing an EDU (such as a
+        # typing notification, read receipt or presence update) for a remote
+        # server before sending it. EDUs queued for the server in the meantime
+        # are sent in the same transaction, and receipts and presence updates
+        # which have been superseded are not sent at all. Defaults to 0, which
+        # sends EDUs straight away.
+        #
+        # federation_edu_coalescing_window_ms: 100
+
+        # Whether to gzip the transactions we send to remote servers which
+        # say that they accept gzipped requests. Synapse always accepts
+        # gzipped requests from other servers.
+        #
+        # federation_compress_transactions: false
+
         # List of ports that Synapse should listen on, their purpose and their
         # configuration.
         listeners:
@@ -13,7 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from ._base import Config
+from ._base import Config, ConfigError
 
 
 class WorkerConfig(Config):
@@ -43,7 +43,36 @@ class WorkerConfig(Config):
         # The port on the main synapse for HTTP replication endpoint
         self.worker_replication_http_port = config.get("worker_replication_http_port")
 
-        self.worker_name = config.get("worker_name", self.worker_app)
+        # Outbound federation can be split between several federation sender
+        # workers, each of which sends to the destinations which hash to its
+        # instance number. `federation_sender_instances` should be set in the
+        # shared configuration, and `federation_sender_instance` in each
+        # federation sender's worker configuration.
+        self.federation_sender_instances = config.get(
+            "federation_sender_instances", 1,
+        )
+        self.federation_sender_instance = config.get(
+            "federation_sender_instance", 0,
+        )
+        if not (
+            0 <= self.federation_sender_instance < self.federation_sender_instances
+        ):
+            raise ConfigError(
+                "federation_sender_instance must be between 0 and"
+                " federation_sender_instances - 1"
+            )
+
+        default_worker_name = self.worker_app
+        if (
+            self.worker_app == "synapse.app.federation_sender" and
+            self.federation_sender_instances > 1
+        ):
+            # each federation sender needs a distinct name, so that the master
+            # can keep track of how far each of them has got.
+            default_worker_name = "%s-%d" % (
+                self.worker_app, self.federation_sender_instance,
+            )
+        self.worker_name = config.get("worker_name", default_worker_name)
 
         self.worker_main_http_uri = config.get("worker_main_http_uri", None)
         self.worker_cpu_affinity = config.get("worker_cpu_affinity")
@@ -12,7 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import logging
+import time
+import weakref
 
+from prometheus_client import Histogram
 from zope.interface import implementer
 
 from OpenSSL import SSL, crypto
@@ -21,8 +24,20 @@ from twisted.internet.interfaces import IOpenSSLClientConnectionCreator
 from twisted.internet.ssl import CertificateOptions, ContextFactory
 from twisted.python.failure import Failure
 
+from synapse.util.caches.lrucache import LruCache
+
 logger = logging.getLogger(__name__)
 
+tls_handshake_time = Histogram(
+    "synapse_crypto_client_tls_handshake_time_seconds",
+    "Time taken by TLS handshakes for outgoing federation connections, by"
+    " whether we offered to resume a previous TLS session",
+    ["resumption_offered"],
+)
+
+# The number of remote servers we keep TLS options (and so TLS sessions) for
+CLIENT_TLS_OPTIONS_CACHE_SIZE = 1000
+
 
 class ServerContextFactory(ContextFactory):
     """Factory for PyOpenSSL SSL contexts that are used to handle incoming
@@ -92,6 +107,9 @@ class ClientTLSOptions(object):
     Client creator for TLS without certificate identity verification. This is a
     copy of twisted.internet._sslverify.ClientTLSOptions with the identity
     verification left out. For documentation, see the twisted documentation.
+
+    It also offers to resume the TLS session of the last connection to the
+    host, which saves the remote server doing a full handshake.
     """
 
     def __init__(self, hostname, ctx):
@@ -102,15 +120,33 @@ class ClientTLSOptions(object):
             _tolerateErrors(self._identityVerifyingInfoCallback)
         )
 
+        self._session = None
+
+        # connection -> (time the handshake started, whether we offered to
+        # resume a session)
+        self._handshakes = weakref.WeakKeyDictionary()
+
     def clientConnectionForTLS(self, tlsProtocol):
         context = self._ctx
         connection = SSL.Connection(context, None)
         connection.set_app_data(tlsProtocol)
+        if self._session is not None:
+            connection.set_session(self._session)
         return connection
 
     def _identityVerifyingInfoCallback(self, connection, where, ret):
         if where & SSL.SSL_CB_HANDSHAKE_START:
             connection.set_tlsext_host_name(self._hostnameBytes)
+            self._handshakes[connection] = (time.time(), self._session is not None)
+        elif where & SSL.SSL_CB_HANDSHAKE_DONE:
+            self._session = connection.get_session()
+
+            handshake = self._handshakes.pop(connection, None)
+            if handshake is not None:
+                start, resumption_offered = handshake
+                tls_handshake_time.labels(resumption_offered).observe(
+                    time.time() - start,
+                )
 
 
 class ClientTLSOptionsFactory(object):
@@ -118,11 +154,17 @@ class ClientTLSOptionsFactory(object):
     to remote servers for federation."""
 
     def __init__(self, config):
-        # We don't use config options yet
-        pass
+        # We keep the options for each host, rather than making new ones for
+        # each connection, so that connections can resume the TLS session of
+        # the previous connection to the host.
+        self._options_by_host = LruCache(CLIENT_TLS_OPTIONS_CACHE_SIZE)
 
     def get_options(self, host):
-        return ClientTLSOptions(
-            host,
-            CertificateOptions(verify=False).getContext()
-        )
+        options = self._options_by_host.get(host)
+        if options is None:
+            options = ClientTLSOptions(
+                host,
+                CertificateOptions(verify=False).getContext()
+            )
+            self._options_by_host[host] = options
+        return options
@@ -34,9 +34,11 @@ from unpaddedbase64 import decode_base64, encode_base64
 
 from OpenSSL import crypto
 from twisted.internet import defer
+from twisted.python import failure
 
 from synapse.api.errors import Codes, SynapseError
 from synapse.crypto.keyclient import fetch_server_key
+from synapse.metrics.background_process_metrics import run_as_background_process
 from synapse.util import logcontext, unwrapFirstError
 from synapse.util.logcontext import (
     LoggingContext,
@@ -48,6 +50,17 @@ from synapse.util.metrics import Measure
 
 logger = logging.getLogger(__name__)
 
+# Signatures are checked in batches of JSON objects signed with the same key,
+# on the reactor's threadpool so that large batches (such as the state in a
+# /send_join response) don't block the reactor. Batches smaller than this are
+# checked on the reactor thread, where they are cheaper than a trip to the
+# threadpool.
+MIN_THREADED_VERIFY_BATCH_SIZE = 10
+
+# The most JSON objects to check in a single batch, so that large batches are
+# spread across the threads in the threadpool.
+MAX_VERIFY_BATCH_SIZE = 100
+
 
 VerifyKeyRequest = namedtuple("VerifyRequest", (
     "server_name", "key_ids", "json_object", "deferred"
@@ -87,6 +100,15 @@ class Keyring(object):
         # These are regular, logcontext-agnostic Deferreds.
         self.key_downloads = {}
 
+        # map from (server_name, key_id) to (verify_key, list of (json_object,
+        # Deferred)) for the signatures waiting to be checked in the next
+        # batch. The Deferreds run their callbacks with no logcontext.
+        #
+        # Signatures are queued as the keys for their verify requests become
+        # available, and the batches are started once we have finished handing
+        # out keys, by _start_verify_batches.
+        self._pending_verifications = {}
+
     def verify_json_for_server(self, server_name, json_object):
         return logcontext.make_deferred_yieldable(
             self.verify_json_objects_for_server(
@@ -136,11 +158,151 @@ class Keyring(object):
 
         # Pass those keys to handle_key_deferred so that the json object
         # signatures can be verified
-        handle = preserve_fn(_handle_key_deferred)
-        return [
+        handle = preserve_fn(self._handle_key_deferred)
+        deferreds = [
             handle(rq) for rq in verify_requests
         ]
 
+        # if any of the keys were available straight away, check those
+        # signatures now
+        self._start_verify_batches()
+
+        return deferreds
+
+    @defer.inlineCallbacks
+    def _handle_key_deferred(self, verify_request):
+        """Waits for the key to become available, and then performs a
+        verification
+
+        Args:
+            verify_request (VerifyKeyRequest):
+
+        Returns:
+            Deferred[None]
+
+        Raises:
+            SynapseError if there was a problem performing the verification
+        """
+        server_name = verify_request.server_name
+        try:
+            with PreserveLoggingContext():
+                _, key_id, verify_key = yield verify_request.deferred
+        except IOError as e:
+            logger.warn(
+                "Got IOError when downloading keys for %s: %s %s",
+                server_name, type(e).__name__, str(e),
+            )
+            raise SynapseError(
+                502,
+                "Error downloading keys for %s" % (server_name,),
+                Codes.UNAUTHORIZED,
+            )
+        except Exception as e:
+            logger.exception(
+                "Got Exception when downloading keys for %s: %s %s",
+                server_name, type(e).__name__, str(e),
+            )
+            raise SynapseError(
+                401,
+                "No key for %s with id %s" % (server_name, verify_request.key_ids),
+                Codes.UNAUTHORIZED,
+            )
+
+        logger.debug("Got key %s %s:%s for server %s, verifying" % (
+            key_id, verify_key.alg, verify_key.version, server_name,
+        ))
+        try:
+            with PreserveLoggingContext():
+                yield self._queue_verification(
+                    server_name, key_id, verify_key, verify_request.json_object,
+                )
+        except SignatureVerifyException as e:
+            logger.debug(
+                "Error verifying signature for %s:%s:%s with key %s: %s",
+                server_name, verify_key.alg, verify_key.version,
+                encode_verify_key_base64(verify_key),
+                str(e),
+            )
+            raise SynapseError(
+                401,
+                "Invalid signature for server %s with key %s:%s: %s" % (
+                    server_name, verify_key.alg, verify_key.version, str(e),
+                ),
+                Codes.UNAUTHORIZED,
+            )
+
+    def _queue_verification(self, server_name, key_id, verify_key, json_object):
+        """Adds a JSON object to the next batch of signatures to be checked
+        with the given key. The batch isn't started until
+        _start_verify_batches is called.
+
+        Args:
+            server_name (str)
+            key_id (str)
+            verify_key (nacl.signing.VerifyKey)
+            json_object (dict)
+
+        Returns:
+            Deferred[None]: resolves once the signature has been checked, or
+                fails with a SignatureVerifyException if it is invalid. Runs
+                its callbacks with no logcontext.
+        """
+        d = defer.Deferred()
+
+        batch = self._pending_verifications.get((server_name, key_id))
+        if batch is None:
+            batch = self._pending_verifications[(server_name, key_id)] = (
+                verify_key, [],
+            )
+        batch[1].append((json_object, d))
+
+        return d
+
+    def _start_verify_batches(self):
+        """Starts checking the signatures queued by _queue_verification"""
+        pending = self._pending_verifications
+        self._pending_verifications = {}
+
+        for (server_name, _), (verify_key, requests) in pending.items():
+            for i in range(0, len(requests), MAX_VERIFY_BATCH_SIZE):
+                run_as_background_process(
+                    "verify_signatures", self._verify_batch,
+                    server_name, verify_key, requests[i:i + MAX_VERIFY_BATCH_SIZE],
+                )
+
+    @defer.inlineCallbacks
+    def _verify_batch(self, server_name, verify_key, requests):
+        """Checks a batch of signatures, and resolves their Deferreds
+
+        Args:
+            server_name (str)
+            verify_key (nacl.signing.VerifyKey)
+            requests (list[(dict, Deferred)]): the JSON objects to check, and
+                the Deferreds to resolve with the result
+        """
+        json_objects = [json_object for json_object, _ in requests]
+        try:
+            if len(json_objects) < MIN_THREADED_VERIFY_BATCH_SIZE:
+                errors = _verify_json_objects(server_name, verify_key, json_objects)
+            else:
+                errors = yield logcontext.defer_to_thread(
+                    self.hs.get_reactor(), _verify_json_objects,
+                    server_name, verify_key, json_objects,
+                )
+        except Exception:
+            f = failure.Failure()
+            with PreserveLoggingContext():
+                for _, d in requests:
+                    d.errback(f)
+            return
+
+        with PreserveLoggingContext():
+            for (_, d), error in zip(requests, errors):
+                if error is None:
+                    d.callback(None)
+                else:
+                    d.errback(error)
+
     @defer.inlineCallbacks
     def _start_key_lookups(self, verify_requests):
         """Sets off the key fetches for each verify request
@@ -313,6 +475,10 @@ class Keyring(object):
                             )
                             requests_missing_keys.append(verify_request)
 
+                    # check the signatures for the requests we've just found
+                    # keys for
+                    self._start_verify_batches()
+
                     if not missing_keys:
                         break
 
@@ -655,62 +821,24 @@ class Keyring(object):
         ).addErrback(unwrapFirstError))
 
 
-@defer.inlineCallbacks
-def _handle_key_deferred(verify_request):
-    """Waits for the key to become available, and then performs a verification
+def _verify_json_objects(server_name, verify_key, json_objects):
+    """Checks the signatures on a list of JSON objects
 
     Args:
-        verify_request (VerifyKeyRequest):
+        server_name (str): the server which should have signed the objects
+        verify_key (nacl.signing.VerifyKey): the key to check the signatures
+            with
+        json_objects (list[dict]): the objects to check
 
     Returns:
-        Deferred[None]
-
-    Raises:
-        SynapseError if there was a problem performing the verification
+        list[SignatureVerifyException|None]: for each object, the error if its
+            signature was invalid, or None if it was valid
     """
-    server_name = verify_request.server_name
-    try:
-        with PreserveLoggingContext():
-            _, key_id, verify_key = yield verify_request.deferred
-    except IOError as e:
-        logger.warn(
-            "Got IOError when downloading keys for %s: %s %s",
-            server_name, type(e).__name__, str(e),
-        )
-        raise SynapseError(
-            502,
-            "Error downloading keys for %s" % (server_name,),
-            Codes.UNAUTHORIZED,
-        )
-    except Exception as e:
-        logger.exception(
-            "Got Exception when downloading keys for %s: %s %s",
-            server_name, type(e).__name__, str(e),
-        )
-        raise SynapseError(
-            401,
-            "No key for %s with id %s" % (server_name, verify_request.key_ids),
-            Codes.UNAUTHORIZED,
-        )
-
-    json_object = verify_request.json_object
-
-    logger.debug("Got key %s %s:%s for server %s, verifying" % (
-        key_id, verify_key.alg, verify_key.version, server_name,
-    ))
-    try:
-        verify_signed_json(json_object, server_name, verify_key)
-    except SignatureVerifyException as e:
-        logger.debug(
-            "Error verifying signature for %s:%s:%s with key %s: %s",
-            server_name, verify_key.alg, verify_key.version,
-            encode_verify_key_base64(verify_key),
-            str(e),
-        )
-        raise SynapseError(
-            401,
-            "Invalid signature for server %s with key %s:%s: %s" % (
-                server_name, verify_key.alg, verify_key.version, str(e),
-            ),
-            Codes.UNAUTHORIZED,
-        )
+    errors = []
+    for json_object in json_objects:
+        try:
+            verify_signed_json(json_object, server_name, verify_key)
+            errors.append(None)
+        except SignatureVerifyException as e:
+            errors.append(e)
+    return errors
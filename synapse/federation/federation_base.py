@@ -249,29 +249,27 @@ def _check_sigs_on_pdus(keyring, pdus):
         for p in pdus
     ]
 
-    # first make sure that the event is signed by the event_id's domain
-    deferreds = keyring.verify_json_objects_for_server([
-        (p.event_id_domain, p.redacted_pdu_json)
-        for p in pdus_to_check
-    ])
-
-    for p, d in zip(pdus_to_check, deferreds):
-        p.deferreds.append(d)
-
-    # now let's look for events where the sender's domain is different to the
-    # event id's domain (normally only the case for joins/leaves), and add additional
-    # checks.
+    # we need to make sure that the event is signed by the event_id's domain,
+    # and for events where the sender's domain is different to the event id's
+    # domain (normally only the case for joins/leaves), by the sender's domain
+    # too.
     pdus_to_check_sender = [
         p for p in pdus_to_check
         if p.sender_domain != p.event_id_domain and not _is_invite_via_3pid(p.pdu)
     ]
 
-    more_deferreds = keyring.verify_json_objects_for_server([
+    # We check all the signatures in one go, so that the keys for each server
+    # are only fetched once, and the signatures made with each key are checked
+    # together.
+    deferreds = keyring.verify_json_objects_for_server([
+        (p.event_id_domain, p.redacted_pdu_json)
+        for p in pdus_to_check
+    ] + [
         (p.sender_domain, p.redacted_pdu_json)
         for p in pdus_to_check_sender
     ])
 
-    for p, d in zip(pdus_to_check_sender, more_deferreds):
+    for p, d in zip(pdus_to_check + pdus_to_check_sender, deferreds):
         p.deferreds.append(d)
 
     # replace lists of deferreds with single Deferreds
@@ -44,9 +44,19 @@ logger = logging.getLogger(__name__)
 
 sent_queries_counter = Counter("synapse_federation_client_sent_queries", "", ["type"])
 
+send_join_checked_pdus_counter = Counter(
+    "synapse_federation_client_send_join_checked_pdus",
+    "Number of PDUs from /send_join responses whose signatures and hashes"
+    " have been checked",
+)
+
 
 PDU_RETRY_TIME_MS = 1 * 60 * 1000
 
+# The number of PDUs from a /send_join response to check the signatures and
+# hashes of at once, to bound the memory used while checking them.
+SEND_JOIN_CHECK_CHUNK_SIZE = 1000
+
 
 class InvalidResponseError(RuntimeError):
     """Helper for _try_destination_list: indicates that the server returned a response
@@ -635,26 +645,37 @@ class FederationClient(FederationBase):
 
             logger.debug("Got content: %s", content)
 
+            # we pop the PDU json out of the response as we go, so that we
+            # don't hold on to it once we have turned it into events.
             state = [
                 event_from_pdu_json(p, outlier=True)
-                for p in content.get("state", [])
+                for p in content.pop("state", [])
             ]
 
             auth_chain = [
                 event_from_pdu_json(p, outlier=True)
-                for p in content.get("auth_chain", [])
+                for p in content.pop("auth_chain", [])
             ]
 
-            pdus = {
+            pdus = list({
                 p.event_id: p
                 for p in itertools.chain(state, auth_chain)
-            }
+            }.values())
 
-            valid_pdus = yield self._check_sigs_and_hash_and_fetch(
-                destination, list(pdus.values()),
-                outlier=True,
+            logger.info(
+                "Checking %d PDUs from /send_join response for %s",
+                len(pdus), pdu.room_id,
             )
 
+            valid_pdus = []
+            for i in range(0, len(pdus), SEND_JOIN_CHECK_CHUNK_SIZE):
+                chunk = pdus[i:i + SEND_JOIN_CHECK_CHUNK_SIZE]
+                valid_chunk = yield self._check_sigs_and_hash_and_fetch(
+                    destination, chunk, outlier=True,
+                )
+                valid_pdus.extend(valid_chunk)
+                send_join_checked_pdus_counter.inc(len(chunk))
+
             valid_pdus_map = {
                 p.event_id: p
                 for p in valid_pdus
@@ -18,7 +18,7 @@ import logging
 import six
 from six import iteritems
 
-from canonicaljson import json
+from canonicaljson import encode_canonical_json, json
 from prometheus_client import Counter
 
 from twisted.internet import defer
@@ -35,9 +35,12 @@ from synapse.api.errors import (
 )
 from synapse.crypto.event_signing import compute_event_signature
 from synapse.federation.federation_base import FederationBase, event_from_pdu_json
+from synapse.federation.incoming_pdu_queue import IncomingPduQueue
 from synapse.federation.persistence import TransactionActions
 from synapse.federation.units import Edu, Transaction
 from synapse.http.endpoint import parse_server_name
+from synapse.http.server import PreEncodedJson
+from synapse.metrics.background_process_metrics import run_as_background_process
 from synapse.replication.http.federation import (
     ReplicationFederationSendEduRestServlet,
     ReplicationGetQueryRestServlet,
@@ -63,6 +66,19 @@ received_queries_counter = Counter(
     "synapse_federation_server_received_queries", "", ["type"]
 )
 
+queued_pdus_counter = Counter(
+    "synapse_federation_server_queued_pdus",
+    "Number of PDUs from incoming transactions which were queued to be"
+    " processed after responding, rather than being processed first",
+)
+
+state_responses_counter = Counter(
+    "synapse_federation_server_state_responses",
+    "Number of responses to /state and /state_ids requests, by whether they"
+    " were stored or had to be computed",
+    ["type", "source"],
+)
+
 
 class FederationServer(FederationBase):
 
@@ -83,6 +99,18 @@ class FederationServer(FederationBase):
         # come in waves.
         self._state_resp_cache = ResponseCache(hs, "state_resp", timeout_ms=30000)
 
+        # If enabled, we respond to transactions once their PDUs have been
+        # queued, and process the PDUs afterwards.
+        self._incoming_pdu_queue = None
+        if hs.config.federation_async_transactions:
+            self._incoming_pdu_queue = IncomingPduQueue(
+                hs, self._process_incoming_pdu,
+            )
+            self._clock.call_later(
+                0, run_as_background_process, "recover_queued_pdus",
+                self._incoming_pdu_queue.recover_queued_pdus,
+            )
+
     @defer.inlineCallbacks
     @log_function
     def on_backfill_request(self, origin, room_id, versions, limit):
@@ -153,6 +181,9 @@ class FederationServer(FederationBase):
 
         pdus_by_room = {}
 
+        # (pdu json, event) for each PDU, in the order they were sent
+        pdus = []
+
         for p in transaction.pdus:
             if "unsigned" in p:
                 unsigned = p["unsigned"]
@@ -187,48 +218,72 @@ class FederationServer(FederationBase):
 
             event = event_from_pdu_json(p)
             pdus_by_room.setdefault(room_id, []).append(event)
+            pdus.append((p, event))
 
         pdu_results = {}
 
-        # we can process different rooms in parallel (which is useful if they
-        # require callouts to other servers to fetch missing events), but
-        # impose a limit to avoid going too crazy with ram/cpu.
-
         @defer.inlineCallbacks
-        def process_pdus_for_room(room_id):
-            logger.debug("Processing PDUs for %s", room_id)
+        def check_acl_for_room(room_id):
             try:
                 yield self.check_server_matches_acl(origin_host, room_id)
             except AuthError as e:
                 logger.warn(
                     "Ignoring PDUs for room %s from banned server", room_id,
                 )
-                for pdu in pdus_by_room[room_id]:
+                for pdu in pdus_by_room.pop(room_id):
                     event_id = pdu.event_id
                     pdu_results[event_id] = e.error_dict()
-                return
 
-            for pdu in pdus_by_room[room_id]:
-                event_id = pdu.event_id
-                with nested_logging_context(event_id):
-                    try:
-                        yield self._handle_received_pdu(
-                            origin, pdu
-                        )
-                        pdu_results[event_id] = {}
-                    except FederationError as e:
-                        logger.warn("Error handling PDU %s: %s", event_id, e)
-                        pdu_results[event_id] = {"error": str(e)}
-                    except Exception as e:
-                        f = failure.Failure()
-                        pdu_results[event_id] = {"error": str(e)}
-                        logger.error(
-                            "Failed to handle PDU %s: %s",
-                            event_id, f.getTraceback().rstrip(),
-                        )
+        queue = self._incoming_pdu_queue
+        if queue is None:
+            queued_room_ids = set()
+        elif queue.has_capacity(len(pdus)):
+            queued_room_ids = set(pdus_by_room)
+        else:
+            # The queue is full, so we process the PDUs before responding
+            # instead. Rooms which already have PDUs in the queue are the
+            # exception: their new PDUs must be processed after those, so they
+            # go on the end of the queue regardless.
+            queued_room_ids = set(
+                room_id for room_id in pdus_by_room
+                if queue.has_queued_pdus(room_id)
+            )
+
+        if queued_room_ids:
+            for room_id in queued_room_ids:
+                yield check_acl_for_room(room_id)
+
+            queued_pdus = [
+                (pdu_json, event) for pdu_json, event in pdus
+                if event.room_id in queued_room_ids
+                and event.room_id in pdus_by_room
+            ]
+            yield queue.queue_pdus(origin, request_time, queued_pdus)
+
+            queued_pdus_counter.inc(len(queued_pdus))
+            for _, event in queued_pdus:
+                pdu_results[event.event_id] = {}
+
+        # we can process different rooms in parallel (which is useful if
+        # they require callouts to other servers to fetch missing
+        # events), but impose a limit to avoid going too crazy with
+        # ram/cpu.
+
+        @defer.inlineCallbacks
+        def process_pdus_for_room(room_id):
+            logger.debug("Processing PDUs for %s", room_id)
+            yield check_acl_for_room(room_id)
+
+            for pdu in pdus_by_room.get(room_id, []):
+                pdu_results[pdu.event_id] = yield self._process_incoming_pdu(
+                    origin, pdu,
+                )
 
         yield concurrently_execute(
-            process_pdus_for_room, pdus_by_room.keys(),
+            process_pdus_for_room, [
+                room_id for room_id in pdus_by_room
+                if room_id not in queued_room_ids
+            ],
             TRANSACTION_CONCURRENCY_LIMIT,
         )
 
@@ -253,6 +308,36 @@ class FederationServer(FederationBase):
         )
         defer.returnValue((200, response))
 
+    @defer.inlineCallbacks
+    def _process_incoming_pdu(self, origin, pdu):
+        """Handle a PDU from an incoming transaction
+
+        Args:
+            origin (unicode): the server which sent the transaction
+            pdu (FrozenEvent)
+
+        Returns:
+            Deferred[dict]: the result to return for the PDU in the response to
+                the transaction
+        """
+        event_id = pdu.event_id
+        with nested_logging_context(event_id):
+            try:
+                yield self._handle_received_pdu(origin, pdu)
+                result = {}
+            except FederationError as e:
+                logger.warn("Error handling PDU %s: %s", event_id, e)
+                result = {"error": str(e)}
+            except Exception as e:
+                f = failure.Failure()
+                result = {"error": str(e)}
+                logger.error(
+                    "Failed to handle PDU %s: %s",
+                    event_id, f.getTraceback().rstrip(),
+                )
+
+        defer.returnValue(result)
+
     @defer.inlineCallbacks
     def received_edu(self, origin, edu_type, content):
         received_edus_counter.inc()
@@ -279,8 +364,8 @@ class FederationServer(FederationBase):
         with (yield self._server_linearizer.queue((origin, room_id))):
             resp = yield self._state_resp_cache.wrap(
                 (room_id, event_id),
-                self._on_context_state_request_compute,
-                room_id, event_id,
+                self._get_state_response,
+                room_id, event_id, "state", self._on_context_state_request_compute,
             )
 
         defer.returnValue((200, resp))
@@ -297,15 +382,64 @@ class FederationServer(FederationBase):
         if not in_room:
             raise AuthError(403, "Host not in room.")
 
+        resp = yield self._get_state_response(
+            room_id, event_id, "state_ids", self._on_state_ids_request_compute,
+        )
+
+        defer.returnValue((200, resp))
+
+    @defer.inlineCallbacks
+    def _get_state_response(self, room_id, event_id, kind, compute):
+        """Gets the response to a /state or /state_ids request, either from
+        the stored responses or by computing and storing it.
+
+        Responses are stored by the state group of the event, so are shared
+        between events with the same state.
+
+        Args:
+            room_id (str)
+            event_id (str)
+            kind (str): either 'state' or 'state_ids'
+            compute (callable): called with the room and event IDs to compute
+                the response if it isn't stored. Should return a Deferred[dict].
+
+        Returns:
+            Deferred[PreEncodedJson]: the encoded response
+        """
+        key = yield self.handler.get_state_response_key(room_id, event_id)
+
+        if key is not None:
+            state_group, state_event_id = key
+            response_json = yield self.store.get_federation_state_response(
+                state_group, state_event_id, kind,
+            )
+            if response_json is not None:
+                state_responses_counter.labels(kind, "stored").inc()
+                defer.returnValue(PreEncodedJson(response_json))
+
+        state_responses_counter.labels(kind, "computed").inc()
+
+        resp = yield compute(room_id, event_id)
+        response_json = encode_canonical_json(resp)
+
+        if key is not None:
+            yield self.store.store_federation_state_response(
+                room_id, state_group, state_event_id, kind, response_json,
+            )
+
+        defer.returnValue(PreEncodedJson(response_json))
+
+    @defer.inlineCallbacks
+    def _on_state_ids_request_compute(self, room_id, event_id):
         state_ids = yield self.handler.get_state_ids_for_pdu(
             room_id, event_id,
         )
         auth_chain_ids = yield self.store.get_auth_chain_ids(state_ids)
 
-        defer.returnValue((200, {
+        defer.returnValue({
             "pdu_ids": state_ids,
             "auth_chain_ids": auth_chain_ids,
-        }))
+        })
 
     @defer.inlineCallbacks
     def _on_context_state_request_compute(self, room_id, event_id):
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 New Vector Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+from collections import deque
+
+from prometheus_client import Histogram
+
+from twisted.internet import defer
+
+from synapse.federation.federation_base import event_from_pdu_json
+from synapse.metrics import LaterGauge
+from synapse.metrics.background_process_metrics import run_as_background_process
+
+logger = logging.getLogger(__name__)
+
+incoming_pdu_lag = Histogram(
+    "synapse_federation_server_incoming_pdu_lag_seconds",
+    "Time between receiving a queued PDU and finishing processing it",
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800, 3600, "+Inf"),
+)
+
+
+class IncomingPduQueue(object):
+    """Processes PDUs from incoming federation transactions after we have
+    responded to the transaction.
+
+    PDUs are persisted before the transaction is acknowledged, so that they are
+    still processed if we restart. Each room's PDUs are processed in the order
+    they were received, and up to `federation_incoming_pdu_concurrency` rooms
+    are processed at once.
+    """
+
+    def __init__(self, hs, process_pdu):
+        """
+        Args:
+            hs (synapse.server.HomeServer)
+            process_pdu (callable): called with the origin and the event for
+                each queued PDU. Should return a Deferred, and handle its own
+                errors.
+        """
+        self.clock = hs.get_clock()
+        self.store = hs.get_datastore()
+
+        # The name we queue PDUs under, so that when there are several
+        # processes handling federation requests, each only recovers its own.
+        self._instance_name = hs.config.worker_name or "master"
+
+        self._process_pdu = process_pdu
+
+        self._queue_limit = hs.config.federation_incoming_pdu_queue_limit
+        self._concurrency = hs.config.federation_incoming_pdu_concurrency
+
+        # room_id -> deque of (origin, event, received_ts) for the PDUs which
+        # haven't finished being processed. A room is only in here while it
+        # has PDUs waiting.
+        self._pdus_by_room = {}
+
+        # rooms which have PDUs waiting, but which no worker is processing
+        self._waiting_rooms = deque()
+
+        self._queued_count = 0
+        self._worker_count = 0
+
+        LaterGauge(
+            "synapse_federation_server_incoming_pdu_queue_depth",
+            "Number of PDUs from incoming transactions waiting to be processed",
+            [],
+            lambda: self._queued_count,
+        )
+
+        LaterGauge(
+            "synapse_federation_server_incoming_pdu_queue_rooms",
+            "Number of rooms with PDUs waiting to be processed",
+            [],
+            lambda: len(self._pdus_by_room),
+        )
+
+    def has_capacity(self, count):
+        """Whether we can queue another `count` PDUs without going over the
+        queue limit.
+
+        Args:
+            count (int)
+
+        Returns:
+            bool
+        """
+        return self._queued_count + count <= self._queue_limit
+
+    def has_queued_pdus(self, room_id):
+        """Whether there are PDUs for the room which haven't finished being
+        processed. New PDUs for such a room must be queued behind them, so
+        that they are processed in order.
+
+        Args:
+            room_id (str)
+
+        Returns:
+            bool
+        """
+        return room_id in self._pdus_by_room
+
+    @defer.inlineCallbacks
+    def queue_pdus(self, origin, received_ts, pdus):
+        """Persist PDUs from a transaction, and queue them to be processed.
+
+        Args:
+            origin (str): the server which sent the transaction
+            received_ts (int): when we received the transaction
+            pdus (list[tuple[dict, FrozenEvent]]): the json and the event for
+                each PDU, in the order they appeared in the transaction
+
+        Returns:
+            Deferred: resolves once the PDUs have been persisted
+        """
+        yield self.store.queue_inbound_pdus(
+            self._instance_name, origin, received_ts, [
+                (event.room_id, event.event_id, pdu_json)
+                for pdu_json, event in pdus
+            ],
+        )
+
+        for _, event in pdus:
+            self._add_pdu(origin, event, received_ts)
+
+        self._start_workers()
+
+    @defer.inlineCallbacks
+    def recover_queued_pdus(self):
+        """Queue any PDUs which we persisted but did not process before we
+        last shut down.
+        """
+        rows = yield self.store.get_queued_inbound_pdus(self._instance_name)
+        if not rows:
+            return
+
+        logger.info("Recovering %d queued incoming PDUs", len(rows))
+
+        for row in rows:
+            event = event_from_pdu_json(row["pdu_json"])
+            self._add_pdu(row["origin"], event, row["received_ts"])
+
+        self._start_workers()
+
+    def _add_pdu(self, origin, event, received_ts):
+        pdus = self._pdus_by_room.get(event.room_id)
+        if pdus is None:
+            pdus = self._pdus_by_room[event.room_id] = deque()
+            self._waiting_rooms.append(event.room_id)
+
+        pdus.append((origin, event, received_ts))
+        self._queued_count += 1
+
+    def _start_workers(self):
+        while self._waiting_rooms and self._worker_count < self._concurrency:
+            self._worker_count += 1
+            run_as_background_process(
+                "process_incoming_pdus", self._process_waiting_rooms,
+            )
+
+    @defer.inlineCallbacks
+    def _process_waiting_rooms(self):
+        try:
+            while self._waiting_rooms:
+                room_id = self._waiting_rooms.popleft()
+                pdus = self._pdus_by_room[room_id]
+
+                # PDUs which arrive for the room while we are processing it
+                # are added to the end of `pdus`, so we keep going until it is
+                # empty.
+                while pdus:
+                    origin, event, received_ts = pdus[0]
+
+                    try:
+                        yield self._process_pdu(origin, event)
+                    except Exception:
+                        logger.exception(
+                            "Failed to process queued PDU %s", event.event_id,
+                        )
+
+                    pdus.popleft()
+                    self._queued_count -= 1
+                    incoming_pdu_lag.observe(
+                        (self.clock.time_msec() - received_ts) / 1000.,
+                    )
+
+                    try:
+                        yield self.store.remove_queued_inbound_pdu(
+                            self._instance_name, origin, event.event_id,
+                        )
+                    except Exception:
+                        logger.exception(
+                            "Failed to remove queued PDU %s", event.event_id,
+                        )
+
+                del self._pdus_by_room[room_id]
+        finally:
+            self._worker_count -= 1
@@ -16,7 +16,9 @@
 """A federation sender that forwards things to be sent across replication to
 a worker process.
 
-It assumes there is a single worker process feeding off of it.
+It assumes there is a single worker process feeding off of it, or, if
+federation sending is sharded, one worker per shard, each of which ignores the
+destinations handled by the other shards.
 
 Each row in the replication stream consists of a type and some json, where the
 types indicate whether they are presence, or edus, etc.
@@ -14,6 +14,7 @@
 # limitations under the License.
 import datetime
 import logging
+import zlib
 
 from six import itervalues
 
@@ -22,6 +23,7 @@ from prometheus_client import Counter
 from twisted.internet import defer
 
 import synapse.metrics
+from synapse.api.constants import EventTypes, Membership
 from synapse.api.errors import FederationDeniedError, HttpResponseException
 from synapse.handlers.presence import format_user_presence_state, get_interested_remotes
 from synapse.metrics import (
@@ -33,7 +35,10 @@ from synapse.metrics import (
     sent_transactions_counter,
 )
 from synapse.metrics.background_process_metrics import run_as_background_process
+from synapse.types import get_domain_from_id
 from synapse.util import logcontext
+from synapse.util.caches import intern_string
+from synapse.util.caches.lrucache import LruCache
 from synapse.util.metrics import measure_func
 from synapse.util.retryutils import NotRetryingDestination, get_retry_limiter
 
@@ -49,6 +54,60 @@ sent_pdus_destination_dist_total = Counter(
     "synapse_federation_client_sent_pdu_destinations:total", ""
 )
 
+room_hosts_lookups_counter = Counter(
+    "synapse_federation_transaction_queue_room_hosts_lookups",
+    "Number of times we have worked out the servers to send an event to, and"
+    " whether they were known from the previous event in the room",
+    ["cached"],
+)
+
+coalesced_edus_counter = Counter(
+    "synapse_federation_transaction_queue_coalesced_edus",
+    "Number of EDUs queued while a transaction to send EDUs to their"
+    " destination was already waiting to start, which therefore didn't need a"
+    " transaction of their own",
+)
+
+superseded_edus_counter = Counter(
+    "synapse_federation_transaction_queue_superseded_edus",
+    "Number of queued EDUs which were replaced by a newer one before being sent",
+    ["type"],
+)
+
+caught_up_pdus_counter = Counter(
+    "synapse_federation_transaction_queue_caught_up_pdus",
+    "Number of PDUs sent to destinations which were catching up on events they"
+    " missed while we couldn't reach them",
+)
+
+# The total number of joined users (plus one per room) in the rooms we
+# remember the servers in after the latest event
+ROOM_HOSTS_CACHE_SIZE = 200000
+
+# The most events to send in each transaction when catching up a destination
+CATCH_UP_TRANSACTION_SIZE = 50
+
+# How long to wait after starting up before catching up destinations which
+# missed events before we restarted, and how long to wait between starting
+# each batch of them.
+CATCH_UP_STARTUP_DELAY_SEC = 15
+CATCH_UP_WAKE_INTERVAL_SEC = 5
+
+
+def get_destination_shard(destination, shards):
+    """Work out which federation sender shard handles a destination
+
+    Args:
+        destination (str): the server name of the destination
+        shards (int): the number of federation sender shards
+
+    Returns:
+        int: the index of the shard, from 0 to shards - 1
+    """
+    # python's hash() is randomised per process, so we need a hash which is
+    # stable across the shards.
+    return (zlib.crc32(destination.encode("utf-8")) & 0xffffffff) % shards
+
 
 class TransactionQueue(object):
     """This class makes sure we only have one transaction in flight at
@@ -66,6 +125,7 @@ class TransactionQueue(object):
         self.transaction_actions = TransactionActions(self.store)
 
         self.transport_layer = hs.get_federation_transport_client()
+        self._destination_health = hs.get_destination_health_tracker()
 
         self.clock = hs.get_clock()
         self.is_mine_id = hs.is_mine_id
@@ -135,8 +195,65 @@ class TransactionQueue(object):
         self._is_processing = False
         self._last_poked_id = -1
 
+        # room_id -> _LatestRoomHosts: the servers in each room after the
+        # latest event we have processed in it. Most events follow directly on
+        # from the previous event in the room, so we can usually update this
+        # from the event itself rather than having to work out the state
+        # before each event. The cache is sized by the number of joined users
+        # in each room, as large rooms take up far more memory.
+        self._latest_room_hosts = LruCache(
+            ROOM_HOSTS_CACHE_SIZE, size_callback=lambda latest: latest.size,
+        )
+
+        # Federation sender workers can be sharded, with each handling the
+        # destinations which hash to its instance number, and keeping track of
+        # its own position in the events stream. The main process always
+        # sends to all destinations.
+        self._shards = 1
+        self._shard = 0
+        self._events_position_type = "events"
+        if hs.config.worker_app and hs.config.federation_sender_instances > 1:
+            self._shards = hs.config.federation_sender_instances
+            self._shard = hs.config.federation_sender_instance
+            self._events_position_type = "events_%d" % (self._shard,)
+
         self._processing_pending_presence = False
 
+        # How long to wait after an EDU is queued before starting a transaction
+        # to send it, so that other EDUs queued for the destination in the
+        # meantime are sent in the same transaction.
+        self._edu_coalescing_window_ms = (
+            hs.config.federation_edu_coalescing_window_ms
+        )
+
+        # destination -> IDelayedCall which will start a transaction to send
+        # the EDUs queued for the destination
+        self._edu_transaction_timers = {}
+
+        # Destinations which we have checked have received all of our events
+        # since we started, and so whose PDUs are queued in memory.
+        self._caught_up_destinations = set()
+
+        # Destinations which are catching up on events they have missed, which
+        # are sent from the database rather than queued in memory, mapped to
+        # whether any new PDUs have been skipped since we last checked the
+        # database for them.
+        self._catching_up_destinations = {}
+
+        # destination -> the stream ordering of the latest of our events we
+        # have successfully sent it, for destinations we have looked up or
+        # sent events to since we started.
+        self._last_successful_stream_orderings = {}
+
+        # Once we have started up, start catching up any destinations which
+        # missed events before we were restarted.
+        self.clock.call_later(
+            CATCH_UP_STARTUP_DELAY_SEC,
+            run_as_background_process,
+            "wake_destinations_needing_catch_up",
+            self._wake_destinations_needing_catch_up,
+        )
+
     def notify_new_events(self, current_id):
         """This gets called when we have some new events we might want to
         send out to other servers.
@@ -152,12 +269,31 @@ class TransactionQueue(object):
             self._process_event_queue_loop,
         )
 
+    def _is_our_destination(self, destination):
+        """Whether this federation sender handles sending to the given
+        destination.
+        """
+        if self._shards == 1:
+            return True
+        return get_destination_shard(destination, self._shards) == self._shard
+
+    @defer.inlineCallbacks
+    def _get_events_position(self):
+        position = yield self.store.get_federation_out_pos(
+            self._events_position_type,
+        )
+        if position is None:
+            # This is a new shard, so carry on from wherever the unsharded
+            # federation sender got to.
+            position = yield self.store.get_federation_out_pos("events")
+        defer.returnValue(position)
+
     @defer.inlineCallbacks
     def _process_event_queue_loop(self):
         try:
             self._is_processing = True
             while True:
-                last_token = yield self.store.get_federation_out_pos("events")
+                last_token = yield self._get_events_position()
                 next_token, events = yield self.store.get_all_new_events_stream(
                     last_token, self._last_poked_id, limit=100,
                 )
@@ -173,18 +309,14 @@ class TransactionQueue(object):
                     send_on_behalf_of = event.internal_metadata.get_send_on_behalf_of()
                     is_mine = self.is_mine_id(event.event_id)
                     if not is_mine and send_on_behalf_of is None:
+                        # we still need to keep track of who is in the room
+                        hosts_to_joined_users = self._get_cached_room_hosts(event)
+                        if hosts_to_joined_users is not None:
+                            self._update_room_hosts(event, hosts_to_joined_users)
                         return
 
                     try:
-                        # Get the state from before the event.
-                        # We need to make sure that this is the state from before
-                        # the event and not from after it.
-                        # Otherwise if the last member on a server in a room is
-                        # banned then it won't receive the event because it won't
-                        # be in the room after the ban.
-                        destinations = yield self.state.get_current_hosts_in_room(
-                            event.room_id, latest_event_ids=event.prev_event_ids(),
-                        )
+                        destinations = yield self._get_hosts_before_event(event)
                     except Exception:
                         logger.exception(
                             "Failed to calculate hosts in room for event: %s",
@@ -202,7 +334,7 @@ class TransactionQueue(object):
 
                     logger.debug("Sending %s to %r", event, destinations)
 
-                    self._send_pdu(event, destinations)
+                    pdus_to_send.append((event, destinations))
 
                 @defer.inlineCallbacks
                 def handle_room_events(events):
@@ -213,6 +345,7 @@ class TransactionQueue(object):
                 for event in events:
                     events_by_room.setdefault(event.room_id, []).append(event)
 
+                pdus_to_send = []
                 yield logcontext.make_deferred_yieldable(defer.gatherResults(
                     [
                         logcontext.run_in_background(handle_room_events, evs)
@@ -221,8 +354,17 @@ class TransactionQueue(object):
                     consumeErrors=True
                 ))
 
+                # The rooms are handled concurrently, so we only queue the
+                # events once the whole batch has been handled, in stream
+                # order. That way a destination is never sent an event before
+                # all our earlier events for it have been queued.
+                pdus_to_send.sort(
+                    key=lambda e: e[0].internal_metadata.stream_ordering,
+                )
+                yield self._send_pdus(pdus_to_send)
+
                 yield self.store.update_federation_out_pos(
-                    "events", next_token
+                    self._events_position_type, next_token
                 )
 
                 if events:
@@ -248,29 +390,184 @@ class TransactionQueue(object):
         finally:
             self._is_processing = False
 
-    def _send_pdu(self, pdu, destinations):
-        # We loop through all destinations to see whether we already have
-        # a transaction in progress. If we do, stick it in the pending_pdus
-        # table and we'll get back to it later.
+    @defer.inlineCallbacks
+    def _get_hosts_before_event(self, event):
+        """Get the servers which were in the room just before the given event,
+        and remember the servers in the room after it.
+
+        We need to make sure that this is the state from before the event and
+        not from after it. Otherwise if the last member on a server in a room
+        is banned then it won't receive the event because it won't be in the
+        room after the ban.
+
+        Args:
+            event (FrozenEvent)
+
+        Returns:
+            Deferred[frozenset[str]]
+        """
+        hosts_to_joined_users = self._get_cached_room_hosts(event)
+
+        if hosts_to_joined_users is not None:
+            room_hosts_lookups_counter.labels(True).inc()
+        else:
+            room_hosts_lookups_counter.labels(False).inc()
+
+            prev_event_ids = event.prev_event_ids()
+            if not prev_event_ids:
+                prev_event_ids = yield self.store.get_latest_event_ids_in_room(
+                    event.room_id,
+                )
+            entry = yield self.state.resolve_state_groups_for_events(
+                event.room_id, prev_event_ids,
+            )
+            joined_users = yield self.store.get_joined_users_from_state(
+                event.room_id, entry,
+            )
+
+            hosts_to_joined_users = {}
+            for user_id in joined_users:
+                host = intern_string(get_domain_from_id(user_id))
+                hosts_to_joined_users.setdefault(host, set()).add(user_id)
+
+        hosts = frozenset(hosts_to_joined_users)
+        self._update_room_hosts(event, hosts_to_joined_users)
+        defer.returnValue(hosts)
+
+    def _get_cached_room_hosts(self, event):
+        """Get the servers in the room before the given event, if it follows
+        directly on from the latest event we've processed in the room.
 
-        order = self._order
-        self._order += 1
+        Args:
+            event (FrozenEvent)
 
-        destinations = set(destinations)
-        destinations.discard(self.server_name)
-        logger.debug("Sending to: %s", str(destinations))
+        Returns:
+            dict[str, set[str]]|None: map from server name to the joined users
+            on that server, or None if we don't know.
+        """
+        latest = self._latest_room_hosts.get(event.room_id)
+        if latest is None:
+            return None
+
+        prev_event_ids = event.prev_event_ids()
+        if len(prev_event_ids) != 1 or prev_event_ids[0] != latest.event_id:
+            return None
+
+        return latest.hosts_to_joined_users
+
+    def _update_room_hosts(self, event, hosts_to_joined_users):
+        """Remember the servers in the room after the given event.
+
+        Args:
+            event (FrozenEvent)
+            hosts_to_joined_users (dict[str, set[str]]): map from server name
+                to the joined users on that server before the event. This is
+                updated in place.
+        """
+        if event.internal_metadata.is_outlier():
+            # outliers aren't part of the room's state
+            return
 
-        if not destinations:
+        if not event.prev_event_ids():
+            # we'll have used the current state of the room rather than the
+            # state before the event, so can't derive the state after it.
             return
 
-        sent_pdus_destination_dist_total.inc(len(destinations))
-        sent_pdus_destination_dist_count.inc()
+        # If we are carrying on from the cached entry, we can keep track of
+        # the number of joined users without counting them all again.
+        latest = self._latest_room_hosts.get(event.room_id)
+        if (
+            latest is not None and
+            latest.hosts_to_joined_users is hosts_to_joined_users
+        ):
+            user_count = latest.user_count
+        else:
+            user_count = sum(
+                len(user_ids) for user_ids in itervalues(hosts_to_joined_users)
+            )
+
+        if event.type == EventTypes.Member and event.is_state():
+            user_id = event.state_key
+            host = intern_string(get_domain_from_id(user_id))
+
+            if event.membership == Membership.JOIN:
+                joined_users = hosts_to_joined_users.setdefault(host, set())
+                if user_id not in joined_users:
+                    joined_users.add(user_id)
+                    user_count += 1
+            else:
+                joined_users = hosts_to_joined_users.get(host)
+                if joined_users is not None and user_id in joined_users:
+                    joined_users.discard(user_id)
+                    user_count -= 1
+                    if not joined_users:
+                        del hosts_to_joined_users[host]
+
+        self._latest_room_hosts[event.room_id] = _LatestRoomHosts(
+            event.event_id, hosts_to_joined_users, user_count,
+        )
 
-        for destination in destinations:
-            self.pending_pdus_by_dest.setdefault(destination, []).append(
-                (pdu, order)
+    @defer.inlineCallbacks
+    def _send_pdus(self, pdus_and_destinations):
+        """Queue up some of our events to be sent to other servers.
+
+        Args:
+            pdus_and_destinations (list[tuple[FrozenEvent, set[str]]]): the
+                events, in stream order, and the destinations to send each to.
+
+        Returns:
+            Deferred
+        """
+        to_send = []
+        for pdu, destinations in pdus_and_destinations:
+            destinations = set(
+                destination for destination in destinations
+                if destination != self.server_name
+                and self._is_our_destination(destination)
             )
+            logger.debug("Sending to: %s", str(destinations))
+
+            if destinations:
+                to_send.append((pdu, destinations))
+
+        if not to_send:
+            return
+
+        # Record that the destinations should get these events, so that we can
+        # send them later if they miss them. This happens before we queue any
+        # of them, so that a destination which is catching up sees all of
+        # them in the database.
+        yield self.store.store_destination_rooms_entries([
+            (destination, pdu.room_id, pdu.internal_metadata.stream_ordering)
+            for pdu, destinations in to_send
+            for destination in destinations
+        ])
+
+        all_destinations = set()
+        for pdu, destinations in to_send:
+            # We loop through all destinations to see whether we already have
+            # a transaction in progress. If we do, stick it in the
+            # pending_pdus table and we'll get back to it later.
+
+            order = self._order
+            self._order += 1
+
+            sent_pdus_destination_dist_total.inc(len(destinations))
+            sent_pdus_destination_dist_count.inc()
+
+            for destination in destinations:
+                if destination in self._catching_up_destinations:
+                    # the destination will get the event from the database
+                    # when it catches up
+                    self._catching_up_destinations[destination] = True
+                else:
+                    self.pending_pdus_by_dest.setdefault(destination, []).append(
+                        (pdu, order)
+                    )
+
+            all_destinations.update(destinations)
 
+        for destination in all_destinations:
             self._attempt_new_transaction(destination)
 
     @logcontext.preserve_fn  # the caller should not yield on this
@@ -336,13 +633,18 @@ class TransactionQueue(object):
                 if destination == self.server_name:
                     continue
 
-                self.pending_presence_by_dest.setdefault(
+                if not self._is_our_destination(destination):
+                    continue
+
+                pending_presence = self.pending_presence_by_dest.setdefault(
                     destination, {}
-                ).update({
-                    state.user_id: state for state in states
-                })
+                )
+                for state in states:
+                    if state.user_id in pending_presence:
+                        superseded_edus_counter.labels("m.presence").inc()
+                    pending_presence[state.user_id] = state
 
-                self._attempt_new_transaction(destination)
+                self._attempt_edu_transaction(destination)
 
     def send_edu(self, destination, edu_type, content, key=None):
         edu = Edu(
@@ -356,27 +658,66 @@ class TransactionQueue(object):
             logger.info("Not sending EDU to ourselves")
             return
 
+        if not self._is_our_destination(destination):
+            return
+
         sent_edus_counter.inc()
 
         if key:
-            self.pending_edus_keyed_by_dest.setdefault(
+            pending_edus = self.pending_edus_keyed_by_dest.setdefault(
                 destination, {}
-            )[(edu.edu_type, key)] = edu
+            )
+            if (edu.edu_type, key) in pending_edus:
+                superseded_edus_counter.labels(edu.edu_type).inc()
+            pending_edus[(edu.edu_type, key)] = edu
         else:
             self.pending_edus_by_dest.setdefault(destination, []).append(edu)
 
-        self._attempt_new_transaction(destination)
+        self._attempt_edu_transaction(destination)
 
     def send_device_messages(self, destination):
         if destination == self.server_name:
             logger.info("Not sending device update to ourselves")
             return
 
+        if not self._is_our_destination(destination):
+            return
+
         self._attempt_new_transaction(destination)
 
     def get_current_token(self):
         return 0
 
+    def _attempt_edu_transaction(self, destination):
+        """Try to start a new transaction to send the EDUs queued for this
+        destination.
+
+        If EDU coalescing is enabled, we wait for the coalescing window to pass
+        first, so that any more EDUs queued in the meantime can be sent in the
+        same transaction.
+
+        Args:
+            destination (str):
+
+        Returns:
+            None
+        """
+        if not self._edu_coalescing_window_ms:
+            self._attempt_new_transaction(destination)
+            return
+
+        if destination in self._edu_transaction_timers:
+            coalesced_edus_counter.inc()
+            return
+
+        def start_transaction():
+            del self._edu_transaction_timers[destination]
+            self._attempt_new_transaction(destination)
+
+        self._edu_transaction_timers[destination] = self.clock.call_later(
+            self._edu_coalescing_window_ms / 1000., start_transaction,
+        )
+
     def _attempt_new_transaction(self, destination):
         """Try to start a new transaction to this destination
 
@@ -419,8 +760,14 @@ class TransactionQueue(object):
             # This will throw if we wouldn't retry. We do this here so we fail
             # quickly, but we will later check this again in the http client,
             # hence why we throw the result away.
+            self._destination_health.check_available(destination)
             yield get_retry_limiter(destination, self.clock, self.store)
 
+            if destination not in self._caught_up_destinations:
+                caught_up = yield self._catch_up_destination(destination)
+                if not caught_up:
+                    return
+
             pending_pdus = []
             while True:
                 device_message_edus, device_stream_id, dev_list_id = (
@@ -452,9 +799,9 @@ class TransactionQueue(object):
 
                 pending_presence = self.pending_presence_by_dest.pop(destination, {})
 
-                pending_edus.extend(
+                pending_edus.extend(_merge_receipt_edus(
                     self.pending_edus_keyed_by_dest.pop(destination, {}).values()
-                )
+                ))
 
                 pending_edus.extend(device_message_edus)
                 if pending_presence:
@@ -492,6 +839,19 @@ class TransactionQueue(object):
                 )
                 if success:
                     sent_transactions_counter.inc()
+
+                    # PDUs are queued in stream order, a batch at a time, so
+                    # all our earlier events for the destination have been
+                    # sent (or were covered by catching up).
+                    if pending_pdus:
+                        yield self._set_last_successful_stream_ordering(
+                            destination,
+                            max(
+                                pdu.internal_metadata.stream_ordering
+                                for pdu, _ in pending_pdus
+                            ),
+                        )
+
                     # Remove the acknowledged device messages from the database
                     # Only bother if we actually sent some device messages
                     if device_message_edus:
@@ -516,6 +876,7 @@ class TransactionQueue(object):
                     (e.retry_last_ts + e.retry_interval) / 1000.0
                 ),
             )
+            self._start_catching_up(destination)
         except FederationDeniedError as e:
             logger.info(e)
         except Exception as e:
@@ -527,10 +888,146 @@ class TransactionQueue(object):
             for p, _ in pending_pdus:
                 logger.info("Failed to send event %s to %s", p.event_id,
                             destination)
+            self._start_catching_up(destination)
         finally:
             # We want to be *very* sure we delete this after we stop processing
             self.pending_transactions.pop(destination, None)
 
+    def _start_catching_up(self, destination):
+        """Stop queuing PDUs in memory for a destination we are failing to
+        send to. Once it is reachable again, it will be sent the latest of
+        our events in each room it missed events in.
+
+        Any PDUs already queued for it are kept, and are sent afterwards if
+        they weren't covered by catching up.
+
+        Args:
+            destination (str)
+        """
+        self._caught_up_destinations.discard(destination)
+
+        if self._last_successful_stream_orderings.get(destination) is None:
+            # we can't tell which events the destination has missed, so have
+            # to keep queuing them in memory.
+            return
+
+        self._catching_up_destinations.setdefault(destination, False)
+
+    def _set_last_successful_stream_ordering(self, destination, stream_ordering):
+        self._last_successful_stream_orderings[destination] = stream_ordering
+        return self.store.set_destination_last_successful_stream_ordering(
+            destination, stream_ordering,
+        )
+
+    @defer.inlineCallbacks
+    def _catch_up_destination(self, destination):
+        """Send a destination the latest of our events in each room which it
+        has missed events in since we last successfully sent it an event.
+
+        The destination can fetch any other events it missed itself, as it
+        would for any event whose prev_events it doesn't have.
+
+        Args:
+            destination (str)
+
+        Returns:
+            Deferred[bool]: whether the destination has caught up, and so can
+                have PDUs queued in memory again.
+        """
+        last_successful_stream_ordering = (
+            yield self.store.get_destination_last_successful_stream_ordering(
+                destination,
+            )
+        )
+        self._last_successful_stream_orderings[destination] = (
+            last_successful_stream_ordering
+        )
+
+        if last_successful_stream_ordering is not None:
+            self._catching_up_destinations.setdefault(destination, False)
+
+        while last_successful_stream_ordering is not None:
+            self._catching_up_destinations[destination] = False
+
+            rows = yield self.store.get_catch_up_room_events(
+                destination, last_successful_stream_ordering,
+                limit=CATCH_UP_TRANSACTION_SIZE,
+            )
+
+            if not rows:
+                if self._catching_up_destinations[destination]:
+                    # a new PDU arrived while we were looking: check again.
+                    continue
+                break
+
+            events = yield self.store.get_events(
+                [event_id for event_id, _ in rows],
+            )
+            pending_pdus = [
+                (events[event_id], stream_ordering)
+                for event_id, stream_ordering in rows
+                if event_id in events
+            ]
+
+            if pending_pdus:
+                logger.info(
+                    "TX [%s] Catching up with %i events",
+                    destination, len(pending_pdus),
+                )
+                caught_up_pdus_counter.inc(len(pending_pdus))
+
+                success = yield self._send_new_transaction(
+                    destination, pending_pdus, [],
+                )
+                if success:
+                    sent_transactions_counter.inc()
+                # otherwise the destination responded, but rejected the
+                # transaction, so there's no point trying to send it again.
+
+            last_successful_stream_ordering = rows[-1][1]
+            yield self._set_last_successful_stream_ordering(
+                destination, last_successful_stream_ordering,
+            )
+
+        self._catching_up_destinations.pop(destination, None)
+        self._caught_up_destinations.add(destination)
+
+        # drop any PDUs we queued in memory which we have now sent (or
+        # superseded) while catching up.
+        pending_pdus = self.pending_pdus_by_dest.pop(destination, [])
+        if last_successful_stream_ordering is not None:
+            pending_pdus = [
+                (pdu, order) for pdu, order in pending_pdus
+                if pdu.internal_metadata.stream_ordering
+                > last_successful_stream_ordering
+            ]
+        if pending_pdus:
+            self.pending_pdus_by_dest[destination] = pending_pdus
+
+        defer.returnValue(True)
+
+    @defer.inlineCallbacks
+    def _wake_destinations_needing_catch_up(self):
+        """Start catching up any destinations which missed some of our events
+        before we last restarted.
+        """
+        last_destination = None
+        while True:
+            destinations = yield self.store.get_catch_up_outstanding_destinations(
+                last_destination,
+            )
+            if not destinations:
+                break
+
+            last_destination = destinations[-1]
+
+            for destination in destinations:
+                if self._is_our_destination(destination):
+                    self._attempt_new_transaction(destination)
+
+            # don't start catching up with too many destinations at once
+            yield self.clock.sleep(CATCH_UP_WAKE_INTERVAL_SEC)
+
     @defer.inlineCallbacks
     def _get_new_device_messages(self, destination):
         last_device_stream_id = self.last_device_stream_id_by_dest.get(destination, 0)
@@ -669,3 +1166,60 @@ class TransactionQueue(object):
             success = False
 
         defer.returnValue(success)
+
+
+def _merge_receipt_edus(edus):
+    """Combines any receipt EDUs in a list of EDUs into a single EDU
+
+    Args:
+        edus (Iterable[Edu]): EDUs for a single destination
+
+    Returns:
+        list[Edu]: the EDUs, with the first receipt EDU replaced by one holding
+            all the receipts, and the others removed.
+    """
+    merged_edus = []
+    receipts = {}
+    receipts_index = None
+
+    for edu in edus:
+        if edu.edu_type != "m.receipt":
+            merged_edus.append(edu)
+            continue
+
+        if receipts_index is None:
+            receipts_index = len(merged_edus)
+            merged_edus.append(edu)
+
+        for room_id, receipts_by_type in edu.content.items():
+            room_receipts = receipts.setdefault(room_id, {})
+            for receipt_type, receipts_by_user in receipts_by_type.items():
+                room_receipts.setdefault(receipt_type, {}).update(receipts_by_user)
+
+    if receipts_index is not None:
+        edu = merged_edus[receipts_index]
+        merged_edus[receipts_index] = Edu(
+            origin=edu.origin,
+            destination=edu.destination,
+            edu_type="m.receipt",
+            content=receipts,
+        )
+
+    return merged_edus
+
+
+class _LatestRoomHosts(object):
+    """The servers in a room after a given event"""
+
+    __slots__ = ["event_id", "hosts_to_joined_users", "user_count"]
+
+    def __init__(self, event_id, hosts_to_joined_users, user_count):
+        self.event_id = event_id
+        self.hosts_to_joined_users = hosts_to_joined_users
+        self.user_count = user_count
+
+    @property
+    def size(self):
+        """The size of this entry in the cache of room hosts"""
+        # Every entry counts for something, even if the room is empty.
+        return self.user_count + 1
@@ -176,6 +176,7 @@ class TransportLayerClient(object):
             json_data_callback=json_data_callback,
             long_retries=True,
             backoff_on_404=True,  # If we get a 404 the other side has gone
+            compress=True,
         )
 
         defer.returnValue(response)
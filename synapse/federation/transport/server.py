@@ -17,6 +17,8 @@
 import functools
 import logging
 import re
+import zlib
+from io import BytesIO
 
 from twisted.internet import defer
 
@@ -38,6 +40,10 @@ from synapse.util.versionstring import get_version_string
 
 logger = logging.getLogger(__name__)
 
+# The largest we will decompress a gzipped request body to. This is well above
+# the size of any legitimate federation request.
+MAX_DECOMPRESSED_REQUEST_SIZE = 50 * 1024 * 1024
+
 
 class TransportLayerServer(JsonResource):
     """Handles incoming federation HTTP requests"""
@@ -189,6 +195,40 @@ def _parse_auth_header(header_bytes):
         )
 
 
+def _decompress_request_content(request):
+    """If the body of a request is gzipped, replaces the request's content
+    with the decompressed body.
+
+    Args:
+        request (twisted.web.http.Request)
+
+    Raises:
+        SynapseError if the body uses an encoding other than gzip, or can't
+            be decompressed.
+    """
+    encodings = request.requestHeaders.getRawHeaders(b"Content-Encoding")
+    if not encodings or encodings == [b"identity"]:
+        return
+
+    if encodings != [b"gzip"]:
+        raise SynapseError(
+            415, "Unsupported Content-Encoding", Codes.UNRECOGNIZED,
+        )
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        body = decompressor.decompress(
+            request.content.read(), MAX_DECOMPRESSED_REQUEST_SIZE,
+        )
+    except zlib.error:
+        raise SynapseError(400, "Invalid gzipped content", Codes.NOT_JSON)
+
+    if decompressor.unconsumed_tail:
+        raise SynapseError(413, "Request body too large", Codes.TOO_LARGE)
+
+    request.content = BytesIO(body)
+
+
 class BaseFederationServlet(object):
     """Abstract base class for federation servlet classes.
 
@@ -251,9 +291,14 @@ class BaseFederationServlet(object):
                 Deferred[(int, object)|None]: (response code, response object) as returned
                     by the callback method. None if the request has already been handled.
             """
+            # Let the remote server know that it can gzip the bodies of its
+            # requests to us (as per RFC 7694).
+            request.setHeader(b"Accept-Encoding", b"gzip")
+
             content = None
             if request.method in [b"PUT", b"POST"]:
                 # TODO: Handle other method types? other content types?
+                _decompress_request_content(request)
                 content = parse_json_object_from_request(request)
 
             try:
@@ -23,6 +23,7 @@ import six
 from six import iteritems, itervalues
 from six.moves import http_client, zip
 
+from prometheus_client import Counter
 from signedjson.key import decode_verify_key_bytes
 from signedjson.sign import verify_signed_json
 from unpaddedbase64 import decode_base64
@@ -48,6 +49,7 @@ from synapse.crypto.event_signing import (
     compute_event_signature,
 )
 from synapse.events.validator import EventValidator
+from synapse.metrics import LaterGauge
 from synapse.replication.http.federation import (
     ReplicationCleanRoomRestServlet,
     ReplicationFederationSendEventsRestServlet,
@@ -67,6 +69,16 @@ from ._base import BaseHandler
 
 logger = logging.getLogger(__name__)
 
+join_persisted_events_counter = Counter(
+    "synapse_handlers_federation_join_persisted_events",
+    "Number of events from the state and auth chain of rooms being joined"
+    " which have been persisted",
+)
+
+# The number of events from the state and auth chain of a room we are joining
+# to persist at once.
+JOIN_PERSIST_CHUNK_SIZE = 1000
+
 
 def shortstr(iterable, maxitems=5):
     """If iterable has maxitems or fewer, return the stringification of a list
@@ -133,6 +145,19 @@ class FederationHandler(BaseHandler):
         self.room_queues = {}
         self._room_pdu_linearizer = Linearizer("fed_room_pdu")
 
+        # map from (room ID, join event ID) to the number of events from the
+        # state and auth chain still to be persisted, for the joins in
+        # progress. Several of our users may be joining the same room at once.
+        self._join_events_pending = {}
+
+        LaterGauge(
+            "synapse_handlers_federation_join_pending_events",
+            "Number of events from the state and auth chain of rooms being"
+            " joined which are waiting to be persisted",
+            [],
+            lambda: sum(itervalues(self._join_events_pending)),
+        )
+
     @defer.inlineCallbacks
     def on_receive_pdu(
             self, origin, pdu, sent_to_us_directly=False,
@@ -1496,6 +1521,26 @@ class FederationHandler(BaseHandler):
         else:
             defer.returnValue([])
 
+    @defer.inlineCallbacks
+    def get_state_response_key(self, room_id, event_id):
+        """Returns what the state at the event, as returned by
+        get_state_for_pdu and get_state_ids_for_pdu, depends on.
+
+        Returns:
+            Deferred[tuple[int, str]|None]: the state group of the event, and
+            the event ID if it is a state event (since it is then left out of
+            the state) or '' otherwise. None if the event has no state group.
+        """
+        event = yield self.store.get_event(
+            event_id, allow_none=False, check_room_id=room_id,
+        )
+
+        state_group = yield self.store.get_state_group_for_event(event_id)
+        if state_group is None:
+            defer.returnValue(None)
+
+        defer.returnValue((state_group, event_id if event.is_state() else ""))
+
     @defer.inlineCallbacks
     @log_function
     def on_backfill_request(self, origin, room_id, pdu_list, limit):
@@ -1627,9 +1672,9 @@ class FederationHandler(BaseHandler):
     @defer.inlineCallbacks
     def _persist_auth_tree(self, origin, auth_events, state, event):
         """Checks the auth chain is valid (and passes auth checks) for the
-        state and event. Then persists the auth chain and state atomically.
-        Persists the event separately. Notifies about the persisted events
-        where appropriate.
+        state and event. Then persists the auth chain and state as outliers,
+        in chunks of JOIN_PERSIST_CHUNK_SIZE events. Persists the event
+        separately. Notifies about the persisted events where appropriate.
 
         Will attempt to fetch missing auth events.
 
@@ -1642,11 +1687,8 @@ class FederationHandler(BaseHandler):
         Returns:
             Deferred
         """
-        events_to_context = {}
         for e in itertools.chain(auth_events, state):
             e.internal_metadata.outlier = True
-            ctx = yield self.state_handler.compute_event_context(e)
-            events_to_context[e.event_id] = ctx
 
         event_map = {
             e.event_id: e
@@ -1677,6 +1719,7 @@ class FederationHandler(BaseHandler):
             else:
                 logger.info("Failed to find auth event %r", e_id)
 
+        rejected_event_ids = set()
         for e in itertools.chain(auth_events, state, [event]):
             auth_for_e = {
                 (event_map[e_id].type, event_map[e_id].state_key): event_map[e_id]
@@ -1702,14 +1745,42 @@ class FederationHandler(BaseHandler):
 
                 if e == event:
                     raise
-                events_to_context[e.event_id].rejected = RejectedReason.AUTH_ERROR
+                rejected_event_ids.add(e.event_id)
+
+        # Persisting the auth chain and state for a large room in one go takes
+        # a lot of memory, so we do it in chunks. They are all outliers, so
+        # it doesn't matter if we only persist some of them before failing.
+        # Each event is persisted after its auth events, as it is only added to
+        # the auth chain index if they are already in it.
+        events_to_persist = _sort_events_by_auth(list({
+            e.event_id: e
+            for e in itertools.chain(auth_events, state)
+        }.values()))
 
-        yield self.persist_events_and_notify(
-            [
-                (e, events_to_context[e.event_id])
-                for e in itertools.chain(auth_events, state)
-            ],
-        )
+        room_id = event.room_id
+        pending_key = (room_id, event.event_id)
+        self._join_events_pending[pending_key] = len(events_to_persist)
+        try:
+            for i in range(0, len(events_to_persist), JOIN_PERSIST_CHUNK_SIZE):
+                chunk = events_to_persist[i:i + JOIN_PERSIST_CHUNK_SIZE]
+
+                events_and_contexts = []
+                for e in chunk:
+                    ctx = yield self.state_handler.compute_event_context(e)
+                    if e.event_id in rejected_event_ids:
+                        ctx.rejected = RejectedReason.AUTH_ERROR
+                    events_and_contexts.append((e, ctx))
+
+                yield self.persist_events_and_notify(events_and_contexts)
+
+                join_persisted_events_counter.inc(len(chunk))
+                self._join_events_pending[pending_key] -= len(chunk)
+                logger.info(
+                    "Persisted %d/%d events from the state of %s",
+                    i + len(chunk), len(events_to_persist), room_id,
+                )
+        finally:
+            self._join_events_pending.pop(pending_key, None)
 
         new_event_context = yield self.state_handler.compute_event_context(
             event, old_state=state
@@ -2543,3 +2614,35 @@ class FederationHandler(BaseHandler):
             )
         else:
             return user_joined_room(self.distributor, user, room_id)
+
+
+def _sort_events_by_auth(events):
+    """Sort events so that each comes after any of its auth events which are
+    in the list, otherwise keeping them in the order given.
+
+    Args:
+        events (list[FrozenEvent])
+
+    Returns:
+        list[FrozenEvent]
+    """
+    event_map = {e.event_id: e for e in events}
+
+    sorted_events = []
+    seen = set()
+    for event in events:
+        stack = [(event, False)]
+        while stack:
+            ev, auth_events_done = stack.pop()
+            if auth_events_done:
+                sorted_events.append(ev)
+                continue
+            if ev.event_id in seen:
+                continue
+            seen.add(ev.event_id)
+            stack.append((ev, True))
+            for auth_id in reversed(ev.auth_event_ids()):
+                if auth_id in event_map and auth_id not in seen:
+                    stack.append((event_map[auth_id], False))
+
+    return sorted_events
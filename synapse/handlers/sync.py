@@ -15,25 +15,37 @@
 # limitations under the License.
 
 import collections
+import contextlib
+import hashlib
 import itertools
 import logging
+import zlib
 
 from six import iteritems, itervalues
 
-from prometheus_client import Counter
+from canonicaljson import json
+from prometheus_client import Counter, Histogram
 
 from twisted.internet import defer
+from twisted.python.failure import Failure
 
 from synapse.api.constants import EventTypes, Membership
+from synapse.metrics.background_process_metrics import run_as_background_process
 from synapse.push.clientformat import format_push_rules_for_user
 from synapse.storage.roommember import MemberSummary
 from synapse.storage.state import StateFilter
-from synapse.types import RoomStreamToken
+from synapse.storage.sync_snapshots import INITIAL_SYNC_SNAPSHOT_MAX_AGE_MS
+from synapse.types import RoomStreamToken, StreamToken
 from synapse.util.async_helpers import concurrently_execute
 from synapse.util.caches.expiringcache import ExpiringCache
 from synapse.util.caches.lrucache import LruCache
 from synapse.util.caches.response_cache import ResponseCache
-from synapse.util.logcontext import LoggingContext
+from synapse.util.logcontext import (
+    LoggingContext,
+    PreserveLoggingContext,
+    defer_to_thread,
+    make_deferred_yieldable,
+)
 from synapse.util.metrics import Measure, measure_func
 from synapse.visibility import filter_events_for_client
 
@@ -52,6 +64,34 @@ non_empty_sync_counter = Counter(
     ["type", "lazy_loaded"],
 )
 
+# The time taken by, and the number of items (rooms, events, users etc)
+# returned by, each phase of generating a sync result. `rooms` is a bucket for
+# the number of rooms the user is joined to.
+sync_phase_timer = Histogram(
+    "synapse_handlers_sync_phase_time_seconds", "sec",
+    ["phase", "type", "rooms"],
+)
+
+sync_phase_items = Histogram(
+    "synapse_handlers_sync_phase_items", "",
+    ["phase", "type", "rooms"],
+    buckets=(0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, float("inf")),
+)
+
+initial_sync_snapshot_hits = Counter(
+    "synapse_handlers_sync_initial_sync_snapshot_hits",
+    "Initial syncs generated from a stored snapshot",
+)
+
+initial_sync_snapshot_misses = Counter(
+    "synapse_handlers_sync_initial_sync_snapshot_misses",
+    "Initial syncs which could have used a snapshot but had none to use",
+)
+
+# The room count buckets used to label the sync phase metrics
+SYNC_ROOM_COUNT_BUCKETS = (10, 100, 1000)
+
+
 # Store the cache that tracks which lazy-loaded members have been sent to a given
 # client for no more than 30 minutes.
 LAZY_LOADED_MEMBERS_CACHE_MAX_AGE = 30 * 60 * 1000
@@ -199,6 +239,96 @@ class SyncResult(collections.namedtuple("SyncResult", [
     __bool__ = __nonzero__  # python3
 
 
+def _get_sync_type(since_token, full_state):
+    if since_token is None:
+        return "initial_sync"
+    elif full_state:
+        return "full_state_sync"
+    else:
+        return "incremental_sync"
+
+
+def _get_room_count_bucket(room_count):
+    """Returns the label for the bucket the given number of rooms falls into.
+    """
+    for limit in SYNC_ROOM_COUNT_BUCKETS:
+        if room_count < limit:
+            return "<%d" % (limit,)
+    return ">=%d" % (SYNC_ROOM_COUNT_BUCKETS[-1],)
+
+
+class _SyncPhaseRecorder(object):
+    """Records how long each phase of generating a sync result takes, and how
+    many items it produces, for the sync phase metrics and the slow sync log.
+
+    Args:
+        clock (Clock)
+        sync_type (str): one of "initial_sync", "full_state_sync" or
+            "incremental_sync"
+    """
+
+    def __init__(self, clock, sync_type):
+        self._clock = clock
+        self._sync_type = sync_type
+        self._start = clock.time()
+        self._room_count = 0
+
+        # phase -> seconds
+        self._durations = collections.OrderedDict()
+
+        # phase -> number of items
+        self._item_counts = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = self._clock.time()
+        try:
+            yield
+        finally:
+            self._durations[name] = self._clock.time() - start
+
+    def set_room_count(self, room_count):
+        self._room_count = room_count
+
+    def set_item_count(self, name, count):
+        self._item_counts[name] = count
+
+    def finish(self, sync_config, slow_sync_log_threshold_ms):
+        """Reports the recorded phases to the metrics, and logs them if the
+        sync took longer than the threshold.
+
+        Args:
+            sync_config (SyncConfig)
+            slow_sync_log_threshold_ms (int|None): None to disable logging.
+        """
+        rooms = _get_room_count_bucket(self._room_count)
+
+        for name, duration in iteritems(self._durations):
+            sync_phase_timer.labels(name, self._sync_type, rooms).observe(duration)
+
+        for name, count in iteritems(self._item_counts):
+            sync_phase_items.labels(name, self._sync_type, rooms).observe(count)
+
+        if slow_sync_log_threshold_ms is None:
+            return
+
+        total_ms = (self._clock.time() - self._start) * 1000
+        if total_ms < slow_sync_log_threshold_ms:
+            return
+
+        breakdown = []
+        for name, duration in iteritems(self._durations):
+            breakdown.append("%s=%dms" % (name, duration * 1000))
+        for name, count in sorted(iteritems(self._item_counts)):
+            breakdown.append("%s_count=%d" % (name, count))
+
+        logger.info(
+            "Slow %s for %s (device %s, %d rooms) took %dms: %s",
+            self._sync_type, sync_config.user, sync_config.device_id,
+            self._room_count, total_ms, ", ".join(breakdown),
+        )
+
+
 class SyncHandler(object):
 
     def __init__(self, hs):
@@ -208,9 +338,23 @@ class SyncHandler(object):
         self.presence_handler = hs.get_presence_handler()
         self.event_sources = hs.get_event_sources()
         self.clock = hs.get_clock()
+        self._reactor = hs.get_reactor()
         self.response_cache = ResponseCache(hs, "sync")
+
+        # A user's devices tend to be woken up by the same notification, with
+        # since tokens which differ only in their device specific parts, so
+        # lookups which depend only on the user and the token positions are
+        # shared between their concurrent syncs. These happen several times
+        # per sync, so we don't log each lookup at INFO.
+        self._shared_lookups = ResponseCache(
+            hs, "sync_shared_lookups", log_level=logging.DEBUG,
+        )
         self.state = hs.get_state_handler()
         self.auth = hs.get_auth()
+        self._state_fetcher = _BatchedStateIdsFetcher(hs)
+        self._room_concurrency = hs.config.sync_room_concurrency
+        self._slow_sync_log_threshold_ms = hs.config.slow_sync_log_threshold_ms
+        self._enable_initial_sync_snapshots = hs.config.enable_initial_sync_snapshots
 
         # ExpiringCache((User, Device)) -> LruCache(state_key => event_id)
         self.lazy_loaded_members_cache = ExpiringCache(
@@ -218,6 +362,12 @@ class SyncHandler(object):
             max_len=0, expiry_ms=LAZY_LOADED_MEMBERS_CACHE_MAX_AGE,
         )
 
+        # The changes made to lazy_loaded_members_cache by in-progress syncs,
+        # which are written to the database at the end of the sync so that
+        # they survive restarts and can be picked up by other synchrotrons.
+        # (User, Device) -> (cleared, OrderedDict(state_key => event_id))
+        self._lazy_loaded_members_pending = {}
+
     @defer.inlineCallbacks
     def wait_for_sync_for_user(self, sync_config, since_token=None, timeout=0,
                                full_state=False):
@@ -243,12 +393,7 @@ class SyncHandler(object):
     @defer.inlineCallbacks
     def _wait_for_sync_for_user(self, sync_config, since_token, timeout,
                                 full_state):
-        if since_token is None:
-            sync_type = "initial_sync"
-        elif full_state:
-            sync_type = "full_state_sync"
-        else:
-            sync_type = "incremental_sync"
+        sync_type = _get_sync_type(since_token, full_state)
 
         context = LoggingContext.current_context()
         if context:
@@ -267,6 +412,7 @@ class SyncHandler(object):
             result = yield self.notifier.wait_for_events(
                 sync_config.user.to_string(), timeout, current_sync_callback,
                 from_token=since_token,
+                room_filter=sync_config.filter_collection.includes_room,
             )
 
         if result:
@@ -286,6 +432,184 @@ class SyncHandler(object):
         """
         return self.generate_sync_result(sync_config, since_token, full_state)
 
+    def can_use_initial_sync_snapshot(self, sync_config):
+        """Whether we can keep a snapshot of an initial sync with the given
+        config, and generate later initial syncs from it.
+
+        Args:
+            sync_config (SyncConfig)
+
+        Returns:
+            bool
+        """
+        if not self._enable_initial_sync_snapshots:
+            return False
+
+        if sync_config.is_guest or sync_config.device_id is None:
+            return False
+
+        # We need the event IDs to be able to trim the timelines, and we
+        # don't try to work out which members would need to be lazy loaded
+        # or merge in the archived rooms.
+        filter = sync_config.filter_collection
+        if filter.event_fields or filter.lazy_load_members():
+            return False
+
+        return not filter.include_leave
+
+    @defer.inlineCallbacks
+    def initial_sync_from_snapshot(self, sync_config, encode_response,
+                                   encode_event):
+        """Generate an initial sync from the stored snapshot for this device
+        and filter, by applying an incremental sync from the snapshot's token.
+
+        Args:
+            sync_config (SyncConfig)
+            encode_response (func[int, SyncResult]): encodes a sync result
+                for the client, given the current time. The snapshot is
+                stored in this format.
+            encode_event (func[int, FrozenEvent]): encodes a single event in
+                the same way as encode_response, given the current time.
+
+        Returns:
+            Deferred[tuple[dict|None, str|None]]: the response and the
+            snapshot's token, or (None, None) if there was no snapshot that
+            we could use.
+        """
+        row = yield self.store.get_initial_sync_snapshot(
+            sync_config.user.to_string(), sync_config.device_id,
+            _get_filter_key(sync_config.filter_collection),
+        )
+
+        time_now = self.clock.time_msec()
+        if not row or row["updated_ts"] < time_now - INITIAL_SYNC_SNAPSHOT_MAX_AGE_MS:
+            initial_sync_snapshot_misses.inc()
+            defer.returnValue((None, None))
+
+        snapshot = yield defer_to_thread(
+            self._reactor, _decode_snapshot, row["snapshot"],
+        )
+
+        # We want the to-device messages and device list changes that an
+        # initial sync would return, rather than those since the snapshot.
+        since_token = StreamToken.from_string(row["stream_token"])
+        since_token = since_token.copy_and_replace(
+            "to_device_key", 0,
+        ).copy_and_replace(
+            "device_list_key", 0,
+        )
+
+        sync_result = yield self.wait_for_sync_for_user(
+            sync_config._replace(request_key=(
+                sync_config.request_key, row["stream_token"],
+            )),
+            since_token=since_token,
+        )
+
+        time_now = self.clock.time_msec()
+        incremental = encode_response(time_now, sync_result)
+
+        _adjust_ages(snapshot, time_now - row["updated_ts"])
+        yield self._apply_redactions_to_snapshot(snapshot, time_now, encode_event)
+
+        response_content, needs_prev_batch = _merge_initial_sync_snapshot(
+            snapshot, incremental, sync_config.filter_collection.timeline_limit(),
+        )
+        if response_content is None:
+            initial_sync_snapshot_misses.inc()
+            defer.returnValue((None, None))
+
+        next_batch = StreamToken.from_string(response_content["next_batch"])
+        for room_id, event_id in iteritems(needs_prev_batch):
+            # The token just before the event, as used for pagination
+            token = yield self.store.get_topological_token_for_event(event_id)
+            token = RoomStreamToken.parse(token)
+            prev_batch = next_batch.copy_and_replace(
+                "room_key", str(RoomStreamToken(token.topological, token.stream - 1)),
+            )
+            timeline = response_content["rooms"]["join"][room_id]["timeline"]
+            timeline["prev_batch"] = prev_batch.to_string()
+
+        initial_sync_snapshot_hits.inc()
+        defer.returnValue((response_content, row["stream_token"]))
+
+    @defer.inlineCallbacks
+    def _apply_redactions_to_snapshot(self, snapshot, time_now, encode_event):
+        """Replace any events in a snapshot which have been redacted since it
+        was stored with their redacted versions.
+
+        Args:
+            snapshot (dict): the initial sync response from the snapshot,
+                which is updated in place
+            time_now (int): the current time
+            encode_event (func[int, FrozenEvent]): encodes an event in the
+                snapshot's format
+
+        Returns:
+            Deferred
+        """
+        events_by_id = {}
+        for room in itervalues(snapshot["rooms"]["join"]):
+            for events in (room["timeline"]["events"], room["state"]["events"]):
+                for i, event in enumerate(events):
+                    if "redacted_by" in event.get("unsigned", {}):
+                        continue
+                    events_by_id.setdefault(event["event_id"], []).append(
+                        (events, i),
+                    )
+
+        if not events_by_id:
+            return
+
+        redacted_ids = yield self.store.get_redacted_event_ids(list(events_by_id))
+        if not redacted_ids:
+            return
+
+        redacted_events = yield self.store.get_events(
+            redacted_ids, allow_rejected=True,
+        )
+        for event_id, event in iteritems(redacted_events):
+            # The redaction may not have been allowed, in which case the
+            # event is returned unchanged.
+            if "redacted_by" not in event.unsigned:
+                continue
+            encoded = encode_event(time_now, event)
+            for events, i in events_by_id[event_id]:
+                events[i] = encoded
+
+    @defer.inlineCallbacks
+    def store_initial_sync_snapshot(self, sync_config, response_content):
+        """Store an initial sync response as the snapshot for this device and
+        filter.
+
+        Args:
+            sync_config (SyncConfig)
+            response_content (dict): the initial sync response. This must not
+                be modified while it is being stored.
+
+        Returns:
+            Deferred
+        """
+        # These are always taken from the incremental sync, so there's no
+        # point keeping them.
+        snapshot = {
+            key: value for key, value in iteritems(response_content)
+            if key not in ("to_device", "device_lists", "device_one_time_keys_count")
+        }
+
+        # Initial syncs are the largest responses we produce, so we encode and
+        # compress them off the reactor thread.
+        snapshot_bytes = yield defer_to_thread(
+            self._reactor, _encode_snapshot, snapshot,
+        )
+
+        yield self.store.store_initial_sync_snapshot(
+            sync_config.user.to_string(), sync_config.device_id,
+            _get_filter_key(sync_config.filter_collection),
+            response_content["next_batch"],
+            snapshot_bytes,
+        )
+
     @defer.inlineCallbacks
     def push_rules_for_user(self, user):
         user_id = user.to_string()
@@ -314,11 +638,24 @@ class SyncHandler(object):
 
             room_ids = sync_result_builder.joined_room_ids
 
+            # The sources return everything up to their current position, so
+            # the lookups are keyed on the now token's position in each stream
+            # (as well as that of the room stream, which determines the joined
+            # rooms).
+            room_stream_id = now_token.room_stream_id
+            limit = sync_config.filter_collection.ephemeral_limit()
+
             typing_source = self.event_sources.sources["typing"]
-            typing, typing_key = yield typing_source.get_new_events(
+            typing, typing_key = yield self._shared_lookups.wrap(
+                (
+                    "typing", sync_config.user.to_string(), typing_key,
+                    now_token.typing_key, room_stream_id, limit,
+                    sync_config.is_guest,
+                ),
+                typing_source.get_new_events,
                 user=sync_config.user,
                 from_key=typing_key,
-                limit=sync_config.filter_collection.ephemeral_limit(),
+                limit=limit,
                 room_ids=room_ids,
                 is_guest=sync_config.is_guest,
             )
@@ -338,10 +675,16 @@ class SyncHandler(object):
             receipt_key = since_token.receipt_key if since_token else "0"
 
             receipt_source = self.event_sources.sources["receipt"]
-            receipts, receipt_key = yield receipt_source.get_new_events(
+            receipts, receipt_key = yield self._shared_lookups.wrap(
+                (
+                    "receipts", sync_config.user.to_string(), receipt_key,
+                    now_token.receipt_key, room_stream_id, limit,
+                    sync_config.is_guest,
+                ),
+                receipt_source.get_new_events,
                 user=sync_config.user,
                 from_key=receipt_key,
-                limit=sync_config.filter_collection.ephemeral_limit(),
+                limit=limit,
                 room_ids=room_ids,
                 is_guest=sync_config.is_guest,
             )
@@ -378,10 +721,9 @@ class SyncHandler(object):
                 # We check if there are any state events, if there are then we pass
                 # all current state events to the filter_events function. This is to
                 # ensure that we always include current state in the timeline
-                current_state_ids = frozenset()
-                if any(e.is_state() for e in recents):
-                    current_state_ids = yield self.state.get_current_state_ids(room_id)
-                    current_state_ids = frozenset(itervalues(current_state_ids))
+                current_state_ids = yield self._get_current_state_ids_for_events(
+                    room_id, recents,
+                )
 
                 recents = yield filter_events_for_client(
                     self.store,
@@ -435,10 +777,9 @@ class SyncHandler(object):
                 # We check if there are any state events, if there are then we pass
                 # all current state events to the filter_events function. This is to
                 # ensure that we always include current state in the timeline
-                current_state_ids = frozenset()
-                if any(e.is_state() for e in loaded_recents):
-                    current_state_ids = yield self.state.get_current_state_ids(room_id)
-                    current_state_ids = frozenset(itervalues(current_state_ids))
+                current_state_ids = yield self._get_current_state_ids_for_events(
+                    room_id, loaded_recents,
+                )
 
                 loaded_recents = yield filter_events_for_client(
                     self.store,
@@ -446,6 +787,14 @@ class SyncHandler(object):
                     loaded_recents,
                     always_include_ids=current_state_ids,
                 )
+
+                # For a newly joined room, the events we load end at the first
+                # of the events we were given (inclusive), so don't return it
+                # twice.
+                recent_ids = set(e.event_id for e in recents)
+                loaded_recents = [
+                    e for e in loaded_recents if e.event_id not in recent_ids
+                ]
                 loaded_recents.extend(recents)
                 recents = loaded_recents
 
@@ -469,6 +818,33 @@ class SyncHandler(object):
             limited=limited or newly_joined_room
         ))
 
+    @defer.inlineCallbacks
+    def _get_current_state_ids_for_events(self, room_id, events):
+        """Get the event IDs of the current state of the room for the
+        (type, state_key) pairs of the state events in the given list, so
+        that we can tell which of them are still current.
+
+        Args:
+            room_id (str)
+            events (list[synapse.events.EventBase])
+
+        Returns:
+            Deferred[frozenset[str]]: the matching current state event IDs
+        """
+        state_keys = set(
+            (e.type, e.state_key) for e in events if e.is_state()
+        )
+        if not state_keys:
+            defer.returnValue(frozenset())
+
+        # The room's current state is cached by the state handler, so we look
+        # it up in full and pick out the keys we need.
+        current_state_ids = yield self.state.get_current_state_ids(room_id)
+        defer.returnValue(frozenset(
+            event_id for key, event_id in iteritems(current_state_ids)
+            if key in state_keys
+        ))
+
     @defer.inlineCallbacks
     def get_state_after_event(self, event, state_filter=StateFilter.all()):
         """
@@ -482,7 +858,7 @@ class SyncHandler(object):
         Returns:
             A Deferred map from ((type, state_key)->Event)
         """
-        state_ids = yield self.store.get_state_ids_for_event(
+        state_ids = yield self._state_fetcher.get_state_ids_for_event(
             event.event_id, state_filter=state_filter,
         )
         if event.is_state():
@@ -554,7 +930,7 @@ class SyncHandler(object):
             return
 
         last_event = last_events[-1]
-        state_ids = yield self.store.get_state_ids_for_event(
+        state_ids = yield self._state_fetcher.get_state_ids_for_event(
             last_event.event_id,
             state_filter=StateFilter.from_types([
                 (EventTypes.Name, ''),
@@ -669,7 +1045,7 @@ class SyncHandler(object):
         missing_hero_state = missing_hero_state.values()
 
         for s in missing_hero_state:
-            cache.set(s.state_key, s.event_id)
+            self._set_lazy_loaded_member(cache_key, cache, s.state_key, s.event_id)
             state[(EventTypes.Member, s.state_key)] = s
 
         defer.returnValue(summary)
@@ -684,6 +1060,84 @@ class SyncHandler(object):
             logger.debug("found LruCache for %r", cache_key)
         return cache
 
+    def _set_lazy_loaded_member(self, cache_key, cache, state_key, event_id):
+        """Record that a membership event is being sent to the client, both in
+        its lazy-loaded members cache and in the changes to persist at the end
+        of the sync.
+        """
+        changed = cache.get(state_key) != event_id
+        cache.set(state_key, event_id)
+
+        if changed and cache_key[1] is not None:
+            pending = self._lazy_loaded_members_pending.get(cache_key)
+            if pending is None:
+                pending = (False, collections.OrderedDict())
+                self._lazy_loaded_members_pending[cache_key] = pending
+            members = pending[1]
+            members.pop(state_key, None)
+            members[state_key] = event_id
+
+    def _clear_lazy_loaded_members_cache(self, cache_key, cache):
+        logger.debug("clearing LruCache for %r", cache_key)
+        cache.clear()
+
+        if cache_key[1] is not None:
+            self._lazy_loaded_members_pending[cache_key] = (
+                True, collections.OrderedDict(),
+            )
+
+    @defer.inlineCallbacks
+    def _load_lazy_loaded_members_cache(self, sync_config):
+        """Populate the lazy-loaded members cache for the syncing device from
+        the database if we don't have it in memory, e.g. because its previous
+        syncs were handled before a restart or by a different synchrotron.
+
+        Args:
+            sync_config (SyncConfig)
+
+        Returns:
+            Deferred
+        """
+        user_id = sync_config.user.to_string()
+        device_id = sync_config.device_id
+        cache_key = (user_id, device_id)
+        if device_id is None or cache_key in self.lazy_loaded_members_cache:
+            return
+
+        members = yield self.store.get_lazy_loaded_members(user_id, device_id)
+
+        # a concurrent sync may have created the cache while we were waiting,
+        # in which case it is at least as up to date as what we've just read.
+        if cache_key in self.lazy_loaded_members_cache:
+            return
+
+        cache = self.get_lazy_loaded_members_cache(cache_key)
+        for state_key, event_id in members:
+            cache.set(state_key, event_id)
+
+    def _persist_lazy_loaded_members_cache(self, sync_config):
+        """Write any changes this sync made to the syncing device's lazy-loaded
+        members cache to the database.
+
+        Args:
+            sync_config (SyncConfig)
+
+        Returns:
+            Deferred
+        """
+        cache_key = (sync_config.user.to_string(), sync_config.device_id)
+        pending = self._lazy_loaded_members_pending.pop(cache_key, None)
+        if pending is None:
+            return defer.succeed(None)
+
+        cleared, members = pending
+        return self.store.add_lazy_loaded_members(
+            sync_config.user.to_string(), sync_config.device_id,
+            list(members.items()),
+            max_size=LAZY_LOADED_MEMBERS_CACHE_MAX_SIZE,
+            clear=cleared,
+        )
+
     @defer.inlineCallbacks
     def compute_state_delta(self, room_id, batch, sync_config, since_token, now_token,
                             full_state):
@@ -744,11 +1198,11 @@ class SyncHandler(object):
 
             if full_state:
                 if batch:
-                    current_state_ids = yield self.store.get_state_ids_for_event(
+                    current_state_ids = yield self._state_fetcher.get_state_ids_for_event(
                         batch.events[-1].event_id, state_filter=state_filter,
                     )
 
-                    state_ids = yield self.store.get_state_ids_for_event(
+                    state_ids = yield self._state_fetcher.get_state_ids_for_event(
                         batch.events[0].event_id, state_filter=state_filter,
                     )
 
@@ -768,8 +1222,10 @@ class SyncHandler(object):
                     lazy_load_members=lazy_load_members,
                 )
             elif batch.limited:
-                state_at_timeline_start = yield self.store.get_state_ids_for_event(
-                    batch.events[0].event_id, state_filter=state_filter,
+                state_at_timeline_start = yield (
+                    self._state_fetcher.get_state_ids_for_event(
+                        batch.events[0].event_id, state_filter=state_filter,
+                    )
                 )
 
                 # for now, we disable LL for gappy syncs - see
@@ -791,7 +1247,7 @@ class SyncHandler(object):
                     state_filter=state_filter,
                 )
 
-                current_state_ids = yield self.store.get_state_ids_for_event(
+                current_state_ids = yield self._state_fetcher.get_state_ids_for_event(
                     batch.events[-1].event_id, state_filter=state_filter,
                 )
 
@@ -815,7 +1271,7 @@ class SyncHandler(object):
                         # So we fish out all the member events corresponding to the
                         # timeline here, and then dedupe any redundant ones below.
 
-                        state_ids = yield self.store.get_state_ids_for_event(
+                        state_ids = yield self._state_fetcher.get_state_ids_for_event(
                             batch.events[0].event_id,
                             # we only want members!
                             state_filter=StateFilter.from_types(
@@ -832,8 +1288,7 @@ class SyncHandler(object):
                 # amnesia and doesn't want any recent lazy-loaded members
                 # de-duplicated.
                 if since_token is None:
-                    logger.debug("clearing LruCache for %r", cache_key)
-                    cache.clear()
+                    self._clear_lazy_loaded_members_cache(cache_key, cache)
                 else:
                     # only send members which aren't in our LruCache (either
                     # because they're new to this client or have been pushed out
@@ -852,7 +1307,7 @@ class SyncHandler(object):
                     timeline_state.items(),
                 ):
                     if t[0] == EventTypes.Member:
-                        cache.set(t[1], event_id)
+                        self._set_lazy_loaded_member(cache_key, cache, t[1], event_id)
 
         state = {}
         if state_ids:
@@ -864,24 +1319,34 @@ class SyncHandler(object):
         })
 
     @defer.inlineCallbacks
-    def unread_notifs_for_room_id(self, room_id, sync_config):
-        with Measure(self.clock, "unread_notifs_for_room_id"):
-            last_unread_event_id = yield self.store.get_last_receipt_event_id_for_user(
-                user_id=sync_config.user.to_string(),
-                room_id=room_id,
-                receipt_type="m.read"
+    def unread_notifs_for_room_ids(self, room_ids, sync_config):
+        """Get the unread notification counts for the given rooms
+
+        Args:
+            room_ids (list[str])
+            sync_config (SyncConfig)
+
+        Returns:
+            Deferred[dict[str, dict]]: map from room ID to a dict with
+            `notify_count` and `highlight_count` keys. Rooms in which the user
+            has no read receipt are omitted.
+        """
+        with Measure(self.clock, "unread_notifs_for_room_ids"):
+            user_id = sync_config.user.to_string()
+            receipts_by_room = yield self.store.get_receipts_for_user(
+                user_id, "m.read",
             )
 
-            notifs = []
-            if last_unread_event_id:
-                notifs = yield self.store.get_unread_event_push_actions_by_room_for_user(
-                    room_id, sync_config.user.to_string(), last_unread_event_id
-                )
-                defer.returnValue(notifs)
+            last_read_event_ids = {
+                room_id: receipts_by_room[room_id]
+                for room_id in room_ids
+                if room_id in receipts_by_room
+            }
 
-        # There is no new information in this period, so your notification
-        # count is whatever it was last time.
-        defer.returnValue(None)
+            notifs = yield self.store.get_unread_event_push_actions_by_rooms_for_user(
+                user_id, last_read_event_ids,
+            )
+            defer.returnValue(notifs)
 
     @defer.inlineCallbacks
     def generate_sync_result(self, sync_config, since_token=None, full_state=False):
@@ -897,6 +1362,10 @@ class SyncHandler(object):
         """
         logger.info("Calculating sync response for %r", sync_config.user)
 
+        phases = _SyncPhaseRecorder(
+            self.clock, _get_sync_type(since_token, full_state),
+        )
+
         # NB: The now_token gets changed by some of the generate_sync_* methods,
         # this is due to some of the underlying streams not supporting the ability
         # to query up to a given point.
@@ -910,9 +1379,17 @@ class SyncHandler(object):
             # See https://github.com/matrix-org/matrix-doc/issues/1144
             raise NotImplementedError()
         else:
-            joined_room_ids = yield self.get_rooms_for_user_at(
-                user_id, now_token.room_stream_id,
-            )
+            with phases.phase("joined_rooms"):
+                joined_room_ids = yield self._shared_lookups.wrap(
+                    ("joined_rooms", user_id, now_token.room_stream_id),
+                    self.get_rooms_for_user_at,
+                    user_id, now_token.room_stream_id,
+                )
+            phases.set_room_count(len(joined_room_ids))
+
+        if since_token and sync_config.filter_collection.lazy_load_members():
+            with phases.phase("lazy_loaded_members"):
+                yield self._load_lazy_loaded_members_cache(sync_config)
 
         sync_result_builder = SyncResultBuilder(
             sync_config, full_state,
@@ -921,43 +1398,76 @@ class SyncHandler(object):
             joined_room_ids=joined_room_ids,
         )
 
-        account_data_by_room = yield self._generate_sync_entry_for_account_data(
-            sync_result_builder
-        )
+        with phases.phase("account_data"):
+            account_data_by_room = yield self._generate_sync_entry_for_account_data(
+                sync_result_builder
+            )
+        phases.set_item_count("account_data", len(sync_result_builder.account_data))
 
-        res = yield self._generate_sync_entry_for_rooms(
-            sync_result_builder, account_data_by_room
-        )
+        with phases.phase("rooms"):
+            res = yield self._generate_sync_entry_for_rooms(
+                sync_result_builder, account_data_by_room
+            )
         newly_joined_rooms, newly_joined_users, _, _ = res
         _, _, newly_left_rooms, newly_left_users = res
+        phases.set_item_count("rooms", (
+            len(sync_result_builder.joined)
+            + len(sync_result_builder.invited)
+            + len(sync_result_builder.archived)
+        ))
+        phases.set_item_count("timeline_events", sum(
+            len(room.timeline.events)
+            for room in itertools.chain(
+                sync_result_builder.joined, sync_result_builder.archived,
+            )
+        ))
 
         block_all_presence_data = (
             since_token is None and
             sync_config.filter_collection.blocks_all_presence()
         )
         if self.hs_config.use_presence and not block_all_presence_data:
-            yield self._generate_sync_entry_for_presence(
-                sync_result_builder, newly_joined_rooms, newly_joined_users
-            )
+            with phases.phase("presence"):
+                yield self._generate_sync_entry_for_presence(
+                    sync_result_builder, newly_joined_rooms, newly_joined_users
+                )
+            phases.set_item_count("presence", len(sync_result_builder.presence))
 
-        yield self._generate_sync_entry_for_to_device(sync_result_builder)
+        with phases.phase("to_device"):
+            yield self._generate_sync_entry_for_to_device(sync_result_builder)
+        phases.set_item_count("to_device", len(sync_result_builder.to_device))
 
-        device_lists = yield self._generate_sync_entry_for_device_list(
-            sync_result_builder,
-            newly_joined_rooms=newly_joined_rooms,
-            newly_joined_users=newly_joined_users,
-            newly_left_rooms=newly_left_rooms,
-            newly_left_users=newly_left_users,
+        with phases.phase("device_lists"):
+            device_lists = yield self._generate_sync_entry_for_device_list(
+                sync_result_builder,
+                newly_joined_rooms=newly_joined_rooms,
+                newly_joined_users=newly_joined_users,
+                newly_left_rooms=newly_left_rooms,
+                newly_left_users=newly_left_users,
+            )
+        phases.set_item_count(
+            "device_lists", len(device_lists.changed) + len(device_lists.left),
         )
 
         device_id = sync_config.device_id
         one_time_key_counts = {}
         if device_id:
-            one_time_key_counts = yield self.store.count_e2e_one_time_keys(
-                user_id, device_id
-            )
+            with phases.phase("one_time_keys"):
+                one_time_key_counts = yield self.store.count_e2e_one_time_keys(
+                    user_id, device_id
+                )
+
+        with phases.phase("groups"):
+            yield self._generate_sync_entry_for_groups(sync_result_builder)
+        groups = sync_result_builder.groups
+        phases.set_item_count(
+            "groups", len(groups.join) + len(groups.invite) + len(groups.leave),
+        )
 
-        yield self._generate_sync_entry_for_groups(sync_result_builder)
+        with phases.phase("lazy_loaded_members"):
+            yield self._persist_lazy_loaded_members_cache(sync_config)
+
+        phases.finish(sync_config, self._slow_sync_log_threshold_ms)
 
         defer.returnValue(SyncResult(
             presence=sync_result_builder.presence,
@@ -1124,12 +1634,20 @@ class SyncHandler(object):
         since_token = sync_result_builder.since_token
 
         if since_token and not sync_result_builder.full_state:
-            account_data, account_data_by_room = (
-                yield self.store.get_updated_account_data_for_user(
-                    user_id,
-                    since_token.account_data_key,
-                )
+            # this returns everything up to the current position, rather than
+            # the now token's, so that needs to be part of the key too.
+            account_data, account_data_by_room = yield self._shared_lookups.wrap(
+                (
+                    "account_data", user_id, since_token.account_data_key,
+                    sync_result_builder.now_token.account_data_key,
+                ),
+                self.store.get_updated_account_data_for_user,
+                user_id,
+                since_token.account_data_key,
             )
+            # the result may be shared with other syncs, so copy it before we
+            # add the push rules.
+            account_data = dict(account_data)
 
             push_rules_changed = yield self.store.have_push_rules_changed_for_user(
                 user_id, int(since_token.push_rules_key)
@@ -1186,12 +1704,20 @@ class SyncHandler(object):
             presence_key = None
             include_offline = False
 
-        presence, presence_key = yield presence_source.get_new_events(
+        presence, presence_key = yield self._shared_lookups.wrap(
+            (
+                "presence", user.to_string(), presence_key,
+                now_token.presence_key, sync_config.is_guest, include_offline,
+            ),
+            presence_source.get_new_events,
             user=user,
             from_key=presence_key,
             is_guest=sync_config.is_guest,
             include_offline=include_offline,
         )
+        # the result may be shared with other syncs, so copy it before we add
+        # to it.
+        presence = list(presence)
         sync_result_builder.now_token = now_token.copy_and_replace(
             "presence_key", presence_key
         )
@@ -1295,7 +1821,23 @@ class SyncHandler(object):
                 always_include=sync_result_builder.full_state,
             )
 
-        yield concurrently_execute(handle_room_entries, room_entries, 10)
+        with Measure(self.clock, "generate_room_entries"):
+            yield concurrently_execute(
+                handle_room_entries, room_entries, self._room_concurrency,
+            )
+
+        # We get the notification counts for all the joined rooms at once,
+        # rather than as part of each room's entry.
+        joined_rooms = {
+            room.room_id: room for room in sync_result_builder.joined
+        }
+        notifs_by_room = yield self.unread_notifs_for_room_ids(
+            list(joined_rooms), sync_result_builder.sync_config,
+        )
+        for room_id, notifs in iteritems(notifs_by_room):
+            unread_notifications = joined_rooms[room_id].unread_notifications
+            unread_notifications["notification_count"] = notifs["notify_count"]
+            unread_notifications["highlight_count"] = notifs["highlight_count"]
 
         sync_result_builder.invited.extend(invited)
 
@@ -1338,8 +1880,10 @@ class SyncHandler(object):
         assert since_token
 
         # Get a list of membership change events that have happened.
-        rooms_changed = yield self.store.get_membership_changes_for_user(
-            user_id, since_token.room_key, now_token.room_key
+        rooms_changed = yield self._shared_lookups.wrap(
+            ("membership_changes", user_id, since_token.room_key, now_token.room_key),
+            self.store.get_membership_changes_for_user,
+            user_id, since_token.room_key, now_token.room_key,
         )
 
         if rooms_changed:
@@ -1377,8 +1921,10 @@ class SyncHandler(object):
         assert since_token
 
         # Get a list of membership change events that have happened.
-        rooms_changed = yield self.store.get_membership_changes_for_user(
-            user_id, since_token.room_key, now_token.room_key
+        rooms_changed = yield self._shared_lookups.wrap(
+            ("membership_changes", user_id, since_token.room_key, now_token.room_key),
+            self.store.get_membership_changes_for_user,
+            user_id, since_token.room_key, now_token.room_key,
         )
 
         mem_change_events_by_room_id = {}
@@ -1486,7 +2032,12 @@ class SyncHandler(object):
         timeline_limit = sync_config.filter_collection.timeline_limit()
 
         # Get all events for rooms we're currently joined to.
-        room_to_events = yield self.store.get_room_events_stream_for_rooms(
+        room_to_events = yield self._shared_lookups.wrap(
+            (
+                "room_events", user_id, since_token.room_key, now_token.room_key,
+                timeline_limit,
+            ),
+            self.store.get_room_events_stream_for_rooms,
             room_ids=sync_result_builder.joined_room_ids,
             from_key=since_token.room_key,
             to_key=now_token.room_key,
@@ -1721,14 +2272,8 @@ class SyncHandler(object):
             )
 
             if room_sync or always_include:
-                notifs = yield self.unread_notifs_for_room_id(
-                    room_id, sync_config
-                )
-
-                if notifs is not None:
-                    unread_notifications["notification_count"] = notifs["notify_count"]
-                    unread_notifications["highlight_count"] = notifs["highlight_count"]
-
+                # the unread notification counts are filled in later, for all
+                # the joined rooms at once.
                 sync_result_builder.joined.append(room_sync)
 
             if batch.limited and since_token:
@@ -1868,6 +2413,377 @@ def _calculate_state(
     }
 
 
+class _BatchedStateIdsFetcher(object):
+    """Collects the requests for the state at events which are made in the
+    same reactor tick, such as by the different rooms of a sync, and looks
+    them up together. This means they share the queries for the events' state
+    groups and for any state groups which aren't cached.
+    """
+
+    def __init__(self, hs):
+        self.store = hs.get_datastore()
+        self.clock = hs.get_clock()
+
+        # list of (event_id, state_filter, deferred) for the pending requests
+        self._pending = []
+
+    def get_state_ids_for_event(self, event_id, state_filter=StateFilter.all()):
+        """Get the state at an event, as per
+        `StateGroupWorkerStore.get_state_ids_for_event`
+
+        Args:
+            event_id (str)
+            state_filter (StateFilter): The state filter used to fetch state
+                from the database.
+
+        Returns:
+            Deferred[dict[tuple[str, str], str]]: Map from type/state_key to
+            event ID.
+        """
+        if not self._pending:
+            self.clock.call_later(0, self._fetch_pending)
+
+        d = defer.Deferred()
+        self._pending.append((event_id, state_filter, d))
+        return make_deferred_yieldable(d)
+
+    def _fetch_pending(self):
+        pending, self._pending = self._pending, []
+        return run_as_background_process(
+            "sync_fetch_state_ids", self._fetch, pending,
+        )
+
+    @defer.inlineCallbacks
+    def _fetch(self, pending):
+        # group the requests by filter, so we can do one lookup per filter
+        requests_by_filter = []
+        for event_id, state_filter, d in pending:
+            for existing_filter, requests in requests_by_filter:
+                if existing_filter == state_filter:
+                    requests.append((event_id, d))
+                    break
+            else:
+                requests_by_filter.append((state_filter, [(event_id, d)]))
+
+        for state_filter, requests in requests_by_filter:
+            try:
+                state_by_event = yield self.store.get_state_ids_for_events(
+                    set(event_id for event_id, _ in requests), state_filter,
+                )
+            except Exception:
+                # Fall back to looking up each event separately, so that one
+                # bad event doesn't fail the others.
+                for event_id, d in requests:
+                    try:
+                        state = yield self.store.get_state_ids_for_event(
+                            event_id, state_filter,
+                        )
+                    except Exception:
+                        failure = Failure()
+                        with PreserveLoggingContext():
+                            d.errback(failure)
+                    else:
+                        with PreserveLoggingContext():
+                            d.callback(state)
+                continue
+
+            with PreserveLoggingContext():
+                for event_id, d in requests:
+                    d.callback(state_by_event[event_id])
+
+
+def _get_filter_key(filter):
+    """Get the key we store initial sync snapshots for the given filter under
+
+    Args:
+        filter (FilterCollection)
+
+    Returns:
+        str
+    """
+    filter_json = json.dumps(filter.get_filter_json(), sort_keys=True)
+    return hashlib.sha256(filter_json.encode("utf-8")).hexdigest()
+
+
+def _encode_snapshot(snapshot):
+    """Encode an initial sync snapshot for storage
+
+    Args:
+        snapshot (dict)
+
+    Returns:
+        bytes
+    """
+    return zlib.compress(json.dumps(snapshot).encode("utf-8"))
+
+
+def _decode_snapshot(snapshot_bytes):
+    """Decode an initial sync snapshot encoded by _encode_snapshot
+
+    Args:
+        snapshot_bytes (bytes)
+
+    Returns:
+        dict
+    """
+    return json.loads(zlib.decompress(snapshot_bytes).decode("utf-8"))
+
+
+def _adjust_ages(response, delta_ms):
+    """Bring the ages of the events in a stored sync response up to date
+
+    Args:
+        response (dict): the sync response, which is updated in place
+        delta_ms (int): how long ago the response was generated
+    """
+    def adjust(event, key):
+        if key in event:
+            event[key] += delta_ms
+
+    for room in itervalues(response["rooms"]["join"]):
+        for event in itertools.chain(
+            room["timeline"]["events"], room["state"]["events"],
+        ):
+            adjust(event.get("unsigned", {}), "age")
+
+    for room in itervalues(response["rooms"]["invite"]):
+        for event in room["invite_state"]["events"]:
+            adjust(event.get("unsigned", {}), "age")
+
+    for event in response.get("presence", {}).get("events", []):
+        adjust(event["content"], "last_active_ago")
+
+
+def _merge_initial_sync_snapshot(snapshot, incremental, timeline_limit):
+    """Apply an incremental sync response to an initial sync snapshot, to
+    give the initial sync response as of the end of the incremental sync.
+
+    The timelines of rooms which have been trimmed (or which don't follow on
+    from the snapshot's timeline) will need their `prev_batch` tokens
+    replacing by the caller, with the token just before the first event.
+
+    Args:
+        snapshot (dict): the initial sync response from the snapshot
+        incremental (dict): the incremental sync response since the snapshot
+        timeline_limit (int): the maximum number of timeline events per room
+
+    Returns:
+        tuple[dict|None, dict[str, str]]: the merged response (or None if
+        the snapshot can't be brought up to date), and a map from room ID to
+        the event ID whose preceding token should be used as the room's
+        `prev_batch`.
+    """
+    for event in incremental["account_data"]["events"]:
+        # The snapshot's timelines will have been filtered with the old list
+        # of ignored users.
+        if event["type"] == "m.ignored_user_list":
+            return None, {}
+
+    needs_prev_batch = {}
+
+    joined = dict(snapshot["rooms"]["join"])
+    invited = dict(snapshot["rooms"]["invite"])
+
+    for room_id in incremental["rooms"]["leave"]:
+        joined.pop(room_id, None)
+        invited.pop(room_id, None)
+
+    for room_id, room in iteritems(incremental["rooms"]["invite"]):
+        joined.pop(room_id, None)
+        invited[room_id] = room
+
+    for room_id, room in iteritems(incremental["rooms"]["join"]):
+        invited.pop(room_id, None)
+        joined[room_id], event_id = _merge_joined_room(
+            joined.get(room_id), room, timeline_limit,
+        )
+        if event_id:
+            needs_prev_batch[room_id] = event_id
+
+    groups = {
+        membership: dict(groups)
+        for membership, groups in iteritems(snapshot["groups"])
+    }
+    for membership, changed in iteritems(incremental["groups"]):
+        for group_id, group in iteritems(changed):
+            for groups_for_membership in itervalues(groups):
+                groups_for_membership.pop(group_id, None)
+            groups[membership][group_id] = group
+
+    merged = dict(incremental)
+    merged["account_data"] = {"events": _merge_events(
+        snapshot["account_data"]["events"], incremental["account_data"]["events"],
+        key=lambda e: e["type"],
+    )}
+    if "presence" in incremental:
+        merged["presence"] = {"events": _merge_events(
+            snapshot.get("presence", {}).get("events", []),
+            incremental["presence"]["events"],
+            key=lambda e: e["sender"],
+        )}
+    merged["rooms"] = {
+        "join": joined,
+        "invite": invited,
+        "leave": {},
+    }
+    merged["groups"] = groups
+
+    return merged, needs_prev_batch
+
+
+def _merge_joined_room(old, new, timeline_limit):
+    """Apply a joined room from an incremental sync to the same room in an
+    initial sync snapshot.
+
+    Args:
+        old (dict|None): the room in the snapshot, if it was there
+        new (dict): the room in the incremental sync
+        timeline_limit (int): the maximum number of timeline events
+
+    Returns:
+        tuple[dict, str|None]: the merged room, and the event ID whose
+        preceding token should be used as the `prev_batch`, if the existing
+        one can't be used.
+    """
+    if old is None:
+        # The room will have been sent down in full
+        return new, None
+
+    def state_key(event):
+        return (event["type"], event["state_key"])
+
+    state = {state_key(e): e for e in old["state"]["events"]}
+    old_timeline = old["timeline"]
+    new_timeline = new["timeline"]
+    needs_prev_batch = None
+
+    if new_timeline["limited"] or new["state"]["events"]:
+        # The new timeline doesn't follow on from the old one, so the old
+        # timeline becomes part of the state at the start of the new one.
+        for event in old_timeline["events"]:
+            if "state_key" in event:
+                state[state_key(event)] = event
+        for event in new["state"]["events"]:
+            state[state_key(event)] = event
+
+        events = new_timeline["events"]
+        limited = True
+        prev_batch = new_timeline["prev_batch"]
+        if not new_timeline["limited"] and events:
+            needs_prev_batch = events[0]["event_id"]
+    else:
+        events = old_timeline["events"] + new_timeline["events"]
+        limited = old_timeline["limited"]
+        prev_batch = old_timeline["prev_batch"]
+
+        if len(events) > timeline_limit:
+            dropped = events[:len(events) - timeline_limit]
+            events = events[len(events) - timeline_limit:]
+            for event in dropped:
+                if "state_key" in event:
+                    state[state_key(event)] = event
+
+            limited = True
+            if events:
+                needs_prev_batch = events[0]["event_id"]
+
+    summary = dict(old.get("summary") or {})
+    summary.update(new.get("summary") or {})
+
+    room = dict(new)
+    room["timeline"] = {
+        "events": events,
+        "prev_batch": prev_batch,
+        "limited": limited,
+    }
+    room["state"] = {"events": list(itervalues(state))}
+    room["account_data"] = {"events": _merge_events(
+        old["account_data"]["events"], new["account_data"]["events"],
+        key=lambda e: e["type"],
+    )}
+    room["ephemeral"] = {"events": _merge_ephemeral(
+        old["ephemeral"]["events"], new["ephemeral"]["events"],
+    )}
+    room["summary"] = summary
+
+    return room, needs_prev_batch
+
+
+def _merge_events(old, new, key):
+    """Merge two lists of events, with events in the new list replacing those
+    in the old list with the same key.
+
+    Args:
+        old (list[dict])
+        new (list[dict])
+        key (func[dict]): returns the key for an event
+
+    Returns:
+        list[dict]
+    """
+    events = {key(e): e for e in old}
+    events.update((key(e), e) for e in new)
+    return list(itervalues(events))
+
+
+def _merge_ephemeral(old, new):
+    """Merge the ephemeral events for a room.
+
+    Typing notifications are taken from the new events only, as an
+    incremental sync only includes them when they've changed and they will
+    have timed out in the meantime otherwise. Read receipts are merged so that
+    each user's latest receipt of each type is kept.
+
+    Args:
+        old (list[dict])
+        new (list[dict])
+
+    Returns:
+        list[dict]
+    """
+    events = {e["type"]: e for e in old if e["type"] != "m.typing"}
+    for event in new:
+        old_event = events.get(event["type"])
+        if event["type"] == "m.receipt" and old_event:
+            event = dict(event, content=_merge_receipts(
+                old_event["content"], event["content"],
+            ))
+        events[event["type"]] = event
+    return list(itervalues(events))
+
+
+def _merge_receipts(old, new):
+    """Merge the content of two receipt events, keeping the receipts in the
+    new content over those in the old for the same user and receipt type.
+
+    Args:
+        old (dict): map from event ID to receipt type to user ID to receipt
+        new (dict): as old
+
+    Returns:
+        dict
+    """
+    replaced = set(
+        (receipt_type, user_id)
+        for receipts in itervalues(new)
+        for receipt_type, users in iteritems(receipts)
+        for user_id in users
+    )
+
+    merged = {}
+    for content, skip in ((old, replaced), (new, ())):
+        for event_id, receipts in iteritems(content):
+            for receipt_type, users in iteritems(receipts):
+                for user_id, receipt in iteritems(users):
+                    if (receipt_type, user_id) in skip:
+                        continue
+                    merged.setdefault(event_id, {}).setdefault(
+                        receipt_type, {},
+                    )[user_id] = receipt
+
+    return merged
+
+
 class SyncResultBuilder(object):
     "Used to help build up a new SyncResult for a user"
     def __init__(self, sync_config, full_state, since_token, now_token,
@@ -17,6 +17,7 @@ import cgi
 import logging
 import random
 import sys
+import zlib
 from io import BytesIO
 
 from six import PY3, string_types
@@ -47,6 +48,7 @@ from synapse.http.endpoint import matrix_federation_endpoint
 from synapse.util.async_helpers import timeout_deferred
 from synapse.util.logcontext import make_deferred_yieldable
 from synapse.util.metrics import Measure
+from synapse.util.retryutils import NotRetryingDestination
 
 logger = logging.getLogger(__name__)
 
@@ -54,6 +56,20 @@ outgoing_requests_counter = Counter("synapse_http_matrixfederationclient_request
                                     "", ["method"])
 incoming_responses_counter = Counter("synapse_http_matrixfederationclient_responses",
                                      "", ["method", "code"])
+compressed_requests_counter = Counter(
+    "synapse_http_matrixfederationclient_compressed_requests",
+    "Number of requests whose bodies were gzipped",
+)
+compressed_bytes_saved_counter = Counter(
+    "synapse_http_matrixfederationclient_compressed_bytes_saved",
+    "Number of bytes saved by gzipping request bodies",
+)
+connections_counter = Counter(
+    "synapse_http_matrixfederationclient_connections",
+    "Number of connections used for federation requests, and whether they"
+    " were reused from the pool of idle connections",
+    ["reused"],
+)
 
 
 MAX_LONG_RETRIES = 10
@@ -79,6 +95,20 @@ class MatrixFederationEndpointFactory(object):
         )
 
 
+class _FederationConnectionPool(HTTPConnectionPool):
+    """An HTTPConnectionPool which tracks how often it reuses connections"""
+
+    def getConnection(self, key, endpoint):
+        self._made_new_connection = False
+        d = HTTPConnectionPool.getConnection(self, key, endpoint)
+        connections_counter.labels(not self._made_new_connection).inc()
+        return d
+
+    def _newConnection(self, key, endpoint):
+        self._made_new_connection = True
+        return HTTPConnectionPool._newConnection(self, key, endpoint)
+
+
 _next_id = 1
 
 
@@ -113,6 +143,12 @@ class MatrixFederationRequest(object):
     :type: dict|None
     """
 
+    compress = attr.ib(default=False)
+    """Whether to gzip the body, if the destination accepts gzipped requests
+    and compression is enabled.
+    :type: bool
+    """
+
     txn_id = attr.ib(default=None)
     """Unique ID for this request (for logging)
     :type: str|None
@@ -186,18 +222,27 @@ class MatrixFederationHttpClient(object):
         self.signing_key = hs.config.signing_key[0]
         self.server_name = hs.hostname
         reactor = hs.get_reactor()
-        pool = HTTPConnectionPool(reactor)
+        pool = _FederationConnectionPool(reactor)
         pool.retryAutomatically = False
-        pool.maxPersistentPerHost = 5
-        pool.cachedConnectionTimeout = 2 * 60
+        pool.maxPersistentPerHost = (
+            hs.config.federation_client_max_idle_connections_per_host
+        )
+        pool.cachedConnectionTimeout = hs.config.federation_client_idle_timeout
         self.agent = Agent.usingEndpointFactory(
             reactor, MatrixFederationEndpointFactory(hs), pool=pool
         )
         self.clock = hs.get_clock()
         self._store = hs.get_datastore()
+        self._destination_health = hs.get_destination_health_tracker()
         self.version_string_bytes = hs.version_string.encode('ascii')
         self.default_timeout = 60
 
+        self._compress_requests = hs.config.federation_compress_transactions
+
+        # destinations which have told us (via an Accept-Encoding response
+        # header, as per RFC 7694) that they accept gzipped request bodies
+        self._gzip_destinations = set()
+
         def schedule(x):
             reactor.callLater(_EPSILON, x)
 
@@ -253,6 +298,12 @@ class MatrixFederationHttpClient(object):
         ):
             raise FederationDeniedError(request.destination)
 
+        # fail quickly if the destination is failing all our requests, without
+        # waiting for the database
+        self._destination_health.check_available(
+            request.destination, ignore_backoff=ignore_backoff,
+        )
+
         limiter = yield synapse.util.retryutils.get_retry_limiter(
             request.destination,
             self.clock,
@@ -295,52 +346,29 @@ class MatrixFederationHttpClient(object):
 
             while True:
                 try:
-                    json = request.get_json()
-                    if json:
-                        headers_dict[b"Content-Type"] = [b"application/json"]
-                        self.sign_request(
-                            destination_bytes, method_bytes, url_to_sign_bytes,
-                            headers_dict, json,
-                        )
-                        data = encode_canonical_json(json)
-                        producer = FileBodyProducer(
-                            BytesIO(data),
-                            cooperator=self._cooperator,
-                        )
-                    else:
-                        producer = None
-                        self.sign_request(
-                            destination_bytes, method_bytes, url_to_sign_bytes,
-                            headers_dict,
-                        )
-
-                    logger.info(
-                        "{%s} [%s] Sending request: %s %s",
-                        request.txn_id, request.destination, request.method,
-                        url_str,
-                    )
-
-                    # we don't want all the fancy cookie and redirect handling that
-                    # treq.request gives: just use the raw Agent.
-                    request_deferred = self.agent.request(
-                        method_bytes,
-                        url_bytes,
-                        headers=Headers(headers_dict),
-                        bodyProducer=producer,
-                    )
-
-                    request_deferred = timeout_deferred(
-                        request_deferred,
-                        timeout=_sec_timeout,
-                        reactor=self.hs.get_reactor(),
-                    )
-
-                    with Measure(self.clock, "outbound_request"):
-                        response = yield make_deferred_yieldable(
-                            request_deferred,
+                    # each attempt takes its own slot, so that we don't hold
+                    # one while we wait to retry.
+                    with self._destination_health.request(
+                        request.destination,
+                        ignore_backoff=ignore_backoff,
+                        backoff_on_404=backoff_on_404,
+                    ) as wait_for_slot:
+                        # wait until we are allowed another request to this
+                        # destination
+                        yield wait_for_slot
+
+                        response = yield self._send_request_attempt(
+                            request, method_bytes, destination_bytes,
+                            url_bytes, url_str, url_to_sign_bytes,
+                            headers_dict, _sec_timeout,
                         )
 
                     break
+                except (HttpResponseException, NotRetryingDestination):
+                    # either the destination responded, or it started failing
+                    # all our requests while we were waiting to send this one:
+                    # there's no point retrying in either case.
+                    raise
                 except Exception as e:
                     logger.warn(
                         "{%s} [%s] Request failed: %s %s: %s",
@@ -376,31 +404,151 @@ class MatrixFederationHttpClient(object):
                     else:
                         raise
 
-            logger.info(
-                "{%s} [%s] Got response headers: %d %s",
-                request.txn_id,
-                request.destination,
-                response.code,
-                response.phrase.decode('ascii', errors='replace'),
+        defer.returnValue(response)
+
+    @defer.inlineCallbacks
+    def _send_request_attempt(self, request, method_bytes, destination_bytes,
+                              url_bytes, url_str, url_to_sign_bytes,
+                              headers_dict, sec_timeout):
+        """Makes a single attempt at sending a request, for _send_request.
+
+        Returns:
+            Deferred: resolves with the http response object on success.
+
+            Fails with ``HttpResponseException``: if we get an HTTP response
+                code >= 300.
+        """
+        json = request.get_json()
+        if json:
+            headers_dict[b"Content-Type"] = [b"application/json"]
+            self.sign_request(
+                destination_bytes, method_bytes, url_to_sign_bytes,
+                headers_dict, json,
+            )
+            data = encode_canonical_json(json)
+            data = self._maybe_compress_body(request, headers_dict, data)
+            producer = FileBodyProducer(
+                BytesIO(data),
+                cooperator=self._cooperator,
+            )
+        else:
+            producer = None
+            self.sign_request(
+                destination_bytes, method_bytes, url_to_sign_bytes,
+                headers_dict,
             )
 
-            if 200 <= response.code < 300:
-                pass
-            else:
-                # :'(
-                # Update transactions table?
-                d = treq.content(response)
-                d = timeout_deferred(
-                    d,
-                    timeout=_sec_timeout,
-                    reactor=self.hs.get_reactor(),
-                )
-                body = yield make_deferred_yieldable(d)
-                raise HttpResponseException(
-                    response.code, response.phrase, body
-                )
-
-            defer.returnValue(response)
+        logger.info(
+            "{%s} [%s] Sending request: %s %s",
+            request.txn_id, request.destination, request.method,
+            url_str,
+        )
+
+        # we don't want all the fancy cookie and redirect handling that
+        # treq.request gives: just use the raw Agent.
+        request_deferred = self.agent.request(
+            method_bytes,
+            url_bytes,
+            headers=Headers(headers_dict),
+            bodyProducer=producer,
+        )
+
+        request_deferred = timeout_deferred(
+            request_deferred,
+            timeout=sec_timeout,
+            reactor=self.hs.get_reactor(),
+        )
+
+        with Measure(self.clock, "outbound_request"):
+            response = yield make_deferred_yieldable(request_deferred)
+
+        logger.info(
+            "{%s} [%s] Got response headers: %d %s",
+            request.txn_id,
+            request.destination,
+            response.code,
+            response.phrase.decode('ascii', errors='replace'),
+        )
+
+        if self._compress_requests:
+            self._update_accepted_encodings(request.destination, response)
+
+        if 200 <= response.code < 300:
+            pass
+        else:
+            # :'(
+            # Update transactions table?
+            d = treq.content(response)
+            d = timeout_deferred(
+                d,
+                timeout=sec_timeout,
+                reactor=self.hs.get_reactor(),
+            )
+            body = yield make_deferred_yieldable(d)
+            raise HttpResponseException(
+                response.code, response.phrase, body
+            )
+
+        defer.returnValue(response)
+
+    def _maybe_compress_body(self, request, headers_dict, data):
+        """Gzips the body of a request, if the request allows it and the
+        destination has told us that it accepts gzipped request bodies.
+
+        Args:
+            request (MatrixFederationRequest)
+            headers_dict (dict[bytes, list[bytes]]): the request headers,
+                which will be updated with the Content-Encoding
+            data (bytes): the encoded body
+
+        Returns:
+            bytes: the body to send
+        """
+        headers_dict.pop(b"Content-Encoding", None)
+
+        if not (
+            self._compress_requests and
+            request.compress and
+            request.destination in self._gzip_destinations
+        ):
+            return data
+
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        compressed = compressor.compress(data) + compressor.flush()
+        if len(compressed) >= len(data):
+            return data
+
+        compressed_requests_counter.inc()
+        compressed_bytes_saved_counter.inc(len(data) - len(compressed))
+
+        headers_dict[b"Content-Encoding"] = [b"gzip"]
+        return compressed
+
+    def _update_accepted_encodings(self, destination, response):
+        """Records whether a destination accepts gzipped request bodies, based
+        on the Accept-Encoding header of its response.
+
+        Args:
+            destination (str)
+            response (twisted.web.iweb.IResponse)
+        """
+        accept_encoding = response.headers.getRawHeaders(b"Accept-Encoding")
+        if accept_encoding is None:
+            # not every response will include the header, so we only forget
+            # about a destination accepting gzip if it tells us otherwise
+            return
+
+        encodings = set()
+        for header in accept_encoding:
+            for coding in header.split(b","):
+                coding = coding.split(b";", 1)[0].strip().lower()
+                if coding:
+                    encodings.add(coding)
+
+        if b"gzip" in encodings:
+            self._gzip_destinations.add(destination)
+        else:
+            self._gzip_destinations.discard(destination)
 
     def sign_request(self, destination, method, url_bytes, headers_dict,
                      content=None, destination_is=None):
@@ -454,7 +602,7 @@ class MatrixFederationHttpClient(object):
                  json_data_callback=None,
                  long_retries=False, timeout=None,
                  ignore_backoff=False,
-                 backoff_on_404=False):
+                 backoff_on_404=False, compress=False):
         """ Sends the specifed json data using PUT
 
         Args:
@@ -475,6 +623,9 @@ class MatrixFederationHttpClient(object):
             backoff_on_404 (bool): True if we should count a 404 response as
                 a failure of the server (and should therefore back off future
                 requests)
+            compress (bool): True if the body may be gzipped, if the
+                destination accepts gzipped requests and
+                `federation_compress_transactions` is enabled.
 
         Returns:
             Deferred: Succeeds when we get a 2xx HTTP response. The result
@@ -497,6 +648,7 @@ class MatrixFederationHttpClient(object):
             query=args,
             json_callback=json_data_callback,
             json=data,
+            compress=compress,
         )
 
         response = yield self._send_request(
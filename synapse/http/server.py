@@ -18,12 +18,13 @@ import cgi
 import collections
 import logging
 
-from six import PY3
+from six import PY3, iteritems
 from six.moves import http_client, urllib
 
 from canonicaljson import encode_canonical_json, encode_pretty_printed_json, json
+from zope.interface import implementer
 
-from twisted.internet import defer
+from twisted.internet import defer, interfaces
 from twisted.python import failure
 from twisted.web import resource
 from twisted.web.server import NOT_DONE_YET
@@ -316,7 +317,10 @@ class JsonResource(HttpServer, resource.Resource):
         callback_return = yield callback(request, **kwargs)
         if callback_return is not None:
             code, response = callback_return
-            self._send_response(request, code, response)
+            if getattr(servlet_instance, "STREAM_RESPONSE", False):
+                self._send_streaming_response(request, code, response)
+            else:
+                self._send_response(request, code, response)
 
     def _get_handler_for_request(self, request):
         """Finds a callback method to handle the given request
@@ -358,6 +362,14 @@ class JsonResource(HttpServer, resource.Resource):
             canonical_json=self.canonical_json,
         )
 
+    def _send_streaming_response(self, request, code, response_json_object):
+        respond_with_json_streaming(
+            request, code, response_json_object, self.clock,
+            send_cors=True,
+            pretty_print=_request_user_agent_is_curl(request),
+            canonical_json=self.canonical_json,
+        )
+
 
 def _options_handler(request):
     """Request handler for OPTIONS requests
@@ -403,6 +415,23 @@ class RootRedirect(resource.Resource):
         return resource.Resource.getChild(self, name, request)
 
 
+class PreEncodedJson(object):
+    """A JSON response body which has already been encoded.
+
+    Servlets registered with a JsonResource can return one of these as the
+    body of their response to have the bytes sent as they are, e.g. when the
+    response is cached in its encoded form.
+
+    Args:
+        json_bytes (bytes): the encoded JSON
+    """
+
+    __slots__ = ["json_bytes"]
+
+    def __init__(self, json_bytes):
+        self.json_bytes = json_bytes
+
+
 def respond_with_json(request, code, json_object, send_cors=False,
                       response_code_message=None, pretty_print=False,
                       canonical_json=True):
@@ -415,7 +444,9 @@ def respond_with_json(request, code, json_object, send_cors=False,
             request)
         return
 
-    if pretty_print:
+    if isinstance(json_object, PreEncodedJson):
+        json_bytes = json_object.json_bytes
+    elif pretty_print:
         json_bytes = encode_pretty_printed_json(json_object) + b"\n"
     else:
         if canonical_json or synapse.events.USE_FROZEN_DICTS:
@@ -461,6 +492,186 @@ def respond_with_json_bytes(request, code, json_bytes, send_cors=False,
     return NOT_DONE_YET
 
 
+# The amount of encoded JSON we buffer up before writing it to the request
+# when streaming a response.
+STREAMING_JSON_CHUNK_SIZE = 64 * 1024
+
+# How many levels of nested dicts and lists we walk when streaming a response.
+# Anything nested deeper than this (e.g. individual events in a sync response)
+# is encoded in one go.
+STREAMING_JSON_MAX_DEPTH = 6
+
+_streaming_json_encoder = json.JSONEncoder(separators=(',', ':'))
+
+
+def respond_with_json_streaming(request, code, json_object, clock,
+                                send_cors=False, pretty_print=False,
+                                canonical_json=True):
+    """Sends a JSON response to the given request, encoding it incrementally.
+
+    Unlike respond_with_json, the response body is never held in memory in
+    its entirety: the object is encoded a chunk at a time and written to the
+    request, returning to the reactor between chunks and pausing whenever the
+    transport's buffers are full. The response is sent without a
+    Content-Length, so uses chunked transfer encoding (and is gzipped on the
+    way out if the listener has compression enabled).
+
+    Pretty printed and canonical JSON responses are not streamed.
+
+    Args:
+        request (twisted.web.http.Request): The http request to respond to.
+        code (int): The HTTP response code.
+        json_object (object): The object to encode and send.
+        clock (synapse.util.Clock): used to schedule the encoding of each chunk
+        send_cors (bool): Whether to send Cross-Origin Resource Sharing headers
+        pretty_print (bool): Whether the response should be pretty printed.
+        canonical_json (bool): Whether the response must be canonical JSON.
+    """
+    if pretty_print or canonical_json or synapse.events.USE_FROZEN_DICTS:
+        return respond_with_json(
+            request, code, json_object,
+            send_cors=send_cors,
+            pretty_print=pretty_print,
+            canonical_json=canonical_json,
+        )
+
+    if request._disconnected:
+        logger.warn(
+            "Not sending response to request %s, already disconnected.",
+            request)
+        return
+
+    request.setResponseCode(code)
+    request.setHeader(b"Content-Type", b"application/json")
+    request.setHeader(b"Cache-Control", b"no-cache, no-store, must-revalidate")
+
+    if send_cors:
+        set_cors_headers(request)
+
+    producer = _JsonStreamingProducer(
+        request,
+        _iterencode_json(json_object, STREAMING_JSON_MAX_DEPTH),
+        clock,
+    )
+    producer.start()
+    return NOT_DONE_YET
+
+
+def _iterencode_json(obj, depth):
+    """Encodes an object as JSON, a piece at a time.
+
+    (The encoders' own iterencode methods produce the entire encoding before
+    returning when the C speedups are in use, so aren't any use here.)
+
+    Args:
+        obj (object): The object to encode. Any dicts must have string keys.
+        depth (int): How many levels of dicts and lists to walk before
+            encoding the remainder of the object in one go.
+
+    Returns:
+        iterator[str]
+    """
+    if depth <= 0 or not isinstance(obj, (dict, list, tuple)):
+        yield _streaming_json_encoder.encode(obj)
+        return
+
+    if isinstance(obj, dict):
+        if not obj:
+            yield "{}"
+            return
+
+        sep = "{"
+        for key, value in iteritems(obj):
+            yield sep + _streaming_json_encoder.encode(key) + ":"
+            for chunk in _iterencode_json(value, depth - 1):
+                yield chunk
+            sep = ","
+        yield "}"
+    else:
+        if not obj:
+            yield "[]"
+            return
+
+        sep = "["
+        for value in obj:
+            yield sep
+            for chunk in _iterencode_json(value, depth - 1):
+                yield chunk
+            sep = ","
+        yield "]"
+
+
+@implementer(interfaces.IPushProducer)
+class _JsonStreamingProducer(object):
+    """Writes the output of a JSON encoder to a request, a chunk at a time.
+
+    Args:
+        request (twisted.web.http.Request): The http request to write to.
+        chunks (iterator[str]): The encoded JSON.
+        clock (synapse.util.Clock)
+    """
+
+    def __init__(self, request, chunks, clock):
+        self._request = request
+        self._chunks = chunks
+        self._clock = clock
+
+        self._paused = False
+        self._call = None
+
+    def start(self):
+        self._request.registerProducer(self, True)
+        self._schedule()
+
+    def _schedule(self):
+        if self._call is None and self._chunks is not None:
+            self._call = self._clock.call_later(0, self._write_chunk)
+
+    def _write_chunk(self):
+        self._call = None
+        if self._paused or self._chunks is None:
+            return
+
+        buf = []
+        size = 0
+        try:
+            for chunk in self._chunks:
+                buf.append(chunk)
+                size += len(chunk)
+                if size >= STREAMING_JSON_CHUNK_SIZE:
+                    break
+            else:
+                self._chunks = None
+        except Exception:
+            logger.exception("Failed to encode JSON response")
+            self._chunks = None
+            self._request.unregisterProducer()
+            self._request.loseConnection()
+            return
+
+        if buf:
+            self._request.write("".join(buf).encode("utf-8"))
+
+        if self._chunks is None:
+            self._request.unregisterProducer()
+            finish_request(self._request)
+        else:
+            self._schedule()
+
+    def pauseProducing(self):
+        self._paused = True
+
+    def resumeProducing(self):
+        self._paused = False
+        self._schedule()
+
+    def stopProducing(self):
+        self._chunks = None
+        if self._call is not None:
+            self._clock.cancel_call_later(self._call, ignore_errs=True)
+            self._call = None
+
+
 def set_cors_headers(request):
     """Set the CORs headers so that javascript running in a web browsers can
     use this API
@@ -271,8 +271,13 @@ class RestServlet(object):
 
     Automatically handles turning CodeMessageExceptions thrown by these methods
     into the appropriate HTTP response.
+
+    Servlets whose responses can be very large may set `STREAM_RESPONSE` to
+    have their JSON responses encoded and written out incrementally.
     """
 
+    STREAM_RESPONSE = False
+
     def register(self, http_server):
         """ Register this servlet with the given HTTP server. """
         if hasattr(self, "PATTERNS"):
@@ -16,6 +16,8 @@
 import logging
 from collections import namedtuple
 
+from six import itervalues
+
 from prometheus_client import Counter
 
 from twisted.internet import defer
@@ -39,6 +41,10 @@ notified_events_counter = Counter("synapse_notifier_notified_events", "")
 users_woken_by_stream_counter = Counter(
     "synapse_notifier_users_woken_by_stream", "", ["stream"])
 
+notifier_wakeups_skipped_counter = Counter(
+    "synapse_notifier_wakeups_skipped", "",
+)
+
 
 # TODO(paul): Should be shared somewhere
 def count(func, l):
@@ -84,12 +90,31 @@ class _NotifierUserStream(object):
         self.last_notified_token = current_token
         self.last_notified_ms = time_now_ms
 
+        # room filters for the listeners currently waiting on this stream
+        self.room_filters = {}
+
         with PreserveLoggingContext():
             self.notify_deferred = ObservableDeferred(defer.Deferred())
 
     def notify(self, stream_key, stream_id, time_now_ms):
         """Notify any listeners for this user of a new event from an
         event source.
+        Args:
+            stream_key(str): The stream the event came from.
+            stream_id(str): The new id for the stream the event came from.
+            time_now_ms(int): The current time in milliseconds.
+        """
+        self.advance(stream_key, stream_id, time_now_ms)
+        self.wake()
+
+    def advance(self, stream_key, stream_id, time_now_ms):
+        """Record a new event from an event source, without waking any
+        listeners.
+
+        Any listeners which arrive with a token from before the event will
+        return straight away, but those already waiting will not be woken
+        until `wake` is called.
+
         Args:
             stream_key(str): The stream the event came from.
             stream_id(str): The new id for the stream the event came from.
@@ -100,14 +125,45 @@ class _NotifierUserStream(object):
         )
         self.last_notified_token = self.current_token
         self.last_notified_ms = time_now_ms
-        noify_deferred = self.notify_deferred
 
-        users_woken_by_stream_counter.labels(stream_key).inc()
+    def wake(self):
+        """Wake up any listeners waiting for this user's stream to advance.
+        """
+        noify_deferred = self.notify_deferred
+        if not noify_deferred.observers():
+            # nobody is waiting, so there's no need to replace the deferred
+            return
 
         with PreserveLoggingContext():
             self.notify_deferred = ObservableDeferred(defer.Deferred())
             noify_deferred.callback(self.current_token)
 
+    def add_room_filter(self, key, room_filter):
+        """Register the rooms that a waiting listener is interested in.
+
+        Args:
+            key (object): identifies the listener, for `remove_room_filter`
+            room_filter (callable[str, bool]|None): returns whether the
+                listener is interested in events in the given room, or None if
+                it is interested in all of them.
+        """
+        self.room_filters[key] = room_filter
+
+    def remove_room_filter(self, key):
+        self.room_filters.pop(key, None)
+
+    def ignores_room(self, room_id):
+        """Whether none of the listeners currently waiting on this stream are
+        interested in events in the given room.
+        """
+        if not self.room_filters:
+            return False
+
+        for room_filter in itervalues(self.room_filters):
+            if room_filter is None or room_filter(room_id):
+                return False
+        return True
+
     def remove(self, notifier):
         """ Remove this listener from all the indexes in the Notifier
         it knows about.
@@ -157,6 +213,11 @@ class Notifier(object):
         self.user_to_user_stream = {}
         self.room_to_user_streams = {}
 
+        # user streams which have been notified this reactor tick, but whose
+        # listeners have not yet been woken
+        self._pending_wakeups = set()
+        self._pending_wakeups_call = None
+
         self.hs = hs
         self.event_sources = hs.get_event_sources()
         self.store = hs.get_datastore()
@@ -287,18 +348,68 @@ class Notifier(object):
                     if user_stream is not None:
                         user_streams.add(user_stream)
 
+                room_streams = set()
                 for room in rooms:
-                    user_streams |= self.room_to_user_streams.get(room, set())
+                    for user_stream in self.room_to_user_streams.get(room, ()):
+                        if user_stream in user_streams:
+                            continue
+                        if user_stream.ignores_room(room):
+                            room_streams.add(user_stream)
+                        else:
+                            user_streams.add(user_stream)
+
+                # streams whose listeners aren't interested in any of the rooms
+                # still need their tokens advancing, but needn't be woken.
+                room_streams -= user_streams
+                if room_streams:
+                    notifier_wakeups_skipped_counter.inc(len(room_streams))
 
                 time_now_ms = self.clock.time_msec()
+                for user_stream in room_streams:
+                    user_stream.advance(stream_key, new_token, time_now_ms)
+
                 for user_stream in user_streams:
                     try:
-                        user_stream.notify(stream_key, new_token, time_now_ms)
+                        user_stream.advance(stream_key, new_token, time_now_ms)
                     except Exception:
                         logger.exception("Failed to notify listener")
+                        continue
+                    self._pending_wakeups.add(user_stream)
+
+                if user_streams:
+                    users_woken_by_stream_counter.labels(stream_key).inc(
+                        len(user_streams),
+                    )
+                    self._schedule_pending_wakeups()
 
                 self.notify_replication()
 
+    def _schedule_pending_wakeups(self):
+        """Arrange for the user streams we have notified this reactor tick to
+        be woken up.
+
+        Deferring the wakeups means that a stream which is notified many times
+        in quick succession (e.g. by a burst of events persisted in a single
+        batch) only wakes its listeners once.
+        """
+        if self._pending_wakeups_call is None:
+            self._pending_wakeups_call = self.clock.call_later(
+                0, self._wake_pending_streams,
+            )
+
+    def _wake_pending_streams(self):
+        self._pending_wakeups_call = None
+
+        pending = self._pending_wakeups
+        self._pending_wakeups = set()
+
+        with Measure(self.clock, "notifier_wake_streams"):
+            for user_stream in pending:
+                try:
+                    user_stream.wake()
+                except Exception:
+                    logger.exception("Failed to notify listener")
+
     def on_new_replication_data(self):
         """Used to inform replication listeners that something has happend
         without waking up any of the normal user event streams"""
@@ -306,9 +417,16 @@ class Notifier(object):
 
     @defer.inlineCallbacks
     def wait_for_events(self, user_id, timeout, callback, room_ids=None,
-                        from_token=StreamToken.START):
+                        from_token=StreamToken.START, room_filter=None):
         """Wait until the callback returns a non empty response or the
         timeout fires.
+
+        Args:
+            room_filter (callable[str, bool]|None): If given, returns whether
+                the caller is interested in events in the given room. We are
+                not woken up for events in rooms it returns False for (except
+                for those which are sent to this user specifically, such as
+                their own membership changes).
         """
         user_stream = self.user_to_user_stream.get(user_id)
         if user_stream is None:
@@ -328,36 +446,43 @@ class Notifier(object):
         if timeout:
             end_time = self.clock.time_msec() + timeout
 
-            while not result:
-                try:
-                    now = self.clock.time_msec()
-                    if end_time <= now:
-                        break
-
-                    # Now we wait for the _NotifierUserStream to be told there
-                    # is a new token.
-                    listener = user_stream.new_listener(prev_token)
-                    listener.deferred = timeout_deferred(
-                        listener.deferred,
-                        (end_time - now) / 1000.,
-                        self.hs.get_reactor(),
-                    )
-                    with PreserveLoggingContext():
-                        yield listener.deferred
+            # identifies this call's room filter in the user stream
+            filter_key = object()
+            user_stream.add_room_filter(filter_key, room_filter)
 
-                    current_token = user_stream.current_token
-
-                    result = yield callback(prev_token, current_token)
-                    if result:
+            try:
+                while not result:
+                    try:
+                        now = self.clock.time_msec()
+                        if end_time <= now:
+                            break
+
+                        # Now we wait for the _NotifierUserStream to be told there
+                        # is a new token.
+                        listener = user_stream.new_listener(prev_token)
+                        listener.deferred = timeout_deferred(
+                            listener.deferred,
+                            (end_time - now) / 1000.,
+                            self.hs.get_reactor(),
+                        )
+                        with PreserveLoggingContext():
+                            yield listener.deferred
+
+                        current_token = user_stream.current_token
+
+                        result = yield callback(prev_token, current_token)
+                        if result:
+                            break
+
+                        # Update the prev_token to the current_token since nothing
+                        # has happened between the old prev_token and the current_token
+                        prev_token = current_token
+                    except defer.TimeoutError:
                         break
-
-                    # Update the prev_token to the current_token since nothing
-                    # has happened between the old prev_token and the current_token
-                    prev_token = current_token
-                except defer.TimeoutError:
-                    break
-                except defer.CancelledError:
-                    break
+                    except defer.CancelledError:
+                        break
+            finally:
+                user_stream.remove_room_filter(filter_key)
 
         if result is None:
             # This happened if there was no timeout or if the timeout had
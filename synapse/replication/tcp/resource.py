@@ -105,6 +105,13 @@ class ReplicationStreamer(object):
         if not hs.config.send_federation:
             self.federation_sender = hs.get_federation_sender()
 
+        # The latest federation stream position acknowledged by each connected
+        # federation sender, by the name of its connection. When federation
+        # sending is sharded between several workers we can only drop queued
+        # updates once all of them have acknowledged them.
+        self._federation_sender_instances = hs.config.federation_sender_instances
+        self._federation_acks = {}
+
         self.notifier.add_replication_callback(self.on_notifier_poke)
 
         # Keeps track of whether we are currently checking for updates
@@ -213,12 +220,27 @@ class ReplicationStreamer(object):
         return stream.get_updates_since(token)
 
     @measure_func("repl.federation_ack")
-    def federation_ack(self, token):
+    def federation_ack(self, token, name):
         """We've received an ack for federation stream from a client.
+
+        Args:
+            token (int): the position the client has handled up to
+            name (str): the name of the client's connection
         """
         federation_ack_counter.inc()
-        if self.federation_sender:
+        if not self.federation_sender:
+            return
+
+        if self._federation_sender_instances == 1:
             self.federation_sender.federation_ack(token)
+            return
+
+        self._federation_acks[name] = token
+        if len(self._federation_acks) < self._federation_sender_instances:
+            # not all the shards have caught up yet
+            return
+
+        self.federation_sender.federation_ack(min(itervalues(self._federation_acks)))
 
     @measure_func("repl.on_user_sync")
     @defer.inlineCallbacks
@@ -285,6 +307,13 @@ class ReplicationStreamer(object):
         # lost so that it can handle any ongoing syncs on that connection.
         self.presence_handler.update_external_syncs_clear(connection.conn_id)
 
+        # Forget the position acknowledged over the connection, unless the
+        # federation sender has already reconnected. Otherwise a federation
+        # sender which comes back under a different name would leave its old
+        # position behind, holding back the minimum forever.
+        if not any(conn.name == connection.name for conn in self.connections):
+            self._federation_acks.pop(connection.name, None)
+
 
 def _batch_updates(updates):
     """Takes a list of updates of form [(token, row)] and sets the token to
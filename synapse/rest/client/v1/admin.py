@@ -563,6 +563,99 @@ class ListMediaInRoom(ClientV1RestServlet):
         defer.returnValue((200, {"local": local_mxcs, "remote": remote_mxcs}))
 
 
+class CompressStateRestServlet(ClientV1RestServlet):
+    """Rewrites the state groups of a room as compactly as possible, returning
+    the number of rows in `state_groups_state` before and after.
+    """
+    PATTERNS = client_path_patterns("/admin/compress_state/(?P<room_id>[^/]+)")
+
+    def __init__(self, hs):
+        super(CompressStateRestServlet, self).__init__(hs)
+        self.store = hs.get_datastore()
+
+    @defer.inlineCallbacks
+    def on_POST(self, request, room_id):
+        requester = yield self.auth.get_user_by_req(request)
+        is_admin = yield self.auth.is_server_admin(requester.user)
+        if not is_admin:
+            raise AuthError(403, "You are not a server admin")
+
+        body = parse_json_object_from_request(request, allow_empty_body=True)
+
+        kwargs = {}
+        if "max_depth" in body:
+            max_depth = body["max_depth"]
+            if not isinstance(max_depth, int) or max_depth < 1:
+                raise SynapseError(
+                    400, "max_depth must be a positive int",
+                    errcode=Codes.BAD_JSON,
+                )
+            kwargs["max_depth"] = max_depth
+
+        stats = yield self.store.compress_state_groups_for_room(room_id, **kwargs)
+
+        defer.returnValue((200, stats))
+
+
+class FederationDestinationsHealthRestServlet(ClientV1RestServlet):
+    """Lists how each remote server we have sent federation requests to is
+    responding.
+    """
+    PATTERNS = client_path_patterns("/admin/federation/destinations$")
+
+    def __init__(self, hs):
+        super(FederationDestinationsHealthRestServlet, self).__init__(hs)
+        self.destination_health = hs.get_destination_health_tracker()
+
+    @defer.inlineCallbacks
+    def on_GET(self, request):
+        requester = yield self.auth.get_user_by_req(request)
+        is_admin = yield self.auth.is_server_admin(requester.user)
+        if not is_admin:
+            raise AuthError(403, "You are not a server admin")
+
+        defer.returnValue((200, {
+            "destinations": self.destination_health.get_all_health(),
+        }))
+
+
+class FederationDestinationHealthRestServlet(ClientV1RestServlet):
+    """Gets how a remote server is responding to our federation requests,
+    including the backoff we have stored for it.
+    """
+    PATTERNS = client_path_patterns(
+        "/admin/federation/destinations/(?P<destination>[^/]+)$"
+    )
+
+    def __init__(self, hs):
+        super(FederationDestinationHealthRestServlet, self).__init__(hs)
+        self.store = hs.get_datastore()
+        self.destination_health = hs.get_destination_health_tracker()
+
+    @defer.inlineCallbacks
+    def on_GET(self, request, destination):
+        requester = yield self.auth.get_user_by_req(request)
+        is_admin = yield self.auth.is_server_admin(requester.user)
+        if not is_admin:
+            raise AuthError(403, "You are not a server admin")
+
+        health = self.destination_health.get_health(destination)
+        retry_timings = yield self.store.get_destination_retry_timings(
+            destination,
+        )
+        if health is None and retry_timings is None:
+            raise NotFoundError("No information about destination")
+
+        ret = {"destination": destination}
+        if health is not None:
+            ret.update(health)
+        if retry_timings is not None:
+            ret["retry_last_ts"] = retry_timings["retry_last_ts"]
+            ret["retry_interval"] = retry_timings["retry_interval"]
+
+        defer.returnValue((200, ret))
+
+
 class ResetPasswordRestServlet(ClientV1RestServlet):
     """Post request to allow an administrator reset password for a user.
     This needs user to have administrator access in Synapse.
@@ -753,4 +846,7 @@ def register_servlets(hs, http_server):
     ShutdownRoomRestServlet(hs).register(http_server)
     QuarantineMediaInRoom(hs).register(http_server)
     ListMediaInRoom(hs).register(http_server)
+    CompressStateRestServlet(hs).register(http_server)
+    FederationDestinationsHealthRestServlet(hs).register(http_server)
+    FederationDestinationHealthRestServlet(hs).register(http_server)
     UserRegisterServlet(hs).register(http_server)
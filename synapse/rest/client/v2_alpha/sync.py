@@ -31,6 +31,7 @@ from synapse.events.utils import (
 from synapse.handlers.presence import format_user_presence_state
 from synapse.handlers.sync import SyncConfig
 from synapse.http.servlet import RestServlet, parse_boolean, parse_integer, parse_string
+from synapse.metrics.background_process_metrics import run_as_background_process
 from synapse.types import StreamToken
 
 from ._base import client_v2_patterns, set_timeline_upper_limit
@@ -77,6 +78,10 @@ class SyncRestServlet(RestServlet):
     PATTERNS = client_v2_patterns("/sync$")
     ALLOWED_PRESENCE = set(["online", "offline"])
 
+    # initial syncs in particular can produce enormous responses, so encode
+    # them a chunk at a time rather than building the whole body in memory.
+    STREAM_RESPONSE = True
+
     def __init__(self, hs):
         super(SyncRestServlet, self).__init__()
         self.hs = hs
@@ -161,27 +166,54 @@ class SyncRestServlet(RestServlet):
         context = yield self.presence_handler.user_syncing(
             user.to_string(), affect_presence=affect_presence,
         )
-        with context:
-            sync_result = yield self.sync_handler.wait_for_sync_for_user(
-                sync_config, since_token=since_token, timeout=timeout,
-                full_state=full_state
+        use_snapshot = (
+            since_token is None
+            and self.sync_handler.can_use_initial_sync_snapshot(sync_config)
+        )
+
+        def encode_response(time_now, sync_result):
+            return self.encode_response(
+                time_now, sync_result, requester.access_token_id, filter
             )
 
-        time_now = self.clock.time_msec()
-        response_content = self.encode_response(
-            time_now, sync_result, requester.access_token_id, filter
-        )
+        def encode_event(time_now, event):
+            return serialize_event(
+                event, time_now, token_id=requester.access_token_id,
+                event_format=_get_event_formatter(filter),
+            )
+
+        with context:
+            response_content = None
+            snapshot_token = None
+            if use_snapshot:
+                response_content, snapshot_token = (
+                    yield self.sync_handler.initial_sync_from_snapshot(
+                        sync_config, encode_response, encode_event,
+                    )
+                )
+
+            if response_content is None:
+                sync_result = yield self.sync_handler.wait_for_sync_for_user(
+                    sync_config, since_token=since_token, timeout=timeout,
+                    full_state=full_state
+                )
+
+                time_now = self.clock.time_msec()
+                response_content = encode_response(time_now, sync_result)
+
+        if use_snapshot and response_content["next_batch"] != snapshot_token:
+            # Don't make the client wait while we store the snapshot
+            run_as_background_process(
+                "store_initial_sync_snapshot",
+                self.sync_handler.store_initial_sync_snapshot,
+                sync_config, response_content,
+            )
 
         defer.returnValue((200, response_content))
 
     @staticmethod
     def encode_response(time_now, sync_result, access_token_id, filter):
-        if filter.event_format == 'client':
-            event_formatter = format_event_for_client_v2_without_room_id
-        elif filter.event_format == 'federation':
-            event_formatter = format_event_raw
-        else:
-            raise Exception("Unknown event format %s" % (filter.event_format, ))
+        event_formatter = _get_event_formatter(filter)
 
         joined = SyncRestServlet.encode_joined(
             sync_result.joined, time_now, access_token_id,
@@ -400,5 +432,23 @@ class SyncRestServlet(RestServlet):
         return result
 
 
+def _get_event_formatter(filter):
+    """Get the function to convert events from federation format to the
+    format requested by the given filter
+
+    Args:
+        filter (FilterCollection)
+
+    Returns:
+        func[dict]
+    """
+    if filter.event_format == 'client':
+        return format_event_for_client_v2_without_room_id
+    elif filter.event_format == 'federation':
+        return format_event_raw
+    else:
+        raise Exception("Unknown event format %s" % (filter.event_format, ))
+
+
 def register_servlets(hs, http_server):
     SyncRestServlet(hs).register(http_server)
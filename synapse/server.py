@@ -86,6 +86,7 @@ from synapse.server_notices.worker_server_notices_sender import WorkerServerNoti
 from synapse.state import StateHandler, StateResolutionHandler
 from synapse.streams.events import EventSources
 from synapse.util import Clock
+from synapse.util.destination_health import DestinationHealthTracker
 from synapse.util.distributor import Distributor
 
 logger = logging.getLogger(__name__)
@@ -117,6 +118,7 @@ class HomeServer(object):
 
     DEPENDENCIES = [
         'http_client',
+        'destination_health_tracker',
         'db_pool',
         'federation_client',
         'federation_server',
@@ -364,6 +366,14 @@ class HomeServer(object):
     def build_http_client(self):
         return MatrixFederationHttpClient(self)
 
+    def build_destination_health_tracker(self):
+        return DestinationHealthTracker(
+            clock=self.get_clock(),
+            max_concurrency=self.config.federation_client_max_concurrency_per_host,
+            latency_target_ms=self.config.federation_client_latency_target_ms,
+            failure_threshold=self.config.federation_client_failure_threshold,
+        )
+
     def build_db_pool(self):
         name = self.db_config["name"]
 
@@ -16,6 +16,7 @@ import synapse.server_notices.server_notices_manager
 import synapse.server_notices.server_notices_sender
 import synapse.state
 import synapse.storage
+import synapse.util.destination_health
 
 
 class HomeServer(object):
@@ -68,6 +69,9 @@ class HomeServer(object):
     def get_federation_transport_client(self) -> synapse.federation.transport.client.TransportLayerClient:
         pass
 
+    def get_destination_health_tracker(self) -> synapse.util.destination_health.DestinationHealthTracker:
+        pass
+
     def get_media_repository_resource(self) -> synapse.rest.media.v1.media_repository.MediaRepositoryResource:
         pass
 
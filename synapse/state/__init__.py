@@ -21,6 +21,7 @@ from six import iteritems, itervalues
 
 import attr
 from frozendict import frozendict
+from prometheus_client import Counter
 
 from twisted.internet import defer
 
@@ -47,6 +48,17 @@ _NEXT_STATE_ID = 1
 
 POWER_KEY = (EventTypes.PowerLevels, "")
 
+# Metrics for the state resolution results that we store in the DB
+state_res_db_cache_hits_counter = Counter(
+    "synapse_state_res_db_cache_hits", "",
+)
+state_res_db_cache_misses_counter = Counter(
+    "synapse_state_res_db_cache_misses", "",
+)
+state_res_db_cache_time_saved_counter = Counter(
+    "synapse_state_res_db_cache_time_saved_seconds", "",
+)
+
 
 def _gen_state_id():
     global _NEXT_STATE_ID
@@ -494,14 +506,10 @@ class StateResolutionHandler(object):
                     break
 
             if conflicted_state:
-                logger.info("Resolving conflicted state for %r", room_id)
-                with Measure(self.clock, "state._resolve_events"):
-                    new_state = yield resolve_events_with_store(
-                        room_version,
-                        list(itervalues(state_groups_ids)),
-                        event_map=event_map,
-                        state_res_store=state_res_store,
-                    )
+                new_state = yield self._resolve_conflicted_state_groups(
+                    room_id, room_version, state_groups_ids, event_map,
+                    state_res_store,
+                )
 
             # if the new state matches any of the input state groups, we can
             # use that state group again. Otherwise we will generate a state_id
@@ -516,6 +524,115 @@ class StateResolutionHandler(object):
 
             defer.returnValue(cache)
 
+    @defer.inlineCallbacks
+    def _resolve_conflicted_state_groups(
+        self, room_id, room_version, state_groups_ids, event_map, state_res_store,
+    ):
+        """Resolves a set of state groups that have conflicting state, reusing
+        the result of a previous resolution of the same groups (possibly by
+        another process) from the database if there is one.
+
+        Args: see resolve_state_groups
+
+        Returns:
+            Deferred[dict[(str, str), str]]: the resolved state
+        """
+        cached = yield state_res_store.get_state_resolution_cache_entry(
+            state_groups_ids.keys(),
+        )
+        if cached is not None:
+            resolution, resolution_time_ms = cached
+            new_state = _state_from_resolution(resolution, state_groups_ids)
+            if new_state is not None:
+                state_res_db_cache_hits_counter.inc()
+                state_res_db_cache_time_saved_counter.inc(
+                    resolution_time_ms / 1000.,
+                )
+                defer.returnValue(new_state)
+
+        state_res_db_cache_misses_counter.inc()
+
+        logger.info("Resolving conflicted state for %r", room_id)
+        start_ms = self.clock.time_msec()
+        with Measure(self.clock, "state._resolve_events"):
+            new_state = yield resolve_events_with_store(
+                room_version,
+                list(itervalues(state_groups_ids)),
+                event_map=event_map,
+                state_res_store=state_res_store,
+            )
+        resolution_time_ms = self.clock.time_msec() - start_ms
+
+        try:
+            yield state_res_store.store_state_resolution_cache_entry(
+                room_id, state_groups_ids.keys(),
+                _resolution_from_state(new_state, state_groups_ids),
+                resolution_time_ms,
+            )
+        except Exception:
+            # We've still got the answer, so don't fail the resolution.
+            logger.exception("Failed to store state resolution for %s", room_id)
+
+        defer.returnValue(new_state)
+
+
+def _resolution_from_state(new_state, state_groups_ids):
+    """Encodes a resolved state map as a delta against whichever of the input
+    state groups it is closest to, for storing in the database.
+
+    Args:
+        new_state (dict[(str, str), str]): the resolved state
+        state_groups_ids (dict[int, dict[(str, str), str]]): the input state
+            groups
+
+    Returns:
+        dict: a JSON-serialisable dict with keys `base`, the state group the
+        delta is against, and `delta`, a list of `[type, state_key, event_id]`
+        where event_id is None for state that was removed.
+    """
+    best = None
+    for group, state in iteritems(state_groups_ids):
+        delta = [
+            [typ, state_key, event_id]
+            for (typ, state_key), event_id in iteritems(new_state)
+            if state.get((typ, state_key)) != event_id
+        ]
+        delta.extend(
+            [typ, state_key, None]
+            for (typ, state_key) in state
+            if (typ, state_key) not in new_state
+        )
+        if best is None or len(delta) < len(best["delta"]):
+            best = {"base": group, "delta": delta}
+
+    return best
+
+
+def _state_from_resolution(resolution, state_groups_ids):
+    """Inverse of `_resolution_from_state`.
+
+    Args:
+        resolution (dict): the stored resolution
+        state_groups_ids (dict[int, dict[(str, str), str]]): the input state
+            groups
+
+    Returns:
+        dict[(str, str), str]|None: the resolved state, or None if the stored
+        resolution doesn't match the input state groups.
+    """
+    base_state = state_groups_ids.get(resolution.get("base"))
+    if base_state is None:
+        return None
+
+    new_state = dict(base_state)
+    for typ, state_key, event_id in resolution["delta"]:
+        if event_id is None:
+            new_state.pop((typ, state_key), None)
+        else:
+            new_state[(typ, state_key)] = event_id
+
+    return new_state
+
 
 def _make_state_cache_entry(
     new_state,
@@ -668,3 +785,53 @@ class StateResolutionStore(object):
         """
 
         return self.store.get_auth_chain_ids(event_ids, include_given=True)
+
+    def get_auth_chain_difference(self, state_sets):
+        """Given sets of state events figure out the auth chain difference (as
+        per state res v2 algorithm).
+
+        This equivalent to fetching the full auth chain for each set of state
+        and returning the events that don't appear in each and every auth
+        chain.
+
+        Args:
+            state_sets (list[set[str]]): The sets of event IDs. Must be state
+                events.
+
+        Returns:
+            Deferred[set[str]]: Set of event IDs.
+        """
+
+        return self.store.get_auth_chain_difference(state_sets)
+
+    def get_state_resolution_cache_entry(self, state_groups):
+        """Looks up the stored result of a previous resolution of the given
+        state groups.
+
+        Args:
+            state_groups (iterable[int])
+
+        Returns:
+            Deferred[tuple[dict, int]|None]: the stored resolution and how long
+            it took to calculate in ms, if any.
+        """
+
+        return self.store.get_state_resolution_cache_entry(state_groups)
+
+    def store_state_resolution_cache_entry(self, room_id, state_groups,
+                                           resolution, resolution_time_ms):
+        """Stores the result of resolving the given state groups.
+
+        Args:
+            room_id (str)
+            state_groups (iterable[int])
+            resolution (dict): JSON-serialisable description of the result
+            resolution_time_ms (int): how long the resolution took
+
+        Returns:
+            Deferred
+        """
+
+        return self.store.store_state_resolution_cache_entry(
+            room_id, state_groups, resolution, resolution_time_ms,
+        )
@@ -36,9 +36,11 @@ from .engines import PostgresEngine
 from .event_federation import EventFederationStore
 from .event_push_actions import EventPushActionsStore
 from .events import EventsStore
+from .federation_state_responses import FederationStateResponseStore
 from .filtering import FilteringStore
 from .group_server import GroupServerStore
 from .keys import KeyStore
+from .lazy_loaded_members import LazyLoadedMembersStore
 from .media_repository import MediaRepositoryStore
 from .monthly_active_users import MonthlyActiveUsersStore
 from .openid import OpenIdStore
@@ -55,6 +57,7 @@ from .search import SearchStore
 from .signatures import SignatureStore
 from .state import StateStore
 from .stream import StreamStore
+from .sync_snapshots import SyncSnapshotStore
 from .tags import TagsStore
 from .transactions import TransactionStore
 from .user_directory import UserDirectoryStore
@@ -91,6 +94,9 @@ class DataStore(RoomMemberStore, RoomStore,
                 GroupServerStore,
                 UserErasureStore,
                 MonthlyActiveUsersStore,
+                SyncSnapshotStore,
+                LazyLoadedMembersStore,
+                FederationStateResponseStore,
                 ):
 
     def __init__(self, db_conn, hs):
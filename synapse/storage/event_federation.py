@@ -15,6 +15,7 @@
 import logging
 import random
 
+from six import iteritems, itervalues
 from six.moves import range
 from six.moves.queue import Empty, PriorityQueue
 
@@ -27,6 +28,8 @@ from synapse.metrics.background_process_metrics import run_as_background_process
 from synapse.storage._base import SQLBaseStore
 from synapse.storage.events_worker import EventsWorkerStore
 from synapse.storage.signatures import SignatureWorkerStore
+from synapse.storage.util.id_generators import IdGenerator
+from synapse.util import batch_iter
 from synapse.util.caches.descriptors import cached
 
 logger = logging.getLogger(__name__)
@@ -64,7 +67,225 @@ class EventFederationWorkerStore(EventsWorkerStore, SignatureWorkerStore,
             event_ids, include_given
         )
 
+    def get_auth_chain_difference(self, state_sets):
+        """Given sets of state events, figure out the auth chain difference
+        (as per state res v2 algorithm).
+
+        This is equivalent to fetching the full auth chain (including the
+        given events) for each set and returning the events that don't appear
+        in every set's chain.
+
+        Args:
+            state_sets (list[set[str]]): The sets of event IDs. These must be
+                state events.
+
+        Returns:
+            Deferred[set[str]]: the event IDs in the auth chain difference
+        """
+        return self.runInteraction(
+            "get_auth_chain_difference",
+            self._get_auth_chain_difference_txn,
+            state_sets,
+        )
+
+    def _get_auth_chain_difference_txn(self, txn, state_sets):
+        all_event_ids = set()
+        for state_set in state_sets:
+            all_event_ids.update(state_set)
+
+        positions = self._get_auth_chain_positions_txn(txn, all_event_ids)
+
+        if len(positions) < len(all_event_ids):
+            # Not all the events are in the auth chain index, so we fall back
+            # to walking the auth graph of each set.
+            auth_sets = [
+                set(self._get_auth_chain_ids_txn(txn, state_set, True))
+                for state_set in state_sets
+            ]
+            if not auth_sets:
+                return set()
+            return set().union(*auth_sets) - auth_sets[0].intersection(
+                *auth_sets[1:]
+            )
+
+        # For each set, work out how far along each chain its auth chain
+        # reaches. Events on a chain between the minimum and maximum reach
+        # across the sets are exactly those in some but not all auth chains.
+        set_to_chains = [
+            self._get_auth_chain_reach_txn(
+                txn, [positions[event_id] for event_id in state_set],
+            )
+            for state_set in state_sets
+        ]
+
+        all_chains = set()
+        for chains in set_to_chains:
+            all_chains.update(chains)
+
+        ranges = []
+        for chain_id in all_chains:
+            reaches = [chains.get(chain_id, 0) for chains in set_to_chains]
+            min_seq = min(reaches)
+            max_seq = max(reaches)
+            if min_seq < max_seq:
+                ranges.append((chain_id, min_seq, max_seq))
+
+        return self._get_event_ids_in_chain_ranges_txn(txn, ranges)
+
     def _get_auth_chain_ids_txn(self, txn, event_ids, include_given):
+        event_ids = set(event_ids)
+
+        positions = self._get_auth_chain_positions_txn(txn, event_ids)
+        if len(positions) == len(event_ids):
+            return self._get_auth_chain_ids_using_index_txn(
+                txn, event_ids, positions, include_given,
+            )
+
+        return self._get_auth_chain_ids_from_graph_txn(
+            txn, event_ids, include_given,
+        )
+
+    def _get_auth_chain_ids_using_index_txn(self, txn, event_ids, positions,
+                                            include_given):
+        """Gets the auth chain for the given events using the auth chain
+        index. All the given events must be in the index.
+        """
+        if not include_given:
+            # We want the auth chain to only include the given events if they
+            # are in the auth chains of the other events, so we start from
+            # the auth events of the given events instead.
+            rows = self._simple_select_many_txn(
+                txn,
+                table="event_auth",
+                column="event_id",
+                iterable=event_ids,
+                keyvalues={},
+                retcols=("auth_id",),
+            )
+            auth_ids = set(row["auth_id"] for row in rows)
+            positions = self._get_auth_chain_positions_txn(txn, auth_ids)
+            if len(positions) < len(auth_ids):
+                return self._get_auth_chain_ids_from_graph_txn(
+                    txn, event_ids, include_given,
+                )
+
+        chains = self._get_auth_chain_reach_txn(txn, itervalues(positions))
+
+        return list(self._get_event_ids_in_chain_ranges_txn(txn, [
+            (chain_id, 0, max_seq) for chain_id, max_seq in iteritems(chains)
+        ]))
+
+    def _get_auth_chain_positions_txn(self, txn, event_ids):
+        """Looks up the position of the given events in the auth chain index.
+
+        Returns:
+            dict[str, tuple[int, int]]: map from event ID to chain ID and
+            sequence number, for those events that are in the index.
+        """
+        rows = self._simple_select_many_txn(
+            txn,
+            table="event_auth_chains",
+            column="event_id",
+            iterable=event_ids,
+            keyvalues={},
+            retcols=("event_id", "chain_id", "sequence_number"),
+        )
+        return {
+            row["event_id"]: (row["chain_id"], row["sequence_number"])
+            for row in rows
+        }
+
+    def _get_event_ids_in_chain_ranges_txn(self, txn, ranges):
+        """Looks up the events in the given ranges of chains in the auth
+        chain index, fetching many chains in each query.
+
+        Args:
+            txn
+            ranges (list[tuple[int, int, int]]): the chain ID of each range,
+                and the sequence numbers that the range starts after and ends
+                at (inclusive).
+
+        Returns:
+            set[str]: the event IDs in the ranges
+        """
+        results = set()
+        for chunk in batch_iter(ranges, 100):
+            sql = "SELECT event_id FROM event_auth_chains WHERE " + " OR ".join(
+                "(chain_id = ? AND ? < sequence_number AND sequence_number <= ?)"
+                for _ in chunk
+            )
+            txn.execute(sql, [arg for chain_range in chunk for arg in chain_range])
+            results.update(row[0] for row in txn)
+
+        return results
+
+    def _get_auth_chain_reach_txn(self, txn, positions):
+        """Works out which parts of which chains are in the auth chains of the
+        events at the given positions in the auth chain index (including the
+        events themselves).
+
+        Args:
+            txn
+            positions (iterable[tuple[int, int]]): chain ID and sequence number
+                of each event.
+
+        Returns:
+            dict[int, int]: map from chain ID to the maximum sequence number
+            on that chain that is reachable. Everything on the chain up to
+            and including that sequence number is reachable.
+        """
+        chains = {}
+        chain_links = {}
+
+        pending = list(positions)
+        while pending:
+            # Map of chain ID to the reach of the chain before this round, so
+            # that we only need to follow the links from the new part of the
+            # chain.
+            updated = {}
+            for chain_id, seq in pending:
+                prev_seq = chains.get(chain_id, 0)
+                if seq > prev_seq:
+                    chains[chain_id] = seq
+                    updated.setdefault(chain_id, prev_seq)
+
+            missing = [
+                chain_id for chain_id in updated if chain_id not in chain_links
+            ]
+            if missing:
+                rows = self._simple_select_many_txn(
+                    txn,
+                    table="event_auth_chain_links",
+                    column="origin_chain_id",
+                    iterable=missing,
+                    keyvalues={},
+                    retcols=(
+                        "origin_chain_id", "origin_sequence_number",
+                        "target_chain_id", "target_sequence_number",
+                    ),
+                )
+                for chain_id in missing:
+                    chain_links[chain_id] = []
+                for row in rows:
+                    chain_links[row["origin_chain_id"]].append((
+                        row["origin_sequence_number"],
+                        row["target_chain_id"],
+                        row["target_sequence_number"],
+                    ))
+
+            pending = []
+            for chain_id, prev_seq in iteritems(updated):
+                seq = chains[chain_id]
+                for origin_seq, target_chain_id, target_seq in chain_links[chain_id]:
+                    if prev_seq < origin_seq <= seq:
+                        pending.append((target_chain_id, target_seq))
+
+        return chains
+
+    def _get_auth_chain_ids_from_graph_txn(self, txn, event_ids, include_given):
+        """Gets the auth chain for the given events by walking the event_auth
+        table, for when the events aren't in the auth chain index.
+        """
         if include_given:
             results = set(event_ids)
         else:
@@ -326,35 +547,30 @@ class EventFederationWorkerStore(EventsWorkerStore, SignatureWorkerStore,
         # We want to make sure that we do a breadth-first, "depth" ordered
         # search.
 
-        query = (
-            "SELECT depth, prev_event_id FROM event_edges"
-            " INNER JOIN events"
-            " ON prev_event_id = events.event_id"
-            " WHERE event_edges.event_id = ?"
-            " AND event_edges.is_state = ?"
-            " LIMIT ?"
+        rows = self._simple_select_many_txn(
+            txn,
+            table="events",
+            column="event_id",
+            iterable=event_list,
+            keyvalues={"room_id": room_id},
+            retcols=("event_id", "depth"),
         )
 
         queue = PriorityQueue()
 
-        for event_id in event_list:
-            depth = self._simple_select_one_onecol_txn(
-                txn,
-                table="events",
-                keyvalues={
-                    "event_id": event_id,
-                    "room_id": room_id,
-                },
-                retcol="depth",
-                allow_none=True,
-            )
+        for row in rows:
+            if row["depth"]:
+                queue.put((-row["depth"], row["event_id"]))
 
-            if depth:
-                queue.put((-depth, event_id))
+        # Map from event ID to the list of (prev_event_id, prev_depth) for the
+        # events whose edges we've loaded so far. We pull them out a window of
+        # depths at a time, so that walking back through the room's history
+        # costs one query per `limit` depths rather than one per event.
+        prev_events = {}
 
         while not queue.empty() and len(event_results) < limit:
             try:
-                _, event_id = queue.get_nowait()
+                depth, event_id = queue.get_nowait()
             except Empty:
                 break
 
@@ -363,14 +579,17 @@ class EventFederationWorkerStore(EventsWorkerStore, SignatureWorkerStore,
 
             event_results.add(event_id)
 
-            txn.execute(
-                query,
-                (event_id, False, limit - len(event_results))
+            self._load_prev_events_txn(
+                txn, room_id, {event_id: -depth}, prev_events, limit,
             )
 
-            for row in txn:
-                if row[1] not in event_results:
-                    queue.put((-row[0], row[1]))
+            for prev_event_id, prev_depth in prev_events[event_id]:
+                # we only backfill events that we actually have
+                if prev_depth is None:
+                    continue
+
+                if prev_event_id not in event_results:
+                    queue.put((-prev_depth, prev_event_id))
 
         return event_results
 
@@ -392,21 +611,35 @@ class EventFederationWorkerStore(EventsWorkerStore, SignatureWorkerStore,
         front = set(latest_events) - seen_events
         event_results = []
 
-        query = (
-            "SELECT prev_event_id FROM event_edges "
-            "WHERE room_id = ? AND event_id = ? AND is_state = ? "
-            "LIMIT ?"
+        rows = self._simple_select_many_txn(
+            txn,
+            table="events",
+            column="event_id",
+            iterable=front,
+            keyvalues={"room_id": room_id},
+            retcols=("event_id", "depth"),
         )
+        depths = {row["event_id"]: row["depth"] for row in rows}
+
+        prev_events = {}
 
         while front and len(event_results) < limit:
+            self._load_prev_events_txn(
+                txn, room_id,
+                {event_id: depths.get(event_id) for event_id in front},
+                prev_events, limit,
+            )
+
             new_front = set()
             for event_id in front:
-                txn.execute(
-                    query,
-                    (room_id, event_id, False, limit - len(event_results))
-                )
-
-                new_results = set(t[0] for t in txn) - seen_events
+                new_results = set()
+                for prev_event_id, prev_depth in prev_events[event_id]:
+                    if len(event_results) + len(new_results) >= limit:
+                        break
+                    if prev_event_id in seen_events:
+                        continue
+                    new_results.add(prev_event_id)
+                    depths[prev_event_id] = prev_depth
 
                 new_front |= new_results
                 seen_events |= new_results
@@ -419,6 +652,93 @@ class EventFederationWorkerStore(EventsWorkerStore, SignatureWorkerStore,
         event_results.reverse()
         return event_results
 
+    def _load_prev_events_txn(self, txn, room_id, event_depths, prev_events,
+                              window):
+        """Make sure that the prev events of each of the given events are in
+        `prev_events`.
+
+        Rather than looking up the edges of each event separately we load
+        the edges of every event in the room within a range of depths, using
+        the (room_id, topological_ordering) index on events, so that a walk
+        back through the graph only needs a query per `window` depths.
+
+        Args:
+            txn
+            room_id (str)
+            event_depths (dict[str, int|None]): map from event ID to its
+                depth, or None if it is unknown.
+            prev_events (dict[str, list[tuple[str, int|None]]]): map from
+                event ID to its (prev_event_id, prev_depth) pairs, which is
+                updated in place. prev_depth is None if we don't have the
+                prev event.
+            window (int): the number of depths to load at a time.
+        """
+        to_load = {
+            event_id: depth for event_id, depth in iteritems(event_depths)
+            if event_id not in prev_events
+        }
+
+        for event_id, depth in list(iteritems(to_load)):
+            if depth is None:
+                prev_events[event_id] = self._get_prev_events_for_event_txn(
+                    txn, event_id,
+                )
+                to_load.pop(event_id)
+
+        while to_load:
+            max_depth = max(itervalues(to_load))
+            min_depth = max_depth - max(window, 1) + 1
+
+            sql = """
+                SELECT e.event_id, ee.prev_event_id, pe.depth FROM events AS e
+                LEFT JOIN event_edges AS ee
+                    ON ee.event_id = e.event_id AND ee.is_state = ?
+                LEFT JOIN events AS pe ON pe.event_id = ee.prev_event_id
+                WHERE e.room_id = ?
+                    AND e.topological_ordering >= ?
+                    AND e.topological_ordering <= ?
+            """
+            txn.execute(sql, (False, room_id, min_depth, max_depth))
+
+            loaded = {}
+            for event_id, prev_event_id, prev_depth in txn:
+                prevs = loaded.setdefault(event_id, [])
+                if prev_event_id is not None:
+                    prevs.append((prev_event_id, prev_depth))
+
+            for event_id, prevs in iteritems(loaded):
+                prev_events.setdefault(event_id, prevs)
+
+            for event_id, depth in list(iteritems(to_load)):
+                if event_id in prev_events:
+                    to_load.pop(event_id)
+                elif depth >= min_depth:
+                    # The event should have been in the range we just loaded,
+                    # so its depth and topological ordering must disagree. Fall
+                    # back to looking it up directly.
+                    prev_events[event_id] = self._get_prev_events_for_event_txn(
+                        txn, event_id,
+                    )
+                    to_load.pop(event_id)
+
+    def _get_prev_events_for_event_txn(self, txn, event_id):
+        """Get the prev events of a single event
+
+        Args:
+            txn
+            event_id (str)
+
+        Returns:
+            list[tuple[str, int|None]]: (prev_event_id, prev_depth) pairs
+        """
+        sql = """
+            SELECT ee.prev_event_id, pe.depth FROM event_edges AS ee
+            LEFT JOIN events AS pe ON pe.event_id = ee.prev_event_id
+            WHERE ee.event_id = ? AND ee.is_state = ?
+        """
+        txn.execute(sql, (event_id, False))
+        return [(r[0], r[1]) for r in txn]
+
 
 class EventFederationStore(EventFederationWorkerStore):
     """ Responsible for storing and serving up the various graphs associated
@@ -431,6 +751,7 @@ class EventFederationStore(EventFederationWorkerStore):
     """
 
     EVENT_AUTH_STATE_ONLY = "event_auth_state_only"
+    EVENT_AUTH_CHAINS_BACKFILL = "event_auth_chains_backfill"
 
     def __init__(self, db_conn, hs):
         super(EventFederationStore, self).__init__(db_conn, hs)
@@ -439,11 +760,19 @@ class EventFederationStore(EventFederationWorkerStore):
             self.EVENT_AUTH_STATE_ONLY,
             self._background_delete_non_state_event_auth,
         )
+        self.register_background_update_handler(
+            self.EVENT_AUTH_CHAINS_BACKFILL,
+            self._background_backfill_event_auth_chains,
+        )
 
         hs.get_clock().looping_call(
             self._delete_old_forward_extrem_cache, 60 * 60 * 1000,
         )
 
+        self._event_chain_id_gen = IdGenerator(
+            db_conn, "event_auth_chains", "chain_id",
+        )
+
     def _update_min_depth_for_room_txn(self, txn, room_id, depth):
         min_depth = self._get_min_depth_interaction(txn, room_id)
 
@@ -483,6 +812,183 @@ class EventFederationStore(EventFederationWorkerStore):
 
         self._update_backward_extremeties(txn, events)
 
+    def _persist_event_auth_chain_txn(self, txn, events):
+        """Adds the given state events to the auth chain index.
+
+        The index splits the auth graph into chains, where each event on a
+        chain has all the earlier events on the chain in its auth chain. Each
+        event is then identified by its chain ID and sequence number, and the
+        edges between chains are stored in `event_auth_chain_links`. This
+        means that the auth chain of an event can be calculated with a few
+        queries, rather than walking the graph one generation at a time.
+
+        An event is only added to the index if all of its auth events are,
+        so that an event being in the index means its whole auth chain is.
+        Events go on the chain of the auth event with the same type and state
+        key where possible, so that e.g. each user's memberships and the power
+        levels each stay on one chain.
+
+        Rejected events must not be passed in, as they must not be used to
+        calculate auth chains.
+
+        Args:
+            txn
+            events (list[FrozenEvent]): The events being persisted.
+        """
+        self._add_to_event_auth_chain_index_txn(txn, [
+            (event.event_id, event.type, event.state_key, event.auth_event_ids())
+            for event in events
+            if event.is_state()
+        ])
+
+    def _add_to_event_auth_chain_index_txn(self, txn, events):
+        """Adds state events to the auth chain index, see
+        `_persist_event_auth_chain_txn`. Events which are already in the index
+        are ignored.
+
+        Args:
+            txn
+            events (list[tuple[str, str, str, list[str]]]): The event ID, type,
+                state key and auth event IDs of each event to add.
+        """
+        if not events:
+            return
+
+        event_map = {event[0]: event for event in events}
+
+        auth_ids = set(
+            aid for _, _, _, event_auth_ids in events for aid in event_auth_ids
+            if aid not in event_map
+        )
+
+        # Map from event ID to (chain ID, sequence number)
+        positions = self._get_auth_chain_positions_txn(
+            txn, auth_ids | set(event_map),
+        )
+
+        events = [event for event in events if event[0] not in positions]
+        if not events:
+            return
+        event_map = {event[0]: event for event in events}
+
+        # Map from chain ID to the maximum sequence number on the chain, for
+        # those chains that we might extend.
+        chain_tips = {}
+        chain_ids = set(chain_id for chain_id, _ in itervalues(positions))
+        if chain_ids:
+            txn.execute(
+                "SELECT chain_id, max(sequence_number) FROM event_auth_chains"
+                " WHERE chain_id IN (%s) GROUP BY chain_id" % (
+                    ",".join("?" for _ in chain_ids),
+                ),
+                list(chain_ids),
+            )
+            chain_tips.update(txn)
+
+        # Each event goes on the same chain as the previous event with the
+        # same type and state key (e.g. the previous membership of the same
+        # user), where that is one of its auth events. Extending whichever
+        # chain happened to end in one of the auth events instead would mean
+        # that most events start a new chain, as events usually have several
+        # auth events and only one of them can have been the tip. We
+        # therefore need the type and state key of those auth events which
+        # are at the tips of their chains.
+        tip_ids = [
+            event_id for event_id, (chain_id, seq) in iteritems(positions)
+            if chain_tips.get(chain_id) == seq
+        ]
+        rows = self._simple_select_many_txn(
+            txn,
+            table="state_events",
+            column="event_id",
+            iterable=tip_ids,
+            keyvalues={},
+            retcols=("event_id", "type", "state_key"),
+        )
+        state_keys = {
+            row["event_id"]: (row["type"], row["state_key"]) for row in rows
+        }
+        state_keys.update(
+            (event_id, (etype, state_key))
+            for event_id, etype, state_key, _ in events
+        )
+
+        # We need to add events after their auth events, so we sort the events
+        # topologically by their auth events in this batch.
+        sorted_events = []
+        seen = set()
+        for event in events:
+            stack = [(event, False)]
+            while stack:
+                ev, children_done = stack.pop()
+                if children_done:
+                    sorted_events.append(ev)
+                    continue
+                if ev[0] in seen:
+                    continue
+                seen.add(ev[0])
+                stack.append((ev, True))
+                for aid in ev[3]:
+                    if aid in event_map and aid not in seen:
+                        stack.append((event_map[aid], False))
+
+        chain_rows = []
+        link_rows = []
+        for event_id, etype, state_key, event_auth_ids in sorted_events:
+            auth_positions = []
+            for aid in event_auth_ids:
+                if aid not in positions:
+                    break
+                auth_positions.append(positions[aid])
+            else:
+                # Extend the chain of the auth event with the same type and
+                # state key if it's at the tip of its chain, or start a new
+                # chain if there isn't one.
+                chain_id = None
+                sequence_number = 0
+                for aid in event_auth_ids:
+                    auth_chain_id, auth_seq = positions[aid]
+                    if (
+                        state_keys.get(aid) == (etype, state_key) and
+                        chain_tips.get(auth_chain_id) == auth_seq
+                    ):
+                        chain_id = auth_chain_id
+                        sequence_number = auth_seq
+                        break
+
+                if chain_id is None:
+                    chain_id = self._event_chain_id_gen.get_next()
+
+                sequence_number += 1
+                positions[event_id] = (chain_id, sequence_number)
+                chain_tips[chain_id] = sequence_number
+
+                chain_rows.append({
+                    "event_id": event_id,
+                    "chain_id": chain_id,
+                    "sequence_number": sequence_number,
+                })
+
+                for auth_chain_id, auth_seq in set(auth_positions):
+                    if auth_chain_id != chain_id:
+                        link_rows.append({
+                            "origin_chain_id": chain_id,
+                            "origin_sequence_number": sequence_number,
+                            "target_chain_id": auth_chain_id,
+                            "target_sequence_number": auth_seq,
+                        })
+
+        self._simple_insert_many_txn(
+            txn,
+            table="event_auth_chains",
+            values=chain_rows,
+        )
+        self._simple_insert_many_txn(
+            txn,
+            table="event_auth_chain_links",
+            values=link_rows,
+        )
+
     def _update_backward_extremeties(self, txn, events):
         """Updates the event_backward_extremities tables based on the new/updated
         events being persisted.
@@ -611,3 +1117,99 @@ class EventFederationStore(EventFederationWorkerStore):
             yield self._end_background_update(self.EVENT_AUTH_STATE_ONLY)
 
         defer.returnValue(batch_size)
+
+    @defer.inlineCallbacks
+    def _background_backfill_event_auth_chains(self, progress, batch_size):
+        """This background update walks through the state events of each room
+        in topological order, adding them to the auth chain index (see
+        `_persist_event_auth_chain_txn`). Rejected events are skipped.
+        """
+        room_id = progress.get("room_id", "")
+        last_topo = progress.get("topological_ordering")
+        last_stream = progress.get("stream_ordering")
+
+        def backfill_txn(txn):
+            new_room_id = room_id
+            new_topo = last_topo
+            new_stream = last_stream
+            rows = []
+
+            if new_room_id:
+                sql = """
+                    SELECT e.topological_ordering, e.stream_ordering,
+                        e.event_id, s.type, s.state_key
+                    FROM events AS e
+                    INNER JOIN state_events AS s ON s.event_id = e.event_id
+                    LEFT JOIN rejections AS r ON r.event_id = e.event_id
+                    WHERE e.room_id = ? AND r.event_id IS NULL %s
+                    ORDER BY e.topological_ordering, e.stream_ordering
+                    LIMIT ?
+                """
+                args = [new_room_id]
+                if new_topo is None:
+                    clause = ""
+                else:
+                    clause = (
+                        "AND (e.topological_ordering > ?"
+                        " OR (e.topological_ordering = ?"
+                        " AND e.stream_ordering > ?))"
+                    )
+                    args.extend((new_topo, new_topo, new_stream))
+                args.append(batch_size)
+
+                txn.execute(sql % (clause,), args)
+                rows = txn.fetchall()
+
+                auth_rows = self._simple_select_many_txn(
+                    txn,
+                    table="event_auth",
+                    column="event_id",
+                    iterable=[row[2] for row in rows],
+                    keyvalues={},
+                    retcols=("event_id", "auth_id"),
+                )
+                auth_ids = {}
+                for row in auth_rows:
+                    auth_ids.setdefault(row["event_id"], []).append(
+                        row["auth_id"],
+                    )
+
+                self._add_to_event_auth_chain_index_txn(txn, [
+                    (event_id, etype, state_key, auth_ids.get(event_id, []))
+                    for _, _, event_id, etype, state_key in rows
+                ])
+
+                if rows:
+                    new_topo, new_stream = rows[-1][0], rows[-1][1]
+
+            if len(rows) < batch_size:
+                # We've finished with this room, move onto the next one.
+                txn.execute(
+                    "SELECT min(room_id) FROM events WHERE room_id > ?",
+                    (new_room_id,)
+                )
+                new_room_id, = txn.fetchone()
+                if new_room_id is None:
+                    return True, len(rows)
+                new_topo = new_stream = None
+
+            progress = {
+                "room_id": new_room_id,
+                "topological_ordering": new_topo,
+                "stream_ordering": new_stream,
+            }
+
+            self._background_update_progress_txn(
+                txn, self.EVENT_AUTH_CHAINS_BACKFILL, progress
+            )
+
+            return False, len(rows)
+
+        finished, count = yield self.runInteraction(
+            self.EVENT_AUTH_CHAINS_BACKFILL, backfill_txn
+        )
+
+        if finished:
+            yield self._end_background_update(self.EVENT_AUTH_CHAINS_BACKFILL)
+
+        defer.returnValue(max(1, count))
@@ -16,14 +16,17 @@
 
 import logging
 
-from six import iteritems
+from six import iteritems, itervalues
+from six.moves import range
 
 from canonicaljson import json
 
 from twisted.internet import defer
+from twisted.python.failure import Failure
 
 from synapse.metrics.background_process_metrics import run_as_background_process
 from synapse.storage._base import LoggingTransaction, SQLBaseStore
+from synapse.util.async_helpers import ObservableDeferred
 from synapse.util.caches.descriptors import cachedInlineCallbacks
 
 logger = logging.getLogger(__name__)
@@ -120,6 +123,208 @@ class EventPushActionsWorkerStore(SQLBaseStore):
             txn, room_id, user_id, stream_ordering
         )
 
+    @defer.inlineCallbacks
+    def get_unread_event_push_actions_by_rooms_for_user(
+            self, user_id, last_read_event_ids,
+    ):
+        """Get the unread notification counts for a user in several rooms at
+        once, using the `get_unread_event_push_actions_by_room_for_user` cache
+        where possible and a single transaction for the rest.
+
+        Args:
+            user_id (str)
+            last_read_event_ids (dict[str, str]): map from room ID to the
+                event ID of the user's read receipt in that room.
+
+        Returns:
+            Deferred[dict[str, dict]]: map from room ID to a dict with
+            `notify_count` and `highlight_count` keys.
+        """
+        cache = self.get_unread_event_push_actions_by_room_for_user.cache
+
+        results = {}
+        missing = {}
+        for room_id, event_id in iteritems(last_read_event_ids):
+            res = cache.get((room_id, user_id, event_id), None)
+            if isinstance(res, ObservableDeferred):
+                res = res.get_result() if res.has_succeeded() else None
+
+            if res is None:
+                missing[room_id] = event_id
+            else:
+                results[room_id] = res
+
+        if not missing:
+            defer.returnValue(results)
+
+        # Put deferreds for the missing entries in the cache, so that if they
+        # are invalidated while we're calculating them we don't cache stale
+        # results.
+        deferreds = {}
+        for room_id, event_id in iteritems(missing):
+            d = defer.Deferred()
+            cache.set(
+                (room_id, user_id, event_id), ObservableDeferred(d, consumeErrors=True),
+            )
+            deferreds[room_id] = d
+
+        try:
+            counts = yield self.runInteraction(
+                "get_unread_event_push_actions_by_rooms",
+                self._get_unread_counts_by_receipts_txn,
+                user_id, missing,
+            )
+        except Exception:
+            for room_id, event_id in iteritems(missing):
+                cache.invalidate((room_id, user_id, event_id))
+                deferreds[room_id].errback(Failure())
+            raise
+
+        for room_id, d in iteritems(deferreds):
+            d.callback(counts[room_id])
+
+        results.update(counts)
+        defer.returnValue(results)
+
+    def _get_unread_counts_by_receipts_txn(self, txn, user_id, last_read_event_ids):
+        counts = {
+            room_id: {"notify_count": 0, "highlight_count": 0}
+            for room_id in last_read_event_ids
+        }
+
+        rows = self._simple_select_many_txn(
+            txn,
+            table="events",
+            column="event_id",
+            iterable=set(itervalues(last_read_event_ids)),
+            keyvalues={},
+            retcols=("room_id", "event_id", "stream_ordering"),
+        )
+
+        stream_orderings = {
+            row["room_id"]: row["stream_ordering"]
+            for row in rows
+            if last_read_event_ids.get(row["room_id"]) == row["event_id"]
+        }
+        if not stream_orderings:
+            return counts
+
+        summarised_counts = self._get_unread_counts_from_summaries_txn(
+            txn, user_id, stream_orderings,
+        )
+        counts.update(summarised_counts)
+
+        stream_orderings = {
+            room_id: stream_ordering
+            for room_id, stream_ordering in iteritems(stream_orderings)
+            if room_id not in summarised_counts
+        }
+        if not stream_orderings:
+            return counts
+
+        min_stream_ordering = min(itervalues(stream_orderings))
+        room_ids = list(stream_orderings)
+
+        for i in range(0, len(room_ids), 100):
+            batch = room_ids[i:i + 100]
+            clause = ",".join("?" for _ in batch)
+
+            # We don't need to put a notif=1 clause as all rows always have
+            # notif=1
+            txn.execute(
+                "SELECT room_id, stream_ordering, highlight"
+                " FROM event_push_actions"
+                " WHERE user_id = ? AND stream_ordering > ?"
+                " AND room_id IN (%s)" % (clause,),
+                [user_id, min_stream_ordering] + batch,
+            )
+            for room_id, stream_ordering, highlight in txn:
+                if stream_ordering > stream_orderings[room_id]:
+                    counts[room_id]["notify_count"] += 1
+                    if highlight:
+                        counts[room_id]["highlight_count"] += 1
+
+            txn.execute(
+                "SELECT room_id, notif_count, stream_ordering"
+                " FROM event_push_summary"
+                " WHERE user_id = ? AND room_id IN (%s)" % (clause,),
+                [user_id] + batch,
+            )
+            for room_id, notif_count, stream_ordering in txn:
+                if stream_ordering > stream_orderings[room_id]:
+                    counts[room_id]["notify_count"] += notif_count
+
+        return counts
+
+    def _get_unread_counts_from_summaries_txn(self, txn, user_id, stream_orderings):
+        """Get the unread notification counts for a user from the running
+        totals in event_push_unread_counts, for those rooms where they are up
+        to date with the user's read receipt.
+
+        Args:
+            txn
+            user_id (str)
+            stream_orderings (dict[str, int]): map from room ID to the stream
+                ordering of the user's read receipt in that room.
+
+        Returns:
+            dict[str, dict]: map from room ID to a dict with `notify_count` and
+            `highlight_count` keys, for the rooms we have running totals for.
+        """
+        counts = {}
+        room_ids = list(stream_orderings)
+
+        for i in range(0, len(room_ids), 100):
+            batch = room_ids[i:i + 100]
+
+            rows = self._simple_select_many_txn(
+                txn,
+                table="event_push_unread_counts",
+                column="room_id",
+                iterable=batch,
+                keyvalues={"user_id": user_id},
+                retcols=(
+                    "room_id", "receipt_stream_ordering", "notif_count",
+                    "highlight_count", "stream_ordering",
+                ),
+            )
+
+            # the stream ordering each room's totals are up to date to
+            totals_stream_orderings = {}
+            for row in rows:
+                room_id = row["room_id"]
+                if row["receipt_stream_ordering"] != stream_orderings[room_id]:
+                    # the totals are for a different receipt, so can't be used
+                    continue
+
+                counts[room_id] = {
+                    "notify_count": row["notif_count"],
+                    "highlight_count": row["highlight_count"],
+                }
+                totals_stream_orderings[room_id] = row["stream_ordering"]
+
+            if not totals_stream_orderings:
+                continue
+
+            # Add on any push actions which were added after the totals were
+            # last updated, which should usually be none.
+            clause = ",".join("?" for _ in totals_stream_orderings)
+            txn.execute(
+                "SELECT room_id, stream_ordering, highlight"
+                " FROM event_push_actions"
+                " WHERE user_id = ? AND stream_ordering > ?"
+                " AND room_id IN (%s)" % (clause,),
+                [user_id, min(itervalues(totals_stream_orderings))]
+                + list(totals_stream_orderings),
+            )
+            for room_id, stream_ordering, highlight in txn:
+                if stream_ordering > totals_stream_orderings[room_id]:
+                    counts[room_id]["notify_count"] += 1
+                    if highlight:
+                        counts[room_id]["highlight_count"] += 1
+
+        return counts
+
     def _get_unread_counts_by_pos_txn(self, txn, room_id, user_id, stream_ordering):
 
         # First get number of notifications.
@@ -646,21 +851,38 @@ class EventPushActionsStore(EventPushActionsWorkerStore):
             ))
 
         for event, _ in events_and_contexts:
-            user_ids = self._simple_select_onecol_txn(
+            rows = self._simple_select_list_txn(
                 txn,
                 table="event_push_actions_staging",
                 keyvalues={
                     "event_id": event.event_id,
                 },
-                retcol="user_id",
+                retcols=("user_id", "highlight"),
             )
 
-            for uid in user_ids:
+            for row in rows:
                 txn.call_after(
                     self.get_unread_event_push_actions_by_room_for_user.invalidate_many,
-                    (event.room_id, uid,)
+                    (event.room_id, row["user_id"],)
                 )
 
+            # Keep the running totals of unread notifications up to date
+            stream_ordering = event.internal_metadata.stream_ordering
+            txn.executemany(
+                "UPDATE event_push_unread_counts"
+                " SET notif_count = notif_count + 1,"
+                " highlight_count = highlight_count + ?,"
+                " stream_ordering = ?"
+                " WHERE user_id = ? AND room_id = ? AND stream_ordering < ?",
+                (
+                    (
+                        1 if row["highlight"] else 0, stream_ordering,
+                        row["user_id"], event.room_id, stream_ordering,
+                    )
+                    for row in rows
+                )
+            )
+
         # Now we delete the staging area for *all* events that were being
         # persisted.
         txn.executemany(
@@ -742,6 +964,29 @@ class EventPushActionsStore(EventPushActionsWorkerStore):
             self.get_unread_event_push_actions_by_room_for_user.invalidate_many,
             (room_id,)
         )
+
+        # Take the push actions out of any running totals which include them
+        rows = self._simple_select_list_txn(
+            txn,
+            table="event_push_actions",
+            keyvalues={"room_id": room_id, "event_id": event_id},
+            retcols=("user_id", "stream_ordering", "highlight"),
+        )
+        txn.executemany(
+            "UPDATE event_push_unread_counts"
+            " SET notif_count = notif_count - 1,"
+            " highlight_count = highlight_count - ?"
+            " WHERE user_id = ? AND room_id = ?"
+            " AND receipt_stream_ordering < ? AND stream_ordering >= ?",
+            (
+                (
+                    1 if row["highlight"] else 0, row["user_id"], room_id,
+                    row["stream_ordering"], row["stream_ordering"],
+                )
+                for row in rows
+            )
+        )
+
         txn.execute(
             "DELETE FROM event_push_actions WHERE room_id = ? AND event_id = ?",
             (room_id, event_id)
@@ -789,6 +1034,59 @@ class EventPushActionsStore(EventPushActionsWorkerStore):
             WHERE room_id = ? AND user_id = ? AND stream_ordering <= ?
         """, (room_id, user_id, stream_ordering))
 
+        self._set_unread_counts_txn(txn, room_id, user_id, stream_ordering)
+
+    def _set_unread_counts_txn(self, txn, room_id, user_id, receipt_stream_ordering):
+        """Recalculates the running totals of a user's unread notifications in
+        a room after their read receipt has moved.
+
+        Args:
+            txn: The transaction
+            room_id (str)
+            user_id (str)
+            receipt_stream_ordering (int): the stream ordering of the event
+                the user's read receipt now points at
+        """
+        if not self.hs.is_mine_id(user_id):
+            # only local users have push actions
+            return
+
+        counts = self._get_unread_counts_by_pos_txn(
+            txn, room_id, user_id, receipt_stream_ordering,
+        )
+
+        txn.execute(
+            "SELECT MAX(stream_ordering) FROM event_push_actions"
+            " WHERE user_id = ? AND room_id = ?",
+            (user_id, room_id),
+        )
+        row = txn.fetchone()
+        stream_ordering = receipt_stream_ordering
+        if row and row[0] is not None:
+            stream_ordering = max(stream_ordering, row[0])
+
+        self._simple_delete_txn(
+            txn,
+            table="event_push_unread_counts",
+            keyvalues={
+                "user_id": user_id,
+                "room_id": room_id,
+            },
+        )
+
+        self._simple_insert_txn(
+            txn,
+            table="event_push_unread_counts",
+            values={
+                "user_id": user_id,
+                "room_id": room_id,
+                "receipt_stream_ordering": receipt_stream_ordering,
+                "notif_count": counts["notify_count"],
+                "highlight_count": counts["highlight_count"],
+                "stream_ordering": stream_ordering,
+            },
+        )
+
     def _start_rotate_notifs(self):
         return run_as_background_process("rotate_notifs", self._rotate_notifs)
 
@@ -825,6 +825,11 @@ class EventsStore(StateGroupWorkerStore, EventFederationStore, EventsWorkerStore
             backfilled=backfilled,
         )
 
+        if not backfilled:
+            self._update_room_latest_stream_orderings_txn(
+                txn, events_and_contexts=events_and_contexts,
+            )
+
         # _update_outliers_txn filters out any events which have already been
         # persisted, and returns the filtered list.
         events_and_contexts = self._update_outliers_txn(
@@ -874,6 +879,13 @@ class EventsStore(StateGroupWorkerStore, EventFederationStore, EventsWorkerStore
             ],
         )
 
+        self._persist_event_auth_chain_txn(
+            txn, [
+                event for event, context in events_and_contexts
+                if not context.rejected
+            ],
+        )
+
         # _store_rejected_events_txn filters out any events which were
         # rejected, and returns the filtered list.
         events_and_contexts = self._store_rejected_events_txn(
@@ -1087,6 +1099,34 @@ class EventsStore(StateGroupWorkerStore, EventFederationStore, EventsWorkerStore
         for room_id, depth in iteritems(depth_updates):
             self._update_min_depth_for_room_txn(txn, room_id, depth)
 
+    def _update_room_latest_stream_orderings_txn(self, txn, events_and_contexts):
+        """Record the latest stream ordering of each room in
+        room_latest_stream_orderings
+
+        Args:
+            txn (twisted.enterprise.adbapi.Connection): db connection
+            events_and_contexts (list[(EventBase, EventContext)]): events
+                we are persisting
+        """
+        latest = {}
+        for event, _ in events_and_contexts:
+            latest[event.room_id] = max(
+                event.internal_metadata.stream_ordering,
+                latest.get(event.room_id, 0),
+            )
+
+        for room_id, stream_ordering in iteritems(latest):
+            # we are the only thing that writes to this table, and stream
+            # orderings only increase, so there's no need to lock it or
+            # compare with the existing value.
+            self._simple_upsert_txn(
+                txn,
+                table="room_latest_stream_orderings",
+                keyvalues={"room_id": room_id},
+                values={"stream_ordering": stream_ordering},
+                lock=False,
+            )
+
     def _update_outliers_txn(self, txn, events_and_contexts):
         """Update any outliers with new event info.
 
@@ -1191,9 +1231,27 @@ class EventsStore(StateGroupWorkerStore, EventFederationStore, EventsWorkerStore
 
         logger.info("Deleting existing")
 
+        # The auth chain links are keyed by the position of their origin event
+        # in the auth chain index, so we need to delete them before deleting
+        # the positions.
+        positions = []
+        for ev, _ in events_and_contexts:
+            txn.execute(
+                "SELECT chain_id, sequence_number FROM event_auth_chains"
+                " WHERE event_id = ?",
+                (ev.event_id,),
+            )
+            positions.extend(txn)
+        txn.executemany(
+            "DELETE FROM event_auth_chain_links"
+            " WHERE origin_chain_id = ? AND origin_sequence_number = ?",
+            positions,
+        )
+
         for table in (
                 "events",
                 "event_auth",
+                "event_auth_chains",
                 "event_json",
                 "event_content_hashes",
                 "event_destinations",
@@ -1482,6 +1540,9 @@ class EventsStore(StateGroupWorkerStore, EventFederationStore, EventsWorkerStore
             (event.event_id, event.redacts)
         )
 
+        # the redacted event may be in stored /state responses for the room
+        self._invalidate_federation_state_responses_txn(txn, event.room_id)
+
     @defer.inlineCallbacks
     def count_daily_messages(self):
         """
@@ -2165,6 +2226,17 @@ class EventsStore(StateGroupWorkerStore, EventFederationStore, EventsWorkerStore
                 (room_id, )
             )
 
+        # The running totals of unread notifications may include the push
+        # actions we've just deleted, so throw them away. They'll be
+        # recalculated when the users next send read receipts.
+        txn.execute(
+            "DELETE FROM event_push_unread_counts WHERE room_id = ?", (room_id,),
+        )
+
+        # Stored /state responses may refer to state groups or events we've
+        # just deleted.
+        self._invalidate_federation_state_responses_txn(txn, room_id)
+
         # Mark all state and own events as outliers
         logger.info("[purge] marking remaining events as outliers")
         txn.execute(
@@ -493,6 +493,39 @@ class EventsWorkerStore(SQLBaseStore):
             )
         defer.returnValue(results)
 
+    @defer.inlineCallbacks
+    def get_redacted_event_ids(self, event_ids):
+        """Given a list of event ids, check which of them have been redacted.
+
+        Args:
+            event_ids (iterable[str]):
+
+        Returns:
+            Deferred[set[str]]: The events that have redactions pointing at
+            them.
+        """
+        results = set()
+
+        def get_redacted_event_ids_txn(txn, chunk):
+            sql = (
+                "SELECT redacts FROM redactions WHERE redacts IN (%s)"
+                % (",".join("?" * len(chunk)), )
+            )
+            txn.execute(sql, chunk)
+            for (event_id, ) in txn:
+                results.add(event_id)
+
+        # break the input up into chunks of 100
+        input_iterator = iter(event_ids)
+        for chunk in iter(lambda: list(itertools.islice(input_iterator, 100)),
+                          []):
+            yield self.runInteraction(
+                "get_redacted_event_ids",
+                get_redacted_event_ids_txn,
+                chunk,
+            )
+        defer.returnValue(results)
+
     def get_seen_events_with_rejections(self, event_ids):
         """Given a list of event ids, check if we rejected them.
 
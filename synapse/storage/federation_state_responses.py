@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 New Vector Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+import six
+
+from synapse.metrics.background_process_metrics import run_as_background_process
+
+from ._base import SQLBaseStore
+
+logger = logging.getLogger(__name__)
+
+# py2 sqlite has buffer hardcoded as only binary type, so we must use it,
+# despite being deprecated and removed in favor of memoryview
+if six.PY2:
+    db_binary_type = six.moves.builtins.buffer
+else:
+    db_binary_type = memoryview
+
+# How long we keep stored /state and /state_ids responses for. They are only
+# useful while other servers are asking about recent events in the room.
+FEDERATION_STATE_RESPONSE_MAX_AGE_MS = 24 * 60 * 60 * 1000
+
+
+class FederationStateResponseWorkerStore(SQLBaseStore):
+    def get_federation_state_response(self, state_group, state_event_id, kind):
+        """Get the stored response to a /state or /state_ids request, if any
+
+        Args:
+            state_group (int): the state group of the requested event
+            state_event_id (str): the requested event if it is a state event,
+                or '' otherwise
+            kind (str): either 'state' or 'state_ids'
+
+        Returns:
+            Deferred[bytes|None]: the encoded JSON response, or None if there
+            isn't one.
+        """
+        def _get_federation_state_response_txn(txn):
+            response_json = self._simple_select_one_onecol_txn(
+                txn,
+                table="federation_state_responses",
+                keyvalues={
+                    "state_group": state_group,
+                    "state_event_id": state_event_id,
+                    "kind": kind,
+                },
+                retcol="response_json",
+                allow_none=True,
+            )
+            if response_json is not None:
+                response_json = bytes(response_json)
+            return response_json
+
+        return self.runInteraction(
+            "get_federation_state_response", _get_federation_state_response_txn,
+        )
+
+    def store_federation_state_response(self, room_id, state_group,
+                                        state_event_id, kind, response_json):
+        """Store the response to a /state or /state_ids request
+
+        Args:
+            room_id (str)
+            state_group (int): the state group of the requested event
+            state_event_id (str): the requested event if it is a state event,
+                or '' otherwise
+            kind (str): either 'state' or 'state_ids'
+            response_json (bytes): the encoded JSON response
+
+        Returns:
+            Deferred
+        """
+        return self._simple_insert(
+            table="federation_state_responses",
+            values={
+                "room_id": room_id,
+                "state_group": state_group,
+                "state_event_id": state_event_id,
+                "kind": kind,
+                "response_json": db_binary_type(response_json),
+                "created_ts": self._clock.time_msec(),
+            },
+            # Another process may have got there first, in which case it will
+            # have stored the same response.
+            or_ignore=True,
+            desc="store_federation_state_response",
+        )
+
+    def _invalidate_federation_state_responses_txn(self, txn, room_id):
+        """Delete the stored /state and /state_ids responses for a room, for
+        when the events in them change, e.g. because one has been redacted.
+
+        Args:
+            txn
+            room_id (str)
+        """
+        self._simple_delete_txn(
+            txn,
+            table="federation_state_responses",
+            keyvalues={"room_id": room_id},
+        )
+
+
+class FederationStateResponseStore(FederationStateResponseWorkerStore):
+    def __init__(self, db_conn, hs):
+        super(FederationStateResponseStore, self).__init__(db_conn, hs)
+
+        hs.get_clock().looping_call(
+            self._delete_old_federation_state_responses, 60 * 60 * 1000,
+        )
+
+    def _delete_old_federation_state_responses(self):
+        def _delete_old_federation_state_responses_txn(txn):
+            txn.execute(
+                "DELETE FROM federation_state_responses WHERE created_ts < ?",
+                (self._clock.time_msec() - FEDERATION_STATE_RESPONSE_MAX_AGE_MS,),
+            )
+
+        return run_as_background_process(
+            "delete_old_federation_state_responses",
+            self.runInteraction,
+            "delete_old_federation_state_responses",
+            _delete_old_federation_state_responses_txn,
+        )
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 New Vector Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from collections import OrderedDict
+
+from canonicaljson import json
+
+from synapse.metrics.background_process_metrics import run_as_background_process
+
+from ._base import SQLBaseStore
+
+logger = logging.getLogger(__name__)
+
+# How long we keep a device's lazy-loaded members around for after they were
+# last updated. A device which hasn't synced for this long is unlikely to be
+# doing incremental syncs from where it left off.
+LAZY_LOADED_MEMBERS_MAX_AGE_MS = 24 * 60 * 60 * 1000
+
+
+class LazyLoadedMembersWorkerStore(SQLBaseStore):
+    def get_lazy_loaded_members(self, user_id, device_id):
+        """Get the membership events which have recently been sent to a device
+        via lazy loading.
+
+        Args:
+            user_id (str)
+            device_id (str)
+
+        Returns:
+            Deferred[list[(str, str)]]: list of (state_key, event_id) pairs,
+            least recently sent first.
+        """
+        def _get_lazy_loaded_members_txn(txn):
+            return self._get_lazy_loaded_members_txn(txn, user_id, device_id)
+
+        return self.runInteraction(
+            "get_lazy_loaded_members", _get_lazy_loaded_members_txn,
+        )
+
+    def _get_lazy_loaded_members_txn(self, txn, user_id, device_id):
+        members = self._simple_select_one_onecol_txn(
+            txn,
+            table="lazy_loaded_members",
+            keyvalues={
+                "user_id": user_id,
+                "device_id": device_id,
+            },
+            retcol="members",
+            allow_none=True,
+        )
+        if not members:
+            return []
+        return [tuple(member) for member in json.loads(members)]
+
+    def add_lazy_loaded_members(self, user_id, device_id, members, max_size,
+                                clear=False):
+        """Record that membership events have been sent to a device via lazy
+        loading.
+
+        Args:
+            user_id (str)
+            device_id (str)
+            members (list[(str, str)]): list of (state_key, event_id) pairs,
+                least recently sent first.
+            max_size (int): the maximum number of members to keep for the
+                device. The least recently sent members are dropped first.
+            clear (bool): whether to forget the previously stored members
+                first, e.g. because the device has done an initial sync.
+
+        Returns:
+            Deferred
+        """
+        def _add_lazy_loaded_members_txn(txn):
+            existing = []
+            if not clear:
+                existing = self._get_lazy_loaded_members_txn(
+                    txn, user_id, device_id,
+                )
+
+            updated = OrderedDict(existing)
+            for state_key, event_id in members:
+                updated.pop(state_key, None)
+                updated[state_key] = event_id
+
+            while len(updated) > max_size:
+                updated.popitem(last=False)
+
+            self._simple_upsert_txn(
+                txn,
+                table="lazy_loaded_members",
+                keyvalues={
+                    "user_id": user_id,
+                    "device_id": device_id,
+                },
+                values={
+                    "members": json.dumps(list(updated.items())),
+                    "updated_ts": self._clock.time_msec(),
+                },
+                lock=False,
+            )
+
+        return self.runInteraction(
+            "add_lazy_loaded_members", _add_lazy_loaded_members_txn,
+        )
+
+
+class LazyLoadedMembersStore(LazyLoadedMembersWorkerStore):
+    def __init__(self, db_conn, hs):
+        super(LazyLoadedMembersStore, self).__init__(db_conn, hs)
+
+        hs.get_clock().looping_call(
+            self._delete_old_lazy_loaded_members, 60 * 60 * 1000,
+        )
+
+    def _delete_old_lazy_loaded_members(self):
+        def _delete_old_lazy_loaded_members_txn(txn):
+            txn.execute(
+                "DELETE FROM lazy_loaded_members WHERE updated_ts < ?",
+                (self._clock.time_msec() - LAZY_LOADED_MEMBERS_MAX_AGE_MS,),
+            )
+
+        return run_as_background_process(
+            "delete_old_lazy_loaded_members",
+            self.runInteraction,
+            "delete_old_lazy_loaded_members",
+            _delete_old_lazy_loaded_members_txn,
+        )
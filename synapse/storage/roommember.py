@@ -495,6 +495,36 @@ class RoomMemberWorkerStore(EventsWorkerStore):
 
         defer.returnValue(True)
 
+    @defer.inlineCallbacks
+    def get_room_member_ids_for_host(self, room_id, host):
+        """Get the users on the given server which are, or ever were, members
+        of the room, in any membership state.
+
+        Args:
+            room_id (str)
+            host (str)
+
+        Returns:
+            Deferred[set[str]]
+        """
+        sql = """
+            SELECT DISTINCT user_id FROM room_memberships
+            WHERE room_id = ? AND user_id LIKE ?
+        """
+
+        # Any wild cards in the host can only widen the match, so we check
+        # below that the returned users actually have the correct domain.
+        like_clause = "%:" + host
+
+        rows = yield self._execute(
+            "get_room_member_ids_for_host", None, sql, room_id, like_clause,
+        )
+
+        defer.returnValue(set(
+            user_id for user_id, in rows
+            if get_domain_from_id(user_id) == host
+        ))
+
     def get_joined_hosts(self, room_id, state_entry):
         state_group = state_entry.state_group
         if not state_group:
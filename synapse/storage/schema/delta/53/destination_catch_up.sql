@@ -0,0 +1,34 @@
+/* Copyright 2018 New Vector Ltd
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- The stream ordering of the latest of our events which we have successfully
+-- sent to each destination.
+ALTER TABLE destinations ADD COLUMN last_successful_stream_ordering BIGINT;
+
+-- The stream ordering of the latest of our events in each room which we
+-- wanted to send to each destination. When a destination has been offline,
+-- we send it the latest event in each room it has missed events in, rather
+-- than everything it missed, and let it fetch the rest itself.
+CREATE TABLE destination_rooms (
+    destination TEXT NOT NULL,
+    room_id TEXT NOT NULL,
+    stream_ordering BIGINT NOT NULL
+);
+
+CREATE UNIQUE INDEX destination_rooms_destination_room_id
+    ON destination_rooms(destination, room_id);
+
+CREATE INDEX destination_rooms_destination_stream_ordering
+    ON destination_rooms(destination, stream_ordering);
@@ -0,0 +1,46 @@
+/* Copyright 2018 New Vector Ltd
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- An index of the auth graph of state events, see
+-- EventFederationStore._persist_event_auth_chain_txn for details.
+CREATE TABLE event_auth_chains (
+    event_id TEXT NOT NULL,
+    chain_id BIGINT NOT NULL,
+    sequence_number BIGINT NOT NULL,
+    UNIQUE (event_id)
+);
+
+CREATE UNIQUE INDEX event_auth_chains_c_seq_index ON event_auth_chains (
+    chain_id, sequence_number
+);
+
+-- Each row means that the event at the origin position has the event at the
+-- target position (and so everything before it on the target chain) in its
+-- auth chain.
+CREATE TABLE event_auth_chain_links (
+    origin_chain_id BIGINT NOT NULL,
+    origin_sequence_number BIGINT NOT NULL,
+    target_chain_id BIGINT NOT NULL,
+    target_sequence_number BIGINT NOT NULL
+);
+
+CREATE INDEX event_auth_chain_links_idx ON event_auth_chain_links (
+    origin_chain_id, target_chain_id
+);
+
+-- Add the state events of existing rooms to the index, see
+-- EventFederationStore._background_backfill_event_auth_chains
+INSERT into background_updates (update_name, progress_json)
+    VALUES ('event_auth_chains_backfill', '{}');
@@ -0,0 +1,30 @@
+/* Copyright 2018 New Vector Ltd
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- Running totals of local users' unread notifications in each room since their
+-- last read receipt. A row is (re)calculated whenever the user's read receipt
+-- in the room moves, and kept up to date as new push actions are added, so that
+-- the unread counts for all of a user's rooms can be read in one go.
+CREATE TABLE event_push_unread_counts (
+    user_id TEXT NOT NULL,
+    room_id TEXT NOT NULL,
+    -- The stream ordering of the event the user's read receipt points at
+    receipt_stream_ordering BIGINT NOT NULL,
+    notif_count BIGINT NOT NULL,
+    highlight_count BIGINT NOT NULL,
+    -- The counts include push actions up to and including this stream ordering
+    stream_ordering BIGINT NOT NULL,
+    UNIQUE (user_id, room_id)
+);
@@ -0,0 +1,35 @@
+/* Copyright 2018 New Vector Ltd
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- PDUs from incoming federation transactions which we have acknowledged but
+-- not yet processed, when federation_async_transactions is enabled.
+CREATE TABLE federation_inbound_pdus (
+    -- the process which received the PDU, and so which will process it
+    instance_name TEXT NOT NULL,
+    origin TEXT NOT NULL,
+    room_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    received_ts BIGINT NOT NULL,
+    -- the position of the PDU in its transaction, so that PDUs received at
+    -- the same time are processed in the order they were sent
+    ordering INTEGER NOT NULL,
+    pdu_json TEXT NOT NULL
+);
+
+CREATE INDEX federation_inbound_pdus_event_id
+    ON federation_inbound_pdus(origin, event_id);
+
+CREATE INDEX federation_inbound_pdus_instance_name
+    ON federation_inbound_pdus(instance_name, received_ts);
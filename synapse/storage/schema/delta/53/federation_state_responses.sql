@@ -0,0 +1,39 @@
+/* Copyright 2018 New Vector Ltd
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- Stores the encoded responses to federation /state and /state_ids requests,
+-- so that they can be shared between processes and survive restarts.
+CREATE TABLE federation_state_responses (
+    room_id TEXT NOT NULL,
+    -- The state group of the requested event
+    state_group BIGINT NOT NULL,
+    -- The requested event if it is a state event, since the response then
+    -- excludes it from the state, or '' otherwise
+    state_event_id TEXT NOT NULL,
+    -- Either 'state' or 'state_ids'
+    kind TEXT NOT NULL,
+    -- The encoded JSON response
+    response_json bytea NOT NULL,
+    created_ts BIGINT NOT NULL,
+    UNIQUE (state_group, state_event_id, kind)
+);
+
+CREATE INDEX federation_state_responses_room_id ON federation_state_responses(
+    room_id
+);
+
+CREATE INDEX federation_state_responses_ts ON federation_state_responses(
+    created_ts
+);
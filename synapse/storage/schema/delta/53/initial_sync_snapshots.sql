@@ -0,0 +1,31 @@
+/* Copyright 2018 New Vector Ltd
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- Stores the last initial /sync response for each device and filter, so that
+-- the next initial sync can be generated by applying an incremental sync to it.
+CREATE TABLE initial_sync_snapshots (
+    user_id TEXT NOT NULL,
+    device_id TEXT NOT NULL,
+    -- A hash of the filter used for the sync
+    filter_key TEXT NOT NULL,
+    -- The next_batch token of the snapshot
+    stream_token TEXT NOT NULL,
+    -- The zlib compressed JSON response
+    snapshot bytea NOT NULL,
+    updated_ts BIGINT NOT NULL,
+    UNIQUE (user_id, device_id, filter_key)
+);
+
+CREATE INDEX initial_sync_snapshots_ts ON initial_sync_snapshots(updated_ts);
@@ -0,0 +1,29 @@
+/* Copyright 2018 New Vector Ltd
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- Stores the membership events each device has recently been sent via lazy
+-- loading, so that they aren't sent again after the in-memory cache is lost
+-- (for instance when a synchrotron restarts, or the device's requests start
+-- going to a different synchrotron).
+CREATE TABLE lazy_loaded_members (
+    user_id TEXT NOT NULL,
+    device_id TEXT NOT NULL,
+    -- JSON list of [state_key, event_id] pairs, least recently sent first
+    members TEXT NOT NULL,
+    updated_ts BIGINT NOT NULL,
+    UNIQUE (user_id, device_id)
+);
+
+CREATE INDEX lazy_loaded_members_ts ON lazy_loaded_members(updated_ts);
@@ -0,0 +1,36 @@
+/* Copyright 2018 New Vector Ltd
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- The stream ordering of the most recent event in each room, so that we can
+-- tell which of a user's rooms have changed since a given token in a single
+-- query, even if that is too long ago for the in-memory stream change cache.
+CREATE TABLE room_latest_stream_orderings (
+    room_id TEXT NOT NULL,
+    stream_ordering BIGINT NOT NULL
+);
+
+CREATE UNIQUE INDEX room_latest_stream_orderings_room_id
+    ON room_latest_stream_orderings(room_id);
+
+-- The stream ordering from which room_latest_stream_orderings is complete:
+-- rooms without an entry have not changed since this point.
+CREATE TABLE room_latest_stream_orderings_position (
+    Lock CHAR(1) NOT NULL DEFAULT 'X' UNIQUE,  -- Makes sure this table only has one row.
+    stream_ordering BIGINT NOT NULL,
+    CHECK (Lock='X')
+);
+
+INSERT INTO room_latest_stream_orderings_position (stream_ordering)
+    SELECT COALESCE(MAX(stream_ordering), 0) FROM events;
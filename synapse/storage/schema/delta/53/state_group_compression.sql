@@ -0,0 +1,24 @@
+/* Copyright 2018 New Vector Ltd
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- The state compressor walks the state groups of each room in turn, so needs
+-- an index to look them up by room.
+INSERT into background_updates (update_name, progress_json)
+    VALUES ('state_groups_room_id_idx', '{}');
+
+-- Rewrite existing state groups as optimal deltas, see
+-- StateStore.compress_state_groups_for_room
+INSERT into background_updates (update_name, progress_json, depends_on)
+    VALUES ('state_group_compression', '{}', 'state_groups_room_id_idx');
@@ -0,0 +1,32 @@
+/* Copyright 2018 New Vector Ltd
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+-- Stores the results of resolving conflicted state groups, so that they can be
+-- shared between processes and survive restarts.
+CREATE TABLE state_group_resolution_cache (
+    -- The resolved state groups, sorted and comma separated
+    state_groups TEXT NOT NULL,
+    room_id TEXT NOT NULL,
+    -- The resolved state, as a delta against one of the state groups
+    resolution_json TEXT NOT NULL,
+    -- How long the resolution took to calculate
+    resolution_time_ms BIGINT NOT NULL,
+    created_ts BIGINT NOT NULL,
+    UNIQUE (state_groups)
+);
+
+CREATE INDEX state_group_resolution_cache_ts ON state_group_resolution_cache(
+    created_ts
+);
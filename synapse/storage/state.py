@@ -20,12 +20,14 @@ from six import iteritems, itervalues
 from six.moves import range
 
 import attr
+from canonicaljson import json
 
 from twisted.internet import defer
 
 from synapse.api.constants import EventTypes
 from synapse.api.errors import NotFoundError
-from synapse.storage._base import SQLBaseStore
+from synapse.metrics.background_process_metrics import run_as_background_process
+from synapse.storage._base import SQLBaseStore, db_to_json
 from synapse.storage.background_updates import BackgroundUpdateStore
 from synapse.storage.engines import PostgresEngine
 from synapse.storage.events_worker import EventsWorkerStore
@@ -39,6 +41,55 @@ logger = logging.getLogger(__name__)
 
 MAX_STATE_DELTA_HOPS = 100
 
+# The number of immediately preceding state groups in a room that the state
+# compressor considers as potential delta bases for each state group.
+STATE_COMPRESSION_WINDOW = 10
+
+# How long we keep the results of state resolutions in the DB.
+STATE_RESOLUTION_CACHE_EXPIRY_MS = 7 * 24 * 60 * 60 * 1000
+
+
+def _count_delta_rows(prev_state, curr_state):
+    """Works out how many rows are needed to store `curr_state` as a delta
+    against `prev_state`.
+
+    Deltas can only add or replace entries, so if `prev_state` has any keys
+    that `curr_state` doesn't then `curr_state` can't be expressed as a delta
+    against it.
+
+    Args:
+        prev_state (dict[tuple[str, str], str]): state map of the base group
+        curr_state (dict[tuple[str, str], str]): state map of the group to store
+
+    Returns:
+        int|None: number of rows, or None if a delta isn't possible.
+    """
+    if len(prev_state) > len(curr_state):
+        return None
+
+    changed = len(curr_state) - len(prev_state)
+    for key, event_id in iteritems(prev_state):
+        curr_event_id = curr_state.get(key)
+        if curr_event_id is None:
+            return None
+        if curr_event_id != event_id:
+            changed += 1
+
+    return changed
+
+
+def _make_state_groups_key(state_groups):
+    """Returns the key used for a set of state groups in the
+    state_group_resolution_cache table.
+
+    Args:
+        state_groups (iterable[int])
+
+    Returns:
+        str
+    """
+    return ",".join(str(group) for group in sorted(state_groups))
+
 
 class _GetStateGroupDelta(namedtuple("_GetStateGroupDelta", ("prev_group", "delta_ids"))):
     """Return type of get_state_group_delta that implements __len__, which lets
@@ -465,12 +516,21 @@ class StateGroupWorkerStore(EventsWorkerStore, SQLBaseStore):
             _get_current_state_ids_txn,
         )
 
-    # FIXME: how should this be cached?
+    # FIXME: how should this be cached? Unless the room's full current state
+    # is already cached by get_current_state_ids, each call hits the database,
+    # so hot paths which need the current state of every room they look at
+    # should use get_current_state_ids instead.
     def get_filtered_current_state_ids(self, room_id, state_filter=StateFilter.all()):
         """Get the current state event of a given type for a room based on the
         current_state_events table.  This may not be as up-to-date as the result
         of doing a fresh state resolution as per state_handler.get_current_state
 
+        If the full current state of the room is already in the
+        `get_current_state_ids` cache then the filter is applied to that in
+        memory, otherwise it is pushed down into the database query so that
+        we only ever pull out the rows we were asked for (rather than, say,
+        every membership event in the room).
+
         Args:
             room_id (str)
             state_filter (StateFilter): The state filter used to fetch state
@@ -481,6 +541,17 @@ class StateGroupWorkerStore(EventsWorkerStore, SQLBaseStore):
             event ID.
         """
 
+        # Returns either an ObservableDeferred, if the full state is still
+        # being fetched, or the raw result
+        cached = self.get_current_state_ids.cache.get(
+            room_id, None, update_metrics=False,
+        )
+        if isinstance(cached, dict):
+            return defer.succeed(state_filter.filter_state(cached))
+
+        if state_filter.is_full():
+            return self.get_current_state_ids(room_id)
+
         def _get_filtered_current_state_ids_txn(txn):
             results = {}
             sql = """
@@ -837,6 +908,19 @@ class StateGroupWorkerStore(EventsWorkerStore, SQLBaseStore):
         state_map = yield self.get_state_ids_for_events([event_id], state_filter)
         defer.returnValue(state_map[event_id])
 
+    def get_state_group_for_event(self, event_id):
+        """Returns the ID of the state group for the state after the given
+        event
+
+        Args:
+            event_id (str)
+
+        Returns:
+            Deferred[int|None]: the state group, or None if the event has none
+            (e.g. because it is an outlier)
+        """
+        return self._get_state_group_for_event(event_id)
+
     @cached(max_entries=50000)
     def _get_state_group_for_event(self, event_id):
         return self._simple_select_one_onecol(
@@ -1193,6 +1277,62 @@ class StateGroupWorkerStore(EventsWorkerStore, SQLBaseStore):
 
         return self.runInteraction("store_state_group", _store_state_group_txn)
 
+    @defer.inlineCallbacks
+    def get_state_resolution_cache_entry(self, state_groups):
+        """Looks up the stored result of a previous resolution of the given
+        state groups.
+
+        Args:
+            state_groups (iterable[int]): the state groups that were resolved
+
+        Returns:
+            Deferred[tuple[dict, int]|None]: the stored resolution and how long
+            the resolution took in ms, or None if there isn't one.
+        """
+        row = yield self._simple_select_one(
+            table="state_group_resolution_cache",
+            keyvalues={"state_groups": _make_state_groups_key(state_groups)},
+            retcols=("resolution_json", "resolution_time_ms"),
+            allow_none=True,
+            desc="get_state_resolution_cache_entry",
+        )
+
+        if not row:
+            defer.returnValue(None)
+
+        defer.returnValue(
+            (db_to_json(row["resolution_json"]), row["resolution_time_ms"])
+        )
+
+    def store_state_resolution_cache_entry(self, room_id, state_groups,
+                                           resolution, resolution_time_ms):
+        """Stores the result of resolving the given state groups, so that other
+        processes can reuse it.
+
+        Args:
+            room_id (str)
+            state_groups (iterable[int]): the state groups that were resolved
+            resolution (dict): JSON-serialisable description of the result
+            resolution_time_ms (int): how long the resolution took
+
+        Returns:
+            Deferred
+        """
+        return self._simple_insert(
+            table="state_group_resolution_cache",
+            values={
+                "state_groups": _make_state_groups_key(state_groups),
+                "room_id": room_id,
+                "resolution_json": json.dumps(resolution),
+                "resolution_time_ms": resolution_time_ms,
+                "created_ts": self._clock.time_msec(),
+            },
+            # Another process may have got there first, in which case it will
+            # have stored the same result.
+            or_ignore=True,
+            desc="store_state_resolution_cache_entry",
+        )
+
     def _count_state_group_hops_txn(self, txn, state_group):
         """Given a state group, count how many hops there are in the tree.
 
@@ -1258,6 +1398,8 @@ class StateStore(StateGroupWorkerStore, BackgroundUpdateStore):
     STATE_GROUP_INDEX_UPDATE_NAME = "state_group_state_type_index"
     CURRENT_STATE_INDEX_UPDATE_NAME = "current_state_members_idx"
     EVENT_STATE_GROUP_INDEX_UPDATE_NAME = "event_to_state_groups_sg_index"
+    STATE_GROUP_ROOM_INDEX_UPDATE_NAME = "state_groups_room_id_idx"
+    STATE_GROUP_COMPRESSION_UPDATE_NAME = "state_group_compression"
 
     def __init__(self, db_conn, hs):
         super(StateStore, self).__init__(db_conn, hs)
@@ -1265,6 +1407,16 @@ class StateStore(StateGroupWorkerStore, BackgroundUpdateStore):
             self.STATE_GROUP_DEDUPLICATION_UPDATE_NAME,
             self._background_deduplicate_state,
         )
+        self.register_background_update_handler(
+            self.STATE_GROUP_COMPRESSION_UPDATE_NAME,
+            self._background_compress_state,
+        )
+        self.register_background_index_update(
+            self.STATE_GROUP_ROOM_INDEX_UPDATE_NAME,
+            index_name="state_groups_room_id_idx",
+            table="state_groups",
+            columns=["room_id", "id"],
+        )
         self.register_background_update_handler(
             self.STATE_GROUP_INDEX_UPDATE_NAME,
             self._background_index_state,
@@ -1283,6 +1435,24 @@ class StateStore(StateGroupWorkerStore, BackgroundUpdateStore):
             columns=["state_group"],
         )
 
+        hs.get_clock().looping_call(
+            self._delete_old_state_resolution_cache, 60 * 60 * 1000,
+        )
+
+    def _delete_old_state_resolution_cache(self):
+        def _delete_old_state_resolution_cache_txn(txn):
+            txn.execute(
+                "DELETE FROM state_group_resolution_cache WHERE created_ts < ?",
+                (self._clock.time_msec() - STATE_RESOLUTION_CACHE_EXPIRY_MS,)
+            )
+
+        return run_as_background_process(
+            "delete_old_state_resolution_cache",
+            self.runInteraction,
+            "_delete_old_state_resolution_cache",
+            _delete_old_state_resolution_cache_txn,
+        )
+
     def _store_event_state_mappings_txn(self, txn, events_and_contexts):
         state_groups = {}
         for event, context in events_and_contexts:
@@ -1493,3 +1663,349 @@ class StateStore(StateGroupWorkerStore, BackgroundUpdateStore):
         yield self._end_background_update(self.STATE_GROUP_INDEX_UPDATE_NAME)
 
         defer.returnValue(1)
+
+    @defer.inlineCallbacks
+    def compress_state_groups_for_room(self, room_id,
+                                       max_depth=MAX_STATE_DELTA_HOPS):
+        """Rewrites the state groups of a room so that they are stored as
+        deltas using as few rows as possible.
+
+        The state at each state group is unchanged, only the way it is
+        encoded in `state_group_edges` and `state_groups_state`.
+
+        Args:
+            room_id (str)
+            max_depth (int): The maximum length of the delta chains to create.
+
+        Returns:
+            Deferred[dict]: stats about the compression, with keys
+            `state_groups`, `state_groups_rewritten`, `rows_before` and
+            `rows_after`.
+        """
+        stats = {
+            "state_groups": 0,
+            "state_groups_rewritten": 0,
+            "rows_before": 0,
+            "rows_after": 0,
+        }
+
+        last_state_group = 0
+        while True:
+            last_state_group, chunk_stats = yield self.runInteraction(
+                "compress_state_groups_for_room",
+                self._compress_state_groups_txn,
+                room_id, last_state_group, 100, max_depth,
+            )
+            for key, value in iteritems(chunk_stats):
+                stats[key] += value
+
+            if last_state_group is None:
+                break
+
+        logger.info(
+            "[compress] Compressed %d state groups in %s, %d rewritten: %d rows"
+            " reduced to %d",
+            stats["state_groups"], room_id, stats["state_groups_rewritten"],
+            stats["rows_before"], stats["rows_after"],
+        )
+
+        defer.returnValue(stats)
+
+    def _compress_state_groups_txn(self, txn, room_id, last_state_group, limit,
+                                   max_depth):
+        """Compresses a batch of state groups in a room.
+
+        Each state group is re-encoded as a delta against whichever of the
+        preceding state groups in the room (or its existing prev group, or the
+        most recent snapshot) gives the smallest number of rows, without
+        making the delta chain longer than `max_depth`. Groups are only
+        rewritten if that reduces the number of rows, and the rewritten groups
+        are checked to still resolve to the same state before the transaction
+        is committed.
+
+        Args:
+            txn
+            room_id (str)
+            last_state_group (int): Only groups after this one are compressed.
+            limit (int): Maximum number of state groups to compress.
+            max_depth (int): The maximum length of the delta chains to create.
+
+        Returns:
+            tuple[int|None, dict]: The last state group that was processed,
+            or None if there were no state groups left in the room, and the
+            stats for this batch.
+        """
+        stats = {
+            "state_groups": 0,
+            "state_groups_rewritten": 0,
+            "rows_before": 0,
+            "rows_after": 0,
+        }
+
+        txn.execute(
+            "SELECT id FROM state_groups WHERE room_id = ? AND id > ?"
+            " ORDER BY id ASC LIMIT ?",
+            (room_id, last_state_group, limit),
+        )
+        groups = [row[0] for row in txn]
+        if not groups:
+            return None, stats
+
+        txn.execute(
+            "SELECT id FROM state_groups WHERE room_id = ? AND id <= ?"
+            " ORDER BY id DESC LIMIT ?",
+            (room_id, last_state_group, STATE_COMPRESSION_WINDOW),
+        )
+        preceding_groups = sorted(row[0] for row in txn)
+
+        rows = self._simple_select_many_txn(
+            txn,
+            table="state_group_edges",
+            column="state_group",
+            iterable=preceding_groups + groups,
+            keyvalues={},
+            retcols=("state_group", "prev_state_group"),
+        )
+        prev_groups = {row["state_group"]: row["prev_state_group"] for row in rows}
+
+        txn.execute(
+            "SELECT state_group, count(*) FROM state_groups_state"
+            " WHERE state_group IN (%s) GROUP BY state_group" % (
+                ",".join("?" for _ in groups),
+            ),
+            groups,
+        )
+        row_counts = dict(txn)
+
+        # Work out the depth of the groups that aren't part of this batch but
+        # which we might use as the base of a delta.
+        depths = {}
+        outside_groups = set(preceding_groups)
+        outside_groups.update(
+            prev_groups[group] for group in groups
+            if group in prev_groups and prev_groups[group] < groups[0]
+        )
+        for group in outside_groups:
+            depths[group] = self._count_state_group_hops_txn(txn, group)
+
+        states = self._get_state_groups_from_groups_txn(
+            txn, list(outside_groups) + groups,
+        )
+
+        window = list(preceding_groups)
+        last_snapshot = None
+        for group in preceding_groups:
+            if group not in prev_groups:
+                last_snapshot = group
+
+        rewritten = {}
+        for group in groups:
+            curr_state = states[group]
+
+            candidates = set(window)
+            if last_snapshot is not None:
+                candidates.add(last_snapshot)
+
+            old_prev_group = prev_groups.get(group)
+            if old_prev_group is not None:
+                candidates.add(old_prev_group)
+
+            best_prev_group = None
+            best_rows = len(curr_state)
+            for candidate in sorted(candidates):
+                if depths[candidate] + 1 >= max_depth:
+                    continue
+
+                num_rows = _count_delta_rows(states[candidate], curr_state)
+                if num_rows is None:
+                    continue
+
+                if num_rows < best_rows or (
+                    num_rows == best_rows and best_prev_group is not None and
+                    depths[candidate] < depths[best_prev_group]
+                ):
+                    best_prev_group = candidate
+                    best_rows = num_rows
+
+            old_rows = row_counts.get(group, 0)
+
+            # We keep the existing encoding unless we can do better, or the
+            # existing chain has become too long.
+            keep_existing = best_rows >= old_rows
+            if old_prev_group is not None and (
+                depths[old_prev_group] + 1 >= max_depth
+            ):
+                keep_existing = False
+
+            stats["state_groups"] += 1
+            stats["rows_before"] += old_rows
+
+            if keep_existing:
+                stats["rows_after"] += old_rows
+                if old_prev_group is not None:
+                    depths[group] = depths[old_prev_group] + 1
+                else:
+                    depths[group] = 0
+            else:
+                stats["rows_after"] += best_rows
+                stats["state_groups_rewritten"] += 1
+                rewritten[group] = curr_state
+                if best_prev_group is not None:
+                    depths[group] = depths[best_prev_group] + 1
+                else:
+                    depths[group] = 0
+
+                self._rewrite_state_group_txn(
+                    txn, room_id, group, best_prev_group,
+                    states.get(best_prev_group, {}), curr_state,
+                )
+
+            if depths[group] == 0:
+                last_snapshot = group
+
+            window.append(group)
+            if len(window) > STATE_COMPRESSION_WINDOW:
+                window.pop(0)
+
+        if rewritten:
+            # Check that we haven't changed the state of any of the groups
+            # before we commit. Raising here will roll back the transaction.
+            new_states = self._get_state_groups_from_groups_txn(
+                txn, list(rewritten),
+            )
+            for group, expected_state in iteritems(rewritten):
+                if new_states[group] != expected_state:
+                    raise Exception(
+                        "State group %d changed during compression" % (group,)
+                    )
+
+        return groups[-1], stats
+
+    def _rewrite_state_group_txn(self, txn, room_id, state_group, prev_group,
+                                 prev_state, curr_state):
+        """Replaces the stored encoding of a state group.
+
+        Args:
+            txn
+            room_id (str)
+            state_group (int): The state group to rewrite.
+            prev_group (int|None): The new prev group, or None to store the
+                full state.
+            prev_state (dict[tuple[str, str], str]): The state at `prev_group`.
+            curr_state (dict[tuple[str, str], str]): The state at `state_group`.
+        """
+        self._simple_delete_txn(
+            txn,
+            table="state_group_edges",
+            keyvalues={"state_group": state_group},
+        )
+        self._simple_delete_txn(
+            txn,
+            table="state_groups_state",
+            keyvalues={"state_group": state_group},
+        )
+
+        if prev_group is not None:
+            self._simple_insert_txn(
+                txn,
+                table="state_group_edges",
+                values={
+                    "state_group": state_group,
+                    "prev_state_group": prev_group,
+                },
+            )
+            to_store = {
+                key: event_id for key, event_id in iteritems(curr_state)
+                if prev_state.get(key) != event_id
+            }
+        else:
+            to_store = curr_state
+
+        self._simple_insert_many_txn(
+            txn,
+            table="state_groups_state",
+            values=[
+                {
+                    "state_group": state_group,
+                    "room_id": room_id,
+                    "type": key[0],
+                    "state_key": key[1],
+                    "event_id": event_id,
+                }
+                for key, event_id in iteritems(to_store)
+            ],
+        )
+
+        # The state at the group hasn't changed so the state group caches are
+        # still valid, but the cached delta isn't. (Other processes may still
+        # have the old delta cached, but that is still a correct description
+        # of the group as the state at the old prev group hasn't changed.)
+        txn.call_after(self.get_state_group_delta.invalidate, (state_group,))
+
+    @defer.inlineCallbacks
+    def _background_compress_state(self, progress, batch_size):
+        """This background update walks through all rooms compressing their
+        state groups, see `compress_state_groups_for_room`.
+        """
+        room_id = progress.get("room_id", "")
+        last_state_group = progress.get("last_state_group", 0)
+        rows_before = progress.get("rows_before", 0)
+        rows_after = progress.get("rows_after", 0)
+
+        BATCH_SIZE_SCALE_FACTOR = 100
+
+        batch_size = max(1, int(batch_size / BATCH_SIZE_SCALE_FACTOR))
+
+        def compress_txn(txn):
+            new_room_id = room_id
+            new_last_state_group = last_state_group
+            stats = None
+
+            if new_room_id:
+                new_last_state_group, stats = self._compress_state_groups_txn(
+                    txn, new_room_id, new_last_state_group, batch_size,
+                    MAX_STATE_DELTA_HOPS,
+                )
+
+            if new_last_state_group is None or not new_room_id:
+                # We've finished with this room, move onto the next one.
+                txn.execute(
+                    "SELECT min(room_id) FROM state_groups WHERE room_id > ?",
+                    (new_room_id,)
+                )
+                new_room_id, = txn.fetchone()
+                if new_room_id is None:
+                    return True, stats
+                new_last_state_group = 0
+
+            progress = {
+                "room_id": new_room_id,
+                "last_state_group": new_last_state_group,
+                "rows_before": rows_before + (stats["rows_before"] if stats else 0),
+                "rows_after": rows_after + (stats["rows_after"] if stats else 0),
+            }
+
+            self._background_update_progress_txn(
+                txn, self.STATE_GROUP_COMPRESSION_UPDATE_NAME, progress
+            )
+
+            return False, stats
+
+        finished, stats = yield self.runInteraction(
+            self.STATE_GROUP_COMPRESSION_UPDATE_NAME, compress_txn
+        )
+
+        if finished:
+            if stats:
+                rows_before += stats["rows_before"]
+                rows_after += stats["rows_after"]
+            logger.info(
+                "[compress] Finished compressing state groups: %d rows reduced"
+                " to %d", rows_before, rows_after,
+            )
+            yield self._end_background_update(
+                self.STATE_GROUP_COMPRESSION_UPDATE_NAME
+            )
+
+        num_groups = stats["state_groups"] if stats else 1
+        defer.returnValue(max(1, num_groups) * BATCH_SIZE_SCALE_FACTOR)
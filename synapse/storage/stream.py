@@ -45,6 +45,7 @@ from synapse.storage._base import SQLBaseStore
 from synapse.storage.engines import PostgresEngine
 from synapse.storage.events_worker import EventsWorkerStore
 from synapse.types import RoomStreamToken
+from synapse.util import batch_iter
 from synapse.util.caches.stream_change_cache import StreamChangeCache
 from synapse.util.logcontext import make_deferred_yieldable, run_in_background
 
@@ -180,6 +181,15 @@ class StreamWorkerStore(EventsWorkerStore, SQLBaseStore):
 
         self._stream_order_on_start = self.get_room_max_stream_ordering()
 
+        # room_latest_stream_orderings can tell us which rooms have changed
+        # since any point after this.
+        txn = db_conn.cursor()
+        txn.execute(
+            "SELECT stream_ordering FROM room_latest_stream_orderings_position"
+        )
+        self._room_latest_stream_orderings_position = txn.fetchone()[0]
+        txn.close()
+
     @abc.abstractmethod
     def get_room_max_stream_ordering(self):
         raise NotImplementedError()
@@ -193,9 +203,7 @@ class StreamWorkerStore(EventsWorkerStore, SQLBaseStore):
                                          order='DESC'):
         from_id = RoomStreamToken.parse_stream_token(from_key).stream
 
-        room_ids = yield self._events_stream_cache.get_entities_changed(
-            room_ids, from_id
-        )
+        room_ids = yield self.get_rooms_changed_since(room_ids, from_id)
 
         if not room_ids:
             defer.returnValue({})
@@ -214,6 +222,49 @@ class StreamWorkerStore(EventsWorkerStore, SQLBaseStore):
 
         defer.returnValue(results)
 
+    @defer.inlineCallbacks
+    def get_rooms_changed_since(self, room_ids, from_id):
+        """Given a list of rooms and a stream ordering, return the rooms which
+        may have had new events since then.
+
+        The in-memory stream change cache can only answer for recent stream
+        orderings, so for older ones (e.g. a client which has been offline for
+        a while) we look the rooms up in room_latest_stream_orderings instead
+        of assuming that they have all changed.
+
+        Args:
+            room_ids (iterable[str])
+            from_id (int): The stream ordering to look for changes since
+
+        Returns:
+            Deferred[set[str]]
+        """
+        changed = self._events_stream_cache.get_entities_changed(room_ids, from_id)
+
+        if (
+            len(changed) > 1
+            and from_id >= self._room_latest_stream_orderings_position
+            and changed.issuperset(room_ids)
+        ):
+            # the cache couldn't rule any of the rooms out, so ask the database
+            changed = yield self.runInteraction(
+                "get_rooms_changed_since", self._get_rooms_changed_since_txn,
+                changed, from_id,
+            )
+
+        defer.returnValue(changed)
+
+    def _get_rooms_changed_since_txn(self, txn, room_ids, from_id):
+        changed = set()
+        for batch in batch_iter(room_ids, 100):
+            sql = (
+                "SELECT room_id FROM room_latest_stream_orderings"
+                " WHERE stream_ordering > ? AND room_id IN (%s)"
+            ) % (",".join("?" for _ in batch),)
+            txn.execute(sql, [from_id] + list(batch))
+            changed.update(room_id for room_id, in txn)
+        return changed
+
     def get_rooms_that_changed(self, room_ids, from_key):
         """Given a list of rooms and a token, return rooms where there may have
         been changes.
@@ -663,30 +714,47 @@ class StreamWorkerStore(EventsWorkerStore, SQLBaseStore):
             if len(rows) == limit:
                 upper_bound = rows[-1][0]
 
-            return upper_bound, [row[1] for row in rows]
+            return upper_bound, rows
 
-        upper_bound, event_ids = yield self.runInteraction(
+        upper_bound, rows = yield self.runInteraction(
             "get_all_new_events_stream", get_all_new_events_stream_txn,
         )
 
-        events = yield self._get_events(event_ids)
+        events = yield self._get_events([row[1] for row in rows])
+
+        stream_orderings = {event_id: ordering for ordering, event_id in rows}
+        for event in events:
+            event.internal_metadata.stream_ordering = stream_orderings[event.event_id]
 
         defer.returnValue((upper_bound, events))
 
     def get_federation_out_pos(self, typ):
+        """Get how far a federation sender has got through a stream
+
+        Args:
+            typ (str): the type of position, e.g. "events"
+
+        Returns:
+            Deferred[int|None]: the stream position, or None if the position
+            hasn't been stored yet (e.g. for a new federation sender shard).
+        """
         return self._simple_select_one_onecol(
             table="federation_stream_position",
             retcol="stream_id",
             keyvalues={"type": typ},
+            allow_none=True,
             desc="get_federation_out_pos"
         )
 
     def update_federation_out_pos(self, typ, stream_id):
-        return self._simple_update_one(
+        # Each type of position only has a single writer, so we don't need to
+        # lock the table.
+        return self._simple_upsert(
             table="federation_stream_position",
             keyvalues={"type": typ},
-            updatevalues={"stream_id": stream_id},
+            values={"stream_id": stream_id},
             desc="update_federation_out_pos",
+            lock=False,
         )
 
     def has_room_changed_since(self, room_id, stream_id):
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 New Vector Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+import six
+
+from synapse.metrics.background_process_metrics import run_as_background_process
+
+from ._base import SQLBaseStore
+
+logger = logging.getLogger(__name__)
+
+# py2 sqlite has buffer hardcoded as only binary type, so we must use it,
+# despite being deprecated and removed in favor of memoryview
+if six.PY2:
+    db_binary_type = six.moves.builtins.buffer
+else:
+    db_binary_type = memoryview
+
+# How long we keep initial sync snapshots around for after they were last
+# updated. Older snapshots would need a large incremental sync to bring them
+# up to date, so aren't worth keeping.
+INITIAL_SYNC_SNAPSHOT_MAX_AGE_MS = 24 * 60 * 60 * 1000
+
+
+class SyncSnapshotWorkerStore(SQLBaseStore):
+    def get_initial_sync_snapshot(self, user_id, device_id, filter_key):
+        """Get the stored initial sync snapshot for a device and filter, if any
+
+        Args:
+            user_id (str)
+            device_id (str)
+            filter_key (str): a hash of the filter used for the sync
+
+        Returns:
+            Deferred[dict|None]: a dict with keys `stream_token`, `snapshot`
+            (the compressed response, as bytes) and `updated_ts`, or None if
+            there is no snapshot.
+        """
+        def _get_initial_sync_snapshot_txn(txn):
+            row = self._simple_select_one_txn(
+                txn,
+                table="initial_sync_snapshots",
+                keyvalues={
+                    "user_id": user_id,
+                    "device_id": device_id,
+                    "filter_key": filter_key,
+                },
+                retcols=("stream_token", "snapshot", "updated_ts"),
+                allow_none=True,
+            )
+            if row:
+                row["snapshot"] = bytes(row["snapshot"])
+            return row
+
+        return self.runInteraction(
+            "get_initial_sync_snapshot", _get_initial_sync_snapshot_txn,
+        )
+
+    def store_initial_sync_snapshot(self, user_id, device_id, filter_key,
+                                    stream_token, snapshot):
+        """Store the initial sync snapshot for a device and filter, replacing
+        any existing one.
+
+        Args:
+            user_id (str)
+            device_id (str)
+            filter_key (str): a hash of the filter used for the sync
+            stream_token (str): the next_batch token of the snapshot
+            snapshot (bytes): the compressed response
+
+        Returns:
+            Deferred
+        """
+        return self._simple_upsert(
+            table="initial_sync_snapshots",
+            keyvalues={
+                "user_id": user_id,
+                "device_id": device_id,
+                "filter_key": filter_key,
+            },
+            values={
+                "stream_token": stream_token,
+                "snapshot": db_binary_type(snapshot),
+                "updated_ts": self._clock.time_msec(),
+            },
+            desc="store_initial_sync_snapshot",
+            lock=False,
+        )
+
+
+class SyncSnapshotStore(SyncSnapshotWorkerStore):
+    def __init__(self, db_conn, hs):
+        super(SyncSnapshotStore, self).__init__(db_conn, hs)
+
+        hs.get_clock().looping_call(
+            self._delete_old_initial_sync_snapshots, 60 * 60 * 1000,
+        )
+
+    def _delete_old_initial_sync_snapshots(self):
+        def _delete_old_initial_sync_snapshots_txn(txn):
+            txn.execute(
+                "DELETE FROM initial_sync_snapshots WHERE updated_ts < ?",
+                (self._clock.time_msec() - INITIAL_SYNC_SNAPSHOT_MAX_AGE_MS,),
+            )
+
+        return run_as_background_process(
+            "delete_old_initial_sync_snapshots",
+            self.runInteraction,
+            "delete_old_initial_sync_snapshots",
+            _delete_old_initial_sync_snapshots_txn,
+        )
@@ -17,8 +17,9 @@ import logging
 from collections import namedtuple
 
 import six
+from six import iteritems
 
-from canonicaljson import encode_canonical_json
+from canonicaljson import encode_canonical_json, json
 
 from twisted.internet import defer
 
@@ -135,6 +136,88 @@ class TransactionStore(SQLBaseStore):
             desc="set_received_txn_response",
         )
 
+    def queue_inbound_pdus(self, instance_name, origin, received_ts, pdus):
+        """Persist PDUs from an incoming transaction which are to be processed
+        after we respond to the transaction.
+
+        Args:
+            instance_name (str): the name of the process which will process
+                the PDUs
+            origin (str): the server which sent the transaction
+            received_ts (int): when we received the transaction
+            pdus (list[tuple[str, str, dict]]): (room_id, event_id, pdu_json)
+                for each PDU, in the order they appeared in the transaction
+
+        Returns:
+            Deferred
+        """
+        return self._simple_insert_many(
+            table="federation_inbound_pdus",
+            values=[
+                {
+                    "instance_name": instance_name,
+                    "origin": origin,
+                    "room_id": room_id,
+                    "event_id": event_id,
+                    "received_ts": received_ts,
+                    "ordering": ordering,
+                    "pdu_json": json.dumps(pdu_json),
+                }
+                for ordering, (room_id, event_id, pdu_json) in enumerate(pdus)
+            ],
+            desc="queue_inbound_pdus",
+        )
+
+    @defer.inlineCallbacks
+    def get_queued_inbound_pdus(self, instance_name):
+        """Get the PDUs which were queued by queue_inbound_pdus for the given
+        process and have not yet been removed.
+
+        Args:
+            instance_name (str): the name of the process which queued the PDUs
+
+        Returns:
+            Deferred[list[dict]]: the origin, room_id, event_id, received_ts
+                and pdu_json of each PDU, in the order they were received
+        """
+        def _get_queued_inbound_pdus_txn(txn):
+            txn.execute(
+                "SELECT origin, room_id, event_id, received_ts, pdu_json"
+                " FROM federation_inbound_pdus"
+                " WHERE instance_name = ?"
+                " ORDER BY received_ts, ordering",
+                (instance_name,),
+            )
+            return self.cursor_to_dict(txn)
+
+        rows = yield self.runInteraction(
+            "get_queued_inbound_pdus", _get_queued_inbound_pdus_txn,
+        )
+        for row in rows:
+            row["pdu_json"] = db_to_json(row["pdu_json"])
+        defer.returnValue(rows)
+
+    def remove_queued_inbound_pdu(self, instance_name, origin, event_id):
+        """Remove a PDU queued by queue_inbound_pdus once it has been processed
+
+        Args:
+            instance_name (str): the name of the process which queued the PDU
+            origin (str)
+            event_id (str)
+
+        Returns:
+            Deferred
+        """
+        return self._simple_delete(
+            table="federation_inbound_pdus",
+            keyvalues={
+                "instance_name": instance_name,
+                "origin": origin,
+                "event_id": event_id,
+            },
+            desc="remove_queued_inbound_pdu",
+        )
+
     def prep_send_transaction(self, transaction_id, destination,
                               origin_server_ts):
         """Persists an outgoing transaction and calculates the values for the
@@ -265,6 +348,150 @@ class TransactionStore(SQLBaseStore):
                 },
             )
 
+    def store_destination_rooms_entries(self, entries):
+        """Record that we want to send some of our events to some
+        destinations, so that we can catch the destinations up if they miss
+        them.
+
+        Args:
+            entries (Iterable[tuple[str, str, int]]): the destination, room ID
+                and stream ordering of each event we want to send.
+
+        Returns:
+            Deferred
+        """
+        # we only need to keep the latest event for each destination and room
+        latest = {}
+        for destination, room_id, stream_ordering in entries:
+            key = (destination, room_id)
+            latest[key] = max(latest.get(key, stream_ordering), stream_ordering)
+
+        def _store_destination_rooms_entries_txn(txn):
+            # there is a unique index on (destination, room_id), and each
+            # destination is only handled by a single federation sender, so
+            # we can replace the existing rows without locking the table.
+            txn.executemany(
+                "DELETE FROM destination_rooms"
+                " WHERE destination = ? AND room_id = ?",
+                list(latest),
+            )
+            self._simple_insert_many_txn(
+                txn,
+                table="destination_rooms",
+                values=[
+                    {
+                        "destination": destination,
+                        "room_id": room_id,
+                        "stream_ordering": stream_ordering,
+                    }
+                    for (destination, room_id), stream_ordering in iteritems(latest)
+                ],
+            )
+
+        return self.runInteraction(
+            "store_destination_rooms_entries",
+            _store_destination_rooms_entries_txn,
+        )
+
+    def get_destination_last_successful_stream_ordering(self, destination):
+        """Get the stream ordering of the latest of our events which we have
+        successfully sent to a destination.
+
+        Args:
+            destination (str)
+
+        Returns:
+            Deferred[int|None]: None if we have never successfully sent an
+                event to the destination.
+        """
+        return self._simple_select_one_onecol(
+            table="destinations",
+            keyvalues={"destination": destination},
+            retcol="last_successful_stream_ordering",
+            allow_none=True,
+            desc="get_destination_last_successful_stream_ordering",
+        )
+
+    def set_destination_last_successful_stream_ordering(self, destination,
+                                                        stream_ordering):
+        """Set the stream ordering of the latest of our events which we have
+        successfully sent to a destination.
+
+        Args:
+            destination (str)
+            stream_ordering (int)
+
+        Returns:
+            Deferred
+        """
+        return self._simple_upsert(
+            table="destinations",
+            keyvalues={"destination": destination},
+            values={"last_successful_stream_ordering": stream_ordering},
+            insertion_values={"retry_last_ts": 0, "retry_interval": 0},
+            desc="set_destination_last_successful_stream_ordering",
+            lock=False,
+        )
+
+    def get_catch_up_room_events(self, destination, last_successful_stream_ordering,
+                                 limit=50):
+        """Get the latest of our events in each room which a destination has
+        missed events in.
+
+        Args:
+            destination (str)
+            last_successful_stream_ordering (int): the stream ordering of the
+                latest event the destination has received from us
+            limit (int): the most events to return
+
+        Returns:
+            Deferred[list[tuple[str, int]]]: the event ID and stream ordering
+                of each event, in stream order.
+        """
+        def _get_catch_up_room_events_txn(txn):
+            sql = (
+                "SELECT e.event_id, d.stream_ordering FROM destination_rooms AS d"
+                " INNER JOIN events AS e ON e.stream_ordering = d.stream_ordering"
+                " WHERE d.destination = ? AND d.stream_ordering > ?"
+                " ORDER BY d.stream_ordering ASC"
+                " LIMIT ?"
+            )
+            txn.execute(sql, (destination, last_successful_stream_ordering, limit))
+            return txn.fetchall()
+
+        return self.runInteraction(
+            "get_catch_up_room_events", _get_catch_up_room_events_txn,
+        )
+
+    def get_catch_up_outstanding_destinations(self, after_destination, limit=25):
+        """Get destinations which have missed some of our events since we last
+        successfully sent them one, in name order.
+
+        Args:
+            after_destination (str|None): only return destinations which sort
+                after this one
+            limit (int): the most destinations to return
+
+        Returns:
+            Deferred[list[str]]
+        """
+        def _get_catch_up_outstanding_destinations_txn(txn):
+            sql = (
+                "SELECT DISTINCT d.destination FROM destinations AS d"
+                " INNER JOIN destination_rooms AS r ON r.destination = d.destination"
+                " WHERE r.stream_ordering > d.last_successful_stream_ordering"
+                " AND d.destination > ?"
+                " ORDER BY d.destination ASC"
+                " LIMIT ?"
+            )
+            txn.execute(sql, (after_destination or "", limit))
+            return [row[0] for row in txn]
+
+        return self.runInteraction(
+            "get_catch_up_outstanding_destinations",
+            _get_catch_up_outstanding_destinations_txn,
+        )
+
     def get_destinations_needing_retry(self):
         """Get all destinations which are due a retry for sending a transaction.
 
@@ -31,13 +31,22 @@ class ResponseCache(object):
     used rather than trying to compute a new response.
     """
 
-    def __init__(self, hs, name, timeout_ms=0):
+    def __init__(self, hs, name, timeout_ms=0, log_level=logging.INFO):
+        """
+        Args:
+            hs (synapse.server.HomeServer)
+            name (str): the name of the cache, for metrics and logging
+            timeout_ms (int): how long to keep completed results for
+            log_level (int): the level to log cache hits and misses at. Caches
+                which are used many times per request should use DEBUG.
+        """
         self.pending_result_cache = {}  # Requests that haven't finished yet.
 
         self.clock = hs.get_clock()
         self.timeout_sec = timeout_ms / 1000.
 
         self._name = name
+        self._log_level = log_level
         self._metrics = register_cache(
             "response_cache", name, self
         )
@@ -118,6 +127,7 @@ class ResponseCache(object):
 
         Otherwise, makes a call to *callback(*args, **kwargs)*, which should
         follow the synapse logcontext rules, and adds the result to the cache.
+        The callback may return either a Deferred or its result directly.
 
         Example usage:
 
@@ -147,14 +157,26 @@ class ResponseCache(object):
         """
         result = self.get(key)
         if not result:
-            logger.info("[%s]: no cached result for [%s], calculating new one",
-                        self._name, key)
+            logger.log(
+                self._log_level,
+                "[%s]: no cached result for [%s], calculating new one",
+                self._name, key,
+            )
             d = run_in_background(callback, *args, **kwargs)
+            if not isinstance(d, defer.Deferred):
+                # the callback returned its result synchronously
+                d = defer.succeed(d)
             result = self.set(key, d)
         elif not isinstance(result, defer.Deferred) or result.called:
-            logger.info("[%s]: using completed cached result for [%s]",
-                        self._name, key)
+            logger.log(
+                self._log_level,
+                "[%s]: using completed cached result for [%s]",
+                self._name, key,
+            )
         else:
-            logger.info("[%s]: using incomplete cached result for [%s]",
-                        self._name, key)
+            logger.log(
+                self._log_level,
+                "[%s]: using incomplete cached result for [%s]",
+                self._name, key,
+            )
         return make_deferred_yieldable(result)
@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 New Vector Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import logging
+
+from prometheus_client import Counter
+
+from twisted.internet import defer
+
+from synapse.metrics import LaterGauge
+from synapse.util.logcontext import PreserveLoggingContext, make_deferred_yieldable
+from synapse.util.retryutils import NotRetryingDestination, is_destination_failure
+
+logger = logging.getLogger(__name__)
+
+circuit_opened_counter = Counter(
+    "synapse_util_destination_health_circuit_opened",
+    "Number of times we stopped sending requests to a destination because "
+    "too many requests to it failed",
+)
+
+fast_failed_requests_counter = Counter(
+    "synapse_util_destination_health_fast_failed_requests",
+    "Number of requests which failed without being sent, because their "
+    "destination was failing",
+)
+
+queued_requests_counter = Counter(
+    "synapse_util_destination_health_queued_requests",
+    "Number of requests which had to wait because their destination was at "
+    "its concurrency limit",
+)
+
+# The number of concurrent requests we allow to a destination we haven't sent
+# anything to yet.
+INITIAL_CONCURRENCY = 10
+
+# The fraction of its concurrency limit a destination keeps when it is slow or
+# a request to it fails.
+CONCURRENCY_DECREASE_FACTOR = 0.5
+
+# How often, in milliseconds, we will decrease a destination's concurrency
+# limit. Requests which were sent at the same time tend to fail at the same
+# time, and should only count once.
+CONCURRENCY_DECREASE_INTERVAL_MS = 1000
+
+# How long, in milliseconds, we stop sending requests to a destination for the
+# first time its circuit opens, and the most we will wait after repeated
+# failures.
+MIN_OPEN_INTERVAL_MS = 10 * 1000
+MAX_OPEN_INTERVAL_MS = 5 * 60 * 1000
+
+# How heavily we weight each new latency sample in the average latency.
+LATENCY_SMOOTHING = 0.2
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+class DestinationHealthTracker(object):
+    def __init__(self, clock, max_concurrency, latency_target_ms,
+                 failure_threshold):
+        """Tracks how well the servers we send federation requests to are
+        responding.
+
+        Each destination gets a concurrency limit, which is adjusted based on
+        how long its requests take: it grows by roughly one each time a full
+        window's worth of requests succeed within `latency_target_ms`, and is
+        halved when a request is slower than that or fails.
+
+        Each destination also gets a circuit breaker: once
+        `failure_threshold` requests in a row fail, we fail any requests to it
+        straight away for a while, and then let a single request through to
+        see if it has recovered.
+
+        Args:
+            clock (Clock)
+            max_concurrency (int): The most concurrent requests to allow to a
+                single destination.
+            latency_target_ms (int): Requests which take longer than this, in
+                milliseconds, reduce the destination's concurrency limit.
+            failure_threshold (int): The number of consecutive failed requests
+                after which we stop sending requests to a destination. 0 to
+                never stop.
+        """
+        self.clock = clock
+
+        self.max_concurrency = max_concurrency
+        self.latency_target_ms = latency_target_ms
+        self.failure_threshold = failure_threshold
+
+        self._destinations = {}
+
+        LaterGauge(
+            "synapse_util_destination_health_open_circuits",
+            "Number of destinations we are not sending requests to",
+            [],
+            lambda: sum(
+                1 for health in self._destinations.values()
+                if health.circuit_state != CIRCUIT_CLOSED
+            ),
+        )
+
+    def check_available(self, destination, ignore_backoff=False):
+        """Checks whether we are currently sending requests to a destination.
+
+        Args:
+            destination (str)
+            ignore_backoff (bool): true if the request will be sent even if
+                the destination's circuit is open.
+
+        Raises:
+            NotRetryingDestination if the destination's circuit is open, and
+                we are not ignoring backoff.
+        """
+        health = self._destinations.get(destination)
+        if health is not None:
+            health.check_available(ignore_backoff)
+
+    def request(self, destination, ignore_backoff=False, backoff_on_404=False):
+        """Limits the concurrent requests to a destination, and records how
+        the request went.
+
+        Example usage:
+
+            with health_tracker.request(destination) as wait_deferred:
+                yield wait_deferred
+                response = yield do_request()
+
+        Exceptions raised in the context, other than CodeMessageExceptions
+        which don't indicate a problem with the destination, count as failed
+        requests.
+
+        Args:
+            destination (str)
+            ignore_backoff (bool): true to send the request even if the
+                destination's circuit is open.
+            backoff_on_404 (bool): true to count a 404 response as a failure.
+
+        Returns:
+            context manager, whose value is a Deferred which resolves once the
+            request may be sent.
+
+        Raises:
+            NotRetryingDestination if the destination's circuit is open, and
+                we are not ignoring backoff.
+        """
+        health = self._destinations.get(destination)
+        if health is None:
+            health = self._destinations[destination] = _DestinationHealth(
+                destination, self,
+            )
+
+        return health.request(ignore_backoff, backoff_on_404)
+
+    def get_health(self, destination):
+        """Get a summary of how a destination is responding.
+
+        Args:
+            destination (str)
+
+        Returns:
+            dict|None: the destination's health, or None if we haven't sent
+                any requests to it.
+        """
+        health = self._destinations.get(destination)
+        if health is None:
+            return None
+        return health.get_summary()
+
+    def get_all_health(self):
+        """Get a summary of how each destination we have sent requests to is
+        responding.
+
+        Returns:
+            list[dict]
+        """
+        return [
+            health.get_summary()
+            for _, health in sorted(self._destinations.items())
+        ]
+
+
+class _DestinationHealth(object):
+    def __init__(self, destination, tracker):
+        self.destination = destination
+        self.tracker = tracker
+        self.clock = tracker.clock
+
+        self.concurrency_limit = float(
+            min(INITIAL_CONCURRENCY, tracker.max_concurrency)
+        )
+        self.last_decrease_ts = 0
+
+        # request_id objects for requests which are in progress
+        self.current_requests = set()
+
+        # map from request_id object to (Deferred, ignore_backoff) for
+        # requests which are waiting for a slot
+        self.waiting_requests = collections.OrderedDict()
+
+        self.average_latency_ms = None
+
+        self.circuit_state = CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self.opened_ts = 0
+        self.open_interval_ms = 0
+        # the request_id of the request we let through to check whether the
+        # destination has recovered, while the circuit is half open
+        self.probe_request_id = None
+
+        self.total_successes = 0
+        self.total_failures = 0
+
+    def check_available(self, ignore_backoff=False):
+        if self.circuit_state == CIRCUIT_CLOSED or ignore_backoff:
+            return
+
+        if self.circuit_state == CIRCUIT_OPEN:
+            now = self.clock.time_msec()
+            if now >= self.opened_ts + self.open_interval_ms:
+                self.circuit_state = CIRCUIT_HALF_OPEN
+
+        if (
+            self.circuit_state == CIRCUIT_HALF_OPEN and
+            self.probe_request_id is None
+        ):
+            return
+
+        fast_failed_requests_counter.inc()
+        raise NotRetryingDestination(
+            retry_last_ts=self.opened_ts,
+            retry_interval=self.open_interval_ms,
+            destination=self.destination,
+        )
+
+    def request(self, ignore_backoff, backoff_on_404):
+        self.check_available(ignore_backoff)
+        return _DestinationRequest(self, ignore_backoff, backoff_on_404)
+
+    def _wait_for_slot(self, request_id, ignore_backoff, start_ts):
+        def on_start(r):
+            self.current_requests.add(request_id)
+            start_ts.append(self.clock.time_msec())
+            return r
+
+        if (
+            len(self.current_requests) < int(self.concurrency_limit) or
+            request_id is self.probe_request_id
+        ):
+            on_start(None)
+            return defer.succeed(None)
+
+        queued_requests_counter.inc()
+        logger.debug(
+            "[%s] Queueing request: %i requests in progress, limit %i",
+            self.destination, len(self.current_requests),
+            self.concurrency_limit,
+        )
+
+        d = defer.Deferred()
+        self.waiting_requests[request_id] = (d, ignore_backoff)
+        d.addCallback(on_start)
+        return make_deferred_yieldable(d)
+
+    def _on_exit(self, request_id):
+        self.current_requests.discard(request_id)
+        self.waiting_requests.pop(request_id, None)
+        if request_id is self.probe_request_id:
+            self.probe_request_id = None
+
+        self._start_waiting_requests()
+
+    def _start_waiting_requests(self):
+        while (
+            self.waiting_requests and
+            len(self.current_requests) < int(self.concurrency_limit)
+        ):
+            request_id, (d, _) = self.waiting_requests.popitem(last=False)
+            # reserve the slot now, so that we don't start too many requests
+            self.current_requests.add(request_id)
+            with PreserveLoggingContext():
+                d.callback(None)
+
+    def _on_success(self, latency_ms):
+        self.total_successes += 1
+        self.consecutive_failures = 0
+
+        if self.average_latency_ms is None:
+            self.average_latency_ms = float(latency_ms)
+        else:
+            self.average_latency_ms += LATENCY_SMOOTHING * (
+                latency_ms - self.average_latency_ms
+            )
+
+        if self.circuit_state != CIRCUIT_CLOSED:
+            logger.info(
+                "[%s] Request succeeded; sending requests again",
+                self.destination,
+            )
+            self.circuit_state = CIRCUIT_CLOSED
+            self.open_interval_ms = 0
+
+        if latency_ms > self.tracker.latency_target_ms:
+            self._decrease_concurrency()
+        else:
+            self.concurrency_limit = min(
+                self.concurrency_limit + 1 / self.concurrency_limit,
+                float(self.tracker.max_concurrency),
+            )
+            self._start_waiting_requests()
+
+    def _on_failure(self):
+        self.total_failures += 1
+        self.consecutive_failures += 1
+
+        self._decrease_concurrency()
+
+        threshold = self.tracker.failure_threshold
+        if self.circuit_state == CIRCUIT_HALF_OPEN or (
+            self.circuit_state == CIRCUIT_CLOSED and
+            threshold and self.consecutive_failures >= threshold
+        ):
+            self._open_circuit()
+
+    def _decrease_concurrency(self):
+        now = self.clock.time_msec()
+        if now - self.last_decrease_ts < CONCURRENCY_DECREASE_INTERVAL_MS:
+            return
+
+        self.last_decrease_ts = now
+        self.concurrency_limit = max(
+            self.concurrency_limit * CONCURRENCY_DECREASE_FACTOR, 1.0,
+        )
+
+    def _open_circuit(self):
+        if self.open_interval_ms:
+            self.open_interval_ms = min(
+                self.open_interval_ms * 2, MAX_OPEN_INTERVAL_MS,
+            )
+        else:
+            self.open_interval_ms = MIN_OPEN_INTERVAL_MS
+
+        logger.info(
+            "[%s] %i requests failed in a row; not sending requests for %ims",
+            self.destination, self.consecutive_failures, self.open_interval_ms,
+        )
+
+        circuit_opened_counter.inc()
+        self.circuit_state = CIRCUIT_OPEN
+        self.opened_ts = self.clock.time_msec()
+
+        # fail any requests which are waiting to be sent, unless they are
+        # ignoring backoff
+        for request_id, (d, ignore_backoff) in list(self.waiting_requests.items()):
+            if ignore_backoff:
+                continue
+
+            del self.waiting_requests[request_id]
+            fast_failed_requests_counter.inc()
+            with PreserveLoggingContext():
+                d.errback(NotRetryingDestination(
+                    retry_last_ts=self.opened_ts,
+                    retry_interval=self.open_interval_ms,
+                    destination=self.destination,
+                ))
+
+    def get_summary(self):
+        if self.circuit_state == CIRCUIT_OPEN:
+            retry_ts = self.opened_ts + self.open_interval_ms
+        else:
+            retry_ts = None
+
+        return {
+            "destination": self.destination,
+            "circuit_state": self.circuit_state,
+            "retry_ts": retry_ts,
+            "consecutive_failures": self.consecutive_failures,
+            "concurrency_limit": int(self.concurrency_limit),
+            "requests_in_progress": len(self.current_requests),
+            "requests_waiting": len(self.waiting_requests),
+            "average_latency_ms": (
+                int(self.average_latency_ms)
+                if self.average_latency_ms is not None else None
+            ),
+            "total_successes": self.total_successes,
+            "total_failures": self.total_failures,
+        }
+
+
+class _DestinationRequest(object):
+    """The context manager returned by DestinationHealthTracker.request"""
+
+    def __init__(self, health, ignore_backoff, backoff_on_404):
+        self.health = health
+        self.ignore_backoff = ignore_backoff
+        self.backoff_on_404 = backoff_on_404
+
+        self.request_id = object()
+        if health.circuit_state == CIRCUIT_HALF_OPEN and not ignore_backoff:
+            health.probe_request_id = self.request_id
+
+        # the time at which the request got a slot, which we use to measure
+        # its latency
+        self.start_ts = []
+
+    def __enter__(self):
+        return self.health._wait_for_slot(
+            self.request_id, self.ignore_backoff, self.start_ts,
+        )
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        health = self.health
+
+        # requests which failed before they got a slot (for instance because
+        # the circuit opened while they were waiting) weren't sent. We record
+        # how the others went before releasing their slot, so that the next
+        # request sees the updated concurrency limit.
+        if self.start_ts:
+            if is_destination_failure(exc_type, exc_val, self.backoff_on_404):
+                health._on_failure()
+            else:
+                health._on_success(health.clock.time_msec() - self.start_ts[0])
+
+        health._on_exit(self.request_id)
@@ -104,6 +104,53 @@ def get_retry_limiter(destination, clock, store, ignore_backoff=False,
     )
 
 
+def is_destination_failure(exc_type, exc_val, backoff_on_404=False):
+    """Whether an exception raised while making a request to a destination
+    means that the destination is having problems.
+
+    Args:
+        exc_type (type|None): the type of the exception, or None if the
+            request succeeded.
+        exc_val (Exception|None): the exception
+        backoff_on_404 (bool): whether a 404 response counts as a failure
+
+    Returns:
+        bool
+    """
+    if exc_type is None:
+        return False
+
+    if not issubclass(exc_type, Exception):
+        # avoid treating exceptions which don't derive from Exception as
+        # failures; this is mostly so as not to catch defer._DefGen.
+        return False
+
+    if issubclass(exc_type, NotRetryingDestination):
+        # we didn't send the request, because the destination was already
+        # failing.
+        return False
+
+    if issubclass(exc_type, CodeMessageException):
+        # Some error codes are perfectly fine for some APIs, whereas other
+        # APIs may expect to never received e.g. a 404. It's important to
+        # handle 404 as some remote servers will return a 404 when the HS
+        # has been decommissioned.
+        # If we get a 401, then we should probably back off since they
+        # won't accept our requests for at least a while.
+        # 429 is us being aggresively rate limited, so lets rate limit
+        # ourselves.
+        if exc_val.code == 404 and backoff_on_404:
+            return True
+        elif exc_val.code in (401, 429):
+            return True
+        elif exc_val.code < 500:
+            return False
+        else:
+            return True
+
+    return True
+
+
 class RetryDestinationLimiter(object):
     def __init__(self, destination, clock, store, retry_interval,
                  min_retry_interval=10 * 60 * 1000,
@@ -143,32 +190,7 @@ class RetryDestinationLimiter(object):
         pass
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        valid_err_code = False
-        if exc_type is None:
-            valid_err_code = True
-        elif not issubclass(exc_type, Exception):
-            # avoid treating exceptions which don't derive from Exception as
-            # failures; this is mostly so as not to catch defer._DefGen.
-            valid_err_code = True
-        elif issubclass(exc_type, CodeMessageException):
-            # Some error codes are perfectly fine for some APIs, whereas other
-            # APIs may expect to never received e.g. a 404. It's important to
-            # handle 404 as some remote servers will return a 404 when the HS
-            # has been decommissioned.
-            # If we get a 401, then we should probably back off since they
-            # won't accept our requests for at least a while.
-            # 429 is us being aggresively rate limited, so lets rate limit
-            # ourselves.
-            if exc_val.code == 404 and self.backoff_on_404:
-                valid_err_code = False
-            elif exc_val.code in (401, 429):
-                valid_err_code = False
-            elif exc_val.code < 500:
-                valid_err_code = True
-            else:
-                valid_err_code = False
-
-        if valid_err_code:
+        if not is_destination_failure(exc_type, exc_val, self.backoff_on_404):
             # We connected successfully.
             if not self.retry_interval:
                 return
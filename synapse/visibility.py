@@ -311,15 +311,24 @@ def filter_events_for_server(store, server_name, events):
     # Ok, so we're dealing with events that have non-trivial visibility
     # rules, so we need to also get the memberships of the room.
 
+    # Only the memberships of the server's own users matter, so rather than
+    # loading the membership of every user in the room, we look up which of
+    # the server's users have ever been in the room.
+    member_ids = set()
+    for room_id in set(e.room_id for e in events):
+        room_member_ids = yield store.get_room_member_ids_for_host(
+            room_id, server_name,
+        )
+        member_ids.update(room_member_ids)
+
     # first, for each event we're wanting to return, get the event_ids
     # of the history vis and membership state at those events.
     event_to_state_ids = yield store.get_state_ids_for_events(
         frozenset(e.event_id for e in events),
         state_filter=StateFilter.from_types(
-            types=(
-                (EventTypes.RoomHistoryVisibility, ""),
-                (EventTypes.Member, None),
-            ),
+            types=[(EventTypes.RoomHistoryVisibility, "")] + [
+                (EventTypes.Member, user_id) for user_id in member_ids
+            ],
         )
     )
 
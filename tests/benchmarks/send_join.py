@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 New Vector Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures how long it takes to check the signatures and hashes on the events
+in a /send_join response, as we do when joining a room over federation.
+
+We build a room state made of membership events from a number of servers,
+each signed by its server, and time FederationClient checking them all.
+
+The homeserver runs against the in-memory reactor, whose threadpool runs
+functions on the reactor thread, so the times include the signature checks
+which would normally be run on the threadpool.
+"""
+
+import argparse
+import hashlib
+import logging
+import resource
+import sys
+import time
+
+import signedjson.key
+from unpaddedbase64 import encode_base64
+
+from synapse.crypto.event_signing import compute_content_hash, compute_event_signature
+from synapse.events import FrozenEvent
+
+from tests.server import get_clock, setup_test_homeserver
+
+
+def _get_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+class SendJoinBenchmark(object):
+    """Checks the signatures on the state of a room, as if it had been
+    returned by /send_join.
+
+    Args:
+        events (int): the number of state events in the room.
+        servers (int): the number of servers the events are from.
+    """
+
+    def __init__(self, events, servers):
+        self.events = events
+        self.servers = servers
+
+        self._cleanups = []
+        self.reactor, self.clock = get_clock()
+        self.hs = setup_test_homeserver(
+            self._cleanups.append, reactor=self.reactor, clock=self.clock,
+        )
+        self.store = self.hs.get_datastore()
+        self.federation_client = self.hs.get_federation_client()
+
+        self.room_id = "!bench:remote0"
+        self.server_names = ["remote%d" % (i,) for i in range(servers)]
+        self.signing_keys = {
+            server_name: signedjson.key.generate_signing_key(1)
+            for server_name in self.server_names
+        }
+        self.pdus = []
+
+    def cleanup(self):
+        for cleanup in self._cleanups:
+            cleanup()
+
+    def pump(self, by=0.0):
+        self.reactor.pump([by] * 100)
+
+    def get_success(self, d):
+        while not d.called:
+            self.pump()
+        return d.result
+
+    def _make_pdu(self, index):
+        server_name = self.server_names[index % self.servers]
+        user_id = "@user%d:%s" % (index, server_name)
+
+        event = FrozenEvent({
+            "event_id": "$%d:%s" % (index, server_name),
+            "room_id": self.room_id,
+            "type": "m.room.member",
+            "state_key": user_id,
+            "sender": user_id,
+            "origin": server_name,
+            "origin_server_ts": 1000,
+            "depth": index + 1,
+            "prev_events": [],
+            "auth_events": [],
+            "content": {"membership": "join", "displayname": "User %d" % (index,)},
+        })
+
+        name, digest = compute_content_hash(event, hash_algorithm=hashlib.sha256)
+        pdu_json = event.get_pdu_json()
+        pdu_json["hashes"] = {name: encode_base64(digest)}
+        pdu_json["signatures"] = compute_event_signature(
+            FrozenEvent(pdu_json), server_name, self.signing_keys[server_name],
+        )
+        return FrozenEvent(pdu_json)
+
+    def setup(self):
+        """Store the servers' keys, and build the events"""
+        for server_name, signing_key in self.signing_keys.items():
+            self.get_success(self.store.store_server_verify_key(
+                server_name, "", self.clock.time_msec() + 3600 * 1000,
+                signedjson.key.get_verify_key(signing_key),
+            ))
+
+        self.pdus = [self._make_pdu(i) for i in range(self.events)]
+
+    def run(self):
+        """Run the benchmark.
+
+        Returns:
+            dict: the results
+        """
+        self.setup()
+
+        start = time.time()
+        cpu_start = _get_cpu_time()
+
+        valid_pdus = self.get_success(
+            self.federation_client._check_sigs_and_hash_and_fetch(
+                self.server_names[0], self.pdus, outlier=True,
+            )
+        )
+
+        cpu_time = _get_cpu_time() - cpu_start
+        elapsed = time.time() - start
+
+        if len(valid_pdus) != self.events:
+            raise Exception(
+                "Only %d of %d events were valid" % (len(valid_pdus), self.events)
+            )
+
+        return {
+            "events": self.events,
+            "elapsed": elapsed,
+            "events_per_second": self.events / elapsed,
+            "cpu_per_event": cpu_time / self.events,
+        }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Benchmark checking the events in a /send_join response",
+    )
+    parser.add_argument(
+        "--events", type=int, default=10000,
+        help="number of state events in the room (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--servers", type=int, default=100,
+        help="number of servers the events are from (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+
+    # the homeserver's warnings about running outside of logcontexts would
+    # otherwise drown out the results
+    logging.basicConfig(level=logging.ERROR)
+
+    benchmark = SendJoinBenchmark(events=args.events, servers=args.servers)
+    try:
+        results = benchmark.run()
+    finally:
+        benchmark.cleanup()
+
+    print("events:              %d" % (results["events"],))
+    print("elapsed:             %.2fs" % (results["elapsed"],))
+    print("events per second:   %.0f" % (results["events_per_second"],))
+    print("CPU per event:       %.3fms" % (results["cpu_per_event"] * 1000,))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 New Vector Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures how the Notifier.wait_for_events and SyncHandler long-polling path
+scales with the number of concurrent long-pollers and rooms.
+
+A number of users long-poll /sync across a set of rooms while messages are
+sent into the rooms at a given rate, and we report how long it takes each
+long-poller to be woken up with each message, the CPU time used per message,
+and the memory used per waiting long-poller.
+
+Time is measured against the real clock, while the homeserver runs against the
+in-memory reactor, so the message rate is in terms of the reactor's simulated
+time.
+"""
+
+import argparse
+import gc
+import logging
+import resource
+import sys
+import time
+
+from twisted.internet import defer
+
+from synapse.api.filtering import DEFAULT_FILTER_COLLECTION
+from synapse.handlers.sync import SyncConfig
+from synapse.types import UserID, create_requester
+
+from tests.server import get_clock, setup_test_homeserver
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def _get_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _percentile(values, percentile):
+    values = sorted(values)
+    return values[int(round((len(values) - 1) * percentile / 100.0))]
+
+
+class SyncWaitBenchmark(object):
+    """Simulates users long-polling /sync across rooms which are receiving
+    messages.
+
+    Args:
+        users (int): the number of users long-polling.
+        rooms (int): the number of rooms.
+        rooms_per_user (int): the number of rooms each user is joined to.
+        messages (int): the number of messages to send.
+        rate (float): the number of messages to send per (simulated) second.
+        timeout_ms (int): the long-polling timeout.
+    """
+
+    def __init__(self, users, rooms, rooms_per_user, messages, rate,
+                 timeout_ms=30000):
+        self.users = users
+        self.rooms = rooms
+        self.rooms_per_user = min(rooms_per_user, rooms)
+        self.messages = messages
+        self.rate = rate
+        self.timeout_ms = timeout_ms
+
+        self._cleanups = []
+        self.reactor, self.clock = get_clock()
+        self.hs = setup_test_homeserver(
+            self._cleanups.append, reactor=self.reactor, clock=self.clock,
+        )
+        self.store = self.hs.get_datastore()
+        self.sync_handler = self.hs.get_sync_handler()
+
+        self.user_ids = [
+            "@bench%d:%s" % (i, self.hs.hostname) for i in range(users)
+        ]
+        self.room_ids = []
+        # the users joined to each room, indexed like room_ids
+        self.room_members = []
+
+        # the real time each message was sent at, by event ID
+        self._sent_at = {}
+        self._requests = 0
+
+        self.wake_latencies = []
+        self.wakeups = 0
+
+    def cleanup(self):
+        for cleanup in self._cleanups:
+            cleanup()
+
+    def pump(self, by=0.0):
+        self.reactor.pump([by] * 100)
+
+    def get_success(self, d):
+        self.pump()
+        return d.result
+
+    @defer.inlineCallbacks
+    def setup(self):
+        """Register the users, and create and join the rooms"""
+        for user_id in self.user_ids:
+            yield self.store.register(
+                user_id=user_id,
+                create_profile_with_localpart=UserID.from_string(user_id).localpart,
+            )
+
+        room_creation_handler = self.hs.get_room_creation_handler()
+        room_member_handler = self.hs.get_room_member_handler()
+
+        for i in range(self.rooms):
+            creator = self.user_ids[i % self.users]
+            info = yield room_creation_handler.create_room(
+                create_requester(creator), {"preset": "public_chat"},
+                ratelimit=False,
+            )
+            self.room_ids.append(info["room_id"])
+            self.room_members.append([creator])
+
+        for i, user_id in enumerate(self.user_ids):
+            for j in range(self.rooms_per_user):
+                room_index = (i + j) % self.rooms
+                if user_id in self.room_members[room_index]:
+                    continue
+                yield room_member_handler.update_membership(
+                    create_requester(user_id),
+                    UserID.from_string(user_id),
+                    self.room_ids[room_index],
+                    "join",
+                    ratelimit=False,
+                )
+                self.room_members[room_index].append(user_id)
+
+    def _sync(self, user_id, since_token, timeout):
+        self._requests += 1
+        sync_config = SyncConfig(
+            user=UserID.from_string(user_id),
+            filter_collection=DEFAULT_FILTER_COLLECTION,
+            is_guest=False,
+            request_key=(user_id, self._requests),
+            device_id="BENCH",
+        )
+        return self.sync_handler.wait_for_sync_for_user(
+            sync_config, since_token=since_token, timeout=timeout,
+        )
+
+    def _long_poll(self, user_id, since_token):
+        d = self._sync(user_id, since_token, self.timeout_ms)
+        d.addCallback(self._on_sync_result, user_id)
+
+    def _on_sync_result(self, result, user_id):
+        now = time.time()
+        woken = False
+        for room in result.joined:
+            for event in room.timeline.events:
+                sent_at = self._sent_at.get(event.event_id)
+                if sent_at is not None:
+                    self.wake_latencies.append(now - sent_at)
+                    woken = True
+        if woken:
+            self.wakeups += 1
+
+        self._long_poll(user_id, result.next_batch)
+
+    def _send_message(self, index):
+        room_index = index % self.rooms
+        members = self.room_members[room_index]
+        sender = members[index % len(members)]
+
+        d = self.hs.get_event_creation_handler().create_and_send_nonmember_event(
+            create_requester(sender),
+            {
+                "type": "m.room.message",
+                "room_id": self.room_ids[room_index],
+                "sender": sender,
+                "content": {"msgtype": "m.text", "body": "message %d" % index},
+            },
+            ratelimit=False,
+        )
+        sent_at = time.time()
+
+        def _sent(event):
+            self._sent_at[event.event_id] = sent_at
+        d.addCallback(_sent)
+
+    def run(self):
+        """Run the benchmark.
+
+        Returns:
+            dict: the results
+        """
+        self.get_success(self.setup())
+
+        # everyone does an initial sync, to get a token to long-poll from
+        tokens = {
+            user_id: self.get_success(self._sync(user_id, None, 0)).next_batch
+            for user_id in self.user_ids
+        }
+
+        # now start everyone long-polling, and measure how much memory it takes
+        gc.collect()
+        if tracemalloc:
+            tracemalloc.start()
+            memory_before = tracemalloc.get_traced_memory()[0]
+
+        for user_id in self.user_ids:
+            self._long_poll(user_id, tokens[user_id])
+        self.pump()
+
+        memory_per_listener = None
+        if tracemalloc:
+            gc.collect()
+            memory_after = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            memory_per_listener = (memory_after - memory_before) / len(self.user_ids)
+
+        # and send the messages, waiting until the last one has been delivered
+        # to everyone in its room.
+        interval = 1.0 / self.rate
+        for i in range(self.messages):
+            self.clock.call_later(i * interval, self._send_message, i)
+
+        expected = sum(
+            len(self.room_members[i % self.rooms]) for i in range(self.messages)
+        )
+
+        start = time.time()
+        cpu_start = _get_cpu_time()
+        steps = 0
+        while len(self.wake_latencies) < expected or len(self._sent_at) < self.messages:
+            self.reactor.advance(interval / 10)
+            steps += 1
+            if steps > 100 * self.messages + 1000:
+                raise Exception(
+                    "Only %d of %d expected wakeups happened" % (
+                        len(self.wake_latencies), expected,
+                    )
+                )
+        cpu_time = _get_cpu_time() - cpu_start
+        elapsed = time.time() - start
+
+        return {
+            "messages": self.messages,
+            "wakeups": self.wakeups,
+            "elapsed": elapsed,
+            "wake_latency_p50": _percentile(self.wake_latencies, 50),
+            "wake_latency_p99": _percentile(self.wake_latencies, 99),
+            "cpu_per_event": cpu_time / self.messages,
+            "memory_per_listener": memory_per_listener,
+        }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Benchmark long-polling /sync against a stream of messages",
+    )
+    parser.add_argument(
+        "--users", type=int, default=100,
+        help="number of users long-polling (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--rooms", type=int, default=10,
+        help="number of rooms (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--rooms-per-user", type=int, default=3,
+        help="number of rooms each user is joined to (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--messages", type=int, default=200,
+        help="number of messages to send (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--rate", type=float, default=20,
+        help="messages sent per simulated second (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+
+    # the homeserver's warnings about running outside of logcontexts would
+    # otherwise drown out the results
+    logging.basicConfig(level=logging.ERROR)
+
+    benchmark = SyncWaitBenchmark(
+        users=args.users,
+        rooms=args.rooms,
+        rooms_per_user=args.rooms_per_user,
+        messages=args.messages,
+        rate=args.rate,
+    )
+    try:
+        results = benchmark.run()
+    finally:
+        benchmark.cleanup()
+
+    print("messages:            %d" % (results["messages"],))
+    print("wakeups:             %d" % (results["wakeups"],))
+    print("elapsed:             %.2fs" % (results["elapsed"],))
+    print("wake latency p50:    %.2fms" % (results["wake_latency_p50"] * 1000,))
+    print("wake latency p99:    %.2fms" % (results["wake_latency_p99"] * 1000,))
+    print("CPU per event:       %.2fms" % (results["cpu_per_event"] * 1000,))
+    if results["memory_per_listener"] is not None:
+        print("memory per listener: %.0f bytes" % (results["memory_per_listener"],))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 New Vector Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from tests import unittest
+from tests.benchmarks.send_join import SendJoinBenchmark
+
+
+class SendJoinBenchmarkTestCase(unittest.TestCase):
+    """Checks that the benchmark still runs, rather than how fast it is"""
+
+    def test_send_join_benchmark(self):
+        benchmark = SendJoinBenchmark(events=30, servers=3)
+        self.addCleanup(benchmark.cleanup)
+
+        results = benchmark.run()
+
+        self.assertEqual(results["events"], 30)
+        self.assertGreater(results["events_per_second"], 0)
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 New Vector Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from tests import unittest
+from tests.benchmarks.sync_wait import SyncWaitBenchmark
+
+
+class SyncWaitBenchmarkTestCase(unittest.TestCase):
+    """Checks that the benchmark still runs, rather than how fast it is"""
+
+    def test_sync_wait_benchmark(self):
+        benchmark = SyncWaitBenchmark(
+            users=4, rooms=2, rooms_per_user=1, messages=4, rate=10,
+        )
+        self.addCleanup(benchmark.cleanup)
+
+        results = benchmark.run()
+
+        # each message wakes up the two users in its room
+        self.assertEqual(len(benchmark.wake_latencies), 8)
+        self.assertEqual(results["messages"], 4)
+        self.assertGreater(results["wake_latency_p99"], 0)
+        self.assertGreaterEqual(
+            results["wake_latency_p99"], results["wake_latency_p50"],
+        )
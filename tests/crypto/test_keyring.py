@@ -217,3 +217,40 @@ class KeyringTestCase(unittest.TestCase):
             yield defer
 
             self.assertIs(LoggingContext.current_context(), context_one)
+
+    @defer.inlineCallbacks
+    def test_verify_json_objects_for_server_in_batches(self):
+        kr = keyring.Keyring(self.hs)
+
+        key1 = signedjson.key.generate_signing_key(1)
+        yield self.hs.datastore.store_server_verify_key(
+            "server9", "", time.time() * 1000, signedjson.key.get_verify_key(key1)
+        )
+
+        # enough objects to be checked in several batches on the threadpool
+        json_objects = []
+        for i in range(keyring.MAX_VERIFY_BATCH_SIZE + 20):
+            json_object = {"i": i}
+            signedjson.sign.sign_json(json_object, "server9", key1)
+            json_objects.append(json_object)
+
+        # spoil a couple of the signatures
+        json_objects[3]["i"] = -1
+        json_objects[-3]["i"] = -1
+
+        with LoggingContext("one") as context_one:
+            context_one.request = "one"
+
+            deferreds = kr.verify_json_objects_for_server(
+                [("server9", json_object) for json_object in json_objects]
+            )
+            results = yield logcontext.make_deferred_yieldable(defer.DeferredList(
+                deferreds, consumeErrors=True,
+            ))
+            self.assertIs(LoggingContext.current_context(), context_one)
+
+        failed = [i for i, (success, _) in enumerate(results) if not success]
+        self.assertEqual(failed, [3, len(json_objects) - 3])
+        for i in failed:
+            self.assertIsInstance(results[i][1].value, SynapseError)
+            self.assertEqual(results[i][1].value.code, 401)
@@ -12,10 +12,21 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import json
 import logging
+import zlib
+from io import BytesIO
 
+from mock import Mock
+
+from twisted.internet import defer
+
+from synapse.api.errors import SynapseError
 from synapse.events import FrozenEvent
 from synapse.federation.federation_server import server_matches_acl_event
+from synapse.federation.transport.server import _decompress_request_content
+from synapse.rest.client.v1 import admin, login, room
+from synapse.util.logcontext import LoggingContext
 
 from tests import unittest
 
@@ -52,3 +63,312 @@ def _create_acl_event(content):
             "content": content,
         }
     )
+
+
+class AsyncTransactionsTestCase(unittest.HomeserverTestCase):
+    servlets = [
+        admin.register_servlets,
+        room.register_servlets,
+        login.register_servlets,
+    ]
+
+    def make_homeserver(self, reactor, clock):
+        config = self.default_config()
+        config.federation_async_transactions = True
+        config.federation_incoming_pdu_queue_limit = 3
+
+        return self.setup_test_homeserver(config=config)
+
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+        self.federation_server = hs.get_federation_server()
+
+        user_id = self.register_user("user", "pass")
+        tok = self.login("user", "pass")
+        self.room_ids = [
+            self.helper.create_room_as(user_id, tok=tok) for _ in range(2)
+        ]
+
+        # event_id -> Deferred which completes the handling of the PDU
+        self.handling = {}
+
+        def _handle_received_pdu(origin, pdu):
+            d = defer.Deferred()
+            self.handling[pdu.event_id] = d
+            return d
+
+        self.federation_server._handle_received_pdu = _handle_received_pdu
+
+    def _transaction(self, txn_id, pdus):
+        return {
+            "transaction_id": txn_id,
+            "origin": "other",
+            "destination": "test",
+            "origin_server_ts": self.clock.time_msec(),
+            "pdus": [
+                {
+                    "event_id": event_id,
+                    "room_id": room_id,
+                    "type": "m.room.message",
+                    "depth": 10,
+                }
+                for event_id, room_id in pdus
+            ],
+        }
+
+    def _send_transaction(self, txn_id, pdus):
+        return self.get_success(self.federation_server.on_incoming_transaction(
+            "other", self._transaction(txn_id, pdus),
+        ))
+
+    def _get_queued_event_ids(self):
+        rows = self.get_success(self.store.get_queued_inbound_pdus("master"))
+        return [row["event_id"] for row in rows]
+
+    def test_pdus_are_processed_after_responding(self):
+        code, response = self._send_transaction("1", [
+            ("$a:other", self.room_ids[0]),
+            ("$b:other", self.room_ids[0]),
+            ("$c:other", self.room_ids[1]),
+        ])
+        self.assertEqual(code, 200)
+        self.assertEqual(
+            response["pdus"], {"$a:other": {}, "$b:other": {}, "$c:other": {}},
+        )
+        self.assertEqual(
+            self._get_queued_event_ids(), ["$a:other", "$b:other", "$c:other"],
+        )
+
+        # rooms are processed in parallel, but PDUs in the same room are
+        # processed in order
+        self.assertEqual(set(self.handling), {"$a:other", "$c:other"})
+
+        self.handling["$a:other"].callback(None)
+        self.pump()
+        self.assertEqual(set(self.handling), {"$a:other", "$b:other", "$c:other"})
+        self.assertEqual(self._get_queued_event_ids(), ["$b:other", "$c:other"])
+
+        self.handling["$b:other"].callback(None)
+        self.handling["$c:other"].callback(None)
+        self.pump()
+        self.assertEqual(self._get_queued_event_ids(), [])
+
+    def test_full_queue_processes_transaction_before_responding(self):
+        self._send_transaction("1", [
+            ("$a:other", self.room_ids[0]),
+            ("$b:other", self.room_ids[0]),
+        ])
+
+        # there is only room in the queue for one more PDU
+        with LoggingContext("test") as context:
+            context.request = "test"
+            d = self.federation_server.on_incoming_transaction(
+                "other", self._transaction("2", [
+                    ("$c:other", self.room_ids[1]),
+                    ("$d:other", self.room_ids[1]),
+                ]),
+            )
+        self.pump()
+        self.assertFalse(d.called)
+        self.assertNotIn("$c:other", self._get_queued_event_ids())
+
+        self.handling["$c:other"].callback(None)
+        self.pump()
+        self.handling["$d:other"].callback(None)
+        self.pump()
+        code, response = self.successResultOf(d)
+        self.assertEqual(response["pdus"], {"$c:other": {}, "$d:other": {}})
+
+    def test_full_queue_keeps_pdus_for_queued_rooms_in_order(self):
+        self._send_transaction("1", [
+            ("$a:other", self.room_ids[0]),
+            ("$b:other", self.room_ids[0]),
+        ])
+        self.reactor.advance(1)
+
+        # The queue is full, but the first room already has PDUs in the queue,
+        # so its new PDU must be queued behind them rather than processed
+        # straight away. The second room's PDU is processed before responding.
+        with LoggingContext("test") as context:
+            context.request = "test"
+            d = self.federation_server.on_incoming_transaction(
+                "other", self._transaction("2", [
+                    ("$c:other", self.room_ids[0]),
+                    ("$d:other", self.room_ids[1]),
+                    ("$e:other", self.room_ids[1]),
+                ]),
+            )
+        self.pump()
+        self.assertFalse(d.called)
+        self.assertEqual(set(self.handling), {"$a:other", "$d:other"})
+        self.assertEqual(
+            self._get_queued_event_ids(), ["$a:other", "$b:other", "$c:other"],
+        )
+
+        self.handling["$d:other"].callback(None)
+        self.pump()
+        self.handling["$e:other"].callback(None)
+        self.pump()
+        code, response = self.successResultOf(d)
+        self.assertEqual(
+            response["pdus"], {"$c:other": {}, "$d:other": {}, "$e:other": {}},
+        )
+
+        for event_id in ("$a:other", "$b:other", "$c:other"):
+            self.handling[event_id].callback(None)
+            self.pump()
+        self.assertEqual(self._get_queued_event_ids(), [])
+
+    def test_recover_queued_pdus(self):
+        def queue_pdus(instance_name, event_ids):
+            self.get_success(self.store.queue_inbound_pdus(
+                instance_name, "other", self.clock.time_msec(), [
+                    (self.room_ids[0], event_id, {
+                        "event_id": event_id,
+                        "room_id": self.room_ids[0],
+                        "type": "m.room.message",
+                        "depth": 10,
+                    })
+                    for event_id in event_ids
+                ],
+            ))
+
+        queue_pdus("master", ("$a:other", "$b:other"))
+        # PDUs queued by another process are left for it to recover
+        queue_pdus("federation_reader", ("$a:other", "$c:other"))
+
+        queue = self.federation_server._incoming_pdu_queue
+        self.get_success(queue.recover_queued_pdus())
+        self.assertEqual(set(self.handling), {"$a:other"})
+
+        self.handling["$a:other"].callback(None)
+        self.pump()
+        self.handling["$b:other"].callback(None)
+        self.pump()
+        self.assertEqual(set(self.handling), {"$a:other", "$b:other"})
+        self.assertEqual(self._get_queued_event_ids(), [])
+
+        rows = self.get_success(
+            self.store.get_queued_inbound_pdus("federation_reader"),
+        )
+        self.assertEqual(
+            [row["event_id"] for row in rows], ["$a:other", "$c:other"],
+        )
+
+
+class StateResponsesTestCase(unittest.HomeserverTestCase):
+    servlets = [
+        admin.register_servlets,
+        room.register_servlets,
+        login.register_servlets,
+    ]
+
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+        self.federation_server = hs.get_federation_server()
+        self.handler = hs.get_handlers().federation_handler
+
+        self.user_id = self.register_user("user", "pass")
+        self.tok = self.login("user", "pass")
+        self.room_id = self.helper.create_room_as(self.user_id, tok=self.tok)
+
+        self.computed = []
+        get_state_for_pdu = self.handler.get_state_for_pdu
+
+        def _get_state_for_pdu(room_id, event_id):
+            self.computed.append(event_id)
+            return get_state_for_pdu(room_id, event_id)
+
+        self.handler.get_state_for_pdu = _get_state_for_pdu
+
+    def _send_message(self):
+        return self.helper.send(self.room_id, tok=self.tok)["event_id"]
+
+    def _get_state(self, event_id):
+        code, resp = self.get_success(
+            self.federation_server.on_context_state_request(
+                "test", self.room_id, event_id,
+            )
+        )
+        self.assertEqual(code, 200)
+        return json.loads(resp.json_bytes.decode("utf-8"))
+
+    def test_state_responses_are_stored(self):
+        event_ids = [self._send_message() for _ in range(2)]
+
+        resp = self._get_state(event_ids[0])
+        self.assertIn(
+            ("m.room.member", self.user_id),
+            [(pdu["type"], pdu["state_key"]) for pdu in resp["pdus"]],
+        )
+        self.assertEqual(self.computed, [event_ids[0]])
+
+        # the second event has the same state group, so gets the same response
+        # without it being computed again
+        self.assertEqual(self._get_state(event_ids[1]), resp)
+        self.assertEqual(self.computed, [event_ids[0]])
+
+        code, state_ids = self.get_success(
+            self.federation_server.on_state_ids_request(
+                "test", self.room_id, event_ids[1],
+            )
+        )
+        self.assertEqual(code, 200)
+        state_ids = json.loads(state_ids.json_bytes.decode("utf-8"))
+        self.assertEqual(
+            set(state_ids["pdu_ids"]), set(pdu["event_id"] for pdu in resp["pdus"]),
+        )
+
+    def test_redaction_invalidates_responses(self):
+        event_id = self._send_message()
+        self._get_state(event_id)
+        self.assertEqual(self.computed, [event_id])
+
+        request, channel = self.make_request(
+            "PUT",
+            "/rooms/%s/redact/%s/1" % (self.room_id, event_id),
+            b"{}",
+            access_token=self.tok,
+        )
+        self.render(request)
+        self.assertEqual(channel.code, 200)
+
+        # let the in-memory cache expire
+        self.reactor.advance(60)
+
+        self._get_state(event_id)
+        self.assertEqual(self.computed, [event_id, event_id])
+
+
+class DecompressRequestContentTestCase(unittest.TestCase):
+    def _make_request(self, content, encoding=None):
+        request = Mock()
+        request.content = BytesIO(content)
+        request.requestHeaders.getRawHeaders.return_value = (
+            [encoding] if encoding else None
+        )
+        return request
+
+    def test_gzipped_content(self):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        body = compressor.compress(b'{"a": "b"}') + compressor.flush()
+
+        request = self._make_request(body, b"gzip")
+        _decompress_request_content(request)
+        self.assertEqual(request.content.read(), b'{"a": "b"}')
+
+    def test_uncompressed_content(self):
+        request = self._make_request(b'{"a": "b"}')
+        _decompress_request_content(request)
+        self.assertEqual(request.content.read(), b'{"a": "b"}')
+
+    def test_bad_content(self):
+        request = self._make_request(b'{"a": "b"}', b"gzip")
+        with self.assertRaises(SynapseError) as cm:
+            _decompress_request_content(request)
+        self.assertEqual(cm.exception.code, 400)
+
+        request = self._make_request(b'{"a": "b"}', b"br")
+        with self.assertRaises(SynapseError) as cm:
+            _decompress_request_content(request)
+        self.assertEqual(cm.exception.code, 415)
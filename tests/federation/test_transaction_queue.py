@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 New Vector Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from mock import Mock
+
+from twisted.internet import defer
+
+from synapse.events import FrozenEvent
+from synapse.federation.transaction_queue import (
+    TransactionQueue,
+    _merge_receipt_edus,
+    get_destination_shard,
+)
+from synapse.federation.units import Edu
+from synapse.rest.client.v1 import admin, login, room
+
+from tests import unittest
+
+DESTINATIONS = ["remote%d.example.com" % (i,) for i in range(20)]
+
+
+class ShardedTransactionQueueTestCase(unittest.HomeserverTestCase):
+
+    def make_homeserver(self, reactor, clock):
+        config = self.default_config()
+        config.worker_app = "synapse.app.federation_sender"
+        config.federation_sender_instances = 2
+        config.federation_sender_instance = 1
+        return self.setup_test_homeserver(config=config)
+
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+        self.queue = TransactionQueue(hs)
+        self.queue._attempt_new_transaction = Mock()
+
+    def test_get_destination_shard(self):
+        shards = [get_destination_shard(d, 2) for d in DESTINATIONS]
+
+        # the destinations should be spread across the shards, and always be
+        # assigned to the same ones.
+        self.assertEqual(set(shards), {0, 1})
+        self.assertEqual(shards, [get_destination_shard(d, 2) for d in DESTINATIONS])
+
+    def test_only_sends_to_our_destinations(self):
+        for destination in DESTINATIONS:
+            self.queue.send_edu(destination, "m.test", {})
+
+        ours = [d for d in DESTINATIONS if get_destination_shard(d, 2) == 1]
+        self.assertEqual(sorted(self.queue.pending_edus_by_dest), sorted(ours))
+
+    def test_events_position(self):
+        self.get_success(self.store.update_federation_out_pos("events", 10))
+
+        # a new shard carries on from where the unsharded sender got to...
+        position = self.get_success(self.queue._get_events_position())
+        self.assertEqual(position, 10)
+
+        # ... and then keeps track of its own position
+        self.get_success(self.store.update_federation_out_pos("events_1", 20))
+        position = self.get_success(self.queue._get_events_position())
+        self.assertEqual(position, 20)
+        position = self.get_success(self.store.get_federation_out_pos("events"))
+        self.assertEqual(position, 10)
+
+
+class EduCoalescingTestCase(unittest.HomeserverTestCase):
+
+    def make_homeserver(self, reactor, clock):
+        config = self.default_config()
+        config.federation_edu_coalescing_window_ms = 50
+        return self.setup_test_homeserver(config=config)
+
+    def prepare(self, reactor, clock, hs):
+        self.queue = TransactionQueue(hs)
+        self.queue._attempt_new_transaction = Mock()
+
+    def test_edus_are_coalesced(self):
+        for i in range(3):
+            self.queue.send_edu("remote", "m.test", {"i": i})
+        self.queue.send_edu("other", "m.test", {})
+
+        # nothing is sent until the window has passed...
+        self.assertFalse(self.queue._attempt_new_transaction.called)
+
+        self.reactor.advance(0.05)
+
+        # ... and then there is only one transaction per destination
+        self.assertEqual(
+            sorted(c[0][0] for c in self.queue._attempt_new_transaction.call_args_list),
+            ["other", "remote"],
+        )
+        self.assertEqual(len(self.queue.pending_edus_by_dest["remote"]), 3)
+
+        # after which a new EDU starts a new window
+        self.queue.send_edu("remote", "m.test", {})
+        self.reactor.advance(0.05)
+        self.assertEqual(self.queue._attempt_new_transaction.call_count, 3)
+
+    def test_keyed_edus_are_superseded(self):
+        self.queue.send_edu("remote", "m.test", {"i": 1}, key="k")
+        self.queue.send_edu("remote", "m.test", {"i": 2}, key="k")
+
+        edus = self.queue.pending_edus_keyed_by_dest["remote"]
+        self.assertEqual(list(edus.values())[0].content, {"i": 2})
+
+
+class MergeReceiptEdusTestCase(unittest.TestCase):
+
+    def test_merge_receipt_edus(self):
+        def receipt(room_id, user_id, event_id):
+            return Edu(
+                origin="test", destination="remote", edu_type="m.receipt",
+                content={room_id: {"m.read": {user_id: {"event_ids": [event_id]}}}},
+            )
+
+        typing = Edu(
+            origin="test", destination="remote", edu_type="m.typing",
+            content={},
+        )
+
+        edus = _merge_receipt_edus([
+            typing,
+            receipt("!a:test", "@u1:test", "$1"),
+            receipt("!a:test", "@u2:test", "$2"),
+            typing,
+            receipt("!b:test", "@u1:test", "$3"),
+        ])
+
+        self.assertEqual([e.edu_type for e in edus], [
+            "m.typing", "m.receipt", "m.typing",
+        ])
+        self.assertEqual(edus[1].content, {
+            "!a:test": {"m.read": {
+                "@u1:test": {"event_ids": ["$1"]},
+                "@u2:test": {"event_ids": ["$2"]},
+            }},
+            "!b:test": {"m.read": {"@u1:test": {"event_ids": ["$3"]}}},
+        })
+
+    def test_no_receipts(self):
+        typing = Edu(
+            origin="test", destination="remote", edu_type="m.typing",
+            content={},
+        )
+        self.assertEqual(_merge_receipt_edus([typing]), [typing])
+
+
+class RoomHostsTestCase(unittest.HomeserverTestCase):
+
+    servlets = [
+        admin.register_servlets,
+        login.register_servlets,
+        room.register_servlets,
+    ]
+
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+        self.queue = TransactionQueue(hs)
+
+        self.user_id = self.register_user("user", "pass")
+        self.tok = self.login("user", "pass")
+
+    def test_hosts_follow_room_events(self):
+        from_token = self.store.get_room_max_stream_ordering()
+        room_id = self.helper.create_room_as(self.user_id, tok=self.tok)
+        self.helper.send(room_id, body="test", tok=self.tok)
+
+        _, events = self.get_success(self.store.get_all_new_events_stream(
+            from_token, self.store.get_room_max_stream_ordering(), limit=100,
+        ))
+
+        resolve_state_groups_for_events = Mock(
+            side_effect=self.queue.state.resolve_state_groups_for_events,
+        )
+        self.queue.state.resolve_state_groups_for_events = (
+            resolve_state_groups_for_events
+        )
+
+        hosts = [
+            self.get_success(self.queue._get_hosts_before_event(event))
+            for event in events
+        ]
+
+        # the create event has no prev events, so the current state of the
+        # room is used for it, but after that each event follows on from the
+        # previous one, so we only needed to look up the state once more.
+        self.assertEqual(hosts[1], frozenset())
+        self.assertEqual(hosts[-1], frozenset(["test"]))
+        self.assertEqual(resolve_state_groups_for_events.call_count, 2)
+
+        # a remote server joins and leaves again
+        join = _create_member_event(room_id, "$join:remote", events[-1], "join")
+        self.assertEqual(
+            self.get_success(self.queue._get_hosts_before_event(join)),
+            frozenset(["test"]),
+        )
+        leave = _create_member_event(room_id, "$leave:remote", join, "leave")
+        self.assertEqual(
+            self.get_success(self.queue._get_hosts_before_event(leave)),
+            frozenset(["test", "remote"]),
+        )
+        self.assertEqual(
+            self.queue._get_cached_room_hosts(
+                _create_member_event(room_id, "$next:remote", leave, "leave"),
+            ),
+            {"test": set([self.user_id])},
+        )
+        self.assertEqual(resolve_state_groups_for_events.call_count, 2)
+
+        # the cache keeps track of the number of joined users, to size it by
+        self.assertEqual(self.queue._latest_room_hosts.get(room_id).user_count, 1)
+        self.assertEqual(self.queue._latest_room_hosts.len(), 2)
+
+
+class CatchUpTestCase(unittest.HomeserverTestCase):
+
+    servlets = [
+        admin.register_servlets,
+        login.register_servlets,
+        room.register_servlets,
+    ]
+
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+        self.queue = TransactionQueue(hs)
+
+        self.sent_pdus = []
+
+        def _send_new_transaction(destination, pending_pdus, pending_edus):
+            self.sent_pdus.extend(pdu.event_id for pdu, _ in pending_pdus)
+            return defer.succeed(True)
+
+        self.queue._send_new_transaction = _send_new_transaction
+
+        self.user_id = self.register_user("user", "pass")
+        self.tok = self.login("user", "pass")
+
+    def _send_events(self, room_id, count):
+        """Send some messages, and record that they should be sent to "remote".
+
+        Returns:
+            list[str]: the event IDs
+        """
+        event_ids = []
+        for _ in range(count):
+            event_id = self.helper.send(room_id, body="test", tok=self.tok)["event_id"]
+            self.get_success(self.store.store_destination_rooms_entries([
+                ("remote", room_id, self.store.get_room_max_stream_ordering()),
+            ]))
+            event_ids.append(event_id)
+        return event_ids
+
+    def test_catch_up_sends_latest_event_per_room(self):
+        room_1 = self.helper.create_room_as(self.user_id, tok=self.tok)
+        room_2 = self.helper.create_room_as(self.user_id, tok=self.tok)
+
+        self._send_events(room_1, 1)
+        self.get_success(self.store.set_destination_last_successful_stream_ordering(
+            "remote", self.store.get_room_max_stream_ordering(),
+        ))
+
+        # "remote" misses some events in each room
+        events_1 = self._send_events(room_1, 3)
+        events_2 = self._send_events(room_2, 2)
+
+        outstanding = self.get_success(
+            self.store.get_catch_up_outstanding_destinations(None)
+        )
+        self.assertEqual(outstanding, ["remote"])
+
+        caught_up = self.get_success(self.queue._catch_up_destination("remote"))
+        self.assertTrue(caught_up)
+
+        # only the latest event in each room is sent
+        self.assertEqual(self.sent_pdus, [events_1[-1], events_2[-1]])
+
+        last_successful = self.get_success(
+            self.store.get_destination_last_successful_stream_ordering("remote")
+        )
+        self.assertEqual(last_successful, self.store.get_room_max_stream_ordering())
+        outstanding = self.get_success(
+            self.store.get_catch_up_outstanding_destinations(None)
+        )
+        self.assertEqual(outstanding, [])
+
+    def test_pdus_are_not_queued_while_catching_up(self):
+        room_id = self.helper.create_room_as(self.user_id, tok=self.tok)
+        self.queue._attempt_new_transaction = Mock()
+
+        # we've never successfully sent "remote" anything, so can't catch it
+        # up, and have to keep queuing its PDUs in memory
+        self.queue._start_catching_up("remote")
+        self.assertNotIn("remote", self.queue._catching_up_destinations)
+
+        self.get_success(self.queue._set_last_successful_stream_ordering(
+            "remote", self.store.get_room_max_stream_ordering(),
+        ))
+        self.queue._start_catching_up("remote")
+
+        event_id = self.helper.send(room_id, body="test", tok=self.tok)["event_id"]
+        _, events = self.get_success(self.store.get_all_new_events_stream(
+            self.store.get_room_max_stream_ordering() - 1,
+            self.store.get_room_max_stream_ordering(),
+            limit=1,
+        ))
+        self.assertEqual(events[0].event_id, event_id)
+
+        self.get_success(self.queue._send_pdus([(events[0], {"remote"})]))
+        self.assertNotIn("remote", self.queue.pending_pdus_by_dest)
+        self.assertTrue(self.queue._catching_up_destinations["remote"])
+
+        # the event is sent when the destination catches up
+        caught_up = self.get_success(self.queue._catch_up_destination("remote"))
+        self.assertTrue(caught_up)
+        self.assertEqual(self.sent_pdus, [event_id])
+        self.assertIn("remote", self.queue._caught_up_destinations)
+
+    def test_pdus_are_queued_in_stream_order(self):
+        room_1 = self.helper.create_room_as(self.user_id, tok=self.tok)
+        room_2 = self.helper.create_room_as(self.user_id, tok=self.tok)
+        self.queue._attempt_new_transaction = Mock()
+
+        from_token = self.store.get_room_max_stream_ordering()
+        self.helper.send(room_1, body="test", tok=self.tok)
+        self.helper.send(room_2, body="test", tok=self.tok)
+        self.helper.send(room_1, body="test", tok=self.tok)
+        _, events = self.get_success(self.store.get_all_new_events_stream(
+            from_token, self.store.get_room_max_stream_ordering(), limit=100,
+        ))
+        self.assertEqual(len(events), 3)
+
+        self.get_success(self.queue._send_pdus(
+            [(event, {"remote", "other"}) for event in events],
+        ))
+
+        for destination in ("remote", "other"):
+            self.assertEqual(
+                [pdu for pdu, _ in self.queue.pending_pdus_by_dest[destination]],
+                events,
+            )
+
+            # only the latest event in each room is recorded
+            rows = self.get_success(self.store.get_catch_up_room_events(
+                destination, from_token,
+            ))
+            self.assertEqual(
+                rows,
+                [
+                    (event.event_id, event.internal_metadata.stream_ordering)
+                    for event in events[1:]
+                ],
+            )
+
+
+def _create_member_event(room_id, event_id, prev_event, membership):
+    return FrozenEvent({
+        "room_id": room_id,
+        "event_id": event_id,
+        "type": "m.room.member",
+        "state_key": "@user:remote",
+        "sender": "@user:remote",
+        "content": {"membership": membership},
+        "prev_events": [(prev_event.event_id, {})],
+    })
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 New Vector Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from mock import patch
+
+from synapse.events import FrozenEvent
+from synapse.handlers import federation
+
+from tests import unittest
+
+ROOM_ID = "!room:remote"
+CREATOR = "@creator:remote"
+
+
+class PersistAuthTreeTestCase(unittest.HomeserverTestCase):
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+        self.handler = hs.get_handlers().federation_handler
+        self._next_event = 0
+
+    def _make_event(self, event_type, state_key, sender, content, auth_events,
+                    prev_events=()):
+        self._next_event += 1
+        domain = sender.split(":", 1)[1]
+        return FrozenEvent({
+            "event_id": "$%d:%s" % (self._next_event, domain),
+            "room_id": ROOM_ID,
+            "type": event_type,
+            "state_key": state_key,
+            "sender": sender,
+            "origin": domain,
+            "origin_server_ts": 0,
+            "content": content,
+            "depth": self._next_event,
+            "prev_events": [(e.event_id, {}) for e in prev_events],
+            "auth_events": [(e.event_id, {}) for e in auth_events],
+            "prev_state": [],
+            "hashes": {},
+            "signatures": {domain: {"ed25519:1": "sig"}},
+        })
+
+    def test_persist_auth_tree_in_chunks(self):
+        create = self._make_event(
+            "m.room.create", "", CREATOR, {"creator": CREATOR}, [],
+        )
+        creator_join = self._make_event(
+            "m.room.member", CREATOR, CREATOR, {"membership": "join"},
+            [create], prev_events=[create],
+        )
+        power_levels = self._make_event(
+            "m.room.power_levels", "", CREATOR, {"users": {CREATOR: 100}},
+            [create, creator_join],
+        )
+        join_rules = self._make_event(
+            "m.room.join_rules", "", CREATOR, {"join_rule": "public"},
+            [create, creator_join, power_levels],
+        )
+        auth_chain = [create, creator_join, power_levels, join_rules]
+
+        members = [
+            self._make_event(
+                "m.room.member", user_id, user_id, {"membership": "join"},
+                [create, power_levels, join_rules],
+            )
+            for user_id in ("@user%d:remote" % (i,) for i in range(5))
+        ]
+        state = auth_chain + members
+
+        join = self._make_event(
+            "m.room.member", "@user:test", "@user:test", {"membership": "join"},
+            [create, power_levels, join_rules], prev_events=[members[-1]],
+        )
+
+        persisted = []
+        pending = []
+        persist_events_and_notify = self.handler.persist_events_and_notify
+
+        def _persist_events_and_notify(events_and_contexts):
+            persisted.append([e.event_id for e, _ in events_and_contexts])
+            pending.append(dict(self.handler._join_events_pending))
+            return persist_events_and_notify(events_and_contexts)
+
+        self.handler.persist_events_and_notify = _persist_events_and_notify
+
+        with patch.object(federation, "JOIN_PERSIST_CHUNK_SIZE", 3):
+            self.get_success(self.handler._persist_auth_tree(
+                "remote", auth_chain, state, join,
+            ))
+
+        # the auth chain and state are persisted in chunks, without
+        # duplicates, followed by the join
+        self.assertEqual(persisted, [
+            [e.event_id for e in auth_chain[:3]],
+            [auth_chain[3].event_id] + [e.event_id for e in members[:2]],
+            [e.event_id for e in members[2:]],
+            [join.event_id],
+        ])
+        # the pending events are tracked per join, as other users could be
+        # joining the room at the same time
+        self.assertEqual(pending[:3], [
+            {(ROOM_ID, join.event_id): 9},
+            {(ROOM_ID, join.event_id): 6},
+            {(ROOM_ID, join.event_id): 3},
+        ])
+        self.assertEqual(self.handler._join_events_pending, {})
+
+        # none of the events should have been rejected
+        for e in state + [join]:
+            stored = self.get_success(self.store.get_event(e.event_id))
+            self.assertEqual(stored.event_id, e.event_id)
+
+    def test_persist_auth_tree_indexes_events_given_out_of_order(self):
+        create = self._make_event(
+            "m.room.create", "", CREATOR, {"creator": CREATOR}, [],
+        )
+        creator_join = self._make_event(
+            "m.room.member", CREATOR, CREATOR, {"membership": "join"},
+            [create], prev_events=[create],
+        )
+        power_levels = self._make_event(
+            "m.room.power_levels", "", CREATOR, {"users": {CREATOR: 100}},
+            [create, creator_join],
+        )
+        join_rules = self._make_event(
+            "m.room.join_rules", "", CREATOR, {"join_rule": "public"},
+            [create, creator_join, power_levels],
+        )
+        auth_chain = [create, creator_join, power_levels, join_rules]
+
+        # each user joins, leaves and joins again, so each of their
+        # memberships depends on the previous one
+        state = []
+        for user_id in ("@user%d:remote" % (i,) for i in range(2)):
+            prev = None
+            for membership in ("join", "leave", "join"):
+                auth_events = [create, power_levels, join_rules]
+                if prev:
+                    auth_events.append(prev)
+                prev = self._make_event(
+                    "m.room.member", user_id, user_id, {"membership": membership},
+                    auth_events,
+                )
+                state.append(prev)
+
+        join = self._make_event(
+            "m.room.member", "@user:test", "@user:test", {"membership": "join"},
+            [create, power_levels, join_rules], prev_events=[state[-1]],
+        )
+
+        # give the events in reverse auth order, spread over several chunks
+        with patch.object(federation, "JOIN_PERSIST_CHUNK_SIZE", 3):
+            self.get_success(self.handler._persist_auth_tree(
+                "remote", list(reversed(auth_chain)), list(reversed(state)), join,
+            ))
+
+        event_ids = [e.event_id for e in auth_chain + state + [join]]
+        positions = self.get_success(self.store.runInteraction(
+            "get_positions", self.store._get_auth_chain_positions_txn, event_ids,
+        ))
+        self.assertEqual(set(positions), set(event_ids))
@@ -12,11 +12,14 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+from mock import Mock, patch
+
 from twisted.internet import defer
 
+import synapse.handlers.sync
 from synapse.api.errors import Codes, ResourceLimitError
 from synapse.api.filtering import DEFAULT_FILTER_COLLECTION
-from synapse.handlers.sync import SyncConfig, SyncHandler
+from synapse.handlers.sync import SyncConfig, SyncHandler, _merge_ephemeral
 from synapse.types import UserID
 
 import tests.unittest
@@ -61,11 +64,109 @@ class SyncTestCase(tests.unittest.TestCase):
             yield self.sync_handler.wait_for_sync_for_user(sync_config)
         self.assertEquals(e.exception.errcode, Codes.RESOURCE_LIMIT_EXCEEDED)
 
-    def _generate_sync_config(self, user_id):
+    @defer.inlineCallbacks
+    def test_lookups_shared_between_devices(self):
+        user_id = "@user1:server"
+
+        initial = yield self.sync_handler.wait_for_sync_for_user(
+            self._generate_sync_config(user_id),
+        )
+
+        result = yield self.store.get_updated_account_data_for_user(
+            user_id, initial.next_batch.account_data_key,
+        )
+        lookup = defer.Deferred()
+        get_updated_account_data_for_user = Mock(return_value=lookup)
+        self.store.get_updated_account_data_for_user = (
+            get_updated_account_data_for_user
+        )
+
+        # two devices syncing from the same position at the same time should
+        # share the lookup
+        syncs = [
+            self.sync_handler.wait_for_sync_for_user(
+                self._generate_sync_config(user_id, device_id),
+                since_token=initial.next_batch,
+            )
+            for device_id in ("device1", "device2")
+        ]
+        self.assertEqual(get_updated_account_data_for_user.call_count, 1)
+
+        lookup.callback(result)
+        results = yield defer.gatherResults(syncs)
+        self.assertEqual(len(results), 2)
+
+    @defer.inlineCallbacks
+    def test_slow_sync_log(self):
+        user_id = "@user1:server"
+
+        with patch.object(synapse.handlers.sync.logger, "info") as info:
+            # the slow sync log is disabled by default
+            yield self.sync_handler.wait_for_sync_for_user(
+                self._generate_sync_config(user_id, "device1"),
+            )
+            self.assertFalse(any(
+                call[0][0].startswith("Slow ") for call in info.call_args_list
+            ))
+
+            self.sync_handler._slow_sync_log_threshold_ms = 0
+            yield self.sync_handler.wait_for_sync_for_user(
+                self._generate_sync_config(user_id, "device2"),
+            )
+
+        slow_logs = [
+            call[0] for call in info.call_args_list if call[0][0].startswith("Slow ")
+        ]
+        self.assertEqual(len(slow_logs), 1)
+        self.assertEqual(slow_logs[0][1], "initial_sync")
+        self.assertIn("rooms=", slow_logs[0][-1])
+        self.assertIn("rooms_count=0", slow_logs[0][-1])
+
+    @defer.inlineCallbacks
+    def test_lazy_loaded_members_persisted(self):
+        user_id = "@user1:server"
+        sync_config = self._generate_sync_config(user_id)
+        cache_key = (user_id, "device_id")
+
+        cache = self.sync_handler.get_lazy_loaded_members_cache(cache_key)
+        self.sync_handler._set_lazy_loaded_member(
+            cache_key, cache, "@user2:server", "$event1",
+        )
+        yield self.sync_handler._persist_lazy_loaded_members_cache(sync_config)
+
+        # a new handler, as after a restart, should pick up where we left off
+        sync_handler = SyncHandler(self.hs)
+        yield sync_handler._load_lazy_loaded_members_cache(sync_config)
+        cache = sync_handler.get_lazy_loaded_members_cache(cache_key)
+        self.assertEqual(cache.get("@user2:server"), "$event1")
+
+    def _generate_sync_config(self, user_id, device_id="device_id"):
         return SyncConfig(
             user=UserID(user_id.split(":")[0][1:], user_id.split(":")[1]),
             filter_collection=DEFAULT_FILTER_COLLECTION,
             is_guest=False,
-            request_key="request_key",
-            device_id="device_id",
+            request_key=("request_key", device_id),
+            device_id=device_id,
+        )
+
+
+class MergeEphemeralTestCase(tests.unittest.TestCase):
+    def test_old_typing_dropped(self):
+        old = [
+            {"type": "m.typing", "content": {"user_ids": ["@user:server"]}},
+            {"type": "m.receipt", "content": {
+                "$event1": {"m.read": {"@user:server": {"ts": 1}}},
+            }},
+        ]
+        new = [
+            {"type": "m.receipt", "content": {
+                "$event2": {"m.read": {"@other:server": {"ts": 2}}},
+            }},
+        ]
+
+        merged = _merge_ephemeral(old, new)
+
+        self.assertEqual([e["type"] for e in merged], ["m.receipt"])
+        self.assertEqual(
+            set(merged[0]["content"]), {"$event1", "$event2"},
         )
@@ -77,6 +77,7 @@ class TypingNotificationsTestCase(unittest.TestCase):
                     "get_received_txn_response",
                     "set_received_txn_response",
                     "get_destination_retry_timings",
+                    "get_destination_last_successful_stream_ordering",
                     "get_devices_by_remote",
                     # Bits that user_directory needs
                     "get_user_directory_stream_pos",
@@ -104,6 +105,10 @@ class TypingNotificationsTestCase(unittest.TestCase):
 
         self.datastore.get_devices_by_remote.return_value = (0, [])
 
+        self.datastore.get_destination_last_successful_stream_ordering.return_value = (
+            defer.succeed(None)
+        )
+
         def get_received_txn_response(*args):
             return defer.succeed(None)
 
@@ -199,6 +204,7 @@ class TypingNotificationsTestCase(unittest.TestCase):
                 json_data_callback=ANY,
                 long_retries=True,
                 backoff_on_404=True,
+                compress=True,
             ),
             defer.succeed((200, "OK")),
         )
@@ -271,6 +277,7 @@ class TypingNotificationsTestCase(unittest.TestCase):
                 json_data_callback=ANY,
                 long_retries=True,
                 backoff_on_404=True,
+                compress=True,
             ),
             defer.succeed((200, "OK")),
         )
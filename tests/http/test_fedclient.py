@@ -13,10 +13,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import zlib
+
 from mock import Mock
 
 from twisted.internet.defer import TimeoutError
-from twisted.internet.error import ConnectingCancelledError, DNSLookupError
+from twisted.internet.error import (
+    ConnectingCancelledError,
+    ConnectionRefusedError,
+    DNSLookupError,
+)
+from twisted.python.failure import Failure
 from twisted.web.client import ResponseNeverReceived
 from twisted.web.http import HTTPChannel
 
@@ -137,6 +144,60 @@ class FederationClientTests(HomeserverTestCase):
         r = self.successResultOf(d)
         self.assertEqual(r.code, 200)
 
+    def test_successful_request_is_recorded(self):
+        """
+        Successful requests reset the destination's count of failed requests.
+        """
+        tracker = self.hs.get_destination_health_tracker()
+        with self.assertRaises(Exception):
+            with tracker.request("testserv:8008"):
+                raise Exception("failed")
+
+        d = self.cl.get_json("testserv:8008", "foo/bar", timeout=10000)
+        self.pump()
+
+        client = self.reactor.tcpClients[0][2].buildProtocol(None)
+        client.makeConnection(Mock())
+        client.dataReceived(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+            b"Content-Length: 2\r\nServer: Fake\r\n\r\n{}"
+        )
+        self.assertEqual(self.successResultOf(d), {})
+
+        health = tracker.get_health("testserv:8008")
+        self.assertEqual(health["total_successes"], 1)
+        self.assertEqual(health["consecutive_failures"], 0)
+        self.assertEqual(health["requests_in_progress"], 0)
+
+    def test_slot_released_between_retries(self):
+        """
+        Requests don't hold on to a slot while they wait to be retried.
+        """
+        tracker = self.hs.get_destination_health_tracker()
+
+        d = self.cl.get_json("testserv:8008", "foo/bar")
+        self.pump()
+        self.assertEqual(
+            tracker.get_health("testserv:8008")["requests_in_progress"], 1,
+        )
+
+        # the connection fails, so the request will be retried in a while
+        factory = self.reactor.tcpClients[0][2]
+        factory.clientConnectionFailed(None, Failure(ConnectionRefusedError()))
+        self.reactor.advance(0.3)
+
+        self.assertFalse(d.called)
+        health = tracker.get_health("testserv:8008")
+        self.assertEqual(health["requests_in_progress"], 0)
+        self.assertEqual(health["total_failures"], 1)
+
+        # and it takes a slot again when it is retried
+        self.reactor.advance(2)
+        self.assertEqual(len(self.reactor.tcpClients), 2)
+        self.assertEqual(
+            tracker.get_health("testserv:8008")["requests_in_progress"], 1,
+        )
+
     def test_client_headers_no_body(self):
         """
         If the HTTP request is connected, but gets no response before being
@@ -188,3 +249,88 @@ class FederationClientTests(HomeserverTestCase):
         request = server.requests[0]
         content = request.content.read()
         self.assertEqual(content, b'{"a":"b"}')
+
+    def test_client_reuses_connection(self):
+        """
+        Once a response has been received, the connection is kept open and
+        used for the next request to the same server.
+        """
+        for i in range(2):
+            d = self.cl.get_json("testserv:8008", "foo/bar")
+
+            self.pump()
+
+            # only one connection is ever made
+            clients = self.reactor.tcpClients
+            self.assertEqual(len(clients), 1)
+
+            if i == 0:
+                conn = Mock()
+                client = clients[0][2].buildProtocol(None)
+                client.makeConnection(conn)
+
+            client.dataReceived(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                b"Content-Length: 2\r\nServer: Fake\r\n\r\n{}"
+            )
+
+            self.pump()
+            self.assertEqual(self.successResultOf(d), {})
+
+        # the idle connection is closed once it has been idle long enough
+        self.assertFalse(conn.loseConnection.called)
+        self.reactor.advance(self.hs.config.federation_client_idle_timeout + 1)
+        self.assertTrue(conn.loseConnection.called)
+
+    def test_client_gzips_body_when_accepted(self):
+        """
+        Once a server has told us it accepts gzipped requests, request bodies
+        which may be compressed are gzipped.
+        """
+        self.cl._compress_requests = True
+        data = {"a": "b" * 1000}
+
+        conn = Mock()
+        for i in range(2):
+            conn.reset_mock()
+            d = self.cl.put_json(
+                "testserv:8008", "foo/bar", data=data, compress=True,
+            )
+
+            self.pump()
+
+            if i == 0:
+                client = self.reactor.tcpClients[0][2].buildProtocol(None)
+                client.makeConnection(conn)
+
+            # the body is written once the headers have been sent
+            self.pump(0.1)
+
+            request = b""
+            for name, args, _ in conn.method_calls:
+                if name == "write":
+                    request += args[0]
+                elif name == "writeSequence":
+                    request += b"".join(args[0])
+            headers, body = request.split(b"\r\n\r\n", 1)
+
+            if i == 0:
+                # we don't know yet that the server accepts gzip
+                self.assertNotIn(b"Content-Encoding", headers)
+                self.assertEqual(body, b'{"a":"%s"}' % (b"b" * 1000,))
+            else:
+                self.assertIn(b"Content-Encoding: gzip", headers)
+                self.assertLess(len(body), 1000)
+                self.assertEqual(
+                    zlib.decompress(body, 16 + zlib.MAX_WBITS),
+                    b'{"a":"%s"}' % (b"b" * 1000,),
+                )
+
+            client.dataReceived(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                b"Accept-Encoding: gzip\r\n"
+                b"Content-Length: 2\r\nServer: Fake\r\n\r\n{}"
+            )
+
+            self.pump()
+            self.assertEqual(self.successResultOf(d), {})
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 New Vector Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from mock import Mock
+
+from synapse.replication.tcp.resource import ReplicationStreamer
+
+from tests import unittest
+
+
+class FederationAckTestCase(unittest.HomeserverTestCase):
+
+    def make_homeserver(self, reactor, clock):
+        config = self.default_config()
+        config.send_federation = False
+        config.federation_sender_instances = 2
+        return self.setup_test_homeserver(config=config)
+
+    def prepare(self, reactor, clock, hs):
+        self.streamer = ReplicationStreamer(hs)
+        self.streamer.federation_sender = Mock()
+
+    def _connect(self, name):
+        connection = Mock()
+        connection.name = name
+        self.streamer.new_connection(connection)
+        return connection
+
+    def test_acks_forgotten_when_connection_lost(self):
+        sender_1 = self._connect("sender1")
+        self._connect("sender2")
+
+        self.streamer.federation_ack(10, "sender1")
+        self.streamer.federation_ack(20, "sender2")
+        self.streamer.federation_sender.federation_ack.assert_called_once_with(10)
+
+        # the first sender comes back under a different name, and its old
+        # position is no longer taken into account
+        self.streamer.lost_connection(sender_1)
+        self._connect("sender1-restarted")
+        self.streamer.federation_ack(30, "sender1-restarted")
+        self.streamer.federation_sender.federation_ack.assert_called_with(20)
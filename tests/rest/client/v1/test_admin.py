@@ -19,6 +19,7 @@ import json
 
 from mock import Mock
 
+from synapse.rest.client.v1 import login
 from synapse.rest.client.v1.admin import register_servlets
 
 from tests import unittest
@@ -296,3 +297,48 @@ class UserRegisterTestCase(unittest.HomeserverTestCase):
 
         self.assertEqual(400, int(channel.result["code"]), msg=channel.result["body"])
         self.assertEqual('Invalid password', channel.json_body["error"])
+
+
+class FederationDestinationHealthTestCase(unittest.HomeserverTestCase):
+
+    servlets = [register_servlets, login.register_servlets]
+
+    def prepare(self, reactor, clock, hs):
+        self.destination_health = hs.get_destination_health_tracker()
+
+        self.register_user("admin", "pass", admin=True)
+        self.admin_tok = self.login("admin", "pass")
+
+        self.register_user("user", "pass")
+        self.user_tok = self.login("user", "pass")
+
+    def _get(self, path, tok):
+        request, channel = self.make_request(
+            "GET", "/_matrix/client/r0/admin/federation/destinations" + path,
+            access_token=tok,
+        )
+        self.render(request)
+        return channel
+
+    def test_destination_health(self):
+        with self.destination_health.request("remote") as wait_deferred:
+            self.successResultOf(wait_deferred)
+
+        channel = self._get("", self.admin_tok)
+        self.assertEqual(200, channel.code, msg=channel.result["body"])
+        self.assertEqual(
+            [d["destination"] for d in channel.json_body["destinations"]],
+            ["remote"],
+        )
+
+        channel = self._get("/remote", self.admin_tok)
+        self.assertEqual(200, channel.code, msg=channel.result["body"])
+        self.assertEqual(channel.json_body["circuit_state"], "closed")
+        self.assertEqual(channel.json_body["total_successes"], 1)
+
+        channel = self._get("/unknown", self.admin_tok)
+        self.assertEqual(404, channel.code, msg=channel.result["body"])
+
+    def test_requires_admin(self):
+        channel = self._get("", self.user_tok)
+        self.assertEqual(403, channel.code, msg=channel.result["body"])
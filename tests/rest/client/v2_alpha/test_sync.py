@@ -15,6 +15,7 @@
 
 from mock import Mock
 
+from synapse.handlers.sync import initial_sync_snapshot_hits
 from synapse.rest.client.v1 import admin, login, room
 from synapse.rest.client.v2_alpha import sync
 
@@ -188,3 +189,205 @@ class SyncTypingTests(unittest.HomeserverTestCase):
             "GET", sync_url % (access_token, next_batch)
         )
         self.assertRaises(TimedOutException, self.render, request)
+
+
+class SyncJoinedRoomTestCase(unittest.HomeserverTestCase):
+
+    servlets = [
+        admin.register_servlets,
+        room.register_servlets,
+        login.register_servlets,
+        sync.register_servlets,
+    ]
+    user_id = True
+    hijack_auth = False
+
+    def sync(self, access_token, since=None):
+        url = "/sync?access_token=%s" % (access_token,)
+        if since:
+            url += "&since=%s" % (since,)
+        request, channel = self.make_request("GET", url)
+        self.render(request)
+        self.assertEqual(channel.code, 200)
+        return channel.json_body
+
+    def test_newly_joined_room_events_not_duplicated(self):
+        user_id = self.register_user("user", "pass")
+        access_token = self.login("user", "pass")
+
+        other_user_id = self.register_user("otheruser", "pass")
+        other_access_token = self.login("otheruser", "pass")
+
+        room_id = self.helper.create_room_as(
+            other_user_id, tok=other_access_token,
+        )
+        self.helper.send(room_id, body="1", tok=other_access_token)
+
+        next_batch = self.sync(access_token)["next_batch"]
+
+        self.helper.invite(
+            room=room_id, src=other_user_id, tok=other_access_token,
+            targ=user_id,
+        )
+        self.helper.join(room=room_id, user=user_id, tok=access_token)
+        message_ids = [
+            self.helper.send(room_id, body=str(i), tok=other_access_token)[
+                "event_id"
+            ]
+            for i in range(2, 4)
+        ]
+
+        timeline = self.sync(access_token, next_batch)["rooms"]["join"][room_id][
+            "timeline"
+        ]
+        event_ids = [e["event_id"] for e in timeline["events"]]
+        self.assertEqual(len(event_ids), len(set(event_ids)))
+
+        # the join and everything after it must still be there
+        join_event = timeline["events"][-3]
+        self.assertEqual(join_event["type"], "m.room.member")
+        self.assertEqual(join_event["state_key"], user_id)
+        self.assertEqual(join_event["content"]["membership"], "join")
+        self.assertEqual(event_ids[-2:], message_ids)
+
+
+class InitialSyncSnapshotTestCase(unittest.HomeserverTestCase):
+
+    servlets = [
+        admin.register_servlets,
+        room.register_servlets,
+        login.register_servlets,
+        sync.register_servlets,
+    ]
+    user_id = True
+    hijack_auth = False
+
+    def make_homeserver(self, reactor, clock):
+        config = self.default_config()
+        config.enable_initial_sync_snapshots = True
+
+        return self.setup_test_homeserver(config=config)
+
+    def initial_sync(self, access_token):
+        request, channel = self.make_request(
+            "GET",
+            "/sync?access_token=%s&filter=%s" % (
+                access_token, '{"room":{"timeline":{"limit":3}}}',
+            ),
+        )
+        self.render(request)
+        self.assertEqual(channel.code, 200)
+        return channel.json_body
+
+    def assertRoomsEqual(self, expected, actual):
+        """Check that two initial syncs have the same timelines and state"""
+        self.assertEqual(
+            set(expected["rooms"]["join"]), set(actual["rooms"]["join"]),
+        )
+        for room_id, expected_room in expected["rooms"]["join"].items():
+            actual_room = actual["rooms"]["join"][room_id]
+            self.assertEqual(
+                [e["event_id"] for e in expected_room["timeline"]["events"]],
+                [e["event_id"] for e in actual_room["timeline"]["events"]],
+            )
+            self.assertEqual(
+                expected_room["timeline"]["limited"],
+                actual_room["timeline"]["limited"],
+            )
+            self.assertEqual(
+                {e["event_id"] for e in expected_room["state"]["events"]},
+                {e["event_id"] for e in actual_room["state"]["events"]},
+            )
+
+    def test_initial_sync_from_snapshot(self):
+        user_id = self.register_user("user", "pass")
+        access_token = self.login("user", "pass")
+
+        other_user_id = self.register_user("otheruser", "pass")
+        other_access_token = self.login("otheruser", "pass")
+
+        room_id = self.helper.create_room_as(user_id, tok=access_token)
+        self.helper.send(room_id, body="1", txn_id="1", tok=access_token)
+
+        # this stores the snapshot
+        self.initial_sync(access_token)
+        hits = initial_sync_snapshot_hits._value.get()
+
+        # the other user joins and sends enough messages to push the join
+        # out of the timeline, so that it has to be moved into the state.
+        self.helper.invite(
+            room=room_id, src=user_id, tok=access_token, targ=other_user_id,
+        )
+        self.helper.join(room=room_id, user=other_user_id, tok=other_access_token)
+        for i in range(3):
+            self.helper.send(
+                room_id, body=str(i), txn_id=str(i), tok=other_access_token,
+            )
+
+        # and we get invited to another room
+        other_room_id = self.helper.create_room_as(
+            other_user_id, tok=other_access_token,
+        )
+        self.helper.invite(
+            room=other_room_id, src=other_user_id, tok=other_access_token,
+            targ=user_id,
+        )
+
+        from_snapshot = self.initial_sync(access_token)
+        self.assertEqual(initial_sync_snapshot_hits._value.get(), hits + 1)
+        self.assertIn(other_room_id, from_snapshot["rooms"]["invite"])
+
+        self.hs.get_datastore()._simple_delete(
+            "initial_sync_snapshots", keyvalues={"user_id": user_id},
+            desc="delete",
+        )
+        expected = self.initial_sync(access_token)
+        self.assertEqual(initial_sync_snapshot_hits._value.get(), hits + 1)
+
+        self.assertRoomsEqual(expected, from_snapshot)
+
+        # joining the other room should move it from the invites
+        self.helper.join(room=other_room_id, user=user_id, tok=access_token)
+
+        from_snapshot = self.initial_sync(access_token)
+        self.assertEqual(initial_sync_snapshot_hits._value.get(), hits + 2)
+        self.assertEqual(from_snapshot["rooms"]["invite"], {})
+
+        self.hs.get_datastore()._simple_delete(
+            "initial_sync_snapshots", keyvalues={"user_id": user_id},
+            desc="delete",
+        )
+        expected = self.initial_sync(access_token)
+        self.assertRoomsEqual(expected, from_snapshot)
+
+    def test_redactions_applied_to_snapshot(self):
+        user_id = self.register_user("user", "pass")
+        access_token = self.login("user", "pass")
+
+        room_id = self.helper.create_room_as(user_id, tok=access_token)
+        event_id = self.helper.send(
+            room_id, body="secret", txn_id="1", tok=access_token,
+        )["event_id"]
+
+        # this stores the snapshot
+        self.initial_sync(access_token)
+        hits = initial_sync_snapshot_hits._value.get()
+
+        request, channel = self.make_request(
+            "PUT",
+            "/rooms/%s/redact/%s/2?access_token=%s" % (
+                room_id, event_id, access_token,
+            ),
+            b"{}",
+        )
+        self.render(request)
+        self.assertEqual(channel.code, 200)
+
+        from_snapshot = self.initial_sync(access_token)
+        self.assertEqual(initial_sync_snapshot_hits._value.get(), hits + 1)
+
+        timeline = from_snapshot["rooms"]["join"][room_id]["timeline"]["events"]
+        events = {e["event_id"]: e for e in timeline}
+        self.assertIn(event_id, events)
+        self.assertNotIn("body", events[event_id]["content"])
+        self.assertIn("redacted_because", events[event_id]["unsigned"])
@@ -13,6 +13,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+
 from twisted.internet import defer
 
 import tests.unittest
@@ -75,3 +77,343 @@ class EventFederationWorkerStoreTestCase(tests.unittest.TestCase):
             el = r[i]
             depth = el[2]
             self.assertLessEqual(5, depth)
+
+    @defer.inlineCallbacks
+    def test_backfill_and_missing_events(self):
+        room_id = '!backfill:local'
+
+        def event_id(i):
+            return '$event_%s:local' % (i,)
+
+        # a linear chain of events 0..29, with a fork at depth 20 which is
+        # merged back in by event 21.
+        graph = {0: []}
+        depths = {0: 0}
+        for i in range(1, 30):
+            graph[i] = [i - 1]
+            depths[i] = i
+        graph['fork'] = [19]
+        depths['fork'] = 20
+        graph[21] = [20, 'fork']
+
+        def insert_events(txn):
+            for i, prevs in graph.items():
+                txn.execute(
+                    (
+                        "INSERT INTO events ("
+                        "   room_id, event_id, type, depth, topological_ordering,"
+                        "   content, processed, outlier, stream_ordering) "
+                        "VALUES (?, ?, 'm.test', ?, ?, 'test', ?, ?, ?)"
+                    ),
+                    (
+                        room_id, event_id(i), depths[i], depths[i], True, False,
+                        len(depths) if i == 'fork' else i,
+                    ),
+                )
+                for prev in prevs:
+                    txn.execute(
+                        (
+                            "INSERT INTO event_edges ("
+                            "   event_id, prev_event_id, room_id, is_state) "
+                            "VALUES (?, ?, ?, ?)"
+                        ),
+                        (event_id(i), event_id(prev), room_id, False),
+                    )
+
+        yield self.store.runInteraction("insert", insert_events)
+
+        for limit in (3, 12, 100):
+            results = yield self.store.runInteraction(
+                "backfill", self.store._get_backfill_events,
+                room_id, [event_id(29)], limit,
+            )
+            self.assertEqual(len(results), min(limit, len(graph)))
+
+            # we should always get the deepest events first
+            expected = sorted(
+                graph, key=lambda i: -depths[i],
+            )[:limit]
+            self.assertEqual(
+                results,
+                set(event_id(i) for i in expected),
+            )
+
+        results = yield self.store.runInteraction(
+            "missing", self.store._get_missing_events,
+            room_id, [event_id(16)], [event_id(23)], 10,
+        )
+        self.assertEqual(len(results), 7)
+        self.assertEqual(
+            set(results),
+            set(event_id(i) for i in (17, 18, 19, 20, 'fork', 21, 22)),
+        )
+        self.assertEqual(results[0], event_id(17))
+        self.assertEqual(results[-1], event_id(22))
+
+        results = yield self.store.runInteraction(
+            "missing", self.store._get_missing_events,
+            room_id, [event_id(0)], [event_id(29)], 3,
+        )
+        self.assertEqual(results, [event_id(26), event_id(27), event_id(28)])
+
+    @defer.inlineCallbacks
+    def test_auth_chain_index(self):
+        room_id = '!room:local'
+
+        # Build an auth graph with a fork:
+        #
+        #   A <- B <- C <- E
+        #        ^         |
+        #        +--- D <--+
+        #
+        # (every event also references A)
+        auth_graph = {
+            "A": [],
+            "B": ["A"],
+            "C": ["A", "B"],
+            "D": ["A", "B"],
+            "E": ["A", "C", "D"],
+        }
+
+        def persist(txn, event_ids):
+            self.store._simple_insert_many_txn(
+                txn,
+                table="event_auth",
+                values=[
+                    {"event_id": eid, "room_id": room_id, "auth_id": aid}
+                    for eid in event_ids
+                    for aid in auth_graph[eid]
+                ],
+            )
+            self.store._persist_event_auth_chain_txn(
+                txn, [_FakeStateEvent(eid, auth_graph[eid]) for eid in event_ids],
+            )
+
+        yield self.store.runInteraction("persist", persist, ["A", "B"])
+        # E is deliberately before its auth events to check that we sort them
+        yield self.store.runInteraction("persist", persist, ["E", "C", "D"])
+
+        def get_positions(txn, event_ids):
+            return self.store._get_auth_chain_positions_txn(txn, event_ids)
+
+        positions = yield self.store.runInteraction(
+            "get_positions", get_positions, list(auth_graph),
+        )
+        self.assertEqual(set(positions), set(auth_graph))
+
+        def get_from_graph(txn, event_ids, include_given):
+            return self.store._get_auth_chain_ids_from_graph_txn(
+                txn, event_ids, include_given,
+            )
+
+        # The index should always agree with walking the graph
+        for event_id in auth_graph:
+            for include_given in (True, False):
+                chain = yield self.store.get_auth_chain_ids(
+                    [event_id], include_given=include_given,
+                )
+                expected = yield self.store.runInteraction(
+                    "get_from_graph", get_from_graph, [event_id], include_given,
+                )
+                self.assertEqual(set(chain), set(expected))
+
+        chain = yield self.store.get_auth_chain_ids(["C", "D"], include_given=True)
+        self.assertEqual(set(chain), {"A", "B", "C", "D"})
+
+        difference = yield self.store.get_auth_chain_difference([{"C"}, {"D"}])
+        self.assertEqual(difference, {"C", "D"})
+
+        difference = yield self.store.get_auth_chain_difference([{"B"}, {"E"}])
+        self.assertEqual(difference, {"C", "D", "E"})
+
+        # Events that aren't in the index fall back to walking the graph
+        difference = yield self.store.get_auth_chain_difference(
+            [{"C"}, {"D", "$unknown"}],
+        )
+        self.assertEqual(difference, {"C", "D", "$unknown"})
+
+    @defer.inlineCallbacks
+    def test_auth_chain_index_chains_by_state_key(self):
+        # A room with two members, who each change their membership a few
+        # times. Each membership refers to the create event, the power levels
+        # and the user's previous membership.
+        events = [
+            _FakeStateEvent("create", [], "m.room.create", ""),
+            _FakeStateEvent("pl", ["create"], "m.room.power_levels", ""),
+        ]
+        prev = {"@a": None, "@b": None}
+        for i in range(3):
+            for user in ("@a", "@b"):
+                auth = ["create", "pl"]
+                if prev[user]:
+                    auth.append(prev[user])
+                event_id = "%s%i" % (user, i)
+                events.append(
+                    _FakeStateEvent(event_id, auth, "m.room.member", user),
+                )
+                prev[user] = event_id
+
+        def persist(txn, event):
+            self.store._simple_insert_txn(
+                txn,
+                table="state_events",
+                values={
+                    "event_id": event.event_id,
+                    "room_id": "!room:local",
+                    "type": event.type,
+                    "state_key": event.state_key,
+                },
+            )
+            self.store._persist_event_auth_chain_txn(txn, [event])
+
+        for event in events:
+            yield self.store.runInteraction("persist", persist, event)
+
+        def get_positions(txn, event_ids):
+            return self.store._get_auth_chain_positions_txn(txn, event_ids)
+
+        positions = yield self.store.runInteraction(
+            "get_positions", get_positions, [e.event_id for e in events],
+        )
+
+        # Each user's memberships go on one chain
+        self.assertEqual(
+            len(set(positions[e.event_id][0] for e in events)), 4,
+        )
+        self.assertEqual(
+            [positions["@a%i" % (i,)] for i in range(3)],
+            [(positions["@a0"][0], i + 1) for i in range(3)],
+        )
+
+        chain = yield self.store.get_auth_chain_ids(["@b2"], include_given=True)
+        self.assertEqual(set(chain), {"create", "pl", "@b0", "@b1", "@b2"})
+
+        difference = yield self.store.get_auth_chain_difference(
+            [{"@a2", "@b0"}, {"@a0", "@b2"}],
+        )
+        self.assertEqual(difference, {"@a1", "@a2", "@b1", "@b2"})
+
+    @defer.inlineCallbacks
+    def test_auth_chain_index_background_update(self):
+        update_name = self.store.EVENT_AUTH_CHAINS_BACKFILL
+
+        # Two rooms, each a chain of state events. In the first, an auth
+        # event has a higher stream ordering than the event that refers to
+        # it, and "rej" was rejected, so "after_rej" can't be indexed either.
+        rooms = {
+            "!a:local": [
+                # (event_id, auth_ids, depth, stream_ordering)
+                ("a_create", [], 1, 10),
+                ("a_pl", ["a_create"], 2, 14),
+                ("a_1", ["a_create", "a_pl"], 3, 11),
+                ("a_2", ["a_create", "a_pl", "a_1"], 4, 12),
+                ("rej", ["a_create"], 4, 13),
+                ("after_rej", ["a_create", "rej"], 5, 15),
+            ],
+            "!b:local": [
+                ("b_create", [], 1, 20),
+                ("b_1", ["b_create"], 2, 21),
+                ("b_2", ["b_create", "b_1"], 3, 22),
+            ],
+        }
+
+        def insert_events(txn):
+            for room_id, events in rooms.items():
+                for event_id, auth_ids, depth, stream in events:
+                    txn.execute(
+                        (
+                            "INSERT INTO events ("
+                            "   room_id, event_id, type, depth,"
+                            "   topological_ordering, content, processed,"
+                            "   outlier, stream_ordering) "
+                            "VALUES (?, ?, 'm.test', ?, ?, 'test', ?, ?, ?)"
+                        ),
+                        (
+                            room_id, event_id, depth, depth, True, False,
+                            stream,
+                        ),
+                    )
+                    self.store._simple_insert_txn(
+                        txn,
+                        table="state_events",
+                        values={
+                            "event_id": event_id,
+                            "room_id": room_id,
+                            "type": "m.test",
+                            "state_key": event_id,
+                        },
+                    )
+                    self.store._simple_insert_many_txn(
+                        txn,
+                        table="event_auth",
+                        values=[
+                            {
+                                "event_id": event_id,
+                                "room_id": room_id,
+                                "auth_id": aid,
+                            }
+                            for aid in auth_ids
+                        ],
+                    )
+            self.store._simple_insert_txn(
+                txn,
+                table="rejections",
+                values={
+                    "event_id": "rej",
+                    "reason": "test",
+                    "last_check": "test",
+                },
+            )
+            # The background update may run after some events have already
+            # been indexed as they were persisted.
+            self.store._add_to_event_auth_chain_index_txn(
+                txn, [("b_create", "m.test", "b_create", [])],
+            )
+
+        yield self.store.runInteraction("insert", insert_events)
+
+        while True:
+            progress = yield self.store._simple_select_one_onecol(
+                table="background_updates",
+                keyvalues={"update_name": update_name},
+                retcol="progress_json",
+                allow_none=True,
+            )
+            if progress is None:
+                break
+            yield self.store._background_backfill_event_auth_chains(
+                json.loads(progress), 2,
+            )
+
+        def get_positions(txn, event_ids):
+            return self.store._get_auth_chain_positions_txn(txn, event_ids)
+
+        all_event_ids = [
+            event[0] for events in rooms.values() for event in events
+        ]
+        positions = yield self.store.runInteraction(
+            "get_positions", get_positions, all_event_ids,
+        )
+        self.assertEqual(
+            set(positions), set(all_event_ids) - {"rej", "after_rej"},
+        )
+
+        chain = yield self.store.get_auth_chain_ids(["a_2"], include_given=True)
+        self.assertEqual(set(chain), {"a_create", "a_pl", "a_1", "a_2"})
+
+        chain = yield self.store.get_auth_chain_ids(["b_2"], include_given=True)
+        self.assertEqual(set(chain), {"b_create", "b_1", "b_2"})
+
+
+class _FakeStateEvent(object):
+    def __init__(self, event_id, auth_event_ids, type="m.test", state_key=None):
+        self.event_id = event_id
+        self._auth_event_ids = auth_event_ids
+        self.type = type
+        self.state_key = event_id if state_key is None else state_key
+
+    def is_state(self):
+        return True
+
+    def auth_event_ids(self):
+        return self._auth_event_ids
@@ -132,6 +132,84 @@ class EventPushActionsStoreTestCase(tests.unittest.TestCase):
         yield _rotate(10)
         yield _assert_counts(1, 1)
 
+    @defer.inlineCallbacks
+    def test_get_unread_counts_for_rooms(self):
+        user_id = "@user1235:example.com"
+        room_ids = ["!foo:example.com", "!bar:example.com", "!baz:example.com"]
+
+        @defer.inlineCallbacks
+        def _inject_actions(room_id, stream, action):
+            event = Mock()
+            event.room_id = room_id
+            event.event_id = "$test%i:example.com" % (stream,)
+            event.internal_metadata.stream_ordering = stream
+            event.depth = stream
+
+            yield self.store.add_push_actions_to_staging(
+                event.event_id, {user_id: action}
+            )
+            yield self.store.runInteraction(
+                "",
+                self.store._set_push_actions_for_event_and_users_txn,
+                [(event, None)],
+                [(event, None)],
+            )
+
+        def _add_event(room_id, stream):
+            return self.store._simple_insert(
+                "events",
+                {
+                    "stream_ordering": stream,
+                    "event_id": "$test%i:example.com" % (stream,),
+                    "type": "",
+                    "room_id": room_id,
+                    "content": "",
+                    "processed": True,
+                    "outlier": False,
+                    "topological_ordering": stream,
+                    "depth": stream,
+                },
+            )
+
+        # the read receipts
+        yield _add_event(room_ids[0], 1)
+        yield _add_event(room_ids[1], 4)
+
+        yield _inject_actions(room_ids[0], 2, PlAIN_NOTIF)
+        yield _inject_actions(room_ids[1], 3, HIGHLIGHT)
+        yield _inject_actions(room_ids[0], 5, HIGHLIGHT)
+        yield _inject_actions(room_ids[1], 6, PlAIN_NOTIF)
+        yield self.store.runInteraction(
+            "", self.store._rotate_notifs_before_txn, 6,
+        )
+        yield _inject_actions(room_ids[1], 7, PlAIN_NOTIF)
+
+        last_read_event_ids = {
+            room_ids[0]: "$test1:example.com",
+            room_ids[1]: "$test4:example.com",
+            room_ids[2]: "$unknown:example.com",
+        }
+        counts = yield self.store.get_unread_event_push_actions_by_rooms_for_user(
+            user_id, last_read_event_ids,
+        )
+        self.assertEqual(counts, {
+            room_ids[0]: {"notify_count": 2, "highlight_count": 1},
+            room_ids[1]: {"notify_count": 2, "highlight_count": 0},
+            room_ids[2]: {"notify_count": 0, "highlight_count": 0},
+        })
+
+        # the results should match the single room lookups, and be cached
+        for room_id, event_id in last_read_event_ids.items():
+            res = yield self.store.get_unread_event_push_actions_by_room_for_user(
+                room_id, user_id, event_id,
+            )
+            self.assertEqual(res, counts[room_id])
+
+        cached = self.store.get_unread_event_push_actions_by_room_for_user.cache.get(
+            (room_ids[0], user_id, last_read_event_ids[room_ids[0]]),
+        )
+        self.assertEqual(cached, counts[room_ids[0]])
+
     @defer.inlineCallbacks
     def test_find_first_stream_ordering_after_ts(self):
         def add_event(so, ts):
@@ -196,3 +274,88 @@ class EventPushActionsStoreTestCase(tests.unittest.TestCase):
         yield add_event(0, 5)
         r = yield self.store.find_first_stream_ordering_after_ts(1)
         self.assertEqual(r, 0)
+
+    @defer.inlineCallbacks
+    def test_unread_count_totals(self):
+        user_id = "@user1235:test"
+        room_id = "!foo:test"
+
+        @defer.inlineCallbacks
+        def _inject_actions(stream, action):
+            event = Mock()
+            event.room_id = room_id
+            event.event_id = "$test%i:test" % (stream,)
+            event.internal_metadata.stream_ordering = stream
+            event.depth = stream
+
+            yield self.store.add_push_actions_to_staging(
+                event.event_id, {user_id: action}
+            )
+            yield self.store.runInteraction(
+                "",
+                self.store._set_push_actions_for_event_and_users_txn,
+                [(event, None)],
+                [(event, None)],
+            )
+
+        def _get_totals():
+            return self.store._simple_select_one(
+                table="event_push_unread_counts",
+                keyvalues={"user_id": user_id, "room_id": room_id},
+                retcols=("notif_count", "highlight_count", "stream_ordering"),
+            )
+
+        @defer.inlineCallbacks
+        def _assert_counts(notif_count, highlight_count):
+            self.store.get_unread_event_push_actions_by_room_for_user.invalidate_all()
+            counts = yield self.store.get_unread_event_push_actions_by_rooms_for_user(
+                user_id, {room_id: "$test2:test"},
+            )
+            self.assertEqual(counts, {
+                room_id: {
+                    "notify_count": notif_count, "highlight_count": highlight_count,
+                },
+            })
+
+        yield self.store._simple_insert(
+            "events",
+            {
+                "stream_ordering": 2,
+                "event_id": "$test2:test",
+                "type": "",
+                "room_id": room_id,
+                "content": "",
+                "processed": True,
+                "outlier": False,
+                "topological_ordering": 2,
+                "depth": 2,
+            },
+        )
+
+        yield _inject_actions(1, PlAIN_NOTIF)
+        yield _inject_actions(3, PlAIN_NOTIF)
+
+        # the user reads up to event 2, which calculates their totals
+        yield self.store.runInteraction(
+            "", self.store._remove_old_push_actions_before_txn, room_id, user_id, 2,
+        )
+        totals = yield _get_totals()
+        self.assertEqual(
+            totals, {"notif_count": 1, "highlight_count": 0, "stream_ordering": 3},
+        )
+        yield _assert_counts(1, 0)
+
+        # new push actions are added to the totals
+        yield _inject_actions(4, HIGHLIGHT)
+        totals = yield _get_totals()
+        self.assertEqual(
+            totals, {"notif_count": 2, "highlight_count": 1, "stream_ordering": 4},
+        )
+        yield _assert_counts(2, 1)
+
+        # and redacted ones are taken out again
+        yield self.store.runInteraction(
+            "", self.store._remove_push_actions_for_event_id_txn,
+            room_id, "$test4:test",
+        )
+        yield _assert_counts(1, 0)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 New Vector Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from tests.unittest import HomeserverTestCase
+
+USER_ID = "@user:test"
+DEVICE_ID = "DEVICE"
+
+
+class LazyLoadedMembersStoreTestCase(HomeserverTestCase):
+
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+
+    def _add(self, members, clear=False):
+        self.get_success(self.store.add_lazy_loaded_members(
+            USER_ID, DEVICE_ID, members, max_size=3, clear=clear,
+        ))
+
+    def _get(self):
+        return self.get_success(
+            self.store.get_lazy_loaded_members(USER_ID, DEVICE_ID)
+        )
+
+    def test_add_lazy_loaded_members(self):
+        self.assertEqual(self._get(), [])
+
+        self._add([("@a:test", "$a1"), ("@b:test", "$b1")])
+        self.assertEqual(self._get(), [("@a:test", "$a1"), ("@b:test", "$b1")])
+
+        # re-sent members move to the end, and the least recently sent members
+        # are dropped once we go over the maximum size.
+        self._add([("@a:test", "$a2"), ("@c:test", "$c1"), ("@d:test", "$d1")])
+        self.assertEqual(
+            self._get(), [("@a:test", "$a2"), ("@c:test", "$c1"), ("@d:test", "$d1")],
+        )
+
+        self._add([("@e:test", "$e1")], clear=True)
+        self.assertEqual(self._get(), [("@e:test", "$e1")])
+
+    def test_delete_old_lazy_loaded_members(self):
+        self._add([("@a:test", "$a1")])
+
+        self.reactor.advance(2 * 24 * 60 * 60)
+        self.assertEqual(self._get(), [])
@@ -82,3 +82,22 @@ class RoomMemberStoreTestCase(unittest.TestCase):
                 )
             ],
         )
+
+    @defer.inlineCallbacks
+    def test_get_room_member_ids_for_host(self):
+        yield self.inject_room_member(self.room, self.u_alice, Membership.JOIN)
+        yield self.inject_room_member(self.room, self.u_bob, Membership.JOIN)
+        yield self.inject_room_member(self.room, self.u_bob, Membership.LEAVE)
+        yield self.inject_room_member(self.room, self.u_charlie, Membership.JOIN)
+
+        member_ids = yield self.store.get_room_member_ids_for_host(
+            self.room.to_string(), "test",
+        )
+        self.assertEqual(
+            member_ids, {self.u_alice.to_string(), self.u_bob.to_string()},
+        )
+
+        member_ids = yield self.store.get_room_member_ids_for_host(
+            self.room.to_string(), "where",
+        )
+        self.assertEqual(member_ids, set())
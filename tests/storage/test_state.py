@@ -114,6 +114,50 @@ class StateStoreTestCase(tests.unittest.TestCase):
             {e1.event_id, e2.event_id},
         )
 
+    @defer.inlineCallbacks
+    def test_get_filtered_current_state_ids(self):
+        e1 = yield self.inject_state_event(
+            self.room, self.u_alice, EventTypes.Create, '', {}
+        )
+        e2 = yield self.inject_state_event(
+            self.room, self.u_alice, EventTypes.Member, self.u_alice.to_string(),
+            {"membership": Membership.JOIN},
+        )
+        yield self.inject_state_event(
+            self.room, self.u_bob, EventTypes.Member, self.u_bob.to_string(),
+            {"membership": Membership.JOIN},
+        )
+
+        room_id = self.room.to_string()
+        state_filter = StateFilter.from_types([
+            (EventTypes.Create, ''),
+            (EventTypes.Member, self.u_alice.to_string()),
+        ])
+        expected = {
+            (EventTypes.Create, ''): e1.event_id,
+            (EventTypes.Member, self.u_alice.to_string()): e2.event_id,
+        }
+
+        # first with the full state not yet cached, so the filter is pushed
+        # down into the database
+        self.store.get_current_state_ids.invalidate_all()
+        state_ids = yield self.store.get_filtered_current_state_ids(
+            room_id, state_filter,
+        )
+        self.assertDictEqual(state_ids, expected)
+
+        # then with the full state cached, so that it is filtered in memory
+        full_state_ids = yield self.store.get_current_state_ids(room_id)
+        self.assertEqual(len(full_state_ids), 3)
+
+        state_ids = yield self.store.get_filtered_current_state_ids(
+            room_id, state_filter,
+        )
+        self.assertDictEqual(state_ids, expected)
+
+        room_version = yield self.store.get_room_version(room_id)
+        self.assertEqual(room_version, "1")
+
     @defer.inlineCallbacks
     def test_get_state_for_event(self):
 
@@ -491,3 +535,69 @@ class StateStoreTestCase(tests.unittest.TestCase):
 
         self.assertEqual(is_all, True)
         self.assertDictEqual({(e5.type, e5.state_key): e5.event_id}, state_dict)
+
+    @defer.inlineCallbacks
+    def test_compress_state_groups(self):
+        room_id = self.room.to_string()
+        create_key = (EventTypes.Create, "")
+        name_key = (EventTypes.Name, "")
+        alice_key = (EventTypes.Member, self.u_alice.to_string())
+
+        # Store a series of full snapshots, which the compressor should turn
+        # into a chain of deltas.
+        states = [
+            {create_key: "$create", alice_key: "$join"},
+            {create_key: "$create", alice_key: "$join", name_key: "$name1"},
+            {create_key: "$create", alice_key: "$join", name_key: "$name2"},
+        ]
+        groups = []
+        for i, state in enumerate(states):
+            group = yield self.store.store_state_group(
+                "$event%d" % (i,), room_id, None, None, state,
+            )
+            groups.append(group)
+
+        stats = yield self.store.compress_state_groups_for_room(room_id)
+
+        self.assertEqual(stats["state_groups"], 3)
+        self.assertEqual(stats["state_groups_rewritten"], 2)
+        self.assertEqual(stats["rows_before"], 8)
+        self.assertEqual(stats["rows_after"], 4)
+
+        # The state at each group should be unchanged
+        group_to_state = yield self.store._get_state_groups_from_groups(
+            groups, StateFilter.all(),
+        )
+        for group, state in zip(groups, states):
+            self.assertDictEqual(group_to_state[group], state)
+
+        # The last group can be stored as a one row delta against either of
+        # the previous groups, so should pick the one with the shorter chain.
+        prev_group, delta_ids = yield self.store.get_state_group_delta(groups[2])
+        self.assertEqual(prev_group, groups[0])
+        self.assertDictEqual(delta_ids, {name_key: "$name2"})
+
+        # Compressing again shouldn't change anything
+        stats = yield self.store.compress_state_groups_for_room(room_id)
+        self.assertEqual(stats["state_groups_rewritten"], 0)
+        self.assertEqual(stats["rows_after"], 4)
+
+    @defer.inlineCallbacks
+    def test_state_resolution_cache(self):
+        room_id = self.room.to_string()
+
+        entry = yield self.store.get_state_resolution_cache_entry([2, 1])
+        self.assertIsNone(entry)
+
+        resolution = {"base": 1, "delta": [["m.room.name", "", "$name"]]}
+        yield self.store.store_state_resolution_cache_entry(
+            room_id, [2, 1], resolution, 1500,
+        )
+
+        # Storing it again (e.g. from another worker) should be a no-op
+        yield self.store.store_state_resolution_cache_entry(
+            room_id, [1, 2], resolution, 1500,
+        )
+
+        entry = yield self.store.get_state_resolution_cache_entry([1, 2])
+        self.assertEqual(entry, (resolution, 1500))
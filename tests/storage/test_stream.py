@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 New Vector Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.rest.client.v1 import room
+from synapse.util.caches.stream_change_cache import StreamChangeCache
+
+from tests.unittest import HomeserverTestCase
+
+
+class RoomsChangedSinceTestCase(HomeserverTestCase):
+
+    user_id = "@red:server"
+    servlets = [room.register_servlets]
+
+    def make_homeserver(self, reactor, clock):
+        hs = self.setup_test_homeserver("server", http_client=None)
+        return hs
+
+    def prepare(self, reactor, clock, hs):
+        self.store = hs.get_datastore()
+        self.room_ids = [
+            self.helper.create_room_as(self.user_id) for _ in range(3)
+        ]
+
+    def test_rooms_changed_since(self):
+        from_id = self.store.get_room_max_stream_ordering()
+
+        self.helper.send(self.room_ids[1], body="test")
+
+        # empty the stream change cache, so that it can't tell us anything
+        # about changes before now
+        self.store._events_stream_cache = StreamChangeCache(
+            "EventsRoomStreamChangeCache", self.store.get_room_max_stream_ordering(),
+        )
+
+        changed = self.get_success(
+            self.store.get_rooms_changed_since(self.room_ids, from_id)
+        )
+        self.assertEqual(changed, {self.room_ids[1]})
+
+        # and nothing has changed since the latest event
+        changed = self.get_success(
+            self.store.get_rooms_changed_since(
+                self.room_ids, self.store.get_room_max_stream_ordering(),
+            )
+        )
+        self.assertEqual(changed, set())
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 New Vector Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from tests import unittest
+
+USER_ID = "@user:test"
+
+
+class NotifierTestCase(unittest.HomeserverTestCase):
+
+    def prepare(self, reactor, clock, hs):
+        self.notifier = hs.get_notifier()
+
+        # the (before, after) tokens the notifier callback has been called with
+        self.callbacks = []
+
+    def _callback(self, before_token, after_token):
+        self.callbacks.append((before_token, after_token))
+        return None
+
+    def _wait_for_events(self, room_filter=None):
+        d = self.notifier.wait_for_events(
+            USER_ID, 10000, self._callback,
+            room_ids=["!a:test", "!b:test"],
+            from_token=self.get_success(
+                self.hs.get_event_sources().get_current_token()
+            ),
+            room_filter=room_filter,
+        )
+        self.pump()
+        return d
+
+    def test_wakeups_are_coalesced(self):
+        d = self._wait_for_events()
+        self.assertEqual(self.callbacks, [])
+
+        self.notifier.on_new_event("typing_key", 1, rooms=["!a:test"])
+        self.notifier.on_new_event("typing_key", 2, rooms=["!b:test"])
+        self.notifier.on_new_event("receipt_key", 3, rooms=["!a:test"])
+
+        # nothing is woken until we go back to the reactor
+        self.assertEqual(self.callbacks, [])
+
+        self.pump()
+        self.assertEqual(len(self.callbacks), 1)
+        after_token = self.callbacks[0][1]
+        self.assertEqual(after_token.typing_key, 2)
+        self.assertEqual(after_token.receipt_key, 3)
+
+        self.reactor.advance(10)
+        self.get_success(d)
+
+    def test_room_filter(self):
+        d = self._wait_for_events(room_filter=lambda room_id: room_id != "!a:test")
+
+        # the listener isn't interested in events in !a:test...
+        self.notifier.on_new_event("typing_key", 1, rooms=["!a:test"])
+        self.pump()
+        self.assertEqual(self.callbacks, [])
+
+        # ... but should still be woken if the event concerns the user directly
+        self.notifier.on_new_event("typing_key", 2, users=[USER_ID], rooms=["!a:test"])
+        self.pump()
+        self.assertEqual(len(self.callbacks), 1)
+
+        self.notifier.on_new_event("typing_key", 3, rooms=["!b:test"])
+        self.pump()
+        self.assertEqual(len(self.callbacks), 2)
+        self.assertEqual(self.callbacks[1][1].typing_key, 3)
+
+        self.reactor.advance(10)
+        self.get_success(d)
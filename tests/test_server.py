@@ -24,7 +24,7 @@ from twisted.web.resource import Resource
 from twisted.web.server import NOT_DONE_YET
 
 from synapse.api.errors import Codes, SynapseError
-from synapse.http.server import JsonResource
+from synapse.http.server import STREAMING_JSON_CHUNK_SIZE, JsonResource, PreEncodedJson
 from synapse.http.site import SynapseSite, logger
 from synapse.util import Clock
 
@@ -145,6 +145,59 @@ class JsonResourceTests(unittest.TestCase):
         self.assertEqual(channel.json_body["error"], "Unrecognized request")
         self.assertEqual(channel.json_body["errcode"], "M_UNRECOGNIZED")
 
+    def test_streaming_response(self):
+        """
+        Servlets which ask for their responses to be streamed have them written
+        out a chunk at a time, without a Content-Length.
+        """
+        body = {"rooms": {"!room%d:test" % (i,): "x" * 100 for i in range(2000)}}
+
+        class _Servlet(object):
+            STREAM_RESPONSE = True
+
+            def on_GET(self, request):
+                return (200, body)
+
+        res = JsonResource(self.homeserver, canonical_json=False)
+        res.register_paths("GET", [re.compile("^/_matrix/foo$")], _Servlet().on_GET)
+
+        writes = []
+        request, channel = make_request(self.reactor, b"GET", b"/_matrix/foo")
+        request.write = _record_writes(request.write, writes)
+        render(request, res, self.reactor)
+
+        self.assertEqual(channel.result["code"], b'200')
+        self.assertEqual(channel.json_body, body)
+        self.assertIsNone(request.responseHeaders.getRawHeaders(b"Content-Length"))
+        self.assertGreater(len(writes), 1)
+        for chunk in writes[:-1]:
+            self.assertGreaterEqual(len(chunk), STREAMING_JSON_CHUNK_SIZE)
+
+    def test_pre_encoded_response(self):
+        """
+        Pre-encoded JSON responses are sent as they are.
+        """
+        json_bytes = b'{"b": 1,  "a": 2}'
+
+        def _callback(request, **kwargs):
+            return (200, PreEncodedJson(json_bytes))
+
+        res = JsonResource(self.homeserver)
+        res.register_paths("GET", [re.compile("^/_matrix/foo$")], _callback)
+
+        request, channel = make_request(self.reactor, b"GET", b"/_matrix/foo")
+        render(request, res, self.reactor)
+
+        self.assertEqual(channel.result["code"], b'200')
+        self.assertEqual(channel.result["body"], json_bytes)
+
+
+def _record_writes(write, writes):
+    def _write(data):
+        writes.append(data)
+        return write(data)
+    return _write
+
 
 class SiteTestCase(unittest.HomeserverTestCase):
     def test_lose_connection(self):
@@ -20,7 +20,12 @@ from twisted.internet import defer
 from synapse.api.auth import Auth
 from synapse.api.constants import EventTypes, Membership, RoomVersions
 from synapse.events import FrozenEvent
-from synapse.state import StateHandler, StateResolutionHandler
+from synapse.state import (
+    StateHandler,
+    StateResolutionHandler,
+    _resolution_from_state,
+    _state_from_resolution,
+)
 
 from tests import unittest
 
@@ -120,6 +125,13 @@ class StateGroupStore(object):
     def get_room_version(self, room_id):
         return RoomVersions.V1
 
+    def get_state_resolution_cache_entry(self, state_groups):
+        return defer.succeed(None)
+
+    def store_state_resolution_cache_entry(self, room_id, state_groups,
+                                           resolution, resolution_time_ms):
+        return defer.succeed(None)
+
 
 class DictObj(dict):
     def __init__(self, **kwargs):
@@ -658,3 +670,24 @@ class StateTestCase(unittest.TestCase):
         self.store.register_event_id_state_group(prev_event_id_2, sg2)
 
         return self.state.compute_event_context(event)
+
+
+class StoredResolutionTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        state_groups_ids = {
+            1: {("a", ""): "$a1", ("b", ""): "$b1", ("c", ""): "$c1"},
+            2: {("a", ""): "$a2", ("b", ""): "$b1"},
+        }
+        new_state = {("a", ""): "$a2", ("c", ""): "$c1"}
+
+        resolution = _resolution_from_state(new_state, state_groups_ids)
+        self.assertEqual(resolution["base"], 1)
+        self.assertEqual(len(resolution["delta"]), 2)
+
+        self.assertEqual(
+            _state_from_resolution(resolution, state_groups_ids), new_state,
+        )
+
+    def test_unknown_base(self):
+        resolution = {"base": 3, "delta": []}
+        self.assertIsNone(_state_from_resolution(resolution, {1: {}, 2: {}}))
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 New Vector Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from twisted.internet import defer
+
+from synapse.api.errors import HttpResponseException
+from synapse.util.destination_health import (
+    CIRCUIT_CLOSED,
+    CIRCUIT_HALF_OPEN,
+    CIRCUIT_OPEN,
+    INITIAL_CONCURRENCY,
+    MIN_OPEN_INTERVAL_MS,
+    DestinationHealthTracker,
+)
+from synapse.util.retryutils import NotRetryingDestination
+
+from tests import unittest
+from tests.server import get_clock
+
+
+class DestinationHealthTrackerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.reactor, self.clock = get_clock()
+        self.tracker = DestinationHealthTracker(
+            self.clock, max_concurrency=20, latency_target_ms=1000,
+            failure_threshold=3,
+        )
+
+    def _start(self, **kwargs):
+        cm = self.tracker.request("remote", **kwargs)
+        return cm, cm.__enter__()
+
+    def _succeed(self, cm):
+        cm.__exit__(None, None, None)
+
+    def _fail(self, cm, exception=None):
+        if exception is None:
+            exception = Exception("failed")
+        try:
+            cm.__exit__(type(exception), exception, None)
+        except type(exception):
+            pass
+
+    def test_concurrency_limit(self):
+        requests = [self._start() for _ in range(INITIAL_CONCURRENCY + 1)]
+
+        # the last request has to wait for one of the others to finish
+        for _, d in requests[:-1]:
+            self.assertTrue(d.called)
+        self.assertFalse(requests[-1][1].called)
+
+        self._succeed(requests[0][0])
+        self.assertTrue(requests[-1][1].called)
+
+        for cm, _ in requests[1:]:
+            self._succeed(cm)
+
+        health = self.tracker.get_health("remote")
+        self.assertEqual(health["requests_in_progress"], 0)
+        self.assertEqual(health["requests_waiting"], 0)
+        self.assertEqual(health["total_successes"], INITIAL_CONCURRENCY + 1)
+
+    def test_concurrency_adapts_to_latency(self):
+        # fast requests slowly increase the limit...
+        for _ in range(INITIAL_CONCURRENCY * 3):
+            cm, _ = self._start()
+            self.reactor.advance(0.1)
+            self._succeed(cm)
+
+        limit = self.tracker.get_health("remote")["concurrency_limit"]
+        self.assertGreater(limit, INITIAL_CONCURRENCY)
+
+        # ... and a slow one halves it
+        cm, _ = self._start()
+        self.reactor.advance(2)
+        self._succeed(cm)
+
+        health = self.tracker.get_health("remote")
+        self.assertEqual(health["concurrency_limit"], limit // 2)
+        self.assertEqual(health["consecutive_failures"], 0)
+
+    def test_client_errors_are_not_failures(self):
+        for _ in range(5):
+            cm, _ = self._start()
+            self._fail(cm, HttpResponseException(400, "Bad request", b""))
+
+        health = self.tracker.get_health("remote")
+        self.assertEqual(health["circuit_state"], CIRCUIT_CLOSED)
+        self.assertEqual(health["total_failures"], 0)
+
+    def test_circuit_breaker(self):
+        requests = [self._start() for _ in range(INITIAL_CONCURRENCY)]
+        waiting_cm, waiting = self._start()
+
+        for cm, _ in requests[:3]:
+            self.reactor.advance(1)
+            self._fail(cm)
+
+        # the circuit opens after three failures, and requests which were
+        # waiting fail straight away
+        self.assertEqual(
+            self.tracker.get_health("remote")["circuit_state"], CIRCUIT_OPEN,
+        )
+        self.failureResultOf(waiting, NotRetryingDestination)
+        self.assertRaises(
+            NotRetryingDestination, self.tracker.check_available, "remote",
+        )
+        self.assertRaises(NotRetryingDestination, self._start)
+
+        # unless they are ignoring backoff
+        cm, _ = self._start(ignore_backoff=True)
+        cm.__exit__(GeneratorExit, GeneratorExit(), None)
+
+        # once the open interval has passed, a single request is let through
+        self.reactor.advance(MIN_OPEN_INTERVAL_MS / 1000.)
+        probe, d = self._start()
+        self.assertTrue(d.called)
+        self.assertEqual(
+            self.tracker.get_health("remote")["circuit_state"], CIRCUIT_HALF_OPEN,
+        )
+        self.assertRaises(NotRetryingDestination, self._start)
+
+        # if it fails, the circuit opens for longer
+        self._fail(probe)
+        self.reactor.advance(MIN_OPEN_INTERVAL_MS / 1000.)
+        self.assertRaises(NotRetryingDestination, self._start)
+        self.reactor.advance(MIN_OPEN_INTERVAL_MS / 1000.)
+
+        # and if it succeeds, the circuit closes again
+        probe, _ = self._start()
+        self._succeed(probe)
+        self.assertEqual(
+            self.tracker.get_health("remote")["circuit_state"], CIRCUIT_CLOSED,
+        )
+        self.tracker.check_available("remote")
+
+    def test_inline_callbacks_success(self):
+        @defer.inlineCallbacks
+        def do_request(succeed):
+            with self.tracker.request("remote") as wait_for_slot:
+                yield wait_for_slot
+                if not succeed:
+                    raise Exception("failed")
+                defer.returnValue("response")
+
+        for _ in range(2):
+            self.failureResultOf(do_request(False), Exception)
+        self.assertEqual(self.successResultOf(do_request(True)), "response")
+
+        # returning from the context with returnValue counts as a success
+        health = self.tracker.get_health("remote")
+        self.assertEqual(health["total_successes"], 1)
+        self.assertEqual(health["consecutive_failures"], 0)
+        self.assertEqual(health["requests_in_progress"], 0)
+
+        # so we need another three failures in a row to open the circuit
+        for _ in range(2):
+            self.failureResultOf(do_request(False), Exception)
+        self.assertEqual(
+            self.tracker.get_health("remote")["circuit_state"], CIRCUIT_CLOSED,
+        )
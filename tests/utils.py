@@ -112,6 +112,9 @@ def default_config(name):
     config.password_providers = []
     config.worker_replication_url = ""
     config.worker_app = None
+    config.worker_name = None
+    config.federation_sender_instances = 1
+    config.federation_sender_instance = 0
     config.email_enable_notifs = False
     config.block_non_admin_invites = False
     config.federation_domain_whitelist = None
@@ -120,6 +123,19 @@ def default_config(name):
     config.federation_rc_sleep_delay = 100
     config.federation_rc_concurrent = 10
     config.filter_timeline_limit = 5000
+    config.enable_initial_sync_snapshots = False
+    config.sync_room_concurrency = 10
+    config.slow_sync_log_threshold_ms = None
+    config.federation_client_max_idle_connections_per_host = 5
+    config.federation_client_idle_timeout = 2 * 60
+    config.federation_client_max_concurrency_per_host = 50
+    config.federation_client_latency_target_ms = 10000
+    config.federation_client_failure_threshold = 5
+    config.federation_async_transactions = False
+    config.federation_incoming_pdu_queue_limit = 1000
+    config.federation_incoming_pdu_concurrency = 10
+    config.federation_edu_coalescing_window_ms = 0
+    config.federation_compress_transactions = False
     config.user_directory_search_all_users = False
     config.user_consent_server_notice_content = None
     config.block_events_without_consent_error = None